@@ -120,8 +120,27 @@ EMAIL_PASS = os.getenv('EMAIL_PASS')
 EMAIL_SERVER = os.getenv('EMAIL_SERVER')
 EMAIL_PORT = int(os.getenv('EMAIL_PORT', '587'))
 
+# Users allowed to call /api/admin/* endpoints (comma-separated user IDs)
+from core.auth import ADMIN_USER_IDS
+
 # Database configuration - MOVIDO para core/database.py (evita importação circular)
-from core.database import get_db_connection, DB_CONFIG, db_pool
+from core.database import (
+    get_db_connection, get_read_connection, get_worker_connection, get_analytics_connection,
+    get_pool_stats, set_request_user
+)
+from core.queue_scheduler import QueueScheduler, normalize_urgency
+from core.reanalysis import ReanalysisRunner
+from core.embeddings import compute_location_embedding, embed_images_async
+from core.vector_index import get_image_index
+from core.text_index import search_reports
+from core.index_sync import get_index_syncer, IndexNotReady
+from tools.vision_tools import vision_breaker, vision_timeout, VISION_CIRCUIT_OPEN
+
+# Priority scheduler for image_processing_queue
+queue_scheduler = QueueScheduler(get_worker_connection)
+
+# Analysis attempts before a queue item is marked as failed
+MAX_QUEUE_RETRIES = 3
 
 # Embeddings configuration (TODO: substituir Titan por alternativa open-source)
 embedding_enabled = False  # Embeddings temporariamente desabilitados
@@ -159,6 +178,15 @@ class ReportCreate(BaseModel):
     description: str
     image_data: Optional[str] = None
     device_info: Optional[Dict[str, str]] = None
+    urgency: Optional[str] = None  # low, normal, high, critical
+
+class ReanalysisCampaignCreate(BaseModel):
+    name: str
+    analysis_version: str  # identifies the new prompt/model
+    filters: Optional[Dict[str, Any]] = None
+    rate_per_minute: float = 30.0
+    promote: bool = False  # replace the current analysis with the new one
+    start: bool = True
 
 class ChangePassword(BaseModel):
     current_password: str
@@ -362,7 +390,7 @@ def save_chat_message(session_id: str, user_id: int, role: str, content: str,
 
 def get_chat_sessions(user_id: int, page: int = 1, per_page: int = 20) -> Dict:
     """Get chat sessions for a user"""
-    connection = get_db_connection()
+    connection = get_read_connection(user_id)
     if not connection:
         return {"error": "Database connection failed"}
 
@@ -410,7 +438,7 @@ def get_chat_sessions(user_id: int, page: int = 1, per_page: int = 20) -> Dict:
 
 def get_chat_messages(session_id: str, user_id: int, page: int = 1, per_page: int = 50) -> Dict:
     """Get messages for a chat session"""
-    connection = get_db_connection()
+    connection = get_read_connection(user_id)
     if not connection:
         return {"error": "Database connection failed"}
 
@@ -435,7 +463,7 @@ def get_chat_messages(session_id: str, user_id: int, page: int = 1, per_page: in
 
         # Get messages
         cursor.execute(
-            """SELECT message_id, role, content, image_url, map_url, created_at
+            """SELECT message_id, role, content, image_url, map_url, is_interrupted, created_at
                FROM chat_messages
                WHERE session_id = %s
                ORDER BY created_at ASC
@@ -694,6 +722,14 @@ async def get_user_from_token(token: str = Depends(oauth2_scheme)):
     user_id = verify_token(token)
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
+    # Read-your-writes: leituras desta requisição após um commit dela vão ao primário
+    set_request_user(user_id)
+    return user_id
+
+async def get_admin_from_token(user_id: int = Depends(get_user_from_token)):
+    """Require an authenticated user listed in ADMIN_USER_IDS"""
+    if user_id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Admin access required")
     return user_id
 
 def generate_otp():
@@ -955,7 +991,7 @@ def analyze_waste_image(payload):
 async def process_report_with_agent_async(report_id, image_url, latitude, longitude, description):
     """Process report using AgentCore for analysis - truly async"""
     try:
-        connection = get_db_connection()
+        connection = get_worker_connection()
         cursor = connection.cursor(dictionary=True)
 
         # Download image and convert to base64 for AgentCore
@@ -1001,18 +1037,15 @@ async def analyze_image_with_claude(image_url, latitude=0.0, longitude=0.0, desc
         description: User-provided description
 
     Returns:
-        Tuple of (analysis_result dict, image_data base64 string)
+        Tuple of (analysis_result dict, image_data base64 string); failures
+        return (None, None), or (None, VISION_CIRCUIT_OPEN) when the circuit
+        breaker rejected the call
     """
     try:
         logger.info(f"Analyzing image with Claude Vision API: {image_url}")
 
         # Convert relative path to absolute local path
-        if image_url.startswith('/static/'):
-            # Get absolute path from relative /static/ path
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-            local_path = os.path.join(base_dir, image_url.lstrip('/'))
-        else:
-            local_path = image_url
+        local_path = resolve_local_image_path(image_url)
 
         if not os.path.exists(local_path):
             logger.error(f"Image file not found: {local_path}")
@@ -1045,29 +1078,113 @@ async def analyze_image_with_claude(image_url, latitude=0.0, longitude=0.0, desc
 
         if result and not result.get('error'):
             # Convert to expected format
-            analysis_result = {
-                "waste_type": result.get("waste_type", "Unknown"),
-                "severity_score": result.get("severity_score", 5),
-                "priority_level": result.get("priority_level", "medium").lower(),
-                "environmental_impact": result.get("environmental_impact", ""),
-                "estimated_volume": result.get("volume_estimate", "Unknown"),
-                "safety_concerns": result.get("recommended_action", ""),
-                "analysis_notes": result.get("description", ""),
-                "waste_detection_confidence": int(result.get("confidence", 0.8) * 100),
-                "short_description": f"{result.get('waste_type', 'Waste')} detected",
-                "full_description": result.get("description", "")
-            }
+            analysis_result = convert_vision_result(result)
             logger.info(f"Analysis complete: {analysis_result.get('waste_type')}")
             return analysis_result, image_data
         else:
             logger.error(f"Analysis failed: {result.get('error', 'Unknown error')}")
-            return None, None
+            return None, (VISION_CIRCUIT_OPEN if result and result.get(VISION_CIRCUIT_OPEN) else None)
 
     except Exception as e:
         logger.error(f"Error in analyze_image_with_claude: {e}")
         return None, None
 
 
+async def analyze_images_batch_with_claude(reports):
+    """
+    Analyze several report images with a single Claude CLI call per batch
+
+    Args:
+        reports: List of report dicts with report_id, image_url, latitude,
+                 longitude and description
+
+    Returns:
+        Dict mapping report_id to (analysis_result, image_data); failed
+        analyses map to (None, None), or (None, VISION_CIRCUIT_OPEN) when the
+        circuit breaker rejected them, like analyze_image_with_claude
+    """
+    from tools.vision_tools import analyze_waste_images_batch
+
+    outcomes = {}
+    items = []
+    batch_reports = []
+
+    for report in reports:
+        local_path = resolve_local_image_path(report['image_url'])
+        if not os.path.exists(local_path):
+            logger.error(f"Image file not found: {local_path}")
+            outcomes[report['report_id']] = (None, None)
+            continue
+
+        items.append({
+            "image_path": local_path,
+            "latitude": report['latitude'],
+            "longitude": report['longitude'],
+            "description": report.get('description') or ''
+        })
+        batch_reports.append(report)
+
+    if not items:
+        return outcomes
+
+    try:
+        loop = asyncio.get_event_loop()
+        results = await loop.run_in_executor(None, analyze_waste_images_batch, items)
+    except Exception as e:
+        logger.error(f"Error in analyze_images_batch_with_claude: {e}")
+        results = [None] * len(items)
+
+    for report, result in zip(batch_reports, results):
+        if result and not result.get('error'):
+            outcomes[report['report_id']] = (convert_vision_result(result), None)
+        else:
+            error = result.get('error', 'Unknown error') if result else 'Unknown error'
+            logger.error(f"Analysis failed for report {report['report_id']}: {error}")
+            outcomes[report['report_id']] = (
+                None, VISION_CIRCUIT_OPEN if result and result.get(VISION_CIRCUIT_OPEN) else None
+            )
+
+    return outcomes
+
+
+def resolve_local_image_path(image_url):
+    """Convert a /static/... image URL to an absolute local path"""
+    if image_url.startswith('/static/'):
+        # Get absolute path from relative /static/ path
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(base_dir, image_url.lstrip('/'))
+    return image_url
+
+
+def convert_vision_result(result):
+    """Convert a vision tool result into the analysis format used by process_report"""
+    return {
+        "waste_type": result.get("waste_type", "Unknown"),
+        "severity_score": result.get("severity_score", 5),
+        "priority_level": result.get("priority_level", "medium").lower(),
+        "environmental_impact": result.get("environmental_impact", ""),
+        "estimated_volume": result.get("volume_estimate", "Unknown"),
+        "safety_concerns": result.get("recommended_action", ""),
+        "analysis_notes": result.get("description", ""),
+        "waste_detection_confidence": int(result.get("confidence", 0.8) * 100),
+        "short_description": f"{result.get('waste_type', 'Waste')} detected",
+        "full_description": result.get("description", "")
+    }
+
+
+def index_image_embedding(analysis_id, image_embedding):
+    """Add a freshly stored image embedding to the in-process ANN index"""
+    if not image_embedding:
+        return
+    try:
+        index = get_image_index()
+        if index is not None:
+            index.add([analysis_id], [image_embedding])
+    except Exception as e:
+        # The index catches up from the database on the next sync
+        logger.warning(f"Failed to index embedding for analysis {analysis_id}: {e}")
+
+
 def extract_volume_number(volume_str):
     """Extract numeric value from volume string like '5 cubic meters' -> 5.0"""
     try:
@@ -1089,24 +1206,39 @@ def extract_volume_number(volume_str):
         logger.warning(f"Failed to extract volume from '{volume_str}': {e}")
         return 0.0
 # Process a waste report
-async def process_report(report_id, background_tasks: BackgroundTasks):
+async def process_report(report_id, background_tasks: BackgroundTasks, precomputed_analysis=None,
+                         precomputed_embedding=None):
     """
     Process a waste report by analyzing its image and updating the database
     
     Args:
         report_id: ID of the report to process
         background_tasks: FastAPI background tasks for async processing
+        precomputed_analysis: Optional (analysis_result, image_data) tuple from
+            batch analysis; when given the image is not analyzed again
+        precomputed_embedding: Optional image embedding computed by the batch
     
     Returns:
         Dictionary with processing results
     """
     try:
         # Get database connection
-        connection = get_db_connection()
+        connection = get_worker_connection()
         if not connection:
             return {"success": False, "message": "Failed to connect to database"}
         
         cursor = connection.cursor(dictionary=True)
+
+        # Vision backend is failing: park the report (queue item stays pending)
+        # instead of tying up a worker until the timeout
+        if precomputed_analysis is None and vision_breaker.is_open():
+            update_queue_status(cursor, report_id, success=False,
+                                error_message="Vision backend unavailable", parked=True)
+            connection.commit()
+            cursor.close()
+            connection.close()
+            logger.warning(f"Report {report_id} parked: vision backend circuit open")
+            return {"success": False, "parked": True, "message": "Vision backend unavailable, report parked"}
         
         # Update report status to analyzing
         cursor.execute(
@@ -1128,6 +1260,9 @@ async def process_report(report_id, background_tasks: BackgroundTasks):
         
         report = cursor.fetchone()
         if not report:
+            update_queue_status(cursor, report_id, success=False,
+                                error_message="Report not found", retryable=False)
+            connection.commit()
             cursor.close()
             connection.close()
             return {"success": False, "message": f"Report {report_id} not found"}
@@ -1138,6 +1273,8 @@ async def process_report(report_id, background_tasks: BackgroundTasks):
                 "UPDATE reports SET status = 'submitted' WHERE report_id = %s",
                 (report_id,)
             )
+            update_queue_status(cursor, report_id, success=False,
+                                error_message="No image available for analysis", retryable=False)
             connection.commit()
             cursor.close()
             connection.close()
@@ -1146,23 +1283,37 @@ async def process_report(report_id, background_tasks: BackgroundTasks):
         # Log the image URL we're about to analyze
         logger.info(f"Processing report {report_id} with image URL: {report['image_url']}")
 
-        # Analyze image with Nova Pro via AgentCore
-        analysis_result, image_data = await analyze_image_with_claude(
-            report['image_url'],
-            report['latitude'],
-            report['longitude'],
-            report.get('description', '')
-        )
+        # Analyze image with Claude (unless already analyzed in a batch)
+        if precomputed_analysis is not None:
+            analysis_result, image_data = precomputed_analysis
+        else:
+            analysis_result, image_data = await analyze_image_with_claude(
+                report['image_url'],
+                report['latitude'],
+                report['longitude'],
+                report.get('description', '')
+            )
         
         if not analysis_result:
+            # Calls rejected by the circuit breaker (open or half-open) don't count as retries
+            parked = image_data == VISION_CIRCUIT_OPEN
             cursor.execute(
                 "UPDATE reports SET status = 'submitted' WHERE report_id = %s",
                 (report_id,)
             )
+            update_queue_status(cursor, report_id, success=False,
+                                error_message="Image analysis failed", parked=parked)
             connection.commit()
             cursor.close()
             connection.close()
-            return {"success": False, "message": "Image analysis failed"}
+            return {"success": False, "parked": parked, "message": "Image analysis failed"}
+
+        # Local CPU embeddings (core/embeddings.py), computed off the event loop
+        if precomputed_embedding is not None:
+            image_embedding = precomputed_embedding
+        else:
+            image_embedding = (await embed_images_async([resolve_local_image_path(report['image_url'])]))[0]
+        location_embedding = compute_location_embedding(report['latitude'], report['longitude'])
         
         # If the image doesn't contain waste, update status to analyzed with "Not Garbage"
         if analysis_result['waste_type'] == 'Not Garbage':
@@ -1200,10 +1351,6 @@ async def process_report(report_id, background_tasks: BackgroundTasks):
                 connection.commit()
                 waste_type_id = cursor.lastrowid
             
-            # TODO: Re-implement embeddings when Claude SDK supports it
-            image_embedding = None  # create_image_content_embedding removed (was AWS Bedrock)
-            location_embedding = None  # create_location_embedding removed (was AWS Bedrock)
-            
             # Insert analysis results for non-garbage
             cursor.execute(
                 """
@@ -1230,6 +1377,7 @@ async def process_report(report_id, background_tasks: BackgroundTasks):
                 )
             )
             connection.commit()
+            index_image_embedding(cursor.lastrowid, image_embedding)
             
             # Log the activity
             cursor.execute(
@@ -1250,6 +1398,9 @@ async def process_report(report_id, background_tasks: BackgroundTasks):
             # Check for hotspots (reports nearby) - for Not Garbage reports too
             logger.info(f"Checking for hotspots near report {report_id} (Not Garbage)")
             hotspot_result = check_and_create_hotspots(cursor, connection, report, report_id, analysis_result)
+
+            update_queue_status(cursor, report_id, success=True)
+            connection.commit()
             
             cursor.close()
             connection.close()
@@ -1307,10 +1458,6 @@ async def process_report(report_id, background_tasks: BackgroundTasks):
             connection.commit()
             waste_type_id = cursor.lastrowid
         
-        # TODO: Re-implement embeddings when Claude SDK supports it
-        image_embedding = None  # create_image_content_embedding removed (was AWS Bedrock)
-        location_embedding = create_location_embedding(report['latitude'], report['longitude'])
-        
         # Insert analysis results
         cursor.execute(
             """
@@ -1337,6 +1484,7 @@ async def process_report(report_id, background_tasks: BackgroundTasks):
             )
         )
         connection.commit()
+        index_image_embedding(cursor.lastrowid, image_embedding)
         
         # Check for hotspots (reports nearby) - for actual waste reports
         logger.info(f"Checking for hotspots near report {report_id} (Actual Waste)")
@@ -1356,6 +1504,7 @@ async def process_report(report_id, background_tasks: BackgroundTasks):
                 'reports'
             )
         )
+        update_queue_status(cursor, report_id, success=True)
         connection.commit()
         
         cursor.close()
@@ -1369,8 +1518,150 @@ async def process_report(report_id, background_tasks: BackgroundTasks):
         
     except Exception as e:
         logger.error(f"Error processing report {report_id}: {e}")
+        release_failed_report(report_id, f"Error processing report: {e}")
         return {"success": False, "message": f"Error processing report: {str(e)}"}
 
+def release_failed_report(report_id, error_message):
+    """
+    Count an unexpected processing error as a failed attempt
+
+    Runs on a fresh connection (the one used by process_report may be in an
+    unknown state), so the claimed queue entry doesn't stay in 'processing'
+    and the report doesn't stay in 'analyzing'.
+    """
+    try:
+        connection = get_worker_connection()
+        if not connection:
+            return
+        cursor = connection.cursor()
+        cursor.execute(
+            "UPDATE reports SET status = 'submitted' WHERE report_id = %s AND status = 'analyzing'",
+            (report_id,)
+        )
+        update_queue_status(cursor, report_id, success=False, error_message=error_message[:500])
+        connection.commit()
+        cursor.close()
+        connection.close()
+    except Exception as e:
+        # The stale queue reaper picks the entry up later
+        logger.error(f"Failed to release queue entry of report {report_id}: {e}")
+
+def update_queue_status(cursor, report_id, success, error_message=None, parked=False, retryable=True):
+    """
+    Close the image_processing_queue entry of a report after an analysis attempt
+
+    Successful analyses mark the entry as completed. Failed ones go back to
+    pending (to be picked again by the scheduler) until MAX_QUEUE_RETRIES
+    attempts, then are marked as failed; non-retryable failures (report or
+    image missing) are marked as failed right away. Parked entries (vision
+    backend circuit open) go back to pending without spending a retry. The
+    caller commits.
+    """
+    if parked:
+        cursor.execute(
+            """
+            UPDATE image_processing_queue
+            SET status = 'pending', error_message = %s
+            WHERE report_id = %s
+            """,
+            (error_message, report_id)
+        )
+    elif success:
+        cursor.execute(
+            """
+            UPDATE image_processing_queue
+            SET status = 'completed', processed_at = %s, error_message = NULL
+            WHERE report_id = %s
+            """,
+            (datetime.now(), report_id)
+        )
+    elif not retryable:
+        cursor.execute(
+            """
+            UPDATE image_processing_queue
+            SET status = 'failed', processed_at = %s, error_message = %s
+            WHERE report_id = %s
+            """,
+            (datetime.now(), error_message, report_id)
+        )
+    else:
+        cursor.execute(
+            """
+            UPDATE image_processing_queue
+            SET retry_count = retry_count + 1,
+                status = IF(retry_count >= %s, 'failed', 'pending'),
+                error_message = %s
+            WHERE report_id = %s
+            """,
+            (MAX_QUEUE_RETRIES, error_message, report_id)
+        )
+
+async def process_reports_batch(report_ids, background_tasks: BackgroundTasks):
+    """
+    Process several queued reports, analyzing their images in batches
+
+    Images are sent to the vision tool in small groups (one CLI call per
+    group); each report is then persisted by process_report with its
+    precomputed analysis. Items that fail in the batch are retried
+    individually by the vision tool itself.
+
+    Args:
+        report_ids: IDs of the reports to process
+        background_tasks: FastAPI background tasks for async processing
+
+    Returns:
+        List with the process_report result of each report
+    """
+    try:
+        connection = get_worker_connection()
+        if not connection:
+            return [{"success": False, "message": "Failed to connect to database"}]
+
+        cursor = connection.cursor(dictionary=True)
+        placeholders = ", ".join(["%s"] * len(report_ids))
+
+        cursor.execute(
+            f"UPDATE reports SET status = 'analyzing' WHERE report_id IN ({placeholders})",
+            tuple(report_ids)
+        )
+        connection.commit()
+
+        cursor.execute(
+            f"""
+            SELECT report_id, image_url, latitude, longitude, description
+            FROM reports
+            WHERE report_id IN ({placeholders}) AND image_url IS NOT NULL
+            """,
+            tuple(report_ids)
+        )
+        reports = cursor.fetchall()
+        cursor.close()
+        connection.close()
+
+        logger.info(f"Batch processing {len(reports)} reports")
+
+        # Vision analysis and image embeddings run concurrently
+        outcomes, image_embeddings = await asyncio.gather(
+            analyze_images_batch_with_claude(reports),
+            embed_images_async([resolve_local_image_path(report['image_url']) for report in reports])
+        )
+        embeddings = {
+            report['report_id']: embedding
+            for report, embedding in zip(reports, image_embeddings)
+        }
+
+    except Exception as e:
+        logger.error(f"Error in batch analysis, falling back to single processing: {e}")
+        outcomes = {}
+        embeddings = {}
+
+    results = []
+    for report_id in report_ids:
+        results.append(await process_report(
+            report_id, background_tasks, outcomes.get(report_id), embeddings.get(report_id)
+        ))
+    return results
+
 # API Routes
 
 # Health check endpoint
@@ -1398,7 +1689,13 @@ async def health_check():
             "status": "ok",
             "service": "duraeco API",
             "version": "1.0.0",
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "vision_backend": {
+                **vision_breaker.stats(),
+                "timeout": vision_timeout.stats()
+            },
+            "db_pools": get_pool_stats(),
+            "indexes": get_index_syncer(get_worker_connection).get_stats()
         }
     except Exception as e:
         logger.error(f"Health check error: {e}")
@@ -2422,8 +2719,8 @@ async def submit_report(report_data: ReportCreate, background_tasks: BackgroundT
         # Add entry to image processing queue if there's an image
         if image_url:
             cursor.execute(
-                "INSERT INTO image_processing_queue (report_id, image_url) VALUES (%s, %s)",
-                (report_id, image_url)
+                "INSERT INTO image_processing_queue (report_id, image_url, urgency) VALUES (%s, %s, %s)",
+                (report_id, image_url, normalize_urgency(report_data.urgency))
             )
         
         # Log the activity
@@ -2469,7 +2766,7 @@ async def get_nearby_reports(
         offset = (page - 1) * per_page
         
         # Get nearby reports
-        connection = get_db_connection()
+        connection = get_read_connection()
         cursor = connection.cursor(dictionary=True)
         
         # Get total count using Haversine formula
@@ -2534,10 +2831,68 @@ async def get_nearby_reports(
         logger.error(f"Get nearby reports error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/reports/search", response_model=dict)
+async def search_reports_text(
+    q: str,
+    waste_type: Optional[str] = None,
+    status: Optional[str] = None,
+    min_severity: Optional[int] = None,
+    max_severity: Optional[int] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    page: int = 1,
+    per_page: int = 10,
+    user_id: int = Depends(get_user_from_token)
+):
+    """Full-text search over report descriptions, addresses and analysis text (BM25, highlighted)"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+    page = max(1, page)
+    per_page = max(1, min(per_page, 50))
+
+    try:
+        for value in (date_from, date_to):
+            if value:
+                datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in YYYY-MM-DD format")
+
+    try:
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(None, lambda: search_reports(
+            get_db_connection, q,
+            limit=per_page,
+            offset=(page - 1) * per_page,
+            waste_type=waste_type,
+            status=status,
+            min_severity=min_severity,
+            max_severity=max_severity,
+            date_from=date_from,
+            date_to=date_to
+        ))
+
+        return {
+            "status": "success",
+            "query": q,
+            "reports": result["results"],
+            "pagination": {
+                "total": result["total"],
+                "page": page,
+                "per_page": per_page,
+                "total_pages": (result["total"] + per_page - 1) // per_page
+            }
+        }
+
+    except IndexNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Report search error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/reports/{report_id}", response_model=dict)
 async def get_report(report_id: int, user_id: int = Depends(get_user_from_token)):
     try:
-        connection = get_db_connection()
+        connection = get_read_connection()
         cursor = connection.cursor(dictionary=True)
         
         # First check if the report exists and if the user has permission to view it
@@ -2715,7 +3070,7 @@ async def get_reports(
         offset = (page - 1) * per_page
         
         # Get reports
-        connection = get_db_connection()
+        connection = get_read_connection()
         cursor = connection.cursor(dictionary=True)
         
         # Get total count
@@ -2795,7 +3150,7 @@ async def get_reports(
 async def get_waste_types(user_id: int = Depends(get_user_from_token)):
     try:
         # Get waste types
-        connection = get_db_connection()
+        connection = get_read_connection()
         cursor = connection.cursor(dictionary=True)
         
         cursor.execute(
@@ -2835,7 +3190,7 @@ async def get_hotspots(
         offset = (page - 1) * per_page
         
         # Get hotspots
-        connection = get_db_connection()
+        connection = get_read_connection()
         cursor = connection.cursor(dictionary=True)
         
         if lat is not None and lon is not None:
@@ -2940,7 +3295,7 @@ async def get_hotspot_reports(
         offset = (page - 1) * per_page
         
         # Get reports for the hotspot
-        connection = get_db_connection()
+        connection = get_read_connection()
         cursor = connection.cursor(dictionary=True)
         
         # Get total count
@@ -2997,7 +3352,7 @@ async def get_hotspot_reports(
 @app.get("/api/dashboard/statistics", response_model=dict)
 async def get_dashboard_statistics(user_id: int = Depends(get_user_from_token)):
     try:
-        connection = get_db_connection()
+        connection = get_analytics_connection()
         cursor = connection.cursor(dictionary=True)
         
         # Get user's report counts
@@ -3174,58 +3529,43 @@ async def get_dashboard_statistics(user_id: int = Depends(get_user_from_token)):
 async def process_queue(background_tasks: BackgroundTasks, user_id: int = Depends(get_user_from_token)):
     """Process the queue of unanalyzed reports"""
     try:
-        # Get database connection
-        connection = get_db_connection()
-        if not connection:
-            raise HTTPException(status_code=500, detail="Failed to connect to database")
-        
-        cursor = connection.cursor(dictionary=True)
-        
-        # Get unprocessed reports from the queue
-        cursor.execute(
-            """
-            SELECT q.queue_id, q.report_id, q.image_url
-            FROM image_processing_queue q
-            WHERE q.status = 'pending'
-            ORDER BY q.queued_at ASC
-            LIMIT 10
-            """
-        )
-        
-        queue_items = cursor.fetchall()
-        cursor.close()
-        connection.close()
+        # Vision backend is failing: leave the queue parked until it recovers
+        if vision_breaker.is_open():
+            retry_after = round(vision_breaker.retry_after())
+            return {
+                "status": "parked",
+                "message": f"Vision backend unavailable, retry in {retry_after}s",
+                "processed_count": 0,
+                "retry_after_seconds": retry_after
+            }
+
+        # Pick the most actionable pending items (priority + aging + per-user
+        # fairness) and mark them as processing
+        queue_items = queue_scheduler.next_batch(limit=10)
         
         if not queue_items:
             return {"status": "success", "message": "No items in the queue", "processed_count": 0}
         
-        # Process each queue item in the background
-        processed_count = 0
-        for item in queue_items:
-            # Update queue item status to processing
-            connection = get_db_connection()
-            cursor = connection.cursor()
-            
-            cursor.execute(
-                """
-                UPDATE image_processing_queue
-                SET status = 'processing', processed_at = %s
-                WHERE queue_id = %s
-                """,
-                (datetime.now(), item['queue_id'])
+        processed_count = len(queue_items)
+
+        # Backlog: analyze the images in batches to amortize per-call overhead
+        if len(queue_items) > 1:
+            background_tasks.add_task(
+                process_reports_batch,
+                [item['report_id'] for item in queue_items],
+                background_tasks
             )
-            connection.commit()
-            cursor.close()
-            connection.close()
-            
-            # Add report to the background processing queue
-            background_tasks.add_task(process_report, item['report_id'], background_tasks)
-            processed_count += 1
+        else:
+            background_tasks.add_task(process_report, queue_items[0]['report_id'], background_tasks)
         
         return {
             "status": "success",
             "message": f"{processed_count} reports added to processing queue",
-            "processed_count": processed_count
+            "processed_count": processed_count,
+            "scheduled": [
+                {"report_id": item['report_id'], "priority": item['priority']}
+                for item in queue_items
+            ]
         }
        
     except HTTPException as e:
@@ -3386,6 +3726,90 @@ async def test_nova_api(image_url: str, user_id: int = Depends(get_user_from_tok
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ==================== ADMIN: BULK RE-ANALYSIS ====================
+
+# Re-analysis campaigns share the vision tool (and its circuit breaker) with
+# live traffic; the runner yields while live queue items are waiting
+reanalysis_runner = ReanalysisRunner(get_worker_connection, analyze_images_batch_with_claude, vision_breaker)
+
+
+@app.post("/api/admin/reanalysis", response_model=dict)
+async def create_reanalysis_campaign(
+    campaign_data: ReanalysisCampaignCreate,
+    background_tasks: BackgroundTasks,
+    admin_id: int = Depends(get_admin_from_token)
+):
+    """Create a re-analysis campaign and (optionally) start it in the background"""
+    try:
+        campaign = reanalysis_runner.create_campaign(
+            name=campaign_data.name,
+            analysis_version=campaign_data.analysis_version,
+            filters=campaign_data.filters,
+            rate_per_minute=campaign_data.rate_per_minute,
+            promote=campaign_data.promote,
+            created_by=admin_id
+        )
+
+        if campaign_data.start and campaign['total_reports']:
+            background_tasks.add_task(reanalysis_runner.run, campaign['campaign_id'])
+
+        return {"status": "success", "campaign": campaign}
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error creating reanalysis campaign: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/admin/reanalysis", response_model=dict)
+async def list_reanalysis_campaigns(limit: int = 20, admin_id: int = Depends(get_admin_from_token)):
+    """List recent re-analysis campaigns with progress and ETA"""
+    return {"status": "success", "campaigns": reanalysis_runner.list_campaigns(min(max(1, limit), 100))}
+
+
+@app.get("/api/admin/reanalysis/{campaign_id}", response_model=dict)
+async def get_reanalysis_campaign(campaign_id: int, admin_id: int = Depends(get_admin_from_token)):
+    """Progress and ETA of a re-analysis campaign"""
+    campaign = reanalysis_runner.get_campaign(campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return {"status": "success", "campaign": campaign}
+
+
+@app.post("/api/admin/reanalysis/{campaign_id}/pause", response_model=dict)
+async def pause_reanalysis_campaign(campaign_id: int, admin_id: int = Depends(get_admin_from_token)):
+    """Pause a campaign; the runner stops after the current batch"""
+    if not reanalysis_runner.pause_campaign(campaign_id):
+        raise HTTPException(status_code=409, detail="Campaign is not pending or running")
+    return {"status": "success", "campaign": reanalysis_runner.get_campaign(campaign_id)}
+
+
+@app.post("/api/admin/reanalysis/{campaign_id}/resume", response_model=dict)
+async def resume_reanalysis_campaign(
+    campaign_id: int,
+    background_tasks: BackgroundTasks,
+    admin_id: int = Depends(get_admin_from_token)
+):
+    """Resume a paused, failed or interrupted campaign from its checkpoint"""
+    campaign = reanalysis_runner.get_campaign(campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    if campaign['status'] in ('completed', 'cancelled'):
+        raise HTTPException(status_code=409, detail=f"Campaign is {campaign['status']}")
+
+    background_tasks.add_task(reanalysis_runner.run, campaign_id)
+    return {"status": "success", "message": "Campaign resuming", "campaign": campaign}
+
+
+@app.post("/api/admin/reanalysis/{campaign_id}/cancel", response_model=dict)
+async def cancel_reanalysis_campaign(campaign_id: int, admin_id: int = Depends(get_admin_from_token)):
+    """Cancel a campaign (versions already written are kept)"""
+    if not reanalysis_runner.cancel_campaign(campaign_id):
+        raise HTTPException(status_code=409, detail="Campaign cannot be cancelled")
+    return {"status": "success", "campaign": reanalysis_runner.get_campaign(campaign_id)}
+
+
 # ==================== CHAT API WITH AGENTCORE ====================
 
 # Pydantic models for chat
@@ -3401,7 +3825,7 @@ class ChatRequest(BaseModel):
 def get_waste_statistics() -> dict:
     """Get overall waste statistics from the database"""
     try:
-        conn = get_db_connection()
+        conn = get_analytics_connection()
         cursor = conn.cursor(dictionary=True)
 
         # Get total reports
@@ -3442,32 +3866,34 @@ def get_waste_statistics() -> dict:
 def search_reports_by_location(district: str = None, limit: int = 10) -> dict:
     """Search waste reports by location"""
     try:
-        conn = get_db_connection()
+        if district:
+            # Address match through the text index instead of a LIKE '%...%' scan
+            result = search_reports(get_analytics_connection, district, limit=limit, fields=["address_text"])
+            reports = [
+                {key: report[key] for key in (
+                    "report_id", "latitude", "longitude", "report_date", "description", "status",
+                    "address_text", "severity_score", "priority_level", "waste_type"
+                )}
+                for report in result["results"]
+            ]
+            for report in reports:
+                if report['severity_score'] is not None:
+                    report['severity_score'] = float(report['severity_score'])
+            return {"reports": reports, "count": len(reports)}
+
+        conn = get_analytics_connection()
         cursor = conn.cursor(dictionary=True)
 
-        if district:
-            cursor.execute("""
-                SELECT r.report_id, r.latitude, r.longitude, r.report_date,
-                       r.description, r.status, r.address_text,
-                       ar.severity_score, ar.priority_level, wt.name as waste_type
-                FROM reports r
-                LEFT JOIN analysis_results ar ON r.report_id = ar.report_id
-                LEFT JOIN waste_types wt ON ar.waste_type_id = wt.waste_type_id
-                WHERE r.address_text LIKE %s
-                ORDER BY r.report_date DESC
-                LIMIT %s
-            """, (f'%{district}%', limit))
-        else:
-            cursor.execute("""
-                SELECT r.report_id, r.latitude, r.longitude, r.report_date,
-                       r.description, r.status, r.address_text,
-                       ar.severity_score, ar.priority_level, wt.name as waste_type
-                FROM reports r
-                LEFT JOIN analysis_results ar ON r.report_id = ar.report_id
-                LEFT JOIN waste_types wt ON ar.waste_type_id = wt.waste_type_id
-                ORDER BY r.report_date DESC
-                LIMIT %s
-            """, (limit,))
+        cursor.execute("""
+            SELECT r.report_id, r.latitude, r.longitude, r.report_date,
+                   r.description, r.status, r.address_text,
+                   ar.severity_score, ar.priority_level, wt.name as waste_type
+            FROM reports r
+            LEFT JOIN analysis_results ar ON r.report_id = ar.report_id
+            LEFT JOIN waste_types wt ON ar.waste_type_id = wt.waste_type_id
+            ORDER BY r.report_date DESC
+            LIMIT %s
+        """, (limit,))
 
         reports = cursor.fetchall()
         cursor.close()
@@ -3492,7 +3918,7 @@ def search_reports_by_location(district: str = None, limit: int = 10) -> dict:
 def get_hotspot_information(limit: int = 10) -> dict:
     """Get information about waste hotspots"""
     try:
-        conn = get_db_connection()
+        conn = get_analytics_connection()
         cursor = conn.cursor(dictionary=True)
 
         cursor.execute("""
@@ -3529,7 +3955,7 @@ def get_hotspot_information(limit: int = 10) -> dict:
 def get_waste_types_info() -> dict:
     """Get information about waste types and categories"""
     try:
-        conn = get_db_connection()
+        conn = get_analytics_connection()
         cursor = conn.cursor(dictionary=True)
 
         cursor.execute("""
@@ -3561,7 +3987,7 @@ def execute_sql_query(sql_query: str) -> dict:
             if keyword in query_upper:
                 return {"error": f"Query contains forbidden keyword: {keyword}"}
 
-        conn = get_db_connection()
+        conn = get_analytics_connection()
         cursor = conn.cursor(dictionary=True)
 
         # Execute the query with a limit to prevent large result sets
@@ -3781,7 +4207,7 @@ async def custom_404_handler(request: requests, exc: HTTPException):
 def cleanup_expired_tokens():
     """Remove expired and revoked refresh tokens from database (runs daily at 3 AM)"""
     try:
-        connection = get_db_connection()
+        connection = get_worker_connection()
         if not connection:
             logger.error("Failed to get database connection for token cleanup")
             return
@@ -3807,11 +4233,24 @@ def cleanup_expired_tokens():
 # Schedule daily token cleanup
 from apscheduler.schedulers.background import BackgroundScheduler
 
+def reap_stale_queue_items():
+    """Return queue items stuck in 'processing' to the queue (runs every 5 minutes)"""
+    try:
+        queue_scheduler.reap_stale(MAX_QUEUE_RETRIES)
+    except Exception as e:
+        logger.error(f"Queue reaper error: {e}")
+
 scheduler = BackgroundScheduler()
 scheduler.add_job(cleanup_expired_tokens, 'cron', hour=3, minute=0)
+scheduler.add_job(reap_stale_queue_items, 'interval', minutes=5)
 scheduler.start()
 
 logger.info("[Scheduler] Token cleanup job scheduled for 3:00 AM daily")
+logger.info("[Scheduler] Stale queue reaper scheduled every 5 minutes")
+
+# In-process indexes (image, geo, text) synced in background; searches only read memory
+get_index_syncer(get_worker_connection).start()
+logger.info("[IndexSync] Background index sync started")
 
 # Run the app
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Backfill de embeddings em analysis_results (CLI)
+
+Preenche image_embedding/location_embedding NULL usando core/embedding_backfill.py.
+O progresso fica em data/embedding_backfill.json; rodar de novo retoma do
+último lote gravado (Ctrl+C é seguro).
+
+Exemplos:
+    python backfill_embeddings.py status
+    python backfill_embeddings.py run --workers 4 --batch-size 200 --rate 50
+    python backfill_embeddings.py run --max-rows 1000 --no-yield
+    python backfill_embeddings.py reset
+"""
+
+import json
+import argparse
+
+from core.embedding_backfill import DEFAULT_CHECKPOINT_PATH, EmbeddingBackfill
+
+
+def print_checkpoint(checkpoint, pending=None):
+    print(
+        f"último analysis_id {checkpoint['last_analysis_id']}: {checkpoint['processed']} processadas, "
+        f"imagem {checkpoint['image_filled']} (falhas {checkpoint['image_failed']}), "
+        f"localização {checkpoint['location_filled']}"
+        + (f", {pending} pendentes" if pending is not None else "")
+        + (" ✅ concluído" if checkpoint.get('completed') else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill de embeddings em analysis_results")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT_PATH, help="Arquivo de checkpoint")
+    parser.add_argument('--json', action='store_true', help="Saída em JSON")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help="Executar/retomar")
+    run.add_argument('--workers', type=int, help="Processos de embedding (default: CPUs - 1)")
+    run.add_argument('--batch-size', type=int, default=200, help="Linhas por lote")
+    run.add_argument('--rate', type=float, help="Máximo de linhas por segundo")
+    run.add_argument('--max-rows', type=int, help="Parar após N linhas")
+    run.add_argument('--no-yield', action='store_true', help="Não esperar pela fila ao vivo")
+
+    sub.add_parser('status', help="Checkpoint e linhas pendentes")
+    sub.add_parser('reset', help="Apagar o checkpoint (recomeça do início)")
+
+    args = parser.parse_args()
+
+    # Importado aqui: os processos do pool (spawn) reimportam este módulo e
+    # não precisam do app nem do pool de conexões
+    from app import get_db_connection, resolve_local_image_path
+
+    backfill = EmbeddingBackfill(
+        get_db_connection,
+        resolve_local_image_path,
+        checkpoint_path=args.checkpoint,
+        workers=getattr(args, 'workers', None),
+        batch_size=getattr(args, 'batch_size', 200),
+        rows_per_second=getattr(args, 'rate', None),
+        yield_to_live=not getattr(args, 'no_yield', False)
+    )
+
+    if args.command == 'reset':
+        backfill.reset_checkpoint()
+        print("Checkpoint apagado")
+        return
+
+    if args.command == 'status':
+        checkpoint = backfill.load_checkpoint()
+        pending = backfill.pending_count(checkpoint['last_analysis_id'])
+        if args.json:
+            print(json.dumps({**checkpoint, "pending": pending}, indent=2))
+        else:
+            print_checkpoint(checkpoint, pending)
+        return
+
+    progress = None if args.json else print_checkpoint
+    try:
+        checkpoint = backfill.run(max_rows=args.max_rows, progress=progress)
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrompido; 'run' retoma do último checkpoint")
+        checkpoint = backfill.load_checkpoint()
+
+    if args.json:
+        print(json.dumps(checkpoint, indent=2))
+    else:
+        print_checkpoint(checkpoint)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,9 @@ logger = logging.getLogger(__name__)
 JWT_SECRET = os.getenv('JWT_SECRET', 'development_secret_do_not_use_in_production')
 JWT_EXPIRATION_HOURS = int(os.getenv('JWT_EXPIRATION_HOURS', '24'))
 
+# Users allowed to call admin endpoints (comma-separated user IDs)
+ADMIN_USER_IDS = {int(uid) for uid in os.getenv('ADMIN_USER_IDS', '').split(',') if uid.strip()}
+
 
 def verify_token(token):
     """Verify a JWT token and return the user ID if valid"""
@@ -0,0 +1,176 @@
+"""
+Cancelamento de gerações do chat
+
+Quando o usuário cancela (ou desconecta, ou manda outra pergunta), a rota
+interrompe o cliente Agent SDK; isso para o modelo, mas não as ferramentas
+que já estão rodando. O token de cancelamento da geração chega às
+ferramentas por um ContextVar:
+
+- Cada cliente do pool (core/claude_handler.py) tem um CancellationSlot,
+  ligado ao contexto da sua task antes de conectar; as tasks que o SDK cria
+  para executar as ferramentas herdam esse contexto
+- A cada mensagem o slot recebe um CancellationToken novo
+- Ferramentas pegam o token com current_token() e registram a conexão
+  MySQL enquanto a query roda (track_query); cancel() faz KILL QUERY nelas
+
+Código em run_in_executor não herda o contexto: pegue o token na parte
+async da ferramenta e passe para a função síncrona.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCancelled(Exception):
+    """A geração do chat foi cancelada"""
+
+
+class CancellationToken:
+    """Estado de cancelamento de uma geração (uma mensagem do chat)"""
+
+    def __init__(self):
+        self.cancelled = False
+        self.reason: Optional[str] = None
+        self._lock = threading.Lock()
+        # thread id MySQL -> função de conexão usada para o KILL
+        self._queries: Dict[int, Callable] = {}
+
+    def cancel(self, reason: str = "cancelled") -> int:
+        """Marca como cancelado e aborta as queries em andamento
+
+        Bloqueante (abre conexões para o KILL): chamar em executor.
+
+        Args:
+            reason: Motivo (ex: "user", "disconnect", "superseded")
+
+        Returns:
+            Número de queries abortadas
+        """
+        with self._lock:
+            if self.cancelled:
+                return 0
+            self.cancelled = True
+            self.reason = reason
+            queries = list(self._queries.items())
+
+        killed = 0
+        for thread_id, get_db_connection in queries:
+            if kill_query(get_db_connection, thread_id):
+                killed += 1
+        if killed:
+            logger.info(f"Generation cancelled ({reason}): killed {killed} running queries")
+        return killed
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled(self.reason or "cancelled")
+
+    @contextmanager
+    def track_query(self, conn, get_db_connection_func: Callable):
+        """Registra a conexão enquanto a query roda (para KILL QUERY)
+
+        Args:
+            conn: Conexão que vai executar a query
+            get_db_connection_func: Função de conexão (usada para o KILL)
+
+        Raises:
+            GenerationCancelled: Se a geração já foi cancelada
+        """
+        self.raise_if_cancelled()
+        thread_id = connection_thread_id(conn)
+        if thread_id is None:
+            yield
+            return
+
+        # O KILL precisa ir ao mesmo servidor (réplica) e não pode esperar vaga
+        # no pool que a própria query ocupa: conexão avulsa quando disponível
+        kill_connection = getattr(conn, "open_side_connection", None) or get_db_connection_func
+        with self._lock:
+            self._queries[thread_id] = kill_connection
+        try:
+            yield
+        except Exception:
+            # Query abortada pelo KILL chega como erro do driver
+            self.raise_if_cancelled()
+            raise
+        finally:
+            with self._lock:
+                self._queries.pop(thread_id, None)
+        self.raise_if_cancelled()
+
+
+class CancellationSlot:
+    """Token atual de um cliente do pool (trocado a cada mensagem)"""
+
+    def __init__(self):
+        self.token: Optional[CancellationToken] = None
+
+
+_current_slot: ContextVar[Optional[CancellationSlot]] = ContextVar("chat_cancellation_slot", default=None)
+
+
+def bind_slot(slot: CancellationSlot):
+    """Liga o slot ao contexto atual (e às tasks criadas a partir dele)"""
+    _current_slot.set(slot)
+
+
+def current_token() -> Optional[CancellationToken]:
+    """Token da geração em andamento, ou None fora do chat"""
+    slot = _current_slot.get()
+    return slot.token if slot else None
+
+
+@contextmanager
+def track_query(conn, get_db_connection_func: Callable, token: Optional[CancellationToken] = None):
+    """track_query do token informado (ou do atual); sem token não faz nada"""
+    token = token or current_token()
+    if token is None:
+        yield
+        return
+    with token.track_query(conn, get_db_connection_func):
+        yield
+
+
+def connection_thread_id(conn) -> Optional[int]:
+    """Thread id MySQL da conexão (o id usado no KILL)"""
+    thread_id = getattr(conn, "connection_id", None)
+    if isinstance(thread_id, int):
+        return thread_id
+    # Conexões do pool (DBUtils) não expõem o atributo do driver
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT CONNECTION_ID()")
+        row = cursor.fetchone()
+        cursor.close()
+        return int(row[0]) if row else None
+    except Exception as e:
+        logger.warning(f"Could not read connection id: {e}")
+        return None
+
+
+def kill_query(get_db_connection_func: Callable, thread_id: int) -> bool:
+    """Aborta a query em execução numa conexão (a conexão continua aberta)"""
+    try:
+        conn = get_db_connection_func()
+    except Exception as e:
+        logger.error(f"KILL QUERY failed: {e}")
+        return False
+    if not conn:
+        logger.error("KILL QUERY failed: database connection failed")
+        return False
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"KILL QUERY {int(thread_id)}")
+        cursor.close()
+        return True
+    except Exception as e:
+        # Query já terminou ou sem privilégio (CONNECTION_ADMIN/PROCESS)
+        logger.warning(f"KILL QUERY {thread_id} failed: {e}")
+        return False
+    finally:
+        conn.close()
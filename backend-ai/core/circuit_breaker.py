@@ -0,0 +1,196 @@
+"""
+Circuit Breaker e timeout adaptativo para backends externos
+
+Usado em volta do backend de visão (Claude Code CLI): quando o backend
+degrada, o circuito abre após falhas/timeouts consecutivos e as chamadas
+falham imediatamente em vez de segurar um worker até o timeout. Depois do
+tempo de recuperação o circuito fica half-open e deixa passar poucas
+chamadas de teste (probes); um sucesso fecha o circuito.
+
+Thread-safe: as chamadas de visão rodam em thread pool.
+"""
+
+import time
+import threading
+from collections import deque
+from typing import Dict
+
+import numpy as np
+
+
+class CircuitBreaker:
+    """Circuit breaker com estados closed / open / half_open"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 60.0,
+        half_open_max_probes: int = 1
+    ):
+        """
+        Args:
+            name: Nome do backend (para logs/métricas)
+            failure_threshold: Falhas consecutivas para abrir o circuito
+            recovery_timeout: Segundos em open antes de permitir probes
+            half_open_max_probes: Chamadas simultâneas permitidas em half-open
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_probes = half_open_max_probes
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._total_failures = 0
+        self._total_rejected = 0
+        self._times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def is_open(self) -> bool:
+        """True se o backend deve ser considerado indisponível agora"""
+        with self._lock:
+            return self._current_state() == self.OPEN
+
+    def retry_after(self) -> float:
+        """Segundos até o circuito aceitar probes (0 se não estiver aberto)"""
+        with self._lock:
+            if self._current_state() != self.OPEN:
+                return 0.0
+            return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def allow_request(self) -> bool:
+        """Verifica se uma chamada pode prosseguir (reserva um probe em half-open)"""
+        with self._lock:
+            state = self._current_state()
+
+            if state == self.CLOSED:
+                return True
+
+            if state == self.HALF_OPEN and self._probes_in_flight < self.half_open_max_probes:
+                self._state = self.HALF_OPEN
+                self._probes_in_flight += 1
+                return True
+
+            self._total_rejected += 1
+            return False
+
+    def record_success(self):
+        """Registra chamada bem-sucedida (fecha o circuito se estava em half-open)"""
+        with self._lock:
+            self._consecutive_failures = 0
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            self._state = self.CLOSED
+
+    def record_failure(self):
+        """Registra falha ou timeout (abre o circuito ao atingir o limite)"""
+        with self._lock:
+            self._consecutive_failures += 1
+            self._total_failures += 1
+            was_probe = self._state == self.HALF_OPEN
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+            if was_probe or self._consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._times_opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        """Estatísticas para health check"""
+        with self._lock:
+            state = self._current_state()
+            return {
+                "name": self.name,
+                "state": state,
+                "consecutive_failures": self._consecutive_failures,
+                "total_failures": self._total_failures,
+                "total_rejected": self._total_rejected,
+                "times_opened": self._times_opened,
+                "retry_after_seconds": round(
+                    max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at)), 1
+                ) if state == self.OPEN else 0.0,
+            }
+
+    def _current_state(self) -> str:
+        """Estado atual (sem lock); open expirado vira half-open"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+
+class AdaptiveTimeout:
+    """Timeout derivado dos percentis de latência recentes"""
+
+    def __init__(
+        self,
+        default: float = 120.0,
+        minimum: float = 30.0,
+        maximum: float = 120.0,
+        percentile: float = 95.0,
+        multiplier: float = 2.0,
+        window: int = 50,
+        min_samples: int = 10
+    ):
+        """
+        Args:
+            default: Timeout usado até haver amostras suficientes
+            minimum: Limite inferior do timeout
+            maximum: Limite superior do timeout
+            percentile: Percentil de latência usado como base
+            multiplier: Folga aplicada sobre o percentil
+            window: Número de latências recentes consideradas
+            min_samples: Amostras necessárias antes de adaptar
+        """
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+
+    def observe(self, latency_seconds: float):
+        """Registra a latência de uma chamada bem-sucedida"""
+        with self._lock:
+            self._latencies.append(latency_seconds)
+
+    def current(self, scale: float = 1.0) -> float:
+        """Timeout atual em segundos
+
+        Args:
+            scale: Fator aplicado ao timeout (ex: lotes com várias imagens)
+        """
+        with self._lock:
+            latencies = list(self._latencies)
+
+        if len(latencies) < self.min_samples:
+            return self.default * scale
+
+        base = float(np.percentile(latencies, self.percentile)) * self.multiplier
+        return min(self.maximum, max(self.minimum, base)) * scale
+
+    def stats(self) -> Dict:
+        """Estatísticas para health check"""
+        with self._lock:
+            latencies = list(self._latencies)
+
+        return {
+            "samples": len(latencies),
+            "p50_seconds": round(float(np.percentile(latencies, 50)), 2) if latencies else None,
+            "p95_seconds": round(float(np.percentile(latencies, 95)), 2) if latencies else None,
+            "timeout_seconds": round(self.current(), 1),
+        }
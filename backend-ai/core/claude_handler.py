@@ -1,142 +1,488 @@
 """
-Claude Handler com Pool de Conexões para Agent SDK
+Claude Handler - Pool de clientes Agent SDK por conversa
 
-Inspirado em: /Users/2a/Desktop/duraeco/backend-chat/core/claude_handler.py
+Abrir um ClaudeSDKClient inicia o processo do CLI e o servidor MCP; fazer
+isso a cada mensagem do chat soma esse tempo ao time-to-first-token. O pool
+mantém um cliente vivo por conversa ativa:
+
+- Criado na primeira mensagem (ou tirado dos reservas pré-aquecidos) e
+  reutilizado nas seguintes: o CLI já tem o contexto da conversa
+- Fechado por inatividade (IDLE_TIMEOUT), idade (MAX_AGE) ou número de
+  usos (MAX_USES); a conversa continua com um cliente novo que retoma a
+  sessão do CLI (resume) quando o id da sessão é conhecido
+- POOL_MAX_SIZE limita os clientes vivos (reservas incluídos): ao atingir o
+  limite, o cliente ocioso usado há mais tempo é fechado
+- Uma mensagem por vez em cada conversa (lock por conversa)
+
+O SDK não permite usar um cliente fora do contexto assíncrono em que foi
+conectado, então cada cliente vive na sua própria task (_PooledClient) e
+recebe os pedidos por fila.
+
+cancel() interrompe a geração em andamento (ver core/cancellation.py): o
+modelo para, as queries das ferramentas são abortadas e o cliente continua
+utilizável depois do ResultMessage da interrupção.
 """
 
-import asyncio
+import os
 import time
-from typing import AsyncGenerator, Dict, Optional
-from datetime import datetime, timedelta
+import asyncio
+import logging
+import dataclasses
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional
 
-from claude_agent_sdk import ClaudeSDKClient, ClaudeAgentOptions
+from claude_agent_sdk import ClaudeSDKClient, ClaudeAgentOptions, ResultMessage
 
+from core.cancellation import CancellationSlot, CancellationToken, bind_slot
 
-class ClaudeHandler:
-    """Handler com pool de conexões para Agent SDK"""
+logger = logging.getLogger(__name__)
 
-    POOL_MAX_SIZE = 10
-    POOL_MIN_SIZE = 2
-    CONNECTION_MAX_AGE_MINUTES = 60
-    CONNECTION_MAX_USES = 100
-    HEALTH_CHECK_INTERVAL = 300  # 5 minutos
+_END = object()
 
-    def __init__(self):
-        self._sessions: Dict[str, Dict] = {}
-        self._session_locks: Dict[str, asyncio.Lock] = {}
-        self._pool_lock = asyncio.Lock()
-        self._last_health_check = time.time()
 
-    async def create_session(
-        self,
-        session_id: str,
-        options: ClaudeAgentOptions
-    ) -> Optional[ClaudeSDKClient]:
-        """Cria ou reutiliza sessão Agent SDK"""
-        async with self._pool_lock:
-            # Verificar se sessão existe e está válida
-            if session_id in self._sessions:
-                session_data = self._sessions[session_id]
-
-                # Verificar age e uso
-                age_minutes = (
-                    datetime.now() - session_data["created_at"]
-                ).total_seconds() / 60
-
-                if (
-                    age_minutes < self.CONNECTION_MAX_AGE_MINUTES
-                    and session_data["use_count"] < self.CONNECTION_MAX_USES
-                ):
-                    session_data["use_count"] += 1
-                    session_data["last_used"] = datetime.now()
-                    return session_data["client"]
-
-                # Sessão expirada, fechar
-                await self._close_session_internal(session_id)
-
-            # Criar nova sessão
-            if session_id not in self._session_locks:
-                self._session_locks[session_id] = asyncio.Lock()
-
-            session_data = {
-                "client": None,  # Será criado no contexto
-                "options": options,
-                "created_at": datetime.now(),
-                "last_used": datetime.now(),
-                "use_count": 1,
-            }
-
-            self._sessions[session_id] = session_data
-            return None  # Cliente será criado com context manager
-
-    async def send_message(
-        self,
-        session_id: str,
-        message: str,
-        options: ClaudeAgentOptions
-    ) -> AsyncGenerator[Dict, None]:
-        """Envia mensagem e retorna stream de respostas"""
+class _PooledClient:
+    """Um ClaudeSDKClient conectado, dono da própria task"""
 
-        # Criar ou reutilizar sessão
-        await self.create_session(session_id, options)
+    CONNECT_TIMEOUT_SECONDS = 60
+    CLOSE_TIMEOUT_SECONDS = 10
+    INTERRUPT_TIMEOUT_SECONDS = 5
+    # Respostas em trânsito por pedido: cheia, a task para de ler do CLI
+    # (backpressure de um cliente WebSocket lento chega até o processo)
+    OUTBOX_MAX_MESSAGES = 64
 
-        # Lock da sessão
-        if session_id not in self._session_locks:
-            self._session_locks[session_id] = asyncio.Lock()
+    def __init__(self, options: ClaudeAgentOptions, client_factory: Callable = ClaudeSDKClient):
+        self.options = options
+        self.client_factory = client_factory
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.use_count = 0
+        self.busy = False
+        # Entregue a um send_message que ainda não chamou ask() (montando o contexto)
+        self.reserved = False
+        self.broken = False
+        self.sdk_session_id: Optional[str] = None
+        self.cancellation = CancellationSlot()
 
-        async with self._session_locks[session_id]:
-            # Usar ClaudeSDKClient como context manager
-            async with ClaudeSDKClient(options=options) as client:
-                await client.query(message)
+        self._client = None
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._ready = asyncio.Event()
+        self._error: Optional[BaseException] = None
+        self._task: Optional[asyncio.Task] = None
 
-                async for msg in client.receive_response():
-                    yield msg
+    async def start(self) -> "_PooledClient":
+        """Conecta o cliente (levanta a exceção da conexão, se houver)"""
+        self._task = asyncio.create_task(self._run(), name="claude-client")
+        try:
+            await asyncio.wait_for(self._ready.wait(), self.CONNECT_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            raise
+        if self._error is not None:
+            raise self._error
+        return self
 
-    async def close_session(self, session_id: str):
-        """Fecha sessão e libera recursos"""
-        async with self._pool_lock:
-            await self._close_session_internal(session_id)
+    async def ask(self, prompt: str) -> AsyncGenerator:
+        """Envia uma mensagem e produz as respostas até o ResultMessage"""
+        outbox: asyncio.Queue = asyncio.Queue(maxsize=self.OUTBOX_MAX_MESSAGES)
+        abandoned = asyncio.Event()
+        finished = False
+        if self._task is None or self._task.done():
+            # Task encerrada não lê mais a inbox: o pedido ficaria esperando para sempre
+            self.broken = True
+            raise ConnectionError("Agent SDK client closed")
+        self.cancellation.token = CancellationToken()
+        self.busy = True
+        self.use_count += 1
+        try:
+            await self._inbox.put((prompt, outbox, abandoned))
+            while True:
+                item = await outbox.get()
+                if item is _END:
+                    finished = True
+                    break
+                if isinstance(item, BaseException):
+                    self.broken = True
+                    raise item
+                if isinstance(item, ResultMessage):
+                    self.sdk_session_id = item.session_id
+                yield item
+        finally:
+            if not finished:
+                # Consumidor saiu antes do fim: o resto da resposta é descartado
+                # e o estado do CLI é incerto, então o cliente não é reutilizado
+                abandoned.set()
+                while not outbox.empty():
+                    outbox.get_nowait()
+                self.broken = True
+            self.busy = False
+            self.last_used = time.monotonic()
 
-    async def _close_session_internal(self, session_id: str):
-        """Fecha sessão (interno, sem lock)"""
-        if session_id in self._sessions:
-            # Cleanup
-            del self._sessions[session_id]
+    async def interrupt(self, reason: str = "cancelled") -> bool:
+        """Interrompe a geração em andamento
 
-        if session_id in self._session_locks:
-            del self._session_locks[session_id]
+        A resposta continua chegando por ask() até o ResultMessage.
 
-    async def health_check(self):
-        """Verifica saúde das sessões e remove expiradas"""
-        now = time.time()
+        Returns:
+            False se não havia geração em andamento
+        """
+        token = self.cancellation.token
+        if not self.busy or token is None or token.cancelled:
+            return False
+
+        loop = asyncio.get_running_loop()
+        # Aborta as queries das ferramentas (KILL QUERY é bloqueante)
+        await loop.run_in_executor(None, token.cancel, reason)
+        try:
+            await asyncio.wait_for(self._client.interrupt(), self.INTERRUPT_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.error(f"Agent SDK interrupt failed: {e}")
+            self.broken = True
+        return True
 
-        # Executar apenas se passou tempo suficiente
-        if now - self._last_health_check < self.HEALTH_CHECK_INTERVAL:
+    async def close(self):
+        if self._task is None or self._task.done():
             return
+        await self._inbox.put(None)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), self.CLOSE_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, Exception):
+            self._task.cancel()
 
-        async with self._pool_lock:
-            expired_sessions = []
+    @property
+    def in_use(self) -> bool:
+        """Gerando ou reservado para um send_message (eviction e health check não fecham)"""
+        return self.busy or self.reserved
 
-            for session_id, session_data in self._sessions.items():
-                age_minutes = (
-                    datetime.now() - session_data["created_at"]
-                ).total_seconds() / 60
+    @property
+    def alive(self) -> bool:
+        return not self.broken and self._task is not None and not self._task.done()
 
-                if age_minutes >= self.CONNECTION_MAX_AGE_MINUTES:
-                    expired_sessions.append(session_id)
+    async def _run(self):
+        # As tasks das ferramentas (criadas pelo SDK a partir desta) veem o token
+        bind_slot(self.cancellation)
+        try:
+            async with self.client_factory(options=self.options) as client:
+                self._client = client
+                self._ready.set()
+                while True:
+                    request = await self._inbox.get()
+                    if request is None:
+                        break
+                    prompt, outbox, abandoned = request
+                    try:
+                        await client.query(prompt)
+                        async for message in client.receive_response():
+                            await self._deliver(outbox, abandoned, message)
+                    except Exception as e:
+                        logger.error(f"Agent SDK client failed: {e}")
+                        await self._deliver(outbox, abandoned, e)
+                        break
+                    finally:
+                        await self._deliver(outbox, abandoned, _END)
+        except Exception as e:
+            self._error = e
+            self.broken = True
+        finally:
+            self._ready.set()
+            # Pedidos que chegaram depois do fim não ficam esperando
+            while not self._inbox.empty():
+                request = self._inbox.get_nowait()
+                if request is not None:
+                    _, outbox, abandoned = request
+                    await self._deliver(outbox, abandoned, ConnectionError("Agent SDK client closed"))
+                    await self._deliver(outbox, abandoned, _END)
 
-            # Remover sessões expiradas
-            for session_id in expired_sessions:
-                await self._close_session_internal(session_id)
+    @staticmethod
+    async def _deliver(outbox: asyncio.Queue, abandoned: asyncio.Event, item):
+        if not abandoned.is_set():
+            await outbox.put(item)
+
+
+class ClaudeHandler:
+    """Pool de clientes Agent SDK: um cliente vivo por conversa + reservas"""
+
+    POOL_MAX_SIZE = int(os.getenv("CHAT_POOL_MAX_SIZE", "10"))
+    POOL_MIN_SPARES = int(os.getenv("CHAT_POOL_MIN_SPARES", "2"))
+    IDLE_TIMEOUT_SECONDS = float(os.getenv("CHAT_CLIENT_IDLE_SECONDS", "600"))
+    CONNECTION_MAX_AGE_MINUTES = float(os.getenv("CHAT_CLIENT_MAX_AGE_MINUTES", "60"))
+    CONNECTION_MAX_USES = int(os.getenv("CHAT_CLIENT_MAX_USES", "100"))
+    HEALTH_CHECK_INTERVAL = 30
+    MAX_RESUME_IDS = 10000
+
+    def __init__(
+        self,
+        options_factory: Callable[[], ClaudeAgentOptions],
+        client_factory: Callable = ClaudeSDKClient,
+        context_builder: Optional[Callable[[str, str], Awaitable[Optional[str]]]] = None
+    ):
+        """
+        Args:
+            options_factory: Retorna as opções do agente (iguais para todas as conversas)
+            client_factory: Classe do cliente (ClaudeSDKClient)
+            context_builder: async (conversation_id, message) -> contexto da conversa,
+                usado na primeira mensagem de um cliente que não retomou sessão
+        """
+        self.options_factory = options_factory
+        self.client_factory = client_factory
+        self.context_builder = context_builder
+
+        self._conversations: Dict[str, _PooledClient] = {}
+        self._spares: List[_PooledClient] = []
+        # Locks por conversa, só enquanto há send_message usando (contados em _lock_users)
+        self._conversation_locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        # Sessão do CLI de conversas cujo cliente foi fechado (para resume)
+        self._resume_ids: Dict[str, str] = {}
+        self._pool_lock: Optional[asyncio.Lock] = None
+        self._maintenance_task: Optional[asyncio.Task] = None
+        # Fechamentos em background (o loop só guarda referência fraca das tasks)
+        self._closing: set = set()
+        self._warming = 0
+        self._stats = {
+            "created": 0, "reused": 0, "spares_used": 0, "resumed": 0,
+            "closed": 0, "cancelled": 0, "context_restored": 0,
+        }
+
+    async def send_message(self, conversation_id: str, message: str) -> AsyncGenerator:
+        """Envia a mensagem pelo cliente da conversa e produz as respostas do SDK"""
+        self._ensure_started()
+
+        lock = self._conversation_locks.setdefault(conversation_id, asyncio.Lock())
+        self._lock_users[conversation_id] = self._lock_users.get(conversation_id, 0) + 1
+        try:
+            async with lock:
+                client = await self._client_for(conversation_id)
+                try:
+                    prompt = await self._with_context(conversation_id, client, message)
+                    async for msg in client.ask(prompt):
+                        yield msg
+                finally:
+                    client.reserved = False
+                    client.last_used = time.monotonic()
+                    if client.sdk_session_id:
+                        self._resume_ids.pop(conversation_id, None)
+                        self._resume_ids[conversation_id] = client.sdk_session_id
+                        if len(self._resume_ids) > self.MAX_RESUME_IDS:
+                            # dict mantém a ordem de inserção: remove a mais antiga
+                            del self._resume_ids[next(iter(self._resume_ids))]
+                    if not client.alive or self._expired(client):
+                        await self._discard(conversation_id, client)
+        finally:
+            # Último usuário do lock: remove (nunca enquanto alguém segura ou espera)
+            self._lock_users[conversation_id] -= 1
+            if not self._lock_users[conversation_id]:
+                del self._lock_users[conversation_id]
+                del self._conversation_locks[conversation_id]
+
+    async def cancel(self, conversation_id: str, reason: str = "cancelled") -> bool:
+        """Interrompe a geração em andamento de uma conversa
+
+        O send_message da conversa termina normalmente, com o ResultMessage
+        da interrupção.
+
+        Args:
+            conversation_id: ID da conversa
+            reason: Motivo (ex: "user", "disconnect", "superseded")
+
+        Returns:
+            True se havia geração em andamento
+        """
+        client = self._conversations.get(conversation_id)
+        if client is None:
+            return False
+        interrupted = await client.interrupt(reason)
+        if interrupted:
+            self._stats["cancelled"] += 1
+            logger.info(f"Cancelled generation for conversation {conversation_id} ({reason})")
+        return interrupted
+
+    async def close_session(self, session_id: str):
+        """Fecha o cliente de uma conversa (ex: conversa apagada)"""
+        async with self._get_pool_lock():
+            client = self._conversations.pop(session_id, None)
+            self._resume_ids.pop(session_id, None)
+        if client:
+            await self._close(client)
 
-            self._last_health_check = now
+    async def shutdown(self):
+        """Fecha todos os clientes"""
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+        async with self._get_pool_lock():
+            clients = list(self._conversations.values()) + self._spares
+            self._conversations.clear()
+            self._spares.clear()
+        await asyncio.gather(*(self._close(c) for c in clients), return_exceptions=True)
+
+    async def health_check(self):
+        """Fecha clientes ociosos/expirados e repõe os reservas"""
+        async with self._get_pool_lock():
+            now = time.monotonic()
+            stale = [
+                conversation_id for conversation_id, client in self._conversations.items()
+                if not client.in_use and (
+                    not client.alive or self._expired(client)
+                    or now - client.last_used >= self.IDLE_TIMEOUT_SECONDS
+                )
+            ]
+            to_close = [self._conversations.pop(conversation_id) for conversation_id in stale]
+
+            to_close += [c for c in self._spares if not c.alive or self._expired(c)]
+            self._spares = [c for c in self._spares if c.alive and not self._expired(c)]
+
+            missing = min(
+                self.POOL_MIN_SPARES - len(self._spares) - self._warming,
+                self.POOL_MAX_SIZE - self._live_count() - self._warming
+            )
+            self._warming += max(0, missing)
+
+        await asyncio.gather(*(self._close(c) for c in to_close), return_exceptions=True)
+        if missing > 0:
+            await asyncio.gather(*(self._warm_spare() for _ in range(missing)), return_exceptions=True)
 
     def get_pool_stats(self) -> Dict:
         """Retorna estatísticas do pool"""
         return {
-            "active_sessions": len(self._sessions),
+            "active_sessions": len(self._conversations),
+            "busy_sessions": sum(1 for c in self._conversations.values() if c.busy),
+            "spares": len(self._spares),
             "max_pool_size": self.POOL_MAX_SIZE,
-            "last_health_check": datetime.fromtimestamp(
-                self._last_health_check
-            ).isoformat(),
+            **self._stats,
         }
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+
+    def _get_pool_lock(self) -> asyncio.Lock:
+        # Criado no event loop do servidor (o módulo é importado antes dele)
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        return self._pool_lock
+
+    def _ensure_started(self):
+        if self._maintenance_task is None or self._maintenance_task.done():
+            self._maintenance_task = asyncio.create_task(self._maintenance_loop(), name="claude-pool-maintenance")
+
+    async def _maintenance_loop(self):
+        while True:
+            try:
+                await self.health_check()
+            except Exception as e:
+                logger.error(f"Agent SDK pool maintenance failed: {e}")
+            await asyncio.sleep(self.HEALTH_CHECK_INTERVAL)
+
+    async def _client_for(self, conversation_id: str) -> _PooledClient:
+        """Cliente da conversa: o atual, um reserva ou um novo"""
+        async with self._get_pool_lock():
+            client = self._conversations.get(conversation_id)
+            if client is not None and client.alive and not self._expired(client):
+                self._stats["reused"] += 1
+                self._reserve(client)
+                return client
+
+            stale = self._conversations.pop(conversation_id, None)
+            resume_id = self._resume_ids.get(conversation_id) or (stale.sdk_session_id if stale else None)
+
+            spare = None
+            if not resume_id:
+                while self._spares and spare is None:
+                    candidate = self._spares.pop(0)
+                    if candidate.alive and not self._expired(candidate):
+                        spare = candidate
+                    else:
+                        self._close_later(candidate)
+
+            evicted = self._evict_for_capacity() if spare is None else None
+
+        if stale is not None:
+            self._close_later(stale)
+        if evicted is not None:
+            self._close_later(evicted)
+
+        if spare is not None:
+            self._stats["spares_used"] += 1
+            client = spare
+        else:
+            options = self.options_factory()
+            if resume_id:
+                # Conversa conhecida: o cliente novo retoma a sessão do CLI
+                options = dataclasses.replace(options, resume=resume_id)
+                self._stats["resumed"] += 1
+            client = await _PooledClient(options, self.client_factory).start()
+            self._stats["created"] += 1
+
+        async with self._get_pool_lock():
+            self._reserve(client)
+            self._conversations[conversation_id] = client
+        return client
+
+    @staticmethod
+    def _reserve(client: _PooledClient):
+        """Marca o cliente como em uso até o fim do send_message (chamar com o pool lock)"""
+        client.reserved = True
+        client.last_used = time.monotonic()
+
+    async def _with_context(self, conversation_id: str, client: _PooledClient, message: str) -> str:
+        """Prefixa o contexto salvo quando o cliente ainda não conhece a conversa"""
+        if self.context_builder is None or client.use_count > 0 or client.options.resume:
+            return message
+        try:
+            context = await self.context_builder(conversation_id, message)
+        except Exception as e:
+            logger.error(f"Error building context for {conversation_id}: {e}")
+            return message
+        if not context:
+            return message
+        self._stats["context_restored"] += 1
+        return f"{context}\n\n{message}"
+
+    def _evict_for_capacity(self) -> Optional[_PooledClient]:
+        """Libera espaço para um cliente novo (chamar com o pool lock)"""
+        if self._live_count() < self.POOL_MAX_SIZE:
+            return None
+        if self._spares:
+            return self._spares.pop()
+
+        idle = [(c.last_used, cid) for cid, c in self._conversations.items() if not c.in_use]
+        if not idle:
+            logger.warning(f"Agent SDK pool above limit ({self.POOL_MAX_SIZE}): all clients busy")
+            return None
+        _, conversation_id = min(idle)
+        return self._conversations.pop(conversation_id)
+
+    async def _warm_spare(self):
+        try:
+            client = await _PooledClient(self.options_factory(), self.client_factory).start()
+            self._stats["created"] += 1
+            async with self._get_pool_lock():
+                self._spares.append(client)
+        except Exception as e:
+            logger.error(f"Failed to pre-warm Agent SDK client: {e}")
+        finally:
+            self._warming -= 1
+
+    async def _discard(self, conversation_id: str, client: _PooledClient):
+        async with self._get_pool_lock():
+            if self._conversations.get(conversation_id) is client:
+                del self._conversations[conversation_id]
+        await self._close(client)
+
+    def _close_later(self, client: _PooledClient):
+        task = asyncio.create_task(self._close(client))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, client: _PooledClient):
+        self._stats["closed"] += 1
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f"Error closing Agent SDK client: {e}")
+
+    def _live_count(self) -> int:
+        return len(self._conversations) + len(self._spares)
+
+    def _expired(self, client: _PooledClient) -> bool:
+        age_minutes = (time.monotonic() - client.created_at) / 60
+        return age_minutes >= self.CONNECTION_MAX_AGE_MINUTES or client.use_count >= self.CONNECTION_MAX_USES
@@ -0,0 +1,302 @@
+"""
+Conversation Context - Contexto da conversa dentro de um orçamento de tokens
+
+O cliente Agent SDK do pool guarda o contexto enquanto vive (e retoma a
+sessão do CLI quando o id é conhecido). Um cliente novo sem sessão para
+retomar (reinício do servidor, conversa antiga reaberta) começava do zero:
+o usuário repetia tudo e o agente refazia as mesmas queries. Para esse
+caso o contexto é montado a partir do banco:
+
+- Turnos recentes na íntegra, do mais novo para o mais antigo, até
+  RECENT_BUDGET_RATIO do orçamento (CHAT_CONTEXT_TOKEN_BUDGET)
+- Resumo contínuo dos turnos anteriores às últimas VERBATIM_MESSAGES,
+  atualizado em background a cada SUMMARY_BATCH mensagens novas
+- Cache compacto dos últimos resultados de ferramentas (nome, input e
+  início do resultado), para o modelo reaproveitar em vez de repetir
+
+Resumo e cache ficam em chat_session_context (uma linha por sessão).
+Tokens são estimados por caracteres (~4 por token).
+"""
+
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _clip(text: str, max_chars: int) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+
+class ExtractiveSummarizer:
+    """Resumo sem modelo: o início de cada pergunta e de cada resposta"""
+
+    name = "extractive"
+
+    def summarize(self, previous: str, messages: List[Dict], max_tokens: int) -> str:
+        lines = previous.splitlines() if previous else []
+        for m in messages:
+            if m["role"] == "user":
+                lines.append(f"- User asked: {_clip(m['content'], 160)}")
+            else:
+                # Primeira frase da resposta costuma ser a conclusão
+                first = (m["content"] or "").strip().split("\n\n")[0].split(". ")[0]
+                lines.append(f"  Assistant: {_clip(first, 200)}")
+
+        # Acima do orçamento: descarta as linhas mais antigas
+        while lines and estimate_tokens("\n".join(lines)) > max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+
+class ClaudeSummarizer:
+    """Resumo pelo Claude CLI (mesmo backend da análise de imagens)"""
+
+    name = "claude_cli"
+    TIMEOUT_SECONDS = 60
+
+    def summarize(self, previous: str, messages: List[Dict], max_tokens: int) -> str:
+        from tools.vision_backends import ClaudeCLIBackend
+
+        transcript = "\n".join(f"{m['role'].capitalize()}: {_clip(m['content'], 2000)}" for m in messages)
+        prompt = (
+            "Update the running summary of a waste-management analytics conversation.\n"
+            f"Keep it under {max_tokens * CHARS_PER_TOKEN // 6} words. Keep concrete facts: report IDs, "
+            "numbers, locations, filters and conclusions. Output only the summary.\n\n"
+            f"Current summary:\n{previous or '(empty)'}\n\nNew messages:\n{transcript}"
+        )
+        return ClaudeCLIBackend().complete(prompt, [], self.TIMEOUT_SECONDS)
+
+
+class ConversationContext:
+    """Monta e mantém o contexto persistido de cada conversa"""
+
+    TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "3000"))
+    RECENT_BUDGET_RATIO = 0.6
+    SUMMARY_BUDGET_RATIO = 0.25
+    RECENT_MESSAGES_SCAN = 40
+    # Mensagens mais recentes que ficam fora do resumo (vão na íntegra)
+    VERBATIM_MESSAGES = 12
+    SUMMARY_BATCH = 10
+    MAX_TOOL_RESULTS = 8
+    TOOL_RESULT_CHARS = 400
+
+    def __init__(self, session_manager, get_db_connection_func, summarizer=None):
+        """
+        Args:
+            session_manager: SessionManager (leitura do histórico)
+            get_db_connection_func: Função que retorna conexão do banco
+            summarizer: Resumidor; padrão por CHAT_SUMMARY_BACKEND (extractive | claude_cli)
+        """
+        self.session_manager = session_manager
+        self.get_db_connection = get_db_connection_func
+        if summarizer is None:
+            backend = os.getenv("CHAT_SUMMARY_BACKEND", "extractive").lower()
+            summarizer = ClaudeSummarizer() if backend == "claude_cli" else ExtractiveSummarizer()
+        self.summarizer = summarizer
+        self._refreshing: set = set()
+        # Referências das tasks de resumo (o loop só guarda referência fraca)
+        self._tasks: set = set()
+
+    async def build(self, session_id: str, current_message: str) -> Optional[str]:
+        """Contexto da conversa para um cliente novo
+
+        Args:
+            session_id: ID da sessão
+            current_message: Mensagem que vai ser enviada (excluída do histórico)
+
+        Returns:
+            Texto do contexto, ou None se a conversa não tem histórico
+        """
+        messages = await self.session_manager.get_session_history(session_id, self.RECENT_MESSAGES_SCAN)
+        if messages and messages[-1]["role"] == "user" and messages[-1]["content"] == current_message:
+            messages = messages[:-1]
+        if not messages:
+            return None
+
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(None, self._load_state, session_id)
+        # O que já está no resumo não se repete na íntegra
+        messages = [m for m in messages if m["message_id"] > state["summarized_until"]]
+
+        # Turnos recentes na íntegra, do mais novo para trás
+        recent: List[str] = []
+        used = 0
+        recent_budget = int(self.TOKEN_BUDGET * self.RECENT_BUDGET_RATIO)
+        for m in reversed(messages):
+            line = f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}"
+            cost = estimate_tokens(line)
+            if used + cost > recent_budget:
+                if not recent:
+                    # A última mensagem sozinha estoura: entra cortada
+                    recent.append(line[:recent_budget * CHARS_PER_TOKEN] + "…")
+                break
+            recent.append(line)
+            used += cost
+        recent.reverse()
+
+        sections = []
+        if state["summary"]:
+            sections.append(f"Summary of earlier conversation:\n{state['summary']}")
+        if state["tool_results"]:
+            lines = [
+                f"- {t['tool']} {json.dumps(t['input'], ensure_ascii=False, default=str)}: {t['result']}"
+                for t in state["tool_results"]
+            ]
+            tools_text = "\n".join(lines)
+            remaining = self.TOKEN_BUDGET - used - estimate_tokens(state["summary"] or "")
+            if remaining > 0:
+                sections.append(
+                    "Earlier tool results (reuse them instead of re-running the same call when still relevant):\n"
+                    + tools_text[:remaining * CHARS_PER_TOKEN]
+                )
+        sections.append("Recent messages:\n" + "\n".join(recent))
+
+        return (
+            "<conversation_context>\n"
+            "This conversation continues an earlier session.\n\n"
+            + "\n\n".join(sections)
+            + "\n</conversation_context>"
+        )
+
+    async def record_turn(self, session_id: str, tool_calls: List[Dict]):
+        """Atualiza o cache de ferramentas e agenda o resumo, se necessário
+
+        Args:
+            session_id: ID da sessão
+            tool_calls: [{"tool", "input", "result"}] do turno
+        """
+        loop = asyncio.get_running_loop()
+        if tool_calls:
+            try:
+                await loop.run_in_executor(None, self._merge_tool_results, session_id, tool_calls)
+            except Exception as e:
+                logger.error(f"Error caching tool results for {session_id}: {e}")
+
+        if session_id not in self._refreshing:
+            self._refreshing.add(session_id)
+            task = asyncio.create_task(self._refresh_summary(session_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+
+    async def _refresh_summary(self, session_id: str):
+        """Resume mensagens que saíram da janela recente (em lotes)"""
+        try:
+            loop = asyncio.get_running_loop()
+            state = await loop.run_in_executor(None, self._load_state, session_id)
+            recent = await self.session_manager.get_session_history(session_id, self.VERBATIM_MESSAGES)
+            if not recent:
+                return
+            # Tudo antes da janela recente deve estar no resumo
+            window_start = recent[0]["message_id"]
+            pending = await self.session_manager.get_session_history(
+                session_id, self.RECENT_MESSAGES_SCAN * 5,
+                after_message_id=state["summarized_until"], before_message_id=window_start
+            )
+            if len(pending) < self.SUMMARY_BATCH:
+                return
+
+            summary_budget = int(self.TOKEN_BUDGET * self.SUMMARY_BUDGET_RATIO)
+            summary = await loop.run_in_executor(
+                None, self.summarizer.summarize, state["summary"] or "", pending, summary_budget
+            )
+            await loop.run_in_executor(
+                None, self._save_summary, session_id, summary, pending[-1]["message_id"]
+            )
+            logger.info(f"Summarized {len(pending)} messages of {session_id} ({self.summarizer.name})")
+        except Exception as e:
+            logger.error(f"Error refreshing summary for {session_id}: {e}")
+        finally:
+            self._refreshing.discard(session_id)
+
+    def _load_state(self, session_id: str) -> Dict:
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                """SELECT summary, summarized_until_message_id, tool_results
+                   FROM chat_session_context WHERE session_id = %s""",
+                (session_id,)
+            )
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+
+        if not row:
+            return {"summary": "", "summarized_until": 0, "tool_results": []}
+        tool_results = row["tool_results"]
+        if isinstance(tool_results, (str, bytes)):
+            tool_results = json.loads(tool_results)
+        return {
+            "summary": row["summary"] or "",
+            "summarized_until": row["summarized_until_message_id"] or 0,
+            "tool_results": tool_results or [],
+        }
+
+    def _merge_tool_results(self, session_id: str, tool_calls: List[Dict]):
+        state = self._load_state(session_id)
+        merged = {
+            (t["tool"], json.dumps(t["input"], sort_keys=True, default=str)): t
+            for t in state["tool_results"]
+        }
+        for call in tool_calls:
+            key = (call["tool"], json.dumps(call["input"], sort_keys=True, default=str))
+            # Mesma chamada de novo: fica só a mais recente, no fim
+            merged.pop(key, None)
+            merged[key] = {
+                "tool": call["tool"].replace("mcp__duraeco__", ""),
+                "input": call["input"],
+                "result": _clip(call["result"], self.TOOL_RESULT_CHARS),
+            }
+        entries = list(merged.values())[-self.MAX_TOOL_RESULTS:]
+
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """INSERT INTO chat_session_context (session_id, tool_results)
+                   VALUES (%s, %s)
+                   ON DUPLICATE KEY UPDATE tool_results = VALUES(tool_results)""",
+                (session_id, json.dumps(entries, ensure_ascii=False, default=str))
+            )
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    def _save_summary(self, session_id: str, summary: str, summarized_until: int):
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """INSERT INTO chat_session_context (session_id, summary, summarized_until_message_id)
+                   VALUES (%s, %s, %s)
+                   ON DUPLICATE KEY UPDATE summary = VALUES(summary),
+                       summarized_until_message_id = VALUES(summarized_until_message_id)""",
+                (session_id, summary, summarized_until)
+            )
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
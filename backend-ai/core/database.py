@@ -1,10 +1,49 @@
 """
 Database module - Evita importação circular
-Contém configuração do pool de conexões e função get_db_connection
+Contém configuração dos pools de conexões e função get_db_connection
+
+Pools nomeados (bulkheads), cada um com tamanho, timeout de checkout e
+timeout de statement próprios, para que uma carga não esgote a outra:
+
+- api: rotas da API (login, envio de relatórios, sessões do chat) - padrão
+- worker: análise em background (fila, re-análise, limpezas)
+- analytics: ferramentas do chat (SQL, RAG, busca) e estatísticas do
+  dashboard; pode apontar para uma réplica de leitura (DB_ANALYTICS_HOST)
+
+Configuração por pool: DB_POOL_<NOME>_SIZE, DB_POOL_<NOME>_TIMEOUT
+(segundos esperando conexão livre) e DB_POOL_<NOME>_STATEMENT_MS
+(MAX_EXECUTION_TIME da sessão, só vale para SELECT; 0 = sem limite).
+
+Réplicas de leitura (DB_REPLICA_HOSTS="host[:porta],..."): chamadas com
+read_only=True vão para uma réplica saudável (rodízio), cada uma com pools
+próprios do mesmo tamanho dos nomeados. Voltam para o primário quando:
+
+- nenhuma réplica passou no último health check (thread em background a
+  cada DB_REPLICA_CHECK_SECONDS) ou o atraso passa de
+  DB_REPLICA_MAX_LAG_SECONDS
+- o usuário escreveu há menos de DB_READ_YOUR_WRITES_SECONDS (commit numa
+  conexão do primário durante a requisição dele, ou note_write())
+- a réplica falha ao conectar
+
+Versões de dados (data_versions, usadas pelo cache do execute_sql_query):
+o commit de uma conexão do primário incrementa o contador das tabelas de
+VERSIONED_TABLES que ela escreveu (INSERT/UPDATE/DELETE/REPLACE). É feito
+pela aplicação, não por triggers, porque o TiDB não tem triggers. Um slot
+aleatório entre VERSION_SLOTS por incremento, numa transação própria logo
+após o commit: escritores concorrentes não disputam a mesma linha.
+Escritas fora do backend só aparecem no cache depois do TTL.
 """
 
 import os
+import re
+import time
+import random
 import logging
+import threading
+import itertools
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
 import mysql.connector
 from mysql.connector import Error
 from dbutils.pooled_db import PooledDB
@@ -24,26 +63,451 @@ DB_CONFIG = {
     'port': int(os.getenv('DB_PORT', '3306'))
 }
 
-# Database connection pool for better performance
-db_pool = PooledDB(
-    creator=mysql.connector,
-    maxconnections=20,  # Maximum connections in pool
-    mincached=2,  # Minimum idle connections
-    maxcached=10,  # Maximum idle connections
-    maxshared=20,  # Maximum shared connections
-    blocking=True,  # Block if no connections available
-    ping=1,  # Ping connection before using
-    **DB_CONFIG
-)
+# Réplica de leitura para o pool de analytics (padrão: o primário)
+ANALYTICS_DB_CONFIG = {
+    **DB_CONFIG,
+    'host': os.getenv('DB_ANALYTICS_HOST', DB_CONFIG['host']),
+    'port': int(os.getenv('DB_ANALYTICS_PORT', str(DB_CONFIG['port']))),
+    'user': os.getenv('DB_ANALYTICS_USER', DB_CONFIG['user']),
+    'password': os.getenv('DB_ANALYTICS_PASSWORD', DB_CONFIG['password']),
+}
+
+# Com DB_ANALYTICS_HOST o pool de analytics já tem servidor próprio (fora do rodízio de réplicas)
+ANALYTICS_PINNED = bool(os.getenv('DB_ANALYTICS_HOST'))
+
+REPLICA_HOSTS = [h.strip() for h in os.getenv('DB_REPLICA_HOSTS', '').split(',') if h.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_CHECK_SECONDS = float(os.getenv('DB_REPLICA_CHECK_SECONDS', '5'))
+READ_YOUR_WRITES_SECONDS = float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', '5'))
+
+# nome -> (tamanho, timeout de checkout em s, timeout de statement em ms)
+POOL_DEFAULTS = {
+    "api": (12, 5, 0),
+    "worker": (6, 30, 0),
+    "analytics": (4, 3, 15000),
+}
+
+
+# Tabelas com contador em data_versions (migrações 007 e 009)
+VERSIONED_TABLES = ("reports", "analysis_results", "hotspots", "hotspot_reports", "report_waste_types")
+VERSION_SLOTS = 16
+
+_WRITE_STATEMENT_RE = re.compile(r"^\s*(?:INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+# Qualquer tabela citada numa escrita (UPDATE com JOIN, INSERT ... SELECT): invalidar a mais é barato
+_VERSIONED_TABLE_RE = re.compile(r"\b(" + "|".join(VERSIONED_TABLES) + r")\b", re.IGNORECASE)
+
+# Sem a tabela data_versions (migração não aplicada) os commits não tentam mais incrementar
+_versions_table_missing = False
+
+
+class PoolTimeout(Exception):
+    """Nenhuma conexão livre no pool dentro do timeout de checkout"""
+
+
+class BoundedPool:
+    """PooledDB com limite de conexões em uso e timeout de checkout
+
+    O PooledDB com blocking=True espera para sempre; aqui um semáforo
+    limita as conexões em uso e desiste após `timeout` segundos. O PooledDB
+    é criado na primeira conexão (réplica fora do ar não impede o import).
+    """
+
+    def __init__(self, name: str, size: int, timeout: float, statement_ms: int, config: Dict,
+                 replica: bool = False):
+        self.name = name
+        self.size = size
+        self.timeout = timeout
+        self.statement_ms = statement_ms
+        self.config = config
+        self.replica = replica
+
+        self._pool: Optional[PooledDB] = None
+        self._create_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._stats_lock = threading.Lock()
+        self.stats = {"checkouts": 0, "timeouts": 0, "in_use": 0, "max_in_use": 0, "wait_seconds": 0.0}
+
+    def connection(self):
+        """Conexão do pool (fechar devolve ao pool)
+
+        Raises:
+            PoolTimeout: Pool cheio por mais de `timeout` segundos
+        """
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._stats_lock:
+                self.stats["timeouts"] += 1
+            raise PoolTimeout(f"No free connection in pool '{self.name}' after {self.timeout}s")
+        try:
+            conn = self._get_pool().connection()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._stats_lock:
+            self.stats["checkouts"] += 1
+            self.stats["in_use"] += 1
+            self.stats["max_in_use"] = max(self.stats["max_in_use"], self.stats["in_use"])
+            self.stats["wait_seconds"] += time.monotonic() - started
+        return _BoundedConnection(conn, self)
+
+    def get_stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                **self.stats,
+                "wait_seconds": round(self.stats["wait_seconds"], 3),
+                "size": self.size,
+                "host": f"{self.config['host']}:{self.config['port']}",
+            }
+
+    def _release(self):
+        with self._stats_lock:
+            self.stats["in_use"] -= 1
+        self._slots.release()
+
+    def _get_pool(self) -> PooledDB:
+        if self._pool is None:
+            with self._create_lock:
+                if self._pool is None:
+                    self._pool = PooledDB(
+                        creator=mysql.connector,
+                        maxconnections=self.size,
+                        mincached=min(2, self.size),
+                        maxcached=self.size,
+                        blocking=True,  # não chega a esperar: o semáforo limita antes
+                        ping=1,  # Ping connection before using
+                        setsession=[f"SET SESSION MAX_EXECUTION_TIME = {int(self.statement_ms)}"]
+                        if self.statement_ms else None,
+                        **self.config
+                    )
+                    logger.info(
+                        f"Database pool '{self.name}' initialized: {self.config['host']}:{self.config['port']}/"
+                        f"{self.config['database']} (size {self.size})"
+                    )
+        return self._pool
+
+
+class _BoundedConnection:
+    """Conexão do PooledDB que devolve a vaga do semáforo ao fechar
+
+    Também anota as tabelas versionadas escritas pelos cursores e, no
+    commit, incrementa o contador delas em data_versions.
+    """
+
+    def __init__(self, conn, pool: BoundedPool):
+        self._conn = conn
+        self._bounded_pool = pool
+        self._released = False
+        self._written_tables = set()
+
+    def cursor(self, *args, **kwargs):
+        return _TrackingCursor(self._conn.cursor(*args, **kwargs), self)
+
+    def commit(self):
+        self._conn.commit()
+        if not self._bounded_pool.replica:
+            # Leituras seguintes do mesmo usuário ficam no primário por alguns segundos
+            note_write(_request_user.get())
+        if self._written_tables:
+            tables, self._written_tables = self._written_tables, set()
+            # Depois do commit: quem ler a versão nova já enxerga os dados novos
+            self._bump_versions(tables)
+
+    def rollback(self):
+        self._written_tables = set()
+        self._conn.rollback()
+
+    def _note_statement(self, operation):
+        if isinstance(operation, bytes):
+            operation = operation.decode("utf-8", "replace")
+        if isinstance(operation, str) and _WRITE_STATEMENT_RE.match(operation):
+            self._written_tables.update(t.lower() for t in _VERSIONED_TABLE_RE.findall(operation))
+
+    def _bump_versions(self, tables):
+        global _versions_table_missing
+        if _versions_table_missing:
+            return
+        tables = sorted(tables)
+        try:
+            cursor = self._conn.cursor()
+            cursor.execute(
+                "UPDATE data_versions SET version = version + 1 "
+                f"WHERE slot = %s AND table_name IN ({', '.join(['%s'] * len(tables))})",
+                [random.randrange(VERSION_SLOTS), *tables]
+            )
+            self._conn.commit()
+            cursor.close()
+        except Error as e:
+            try:
+                self._conn.rollback()
+            except Error:
+                pass
+            if getattr(e, "errno", None) == 1146:  # ER_NO_SUCH_TABLE
+                _versions_table_missing = True
+                logger.warning("data_versions table not found, SQL cache versions will not be bumped")
+            else:
+                logger.error(f"Could not bump data_versions for {tables}: {e}")
+
+    def close(self):
+        try:
+            self._conn.close()
+        finally:
+            self._release()
+
+    def open_side_connection(self):
+        """Conexão nova (fora do pool) ao mesmo servidor - usada para KILL QUERY"""
+        return mysql.connector.connect(connection_timeout=5, **self._bounded_pool.config)
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._bounded_pool._release()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __del__(self):
+        # Conexão esquecida sem close(): não perde a vaga
+        self._release()
+
 
-logger.info(f"Database pool initialized: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
+class _TrackingCursor:
+    """Cursor que avisa a conexão das escritas (para o data_versions)"""
 
+    def __init__(self, cursor, connection: _BoundedConnection):
+        self._cursor = cursor
+        self._connection = connection
+
+    def execute(self, operation, *args, **kwargs):
+        self._connection._note_statement(operation)
+        return self._cursor.execute(operation, *args, **kwargs)
+
+    def executemany(self, operation, *args, **kwargs):
+        self._connection._note_statement(operation)
+        return self._cursor.executemany(operation, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def _pool_setting(name: str, key: str, default):
+    return type(default)(os.getenv(f"DB_POOL_{name.upper()}_{key}", str(default)))
+
+
+pools: Dict[str, BoundedPool] = {
+    name: BoundedPool(
+        name,
+        size=_pool_setting(name, "SIZE", size),
+        timeout=_pool_setting(name, "TIMEOUT", float(timeout)),
+        statement_ms=_pool_setting(name, "STATEMENT_MS", statement_ms),
+        config=ANALYTICS_DB_CONFIG if name == "analytics" else DB_CONFIG,
+    )
+    for name, (size, timeout, statement_ms) in POOL_DEFAULTS.items()
+}
+
+
+class ReplicaMonitor:
+    """Saúde e atraso das réplicas, checados por uma thread em background"""
+
+    def __init__(self, hosts: List[str]):
+        self.replicas = []
+        for host in hosts:
+            name, _, port = host.partition(':')
+            config = {
+                **DB_CONFIG,
+                'host': name,
+                'port': int(port or DB_CONFIG['port']),
+                'user': os.getenv('DB_REPLICA_USER', DB_CONFIG['user']),
+                'password': os.getenv('DB_REPLICA_PASSWORD', DB_CONFIG['password']),
+            }
+            self.replicas.append({
+                "name": f"{config['host']}:{config['port']}",
+                "config": config,
+                "healthy": False,
+                "lag_seconds": None,
+                "checked_at": 0.0,
+                "error": None,
+            })
+        self._round_robin = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def choose(self) -> Optional[Dict]:
+        """Réplica para uma leitura, ou None para usar o primário"""
+        self._ensure_started()
+        # Check antigo demais (thread parada ou travada) não vale
+        stale = time.monotonic() - 3 * REPLICA_CHECK_SECONDS
+        candidates = [
+            r for r in self.replicas
+            if r["healthy"] and r["checked_at"] > stale and r["lag_seconds"] <= REPLICA_MAX_LAG_SECONDS
+        ]
+        if not candidates:
+            return None
+        return candidates[next(self._round_robin) % len(candidates)]
+
+    def mark_down(self, replica: Dict, error: Exception):
+        replica["healthy"] = False
+        replica["error"] = str(error)
+
+    def get_stats(self) -> List[Dict]:
+        return [
+            {k: v for k, v in r.items() if k not in ("config", "checked_at")} | {
+                "checked_seconds_ago": round(time.monotonic() - r["checked_at"], 1) if r["checked_at"] else None
+            }
+            for r in self.replicas
+        ]
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="db-replica-monitor", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            for replica in self.replicas:
+                self._check(replica)
+            time.sleep(REPLICA_CHECK_SECONDS)
+
+    def _check(self, replica: Dict):
+        try:
+            conn = mysql.connector.connect(connection_timeout=3, **replica["config"])
+            try:
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    cursor.execute("SHOW REPLICA STATUS")
+                except Error:
+                    # MySQL < 8.0.22
+                    cursor.execute("SHOW SLAVE STATUS")
+                status = cursor.fetchone()
+                cursor.fetchall()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            if replica["healthy"] or replica["error"] is None:
+                logger.warning(f"Replica {replica['name']} unavailable: {e}")
+            replica.update(healthy=False, error=str(e), checked_at=time.monotonic())
+            return
+
+        if status is None:
+            # Sem status de replicação (TiDB, endpoint gerenciado): sem atraso conhecido
+            lag, error = 0, None
+        else:
+            lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+            error = None if lag is not None else "replication stopped"
+        if error and replica["healthy"]:
+            logger.warning(f"Replica {replica['name']} unhealthy: {error}")
+        replica.update(
+            healthy=error is None,
+            lag_seconds=lag,
+            error=error,
+            checked_at=time.monotonic(),
+        )
+
+
+replica_monitor: Optional[ReplicaMonitor] = ReplicaMonitor(REPLICA_HOSTS) if REPLICA_HOSTS else None
+_replica_pools: Dict[str, BoundedPool] = {}
+_replica_pools_lock = threading.Lock()
+
+# Read-your-writes: user_id -> instante da última escrita
+_recent_writes: Dict[int, float] = {}
+_recent_writes_lock = threading.Lock()
+_request_user: ContextVar[Optional[int]] = ContextVar("db_request_user", default=None)
+
+
+def set_request_user(user_id: Optional[int]):
+    """Usuário da requisição atual (commits dele ativam o read-your-writes)"""
+    _request_user.set(user_id)
+
+
+def note_write(user_id: Optional[int]):
+    """Registra uma escrita do usuário: leituras dele vão ao primário por alguns segundos"""
+    if user_id is None or replica_monitor is None:
+        return
+    now = time.monotonic()
+    with _recent_writes_lock:
+        _recent_writes[user_id] = now
+        if len(_recent_writes) > 10000:
+            expired = [u for u, t in _recent_writes.items() if now - t > READ_YOUR_WRITES_SECONDS]
+            for u in expired:
+                del _recent_writes[u]
+
+
+def _wrote_recently(user_id: Optional[int]) -> bool:
+    if user_id is None:
+        return False
+    written_at = _recent_writes.get(user_id)
+    return written_at is not None and time.monotonic() - written_at < READ_YOUR_WRITES_SECONDS
+
+
+def _replica_pool(pool: str, replica: Dict) -> BoundedPool:
+    key = f"{pool}@{replica['name']}"
+    if key not in _replica_pools:
+        with _replica_pools_lock:
+            if key not in _replica_pools:
+                primary = pools[pool]
+                _replica_pools[key] = BoundedPool(
+                    key, primary.size, primary.timeout, primary.statement_ms, replica["config"], replica=True
+                )
+    return _replica_pools[key]
+
+
+def get_db_connection(pool: str = "api", read_only: bool = False, user_id: Optional[int] = None):
+    """Get a database connection from the named pool (default: api)
+
+    Args:
+        pool: api | worker | analytics
+        read_only: A conexão só vai ler: pode ir para uma réplica
+        user_id: Usuário da leitura (read-your-writes); padrão: o da requisição
+    """
+    if read_only and replica_monitor is not None and not (pool == "analytics" and ANALYTICS_PINNED):
+        if not _wrote_recently(user_id if user_id is not None else _request_user.get()):
+            replica = replica_monitor.choose()
+            if replica is not None:
+                try:
+                    return _replica_pool(pool, replica).connection()
+                except PoolTimeout as e:
+                    logger.warning(f"{e}, reading from primary")
+                except Error as e:
+                    logger.warning(f"Replica {replica['name']} connection failed, reading from primary: {e}")
+                    replica_monitor.mark_down(replica, e)
 
-def get_db_connection():
-    """Get a database connection from the pool"""
     try:
-        connection = db_pool.connection()
-        return connection
-    except Error as e:
-        logger.error(f"Database connection error: {e}")
+        return pools[pool].connection()
+    except (Error, PoolTimeout) as e:
+        logger.error(f"Database connection error ({pool} pool): {e}")
         return None
+
+
+def get_read_connection(user_id: Optional[int] = None):
+    """Conexão do pool da API para leitura (réplica quando possível)"""
+    return get_db_connection("api", read_only=True, user_id=user_id)
+
+
+def get_worker_connection():
+    """Conexão do pool de workers (análise em background)"""
+    return get_db_connection("worker")
+
+
+def get_analytics_connection():
+    """Conexão do pool de analytics (ferramentas do chat, dashboard): só leitura, réplica quando possível"""
+    return get_db_connection("analytics", read_only=True)
+
+
+def get_pool_stats() -> Dict[str, Dict]:
+    stats = {name: pool.get_stats() for name, pool in {**pools, **_replica_pools}.items()}
+    if replica_monitor is not None:
+        stats["replicas"] = replica_monitor.get_stats()
+    return stats
@@ -0,0 +1,306 @@
+"""
+Embedding Backfill - Preenche embeddings ausentes em analysis_results
+
+As análises gravadas sem embedding (período sem o Titan, falhas de leitura
+de imagem) ficam fora da busca por similaridade. O backfill percorre
+analysis_results em lotes pela chave primária e preenche image_embedding e
+location_embedding onde estiverem NULL:
+
+- Keyset pagination (analysis_id > último), nunca OFFSET
+- Embeddings de imagem calculados num pool de processos (CPU-bound)
+- Um UPDATE multi-linha por lote (CASE analysis_id), só sobre colunas NULL:
+  não sobrescreve o que o pipeline gravou no meio tempo
+- Checkpoint em arquivo JSON após cada lote; rodar de novo retoma dali
+- Throttling: limite de linhas por segundo e pausa enquanto a fila de
+  análise ao vivo tiver itens recentes
+- Os vetores novos entram no índice ANN (diretamente, ou via
+  request_rescan quando outro processo é o escritor do índice)
+"""
+
+import os
+import json
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from core.embeddings import compute_image_embedding, compute_location_embedding
+from core.vector_index import get_image_index, image_index_path, request_rescan
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "embedding_backfill.json"
+)
+
+
+class EmbeddingBackfill:
+    """Job de backfill de embeddings com checkpoint e throttling"""
+
+    # Itens recentes na fila ao vivo acima dos quais o backfill espera
+    LIVE_BACKLOG_THRESHOLD = 0
+    LIVE_WINDOW_MINUTES = 30
+    YIELD_SECONDS = 15
+
+    def __init__(self, get_db_connection_func, resolve_image_path_func: Callable[[str], str],
+                 checkpoint_path: str = DEFAULT_CHECKPOINT_PATH, workers: Optional[int] = None,
+                 batch_size: int = 200, rows_per_second: Optional[float] = None,
+                 yield_to_live: bool = True):
+        """
+        Args:
+            get_db_connection_func: Função que retorna conexão do banco
+            resolve_image_path_func: Converte image_url em caminho local
+            checkpoint_path: Arquivo JSON do checkpoint
+            workers: Processos do pool de embeddings (default: CPUs - 1)
+            batch_size: Linhas por lote (SELECT e UPDATE)
+            rows_per_second: Limite de vazão (None = sem limite)
+            yield_to_live: Esperar enquanto houver tráfego ao vivo na fila
+        """
+        self.get_db_connection = get_db_connection_func
+        self.resolve_image_path = resolve_image_path_func
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.batch_size = batch_size
+        self.rows_per_second = rows_per_second
+        self.yield_to_live = yield_to_live
+
+    # ------------------------------------------------------------------
+    # Checkpoint
+    # ------------------------------------------------------------------
+
+    def load_checkpoint(self) -> Dict:
+        """Checkpoint salvo (ou um novo, a partir do início da tabela)"""
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        return {
+            "last_analysis_id": 0,
+            "processed": 0,
+            "image_filled": 0,
+            "location_filled": 0,
+            "image_failed": 0,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "updated_at": None,
+            "completed": False,
+        }
+
+    def reset_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def _save_checkpoint(self, checkpoint: Dict):
+        checkpoint["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # ------------------------------------------------------------------
+    # Execução
+    # ------------------------------------------------------------------
+
+    def pending_count(self, after_analysis_id: int = 0) -> int:
+        """Análises com algum embedding NULL após o id informado"""
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT COUNT(*)
+            FROM analysis_results
+            WHERE analysis_id > %s
+              AND (image_embedding IS NULL OR location_embedding IS NULL)
+            """,
+            (after_analysis_id,)
+        )
+        count = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+        return count
+
+    def run(self, max_rows: Optional[int] = None, progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Processa lotes até acabar (ou até max_rows)
+
+        Args:
+            max_rows: Parar depois de processar este número de linhas
+            progress: Chamado com o checkpoint após cada lote
+
+        Returns:
+            Checkpoint final
+        """
+        checkpoint = self.load_checkpoint()
+        checkpoint["completed"] = False
+        processed_now = 0
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            while max_rows is None or processed_now < max_rows:
+                if self.yield_to_live:
+                    self._wait_for_live_traffic()
+
+                batch_started = time.monotonic()
+                limit = self.batch_size if max_rows is None else min(self.batch_size, max_rows - processed_now)
+                rows = self._next_batch(checkpoint["last_analysis_id"], limit)
+                if not rows:
+                    checkpoint["completed"] = True
+                    self._save_checkpoint(checkpoint)
+                    break
+
+                image_updates, location_updates, failed = self._compute(pool, rows)
+                self._write(image_updates, location_updates)
+                self._index(image_updates)
+
+                checkpoint["last_analysis_id"] = rows[-1]["analysis_id"]
+                checkpoint["processed"] += len(rows)
+                checkpoint["image_filled"] += len(image_updates)
+                checkpoint["location_filled"] += len(location_updates)
+                checkpoint["image_failed"] += failed
+                self._save_checkpoint(checkpoint)
+                processed_now += len(rows)
+
+                if progress:
+                    progress(checkpoint)
+                self._throttle(len(rows), time.monotonic() - batch_started)
+
+        return checkpoint
+
+    def _next_batch(self, last_analysis_id: int, limit: int) -> List[Dict]:
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            """
+            SELECT ar.analysis_id, r.image_url, r.latitude, r.longitude,
+                   ar.image_embedding IS NULL AS needs_image,
+                   ar.location_embedding IS NULL AS needs_location
+            FROM analysis_results ar
+            JOIN reports r ON ar.report_id = r.report_id
+            WHERE ar.analysis_id > %s
+              AND (ar.image_embedding IS NULL OR ar.location_embedding IS NULL)
+            ORDER BY ar.analysis_id
+            LIMIT %s
+            """,
+            (last_analysis_id, limit)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return rows
+
+    def _compute(self, pool: ProcessPoolExecutor, rows: List[Dict]):
+        """Calcula os embeddings que faltam
+
+        Returns:
+            (updates de imagem, updates de localização, imagens que falharam);
+            updates são listas de (analysis_id, vetor)
+        """
+        image_rows = [row for row in rows if row["needs_image"] and row["image_url"]]
+        paths = [self.resolve_image_path(row["image_url"]) for row in image_rows]
+        chunksize = max(1, len(paths) // (self.workers * 4))
+        image_vectors = list(pool.map(compute_image_embedding, paths, chunksize=chunksize))
+
+        image_updates = [
+            (row["analysis_id"], vector)
+            for row, vector in zip(image_rows, image_vectors) if vector is not None
+        ]
+
+        location_updates = []
+        for row in rows:
+            if row["needs_location"]:
+                vector = compute_location_embedding(row["latitude"], row["longitude"])
+                if vector is not None:
+                    location_updates.append((row["analysis_id"], vector))
+
+        return image_updates, location_updates, len(image_rows) - len(image_updates)
+
+    def _write(self, image_updates: List, location_updates: List):
+        """Um UPDATE multi-linha por lote, preenchendo só colunas NULL"""
+        if not image_updates and not location_updates:
+            return
+
+        assignments, params, ids = [], [], set()
+        for column, updates in (("image_embedding", image_updates), ("location_embedding", location_updates)):
+            if not updates:
+                continue
+            cases = " ".join(["WHEN %s THEN %s"] * len(updates))
+            # COALESCE: mantém o valor se o pipeline gravou um no meio tempo
+            assignments.append(f"{column} = COALESCE({column}, CASE analysis_id {cases} ELSE NULL END)")
+            for analysis_id, vector in updates:
+                params.extend((analysis_id, json.dumps(vector)))
+                ids.add(analysis_id)
+
+        ids = sorted(ids)
+        placeholders = ", ".join(["%s"] * len(ids))
+
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"UPDATE analysis_results SET {', '.join(assignments)} WHERE analysis_id IN ({placeholders})",
+                params + ids
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _index(self, image_updates: List):
+        """Leva os vetores novos ao índice ANN"""
+        if not image_updates:
+            return
+
+        try:
+            index = get_image_index()
+            if index is not None and not index.read_only:
+                ids, vectors = zip(*image_updates)
+                index.add(ids, vectors)
+            else:
+                # Outro processo é o escritor: ele reindexa no próximo sync
+                request_rescan(image_index_path(), image_updates[0][0])
+        except Exception as e:
+            logger.warning(f"Failed to index backfilled embeddings: {e}")
+
+    def _throttle(self, rows: int, elapsed: float):
+        if self.rows_per_second:
+            wait = rows / self.rows_per_second - elapsed
+            if wait > 0:
+                time.sleep(wait)
+
+    def _wait_for_live_traffic(self):
+        """Cede a vez enquanto a fila ao vivo tiver itens recentes"""
+        while True:
+            conn = self.get_db_connection()
+            if not conn:
+                raise Exception("Database connection failed")
+
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT COUNT(*)
+                FROM image_processing_queue
+                WHERE status IN ('pending', 'processing')
+                  AND queued_at >= NOW() - INTERVAL %s MINUTE
+                """,
+                (self.LIVE_WINDOW_MINUTES,)
+            )
+            live = cursor.fetchone()[0]
+            cursor.close()
+            conn.close()
+
+            if live <= self.LIVE_BACKLOG_THRESHOLD:
+                return
+            logger.info(f"Embedding backfill yielding {self.YIELD_SECONDS}s to {live} live queue items")
+            time.sleep(self.YIELD_SECONDS)
@@ -0,0 +1,274 @@
+"""
+Embedding Store - Vetores quantizados em arquivo memory-mapped
+
+Guardar embeddings como texto JSON em analysis_results obriga a parsear
+1024 floats por linha a cada uso. O store guarda os vetores num array
+contíguo, endereçado diretamente pelo analysis_id (linha = analysis_id):
+
+- int8 (default): quantização simétrica por vetor, 1 byte por dimensão +
+  escala float32 (~1 KB por vetor, 4x menor que float32)
+- float16: 2 bytes por dimensão, sem perda relevante
+- Cabeçalho de 64 bytes com magic, versão do formato, tipo, dimensão e
+  capacidade, seguido da matriz (capacidade x dimensão)
+- As escalas ficam num arquivo ao lado (<path>.scales, float32); escala 0 =
+  posição vazia (analysis_id sem vetor ou removido). Contar/listar os
+  presentes lê só esse arquivo, não a matriz inteira
+
+Um processo escreve; os demais abrem com read_only=True e compartilham as
+páginas do arquivo via page cache (sem cópia por worker). Similaridade de
+várias linhas é um único produto matriz-vetor em NumPy.
+"""
+
+import os
+import struct
+import threading
+from typing import Sequence, Tuple
+
+import numpy as np
+
+MAGIC = b"DEMB"
+FORMAT_VERSION = 1
+HEADER_SIZE = 64
+_HEADER = struct.Struct("<4sHHIQ")
+
+DTYPE_CODES = {"int8": 1, "float16": 2}
+_CODE_DTYPES = {code: name for name, code in DTYPE_CODES.items()}
+
+INITIAL_CAPACITY = 4096
+
+
+def _value_dtype(dtype: str) -> np.dtype:
+    return np.dtype("i1" if dtype == "int8" else "<f2")
+
+
+class EmbeddingStore:
+    """Array memory-mapped de embeddings quantizados indexado por analysis_id"""
+
+    def __init__(self, path: str, dim: int = 1024, dtype: str = "int8", read_only: bool = False):
+        """
+        Args:
+            path: Arquivo do store (criado se não existir, exceto em read_only)
+            dim: Dimensão dos vetores (ignorado se o arquivo já existe)
+            dtype: "int8" ou "float16" (ignorado se o arquivo já existe)
+            read_only: Abrir só para leitura (workers que não escrevem)
+
+        Raises:
+            ValueError: Arquivo com formato inválido ou parâmetros incompatíveis
+        """
+        if dtype not in DTYPE_CODES:
+            raise ValueError(f"Unsupported dtype: {dtype}")
+
+        self.path = path
+        self.scales_path = path + ".scales"
+        self.read_only = read_only
+        self._lock = threading.RLock()
+
+        if not os.path.exists(path):
+            if read_only:
+                raise FileNotFoundError(path)
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.dim = dim
+            self.dtype = dtype
+            self._resize_files(INITIAL_CAPACITY)
+            self._write_header(INITIAL_CAPACITY)
+
+        self._map()
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def __len__(self) -> int:
+        """Número de vetores presentes"""
+        with self._lock:
+            if self.read_only:
+                return int(np.count_nonzero(self._scales))
+            return self._count
+
+    def present_ids(self) -> np.ndarray:
+        """analysis_id de todos os vetores presentes"""
+        with self._lock:
+            return np.flatnonzero(self._scales)
+
+    def contains(self, ids: Sequence[int]) -> np.ndarray:
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            inside = (ids >= 0) & (ids < self._capacity)
+            result = np.zeros(len(ids), dtype=bool)
+            result[inside] = self._scales[ids[inside]] != 0
+            return result
+
+    def get(self, ids: Sequence[int]) -> np.ndarray:
+        """Vetores float32 (linhas ausentes = zeros)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.zeros((len(ids), self.dim), dtype=np.float32)
+        with self._lock:
+            inside = (ids >= 0) & (ids < self._capacity)
+            rows = ids[inside]
+            vectors[inside] = self._q[rows].astype(np.float32) * self._scales[rows][:, None]
+        return vectors
+
+    def dot(self, query: np.ndarray, ids: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Produto escalar da consulta com as linhas indicadas
+
+        Returns:
+            (ids presentes, scores) na mesma ordem
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            ids = ids[(ids >= 0) & (ids < self._capacity)]
+            scales = np.asarray(self._scales[ids])
+            ids = ids[scales != 0]
+            scales = scales[scales != 0]
+            scores = (self._q[ids].astype(np.float32) @ query) * scales
+        return ids, scores
+
+    def search(self, query: np.ndarray, k: int = 10, chunk: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+        """Busca exata (força bruta) em blocos sobre todos os vetores
+
+        Returns:
+            (ids, scores) dos k maiores produtos escalares, em ordem decrescente
+        """
+        query = np.asarray(query, dtype=np.float32)
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+
+        with self._lock:
+            capacity, q, scales = self._capacity, self._q, self._scales
+
+        for start in range(0, capacity, chunk):
+            block_scales = np.asarray(scales[start:start + chunk])
+            present = np.flatnonzero(block_scales)
+            if not len(present):
+                continue
+            # Bloco contíguo: uma multiplicação matriz-vetor por bloco
+            block = q[start + present[0]:start + present[-1] + 1]
+            scores = (block.astype(np.float32) @ query)[present - present[0]] * block_scales[present]
+
+            best_ids = np.concatenate([best_ids, present + start])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k - 1)[:k]
+                best_ids, best_scores = best_ids[keep], best_scores[keep]
+
+        order = np.argsort(-best_scores)
+        return best_ids[order], best_scores[order]
+
+    def refresh(self):
+        """Remapeia se o arquivo cresceu (workers read-only)"""
+        with self._lock:
+            with open(self.path, "rb") as f:
+                _, _, _, _, capacity = _HEADER.unpack(f.read(_HEADER.size))
+            if capacity != self._capacity:
+                self._map()
+
+    # ------------------------------------------------------------------
+    # Escrita
+    # ------------------------------------------------------------------
+
+    def put(self, ids: Sequence[int], vectors) -> int:
+        """Grava (ou substitui) vetores nas posições dos analysis_id"""
+        self._check_writable()
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors must have the same length")
+        if not len(ids):
+            return 0
+        if ids.min() < 0:
+            raise ValueError("ids must be non-negative")
+
+        if self.dtype == "int8":
+            peak = np.abs(vectors).max(axis=1)
+            scales = np.where(peak > 0, peak / 127.0, np.finfo(np.float32).tiny).astype(np.float32)
+            values = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        else:
+            scales = np.ones(len(ids), dtype=np.float32)
+            values = vectors.astype(np.float16)
+
+        with self._lock:
+            needed = int(ids.max()) + 1
+            if needed > self._capacity:
+                self._grow(needed)
+            unique_ids = np.unique(ids)
+            self._count += int(np.count_nonzero(self._scales[unique_ids] == 0))
+            self._q[ids] = values
+            self._scales[ids] = scales
+        return len(ids)
+
+    def delete(self, ids: Sequence[int]) -> int:
+        """Marca posições como vazias"""
+        self._check_writable()
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        with self._lock:
+            ids = ids[(ids >= 0) & (ids < self._capacity)]
+            removed = int(np.count_nonzero(self._scales[ids]))
+            self._scales[ids] = 0
+            self._count -= removed
+            return removed
+
+    def flush(self):
+        if not self.read_only:
+            with self._lock:
+                self._q.flush()
+                self._scales.flush()
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+
+    def _check_writable(self):
+        if self.read_only:
+            raise PermissionError(f"Embedding store {self.path} is read-only")
+
+    def _map(self):
+        with open(self.path, "rb") as f:
+            magic, version, dtype_code, dim, capacity = _HEADER.unpack(f.read(_HEADER.size))
+
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not an embedding store")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding store version {version}")
+        if dtype_code not in _CODE_DTYPES:
+            raise ValueError(f"Unknown embedding store dtype code {dtype_code}")
+
+        mode = "r" if self.read_only else "r+"
+        self.dim = dim
+        self.dtype = _CODE_DTYPES[dtype_code]
+        self._capacity = capacity
+        self._q = np.memmap(self.path, dtype=_value_dtype(self.dtype), mode=mode,
+                            offset=HEADER_SIZE, shape=(capacity, dim))
+        self._scales = np.memmap(self.scales_path, dtype=np.float32, mode=mode, shape=(capacity,))
+        self._count = int(np.count_nonzero(self._scales))
+
+    def _grow(self, needed: int):
+        capacity = max(self._capacity, INITIAL_CAPACITY)
+        while capacity < needed:
+            capacity *= 2
+
+        self.flush()
+        del self._q, self._scales
+        # Arquivos crescem antes do cabeçalho: um leitor nunca mapeia
+        # uma capacidade maior que os arquivos
+        self._resize_files(capacity)
+        self._write_header(capacity)
+        self._map()
+
+    def _resize_files(self, capacity: int):
+        sizes = (
+            (self.scales_path, capacity * 4),
+            (self.path, HEADER_SIZE + capacity * self.dim * _value_dtype(self.dtype).itemsize),
+        )
+        for path, size in sizes:
+            with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+                f.truncate(size)
+
+    def _write_header(self, capacity: int):
+        header = _HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[self.dtype], self.dim, capacity)
+        with open(self.path, "r+b") as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
@@ -0,0 +1,240 @@
+"""
+Embeddings locais (CPU) para imagens e localizações
+
+Substitui o Amazon Titan Embed: os vetores são calculados no próprio
+processo com Pillow/NumPy, sem serviço externo, e têm 1024 dimensões para
+caber nas colunas VECTOR(1024) de analysis_results.
+
+Imagem (features determinísticas, cada bloco normalizado):
+- histograma de cor HSV 8x8x8 (512)
+- histograma de orientação de bordas em grade 4x4 com 16 direções (256)
+- histograma de texturas LBP 8-vizinhos (256)
+
+Opcionalmente um modelo leve (projeção linear, ex: PCA/whitening treinado
+offline) é carregado de IMAGE_EMBEDDING_MODEL_PATH (.npz com "mean" e
+"components" 1024x1024) e aplicado sobre as features.
+
+Localização: random Fourier features das coordenadas ECEF em várias escalas;
+a similaridade de cosseno decai com a distância real entre os pontos.
+
+O cálculo é CPU-bound: use embed_images_async para rodar fora do event loop.
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 1024
+
+# Identifica o algoritmo (muda se as features mudarem)
+IMAGE_EMBEDDING_VERSION = "local-hsv-hog-lbp-v1"
+
+IMAGE_EMBEDDING_MODEL_PATH = os.getenv("IMAGE_EMBEDDING_MODEL_PATH")
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "2"))
+
+_IMAGE_SIZE = 128
+_HSV_BINS = 8
+_EDGE_GRID = 4
+_EDGE_BINS = 16
+
+# Peso de cada bloco no vetor final (cor, bordas, textura)
+_BLOCK_WEIGHTS = (1.0, 1.0, 0.7)
+
+# Escalas (km) das features de localização: 256 dimensões por escala
+_LOCATION_SCALES_KM = (0.5, 2.0, 10.0, 50.0)
+_EARTH_RADIUS_KM = 6371.0
+
+_executor = ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS, thread_name_prefix="embeddings")
+_model_lock = threading.Lock()
+_model = None
+_model_loaded = False
+_location_projection = None
+
+
+def compute_image_embedding(image_path: str) -> Optional[List[float]]:
+    """Calcula o embedding de uma imagem local
+
+    Args:
+        image_path: Caminho do arquivo de imagem
+
+    Returns:
+        Vetor L2-normalizado com EMBEDDING_DIM floats, ou None se a imagem
+        não puder ser lida
+    """
+    try:
+        with Image.open(image_path) as image:
+            # JPEG: decodifica já reduzido (escala DCT), bem mais rápido
+            image.draft("RGB", (_IMAGE_SIZE * 2, _IMAGE_SIZE * 2))
+            image = image.convert("RGB").resize((_IMAGE_SIZE, _IMAGE_SIZE), Image.BILINEAR)
+            rgb = np.asarray(image, dtype=np.float32)
+            hsv = np.asarray(image.convert("HSV"), dtype=np.uint8)
+
+    except Exception as e:
+        logger.error(f"Error reading image for embedding {image_path}: {e}")
+        return None
+
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    blocks = (
+        _color_histogram(hsv),
+        _edge_orientation_histogram(gray),
+        _lbp_histogram(gray),
+    )
+    features = np.concatenate([
+        weight * _l2_normalize(block) for weight, block in zip(_BLOCK_WEIGHTS, blocks)
+    ])
+
+    model = _load_model()
+    if model is not None:
+        mean, components = model
+        features = components @ (features - mean)
+
+    return _to_list(_l2_normalize(features))
+
+
+def compute_image_embeddings_batch(image_paths: Sequence[Optional[str]]) -> List[Optional[List[float]]]:
+    """Embeddings de várias imagens (None para caminhos ausentes/ilegíveis)"""
+    return [compute_image_embedding(path) if path else None for path in image_paths]
+
+
+async def embed_images_async(image_paths: Sequence[Optional[str]]) -> List[Optional[List[float]]]:
+    """Versão assíncrona de compute_image_embeddings_batch (roda no pool de embeddings)"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_executor, compute_image_embeddings_batch, list(image_paths))
+
+
+def compute_location_embedding(latitude: float, longitude: float) -> Optional[List[float]]:
+    """Embedding de uma coordenada (similaridade de cosseno ~ proximidade)
+
+    Cada escala contribui com exp(-d²/2σ²) para o produto escalar entre dois
+    pontos a d km de distância, então pontos próximos ficam similares em
+    várias escalas e pontos distantes só nas maiores.
+    """
+    if latitude is None or longitude is None:
+        return None
+
+    lat, lon = np.radians(float(latitude)), np.radians(float(longitude))
+    point = _EARTH_RADIUS_KM * np.array([
+        np.cos(lat) * np.cos(lon),
+        np.cos(lat) * np.sin(lon),
+        np.sin(lat),
+    ])
+
+    weights, offsets = _location_features()
+    features = np.cos(weights @ point + offsets)
+    return _to_list(_l2_normalize(features))
+
+
+def _color_histogram(hsv: np.ndarray) -> np.ndarray:
+    """Histograma conjunto H/S/V (8 níveis cada), raiz quadrada (Hellinger)"""
+    quantized = (hsv.astype(np.uint16) * _HSV_BINS) >> 8
+    codes = (quantized[..., 0] * _HSV_BINS + quantized[..., 1]) * _HSV_BINS + quantized[..., 2]
+    histogram = np.bincount(codes.ravel(), minlength=_HSV_BINS ** 3).astype(np.float32)
+    return np.sqrt(histogram / histogram.sum())
+
+
+def _edge_orientation_histogram(gray: np.ndarray) -> np.ndarray:
+    """Histograma de orientação de gradientes por célula (estilo HOG simplificado)"""
+    gx = np.zeros_like(gray)
+    gy = np.zeros_like(gray)
+    gx[:, 1:-1] = gray[:, 2:] - gray[:, :-2]
+    gy[1:-1, :] = gray[2:, :] - gray[:-2, :]
+
+    magnitude = np.hypot(gx, gy)
+    # Orientação sem sinal (0..π): bordas claro->escuro e escuro->claro iguais
+    orientation = np.mod(np.arctan2(gy, gx), np.pi)
+    bins = np.minimum((orientation / np.pi * _EDGE_BINS).astype(np.int32), _EDGE_BINS - 1)
+
+    cell = _IMAGE_SIZE // _EDGE_GRID
+    rows = np.arange(_IMAGE_SIZE) // cell
+    cell_index = rows[:, None] * _EDGE_GRID + rows[None, :]
+
+    histogram = np.bincount(
+        (cell_index * _EDGE_BINS + bins).ravel(),
+        weights=magnitude.ravel(),
+        minlength=_EDGE_GRID * _EDGE_GRID * _EDGE_BINS
+    ).astype(np.float32)
+
+    # Normalização por célula (robusta a variações de iluminação)
+    histogram = histogram.reshape(_EDGE_GRID * _EDGE_GRID, _EDGE_BINS)
+    norms = np.linalg.norm(histogram, axis=1, keepdims=True)
+    return (histogram / np.maximum(norms, 1e-6)).ravel()
+
+
+def _lbp_histogram(gray: np.ndarray) -> np.ndarray:
+    """Histograma de Local Binary Patterns (8 vizinhos, raio 1)"""
+    center = gray[1:-1, 1:-1]
+    neighbours = (
+        gray[:-2, :-2], gray[:-2, 1:-1], gray[:-2, 2:], gray[1:-1, 2:],
+        gray[2:, 2:], gray[2:, 1:-1], gray[2:, :-2], gray[1:-1, :-2],
+    )
+    codes = np.zeros(center.shape, dtype=np.uint16)
+    for bit, neighbour in enumerate(neighbours):
+        codes |= (neighbour >= center).astype(np.uint16) << bit
+
+    histogram = np.bincount(codes.ravel(), minlength=256).astype(np.float32)
+    return np.sqrt(histogram / histogram.sum())
+
+
+def _load_model():
+    """Carrega (uma vez) a projeção opcional de IMAGE_EMBEDDING_MODEL_PATH"""
+    global _model, _model_loaded
+
+    if _model_loaded:
+        return _model
+
+    with _model_lock:
+        if _model_loaded:
+            return _model
+
+        if IMAGE_EMBEDDING_MODEL_PATH:
+            try:
+                data = np.load(IMAGE_EMBEDDING_MODEL_PATH)
+                mean = data["mean"].astype(np.float32)
+                components = data["components"].astype(np.float32)
+                if mean.shape != (EMBEDDING_DIM,) or components.shape != (EMBEDDING_DIM, EMBEDDING_DIM):
+                    raise ValueError(
+                        f"expected mean ({EMBEDDING_DIM},) and components "
+                        f"({EMBEDDING_DIM}, {EMBEDDING_DIM}), got {mean.shape} and {components.shape}"
+                    )
+                _model = (mean, components)
+                logger.info(f"Image embedding model loaded: {IMAGE_EMBEDDING_MODEL_PATH}")
+            except Exception as e:
+                logger.error(f"Error loading image embedding model, using raw features: {e}")
+
+        _model_loaded = True
+        return _model
+
+
+def _location_features():
+    """Matriz de frequências fixa (semente constante: embeddings estáveis)"""
+    global _location_projection
+
+    if _location_projection is None:
+        rng = np.random.default_rng(20240601)
+        per_scale = EMBEDDING_DIM // len(_LOCATION_SCALES_KM)
+        weights = np.concatenate([
+            rng.normal(0.0, 1.0 / scale, size=(per_scale, 3)) for scale in _LOCATION_SCALES_KM
+        ])
+        offsets = rng.uniform(0.0, 2 * np.pi, size=EMBEDDING_DIM)
+        _location_projection = (weights, offsets)
+
+    return _location_projection
+
+
+def _l2_normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def _to_list(vector: np.ndarray) -> List[float]:
+    # 6 casas decimais: suficiente para cosseno e mantém o texto da coluna menor
+    return np.round(vector.astype(np.float32), 6).tolist()
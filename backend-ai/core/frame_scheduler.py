@@ -0,0 +1,249 @@
+"""
+Frame Scheduler - Fila de saída por conexão WebSocket do chat
+
+Com partial messages o SDK produz um delta a cada poucos tokens; mandar um
+frame por delta (e resultados de ferramentas inteiros) gasta CPU com frames
+minúsculos e, com um cliente lento, deixa o servidor acumulando memória.
+O scheduler fica entre a rota e o socket:
+
+- Junta text_chunk/thinking consecutivos numa janela curta (COALESCE_MS)
+  ou até MAX_COALESCED_CHARS
+- Trunca tool_result grandes (o frontend só mostra um resumo)
+- Fila limitada (MAX_QUEUED_FRAMES): quando enche, send() espera o socket;
+  a espera volta pelo stream do SDK até o processo do CLI
+- Cliente que não consome nada por SEND_TIMEOUT_SECONDS é desconectado
+- Codificação negociada no connect pelo subprotocolo do WebSocket:
+  JSON (padrão) ou MessagePack (se o pacote msgpack estiver instalado)
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+try:
+    import msgpack
+except ImportError:  # opcional: sem ele só JSON é oferecido
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Subprotocolo pedido pelo cliente -> codificação
+SUBPROTOCOLS = {
+    "duraeco.msgpack.v1": "msgpack",
+    "duraeco.json.v1": "json",
+}
+
+COALESCED_TYPES = ("text_chunk", "thinking")
+
+
+def negotiate_encoding(websocket: WebSocket) -> Tuple[Optional[str], str]:
+    """Escolhe a codificação pelos subprotocolos oferecidos no handshake
+
+    Args:
+        websocket: Conexão ainda não aceita
+
+    Returns:
+        (subprotocolo para o accept ou None, "json" | "msgpack")
+    """
+    for subprotocol in websocket.scope.get("subprotocols", []):
+        encoding = SUBPROTOCOLS.get(subprotocol)
+        if encoding == "msgpack" and msgpack is None:
+            continue
+        if encoding:
+            return subprotocol, encoding
+    return None, "json"
+
+
+class FrameScheduler:
+    """Envia os frames de uma conexão: coalescing, truncagem e backpressure"""
+
+    COALESCE_MS = float(os.getenv("CHAT_COALESCE_MS", "40"))
+    MAX_COALESCED_CHARS = 4096
+    MAX_TOOL_RESULT_CHARS = int(os.getenv("CHAT_MAX_TOOL_RESULT_CHARS", "4000"))
+    MAX_QUEUED_FRAMES = 64
+    SEND_TIMEOUT_SECONDS = float(os.getenv("CHAT_SEND_TIMEOUT_SECONDS", "30"))
+
+    def __init__(self, websocket: WebSocket, encoding: str = "json"):
+        """
+        Args:
+            websocket: Conexão já aceita
+            encoding: "json" ou "msgpack" (ver negotiate_encoding)
+        """
+        self.websocket = websocket
+        self.encoding = encoding
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=self.MAX_QUEUED_FRAMES)
+        self._order_lock = asyncio.Lock()
+        self._writer: Optional[asyncio.Task] = None
+        self._flush_timer: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+        self._pending_type: Optional[str] = None
+        self._pending_parts: List[str] = []
+        self._pending_chars = 0
+
+        self.stats = {
+            "frames_in": 0, "frames_out": 0, "bytes_out": 0,
+            "coalesced": 0, "truncated": 0, "max_queued": 0,
+        }
+
+    def start(self) -> "FrameScheduler":
+        self._writer = asyncio.create_task(self._write_loop(), name="chat-frame-writer")
+        return self
+
+    async def send(self, frame: Dict):
+        """Agenda um frame (espera se a fila do cliente estiver cheia)
+
+        Raises:
+            WebSocketDisconnect: Cliente desconectado ou lento demais
+        """
+        self._raise_if_failed()
+        self.stats["frames_in"] += 1
+        frame_type = frame.get("type")
+
+        if frame_type in COALESCED_TYPES:
+            if self._pending_type not in (None, frame_type):
+                async with self._order_lock:
+                    await self._flush_pending()
+            self._pending_type = frame_type
+            self._pending_parts.append(frame.get("content") or "")
+            self._pending_chars += len(self._pending_parts[-1])
+            if self._pending_chars >= self.MAX_COALESCED_CHARS:
+                async with self._order_lock:
+                    await self._flush_pending()
+            elif self._flush_timer is None:
+                self._flush_timer = asyncio.create_task(self._flush_later())
+            return
+
+        if frame_type == "tool_result":
+            frame = self._compact_tool_result(frame)
+
+        # Texto pendente sai antes para manter a ordem
+        async with self._order_lock:
+            await self._flush_pending()
+            await self._enqueue(frame)
+
+    async def close(self, timeout: float = 5.0):
+        """Envia o que estiver pendente e encerra o writer"""
+        if self._writer is None or self._writer.done():
+            self._cancel_timer()
+            return
+        try:
+            if self._error is None:
+                async with self._order_lock:
+                    await self._flush_pending()
+                await asyncio.wait_for(self._queue.put(None), timeout)
+                await asyncio.wait_for(asyncio.shield(self._writer), timeout)
+        except (asyncio.TimeoutError, Exception):
+            pass
+        finally:
+            self._cancel_timer()
+            if not self._writer.done():
+                self._writer.cancel()
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.COALESCE_MS / 1000)
+        self._flush_timer = None
+        async with self._order_lock:
+            await self._flush_pending()
+
+    async def _flush_pending(self):
+        """Enfileira o texto acumulado (chamar com o _order_lock)"""
+        self._cancel_timer()
+        if not self._pending_parts:
+            return
+        if len(self._pending_parts) > 1:
+            self.stats["coalesced"] += len(self._pending_parts) - 1
+        frame = {"type": self._pending_type, "content": "".join(self._pending_parts)}
+        self._pending_type = None
+        self._pending_parts = []
+        self._pending_chars = 0
+        await self._enqueue(frame)
+
+    async def _enqueue(self, frame: Dict):
+        self._raise_if_failed()
+        await self._queue.put(frame)
+        self.stats["max_queued"] = max(self.stats["max_queued"], self._queue.qsize())
+        self._raise_if_failed()
+
+    def _cancel_timer(self):
+        timer, self._flush_timer = self._flush_timer, None
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def _compact_tool_result(self, frame: Dict) -> Dict:
+        content = frame.get("content")
+        if content is None or (isinstance(content, str) and len(content) <= self.MAX_TOOL_RESULT_CHARS):
+            return frame
+
+        if not isinstance(content, str):
+            # Lista de blocos MCP: o texto dos blocos de texto, o resto em JSON
+            if isinstance(content, list) and all(isinstance(b, dict) for b in content):
+                content = "\n".join(
+                    b.get("text", "") if b.get("type") == "text" else json.dumps(b, default=str)
+                    for b in content
+                )
+            else:
+                content = json.dumps(content, default=str)
+            if len(content) <= self.MAX_TOOL_RESULT_CHARS:
+                return frame
+
+        self.stats["truncated"] += 1
+        return {
+            **frame,
+            "content": content[:self.MAX_TOOL_RESULT_CHARS] + "…",
+            "truncated": True,
+            "content_length": len(content),
+        }
+
+    def _encode(self, frame: Dict):
+        if self.encoding == "msgpack":
+            return msgpack.packb(frame, use_bin_type=True, default=str)
+        # Mesmo formato do send_json do Starlette
+        return json.dumps(frame, separators=(",", ":"), ensure_ascii=False, default=str)
+
+    async def _write_loop(self):
+        try:
+            while True:
+                frame = await self._queue.get()
+                if frame is None:
+                    break
+                payload = self._encode(frame)
+                started = time.monotonic()
+                try:
+                    if isinstance(payload, bytes):
+                        await asyncio.wait_for(self.websocket.send_bytes(payload), self.SEND_TIMEOUT_SECONDS)
+                    else:
+                        await asyncio.wait_for(self.websocket.send_text(payload), self.SEND_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    logger.warning(
+                        f"Chat client too slow (send blocked {time.monotonic() - started:.1f}s), closing"
+                    )
+                    self._error = WebSocketDisconnect(code=1013, reason="Client too slow")
+                    try:
+                        await self.websocket.close(code=1013, reason="Client too slow")
+                    except Exception:
+                        pass
+                    break
+                self.stats["frames_out"] += 1
+                self.stats["bytes_out"] += len(payload) if isinstance(payload, bytes) else len(payload.encode())
+        except Exception as e:
+            self._error = e if isinstance(e, WebSocketDisconnect) else WebSocketDisconnect(code=1011, reason=str(e))
+        finally:
+            if self._error is not None:
+                # Libera quem estiver esperando espaço na fila
+                while not self._queue.empty():
+                    self._queue.get_nowait()
@@ -0,0 +1,437 @@
+"""
+Geo Index - Índice espacial em grade para relatórios analisados
+
+Busca por raio e k vizinhos mais próximos com distância exata (Haversine),
+sem varrer a tabela de relatórios a cada chamada:
+
+- Grade regular em graus (GEO_INDEX_CELL_DEGREES, default 0.05° ≈ 5.5 km);
+  uma consulta só visita as células do retângulo que contém o círculo
+- Colunas em arrays NumPy (lat, lon, tipo de lixo, severidade, data): os
+  filtros e a distância são calculados vetorizados só sobre os candidatos
+- k-NN por raio crescente: dobra o raio até ter k resultados, então o
+  resultado é exato
+- Sync incremental pelo analysis_id (análise mais recente de cada relatório
+  substitui a anterior) e reconstrução periódica completa em background
+  para refletir reanálises promovidas e relatórios removidos
+
+Cada processo mantém a própria cópia (dezenas de bytes por relatório).
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from array import array
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.geo import EARTH_RADIUS_KM
+
+logger = logging.getLogger(__name__)
+
+GEO_INDEX_CELL_DEGREES = float(os.getenv("GEO_INDEX_CELL_DEGREES", "0.05"))
+SYNC_INTERVAL_SECONDS = float(os.getenv("GEO_INDEX_SYNC_SECONDS", "5"))
+REBUILD_INTERVAL_SECONDS = float(os.getenv("GEO_INDEX_REBUILD_SECONDS", "600"))
+
+_KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+_MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+_NO_DATE = -1.0
+
+
+class GeoGridIndex:
+    """Índice em grade lat/lon com filtros por tipo de lixo, severidade e data"""
+
+    _COLUMNS = (
+        ("report_id", np.int64),
+        ("latitude", np.float64),
+        ("longitude", np.float64),
+        ("waste_type_id", np.int32),
+        ("severity", np.int16),
+        ("report_time", np.float64),
+        ("live", np.bool_),
+    )
+
+    def __init__(self, cell_degrees: float = GEO_INDEX_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._rows = int(math.ceil(180.0 / cell_degrees))
+        self._cols = int(math.ceil(360.0 / cell_degrees))
+
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._high_water_mark = 0
+        self._last_sync = 0.0
+        self._last_rebuild = 0.0
+        self._rebuilding = False
+        self._reset()
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def radius(self, latitude: float, longitude: float, radius_km: float, limit: Optional[int] = None,
+               **filters) -> List[Tuple[int, float]]:
+        """Relatórios dentro do raio, do mais próximo ao mais distante
+
+        Args:
+            latitude: Latitude do centro
+            longitude: Longitude do centro
+            radius_km: Raio em km
+            limit: Máximo de resultados (None = todos)
+            **filters: waste_type, min_severity, max_severity, date_from, date_to
+
+        Returns:
+            Lista de (report_id, distância em km)
+        """
+        with self._lock:
+            candidates = self._candidates(latitude, longitude, radius_km)
+            if not len(candidates):
+                return []
+            columns = {name: values[candidates] for name, values in self._columns.items()}
+            waste_type_ids = self._waste_type_ids
+
+        mask = columns["live"] & self._filter_mask(columns, waste_type_ids, **filters)
+        distances = _haversine(latitude, longitude, columns["latitude"][mask], columns["longitude"][mask])
+        report_ids = columns["report_id"][mask]
+
+        inside = distances <= radius_km
+        report_ids, distances = report_ids[inside], distances[inside]
+
+        if limit is not None and len(distances) > limit:
+            top = np.argpartition(distances, limit - 1)[:limit]
+            report_ids, distances = report_ids[top], distances[top]
+        order = np.argsort(distances, kind="stable")
+        return [(int(r), float(d)) for r, d in zip(report_ids[order], distances[order])]
+
+    def nearest(self, latitude: float, longitude: float, k: int = 10,
+                max_radius_km: Optional[float] = None, **filters) -> List[Tuple[int, float]]:
+        """k relatórios mais próximos (opcionalmente limitados a um raio)"""
+        max_radius_km = min(max_radius_km or _MAX_DISTANCE_KM, _MAX_DISTANCE_KM)
+        radius_km = min(max(self.cell_degrees * _KM_PER_DEGREE, 1.0), max_radius_km)
+
+        while True:
+            results = self.radius(latitude, longitude, radius_km, limit=k, **filters)
+            if len(results) >= k or radius_km >= max_radius_km:
+                return results
+            radius_km = min(radius_km * 2, max_radius_km)
+
+    def lookup(self, report_ids, latitude: Optional[float] = None, longitude: Optional[float] = None,
+               **filters) -> Dict[int, Optional[float]]:
+        """Dos report_ids informados, os que estão no índice e passam nos filtros
+
+        Args:
+            report_ids: Relatórios a verificar
+            latitude, longitude: Ponto para calcular a distância (opcional)
+            **filters: waste_type, min_severity, max_severity, date_from, date_to
+
+        Returns:
+            {report_id: distância em km (None sem ponto)}
+        """
+        with self._lock:
+            found = [(int(r), self._positions[int(r)]) for r in report_ids if int(r) in self._positions]
+            if not found:
+                return {}
+            positions = np.array([p for _, p in found], dtype=np.int64)
+            columns = {name: values[positions] for name, values in self._columns.items()}
+            waste_type_ids = self._waste_type_ids
+
+        mask = self._filter_mask(columns, waste_type_ids, **filters)
+        if latitude is None or longitude is None:
+            return {r: None for (r, _), keep in zip(found, mask) if keep}
+
+        distances = _haversine(latitude, longitude, columns["latitude"], columns["longitude"])
+        return {r: float(d) for (r, _), d, keep in zip(found, distances, mask) if keep}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "reports": len(self._positions),
+                "cells": len(self._cells),
+                "cell_degrees": self.cell_degrees,
+                "high_water_mark": self._high_water_mark,
+            }
+
+    # ------------------------------------------------------------------
+    # Atualização
+    # ------------------------------------------------------------------
+
+    def upsert(self, rows: List[Dict]):
+        """Insere ou atualiza relatórios
+
+        Args:
+            rows: Dicts com report_id, latitude, longitude, waste_type_id,
+                waste_type, severity_score e report_date
+        """
+        with self._lock:
+            for row in rows:
+                if row["latitude"] is None or row["longitude"] is None:
+                    continue
+                lat, lon = float(row["latitude"]), float(row["longitude"])
+                cell = self._cell(lat, lon)
+
+                if row.get("waste_type_id") is not None and row.get("waste_type"):
+                    self._waste_type_ids[row["waste_type"].lower()] = int(row["waste_type_id"])
+
+                position = self._positions.get(row["report_id"])
+                if position is None:
+                    position = self._append_position()
+                    self._positions[row["report_id"]] = position
+                    self._cells.setdefault(cell, array("q")).append(position)
+                else:
+                    old_cell = self._cell(self._columns["latitude"][position], self._columns["longitude"][position])
+                    if old_cell != cell:
+                        self._cells[old_cell].remove(position)
+                        if not self._cells[old_cell]:
+                            del self._cells[old_cell]
+                        self._cells.setdefault(cell, array("q")).append(position)
+
+                self._columns["report_id"][position] = row["report_id"]
+                self._columns["latitude"][position] = lat
+                self._columns["longitude"][position] = lon
+                self._columns["waste_type_id"][position] = row.get("waste_type_id") or -1
+                self._columns["severity"][position] = row.get("severity_score") or 0
+                self._columns["report_time"][position] = _timestamp(row.get("report_date"))
+                self._columns["live"][position] = True
+
+    def remove(self, report_ids: List[int]):
+        with self._lock:
+            for report_id in report_ids:
+                position = self._positions.pop(report_id, None)
+                if position is not None:
+                    self._columns["live"][position] = False
+
+    def sync(self, get_db_connection_func, batch_size: int = 5000, force: bool = False) -> int:
+        """Carrega as análises novas (analysis_id acima da marca d'água)
+
+        Também dispara a reconstrução completa em background a cada
+        REBUILD_INTERVAL_SECONDS.
+
+        Returns:
+            Número de linhas carregadas
+        """
+        now = time.monotonic()
+        if not force and now - self._last_sync < SYNC_INTERVAL_SECONDS:
+            return 0
+
+        if self._last_rebuild and now - self._last_rebuild >= REBUILD_INTERVAL_SECONDS:
+            self.rebuild_async(get_db_connection_func)
+
+        with self._sync_lock:
+            if not force and now - self._last_sync < SYNC_INTERVAL_SECONDS:
+                return 0
+            self._last_sync = now
+
+            loaded = 0
+            for rows in self._fetch(get_db_connection_func, self._high_water_mark, batch_size):
+                self.upsert(rows)
+                with self._lock:
+                    self._high_water_mark = max(self._high_water_mark, rows[-1]["analysis_id"])
+                loaded += len(rows)
+
+            if not self._last_rebuild:
+                # Primeiro sync carrega tudo: conta como reconstrução
+                self._last_rebuild = now
+                logger.info(f"Geo index loaded: {self.stats()}")
+            return loaded
+
+    def rebuild(self, get_db_connection_func, batch_size: int = 5000):
+        """Reconstrói o índice do zero e troca o estado de uma vez"""
+        fresh = GeoGridIndex(self.cell_degrees)
+        high_water_mark = 0
+        for rows in self._fetch(get_db_connection_func, 0, batch_size):
+            fresh.upsert(rows)
+            high_water_mark = rows[-1]["analysis_id"]
+
+        with self._sync_lock, self._lock:
+            # Análises gravadas durante a reconstrução são relidas no próximo sync
+            self._columns, self._size = fresh._columns, fresh._size
+            self._positions, self._cells = fresh._positions, fresh._cells
+            self._waste_type_ids = fresh._waste_type_ids
+            self._high_water_mark = high_water_mark
+            self._last_rebuild = time.monotonic()
+            self._last_sync = 0.0
+
+    def rebuild_async(self, get_db_connection_func):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+            # Evita disparar de novo enquanto esta reconstrução roda
+            self._last_rebuild = time.monotonic()
+
+        def run():
+            try:
+                self.rebuild(get_db_connection_func)
+            except Exception as e:
+                logger.error(f"Error rebuilding geo index: {e}")
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, name="geo-index-rebuild", daemon=True).start()
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+
+    def _reset(self):
+        self._size = 0
+        self._columns = {name: np.zeros(1024, dtype=dtype) for name, dtype in self._COLUMNS}
+        self._positions: Dict[int, int] = {}
+        self._cells: Dict[int, array] = {}
+        self._waste_type_ids: Dict[str, int] = {}
+
+    def _append_position(self) -> int:
+        if self._size == len(self._columns["report_id"]):
+            for name, values in self._columns.items():
+                grown = np.zeros(len(values) * 2, dtype=values.dtype)
+                grown[:self._size] = values[:self._size]
+                self._columns[name] = grown
+        self._size += 1
+        return self._size - 1
+
+    def _cell(self, latitude: float, longitude: float) -> int:
+        row = min(int((latitude + 90.0) // self.cell_degrees), self._rows - 1)
+        col = int((longitude + 180.0) // self.cell_degrees) % self._cols
+        return row * self._cols + col
+
+    def _candidates(self, latitude: float, longitude: float, radius_km: float) -> np.ndarray:
+        """Posições nas células que cobrem o círculo (todas se for mais barato)"""
+        angular = radius_km / EARTH_RADIUS_KM
+        dlat = math.degrees(angular)
+        row_from = max(int((latitude - dlat + 90.0) // self.cell_degrees), 0)
+        row_to = min(int((latitude + dlat + 90.0) // self.cell_degrees), self._rows - 1)
+
+        # Meia-largura exata em longitude do círculo; contém um polo = todas
+        sin_ratio = math.sin(min(angular, math.pi / 2)) / max(math.cos(math.radians(latitude)), 1e-12)
+        if angular >= math.pi / 2 or sin_ratio >= 1.0 or abs(latitude) + dlat >= 90.0:
+            col_span = self._cols
+            col_from = 0
+        else:
+            dlon = math.degrees(math.asin(sin_ratio))
+            col_from = int((longitude - dlon + 180.0) // self.cell_degrees)
+            col_span = int((longitude + dlon + 180.0) // self.cell_degrees) - col_from + 1
+
+        col_span = min(col_span, self._cols)
+        if (row_to - row_from + 1) * col_span > len(self._cells):
+            # Mais células no retângulo que células ocupadas: filtra as ocupadas
+            keys = np.fromiter(self._cells.keys(), dtype=np.int64, count=len(self._cells))
+            rows, cols = keys // self._cols, keys % self._cols
+            inside = (rows >= row_from) & (rows <= row_to)
+            if col_span < self._cols:
+                inside &= (cols - col_from) % self._cols < col_span
+            cells = keys[inside]
+        else:
+            cells = [
+                row * self._cols + (col_from + offset) % self._cols
+                for row in range(row_from, row_to + 1)
+                for offset in range(col_span)
+            ]
+
+        positions = [self._cells[int(cell)] for cell in cells if int(cell) in self._cells]
+        if not positions:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.frombuffer(p, dtype=np.int64) for p in positions])
+
+    @staticmethod
+    def _filter_mask(columns: Dict[str, np.ndarray], waste_type_ids: Dict[str, int], waste_type: Optional[str] = None,
+                     min_severity: Optional[int] = None, max_severity: Optional[int] = None,
+                     date_from=None, date_to=None) -> np.ndarray:
+        mask = np.ones(len(columns["report_id"]), dtype=bool)
+
+        if waste_type:
+            waste_type_id = waste_type_ids.get(waste_type.strip().lower())
+            if waste_type_id is None:
+                return np.zeros_like(mask)
+            mask &= columns["waste_type_id"] == waste_type_id
+        if min_severity is not None:
+            mask &= columns["severity"] >= min_severity
+        if max_severity is not None:
+            mask &= columns["severity"] <= max_severity
+        if date_from is not None:
+            mask &= columns["report_time"] >= _timestamp(date_from)
+        if date_to is not None:
+            # Data sem hora inclui o dia inteiro
+            end = _timestamp(date_to) + (86400 if _is_date_only(date_to) else 0)
+            mask &= (columns["report_time"] != _NO_DATE) & (columns["report_time"] < end)
+        return mask
+
+    @staticmethod
+    def _fetch(get_db_connection_func, after_analysis_id: int, batch_size: int):
+        """Lotes de (relatório, análise) por analysis_id crescente"""
+        conn = get_db_connection_func()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        try:
+            cursor = conn.cursor(dictionary=True)
+            while True:
+                cursor.execute(
+                    """
+                    SELECT ar.analysis_id, r.report_id, r.latitude, r.longitude, r.report_date,
+                           ar.waste_type_id, wt.name AS waste_type, ar.severity_score
+                    FROM analysis_results ar
+                    JOIN reports r ON ar.report_id = r.report_id
+                    LEFT JOIN waste_types wt ON ar.waste_type_id = wt.waste_type_id
+                    WHERE ar.analysis_id > %s
+                    ORDER BY ar.analysis_id
+                    LIMIT %s
+                    """,
+                    (after_analysis_id, batch_size)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                yield rows
+                after_analysis_id = rows[-1]["analysis_id"]
+                if len(rows) < batch_size:
+                    break
+            cursor.close()
+        finally:
+            conn.close()
+
+
+def _haversine(latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Distâncias (km) de um ponto a vários (mesma fórmula de core.geo)"""
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def _is_date_only(value) -> bool:
+    if isinstance(value, str):
+        return len(value.strip()) == 10
+    return isinstance(value, date) and not isinstance(value, datetime)
+
+
+def _timestamp(value) -> float:
+    """datetime/date/ISO string -> epoch (segundos); ausente = _NO_DATE"""
+    if value is None:
+        return _NO_DATE
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip())
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day).timestamp()
+    return float(value)
+
+
+_geo_index = None
+_geo_index_lock = threading.Lock()
+
+
+def get_geo_index() -> GeoGridIndex:
+    """Índice espacial deste processo (carregado no primeiro sync)"""
+    global _geo_index
+
+    if _geo_index is None:
+        with _geo_index_lock:
+            if _geo_index is None:
+                _geo_index = GeoGridIndex()
+    return _geo_index
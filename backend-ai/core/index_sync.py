@@ -0,0 +1,135 @@
+"""
+Index Sync - Sincronização dos índices em processo fora do caminho da busca
+
+As ferramentas do chat chamavam index.sync() antes de cada busca: no
+primeiro uso (marca d'água 0) ou depois de um request_rescan do backfill,
+a chamada lia e convertia a tabela analysis_results inteira, segurando uma
+conexão do pool de analytics enquanto a própria busca já tinha outra.
+
+Aqui uma thread em background sincroniza os índices registrados (imagem,
+espacial, textual) a cada INDEX_SYNC_SECONDS, com conexões do pool de
+worker. As reconstruções periódicas e os pedidos de rescan continuam
+saindo do sync() de cada índice, agora nesta thread. As buscas só leem o
+índice em memória:
+
+- Índice pronto = primeiro sync completo neste processo
+- Antes disso a busca por imagem usa o SQL e a busca híbrida deixa a perna
+  de imagem de fora; as demais esperam até INDEX_READY_TIMEOUT_SECONDS e
+  falham com IndexNotReady
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from core.geo_index import get_geo_index
+from core.text_index import get_text_index
+from core.vector_index import get_image_index
+
+logger = logging.getLogger(__name__)
+
+INDEX_SYNC_SECONDS = float(os.getenv("INDEX_SYNC_SECONDS", "5"))
+INDEX_READY_TIMEOUT_SECONDS = float(os.getenv("INDEX_READY_TIMEOUT_SECONDS", "10"))
+
+
+class IndexNotReady(Exception):
+    """Índice ainda carregando (primeiro sync não terminou)"""
+
+
+class IndexSyncer:
+    """Thread que mantém os índices em processo sincronizados com o banco"""
+
+    def __init__(self, get_db_connection_func: Callable, interval: float = INDEX_SYNC_SECONDS):
+        """
+        Args:
+            get_db_connection_func: Função que retorna conexão do banco
+            interval: Segundos entre sincronizações
+        """
+        self.get_db_connection = get_db_connection_func
+        self.interval = interval
+
+        # nome -> função que retorna o índice (None = indisponível neste processo)
+        self._indexes: Dict[str, Callable[[], Any]] = {}
+        self._ready: Dict[str, threading.Event] = {}
+        self._stats: Dict[str, Dict] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def register(self, name: str, get_index: Callable[[], Any]):
+        """Registra um índice com método sync(get_db_connection_func, force=...)"""
+        self._indexes[name] = get_index
+        self._ready[name] = threading.Event()
+        self._stats[name] = {"syncs": 0, "loaded": 0, "errors": 0, "last_error": None, "last_seconds": None}
+
+    def start(self):
+        """Inicia a thread (idempotente)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="index-sync", daemon=True)
+                self._thread.start()
+
+    def is_ready(self, name: str) -> bool:
+        self.start()
+        return self._ready[name].is_set()
+
+    def wait_ready(self, name: str, timeout: float = INDEX_READY_TIMEOUT_SECONDS):
+        """Espera o primeiro sync do índice (bloqueante: chamar fora do event loop)
+
+        Raises:
+            IndexNotReady: Índice não carregou dentro do timeout
+        """
+        self.start()
+        if not self._ready[name].wait(timeout):
+            raise IndexNotReady(f"The {name} index is still loading, try again in a few seconds")
+
+    def get_stats(self) -> Dict:
+        return {
+            name: {**stats, "ready": self._ready[name].is_set()}
+            for name, stats in self._stats.items()
+        }
+
+    def _loop(self):
+        while True:
+            for name in list(self._indexes):
+                self._sync(name)
+            time.sleep(self.interval)
+
+    def _sync(self, name: str):
+        stats = self._stats[name]
+        started = time.monotonic()
+        try:
+            index = self._indexes[name]()
+            if index is not None:
+                stats["loaded"] += index.sync(self.get_db_connection, force=True) or 0
+            stats["syncs"] += 1
+            stats["last_error"] = None
+            self._ready[name].set()
+        except Exception as e:
+            stats["errors"] += 1
+            if stats["last_error"] != str(e):
+                logger.error(f"Error syncing {name} index: {e}")
+            stats["last_error"] = str(e)
+        stats["last_seconds"] = round(time.monotonic() - started, 3)
+
+
+_index_syncer: Optional[IndexSyncer] = None
+_index_syncer_lock = threading.Lock()
+
+
+def get_index_syncer(get_db_connection_func: Callable) -> IndexSyncer:
+    """Retorna o syncer singleton do processo, com os três índices registrados"""
+    global _index_syncer
+
+    if _index_syncer is None:
+        with _index_syncer_lock:
+            if _index_syncer is None:
+                syncer = IndexSyncer(get_db_connection_func)
+                syncer.register("image", get_image_index)
+                syncer.register("geo", get_geo_index)
+                syncer.register("text", get_text_index)
+                _index_syncer = syncer
+    return _index_syncer
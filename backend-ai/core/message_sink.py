@@ -0,0 +1,471 @@
+"""
+Message Sink - Persistência write-behind das mensagens do chat
+
+Salvar uma mensagem custava INSERT + UPDATE da sessão + COUNT(*) (+ título)
+dentro do loop do WebSocket, antes da chamada ao modelo. Com o sink:
+
+- add_message()/add_session() só acrescentam o registro na memória e numa
+  linha do spool (data/chat_spool.jsonl.<processo>): microssegundos, sem banco
+- Uma task grava a cada FLUSH_INTERVAL (ou ao juntar MAX_BATCH registros):
+  INSERTs multi-linha, um UPDATE de updated_at por sessão e um commit
+- Se o banco falhar, os registros voltam para a fila e o spool é mantido;
+  ao iniciar, spools que sobraram (queda do processo) são regravados
+- message_uid (UNIQUE) + ON DUPLICATE KEY UPDATE tornam a regravação
+  idempotente; outros erros (FK, dado grande demais) continuam sendo erros:
+  o lote é regravado registro a registro e os rejeitados são descartados
+  com log, para não travar a fila
+
+Cada processo (worker do uvicorn) tem os próprios arquivos de spool e
+segura um flock exclusivo no .lock deles enquanto vive. Ao iniciar, um
+processo só assume spools cujo lock está livre (dono morto). Quem lê
+mensagens logo depois de escrevê-las deve chamar flush() antes.
+"""
+
+import os
+import glob
+import json
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from mysql.connector.errors import DataError, IntegrityError
+
+try:
+    import fcntl
+except ImportError:  # Windows (desenvolvimento): um processo por spool
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPOOL_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "chat_spool.jsonl"
+)
+
+MESSAGE_COLUMNS = (
+    "session_id", "user_id", "role", "content", "image_url", "map_url",
+    "is_interrupted", "message_uid", "created_at",
+)
+
+
+class MessageSink:
+    """Fila write-behind de sessões e mensagens do chat"""
+
+    FLUSH_INTERVAL_SECONDS = float(os.getenv("CHAT_SINK_FLUSH_MS", "250")) / 1000
+    MAX_BATCH = 500
+    RETRY_SECONDS = 5
+
+    def __init__(self, get_db_connection_func: Callable, spool_path: str = DEFAULT_SPOOL_PATH):
+        """
+        Args:
+            get_db_connection_func: Função que retorna conexão do banco
+            spool_path: Arquivo JSONL com os registros ainda não gravados
+        """
+        self.get_db_connection = get_db_connection_func
+        self.spool_path = spool_path
+        # Arquivos deste processo: <spool_path>.<dono> (atual) e <spool_path>.<dono>.<id> (rotacionados)
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._owner_lock = None
+
+        self._pending: List[Dict] = []
+        self._spool = None
+        # Spools rotacionados cujos registros estão na fila (apagados após gravar)
+        self._rotated: List[str] = []
+        self._recovered = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"queued": 0, "written": 0, "flushes": 0, "failures": 0, "recovered": 0, "dropped": 0}
+
+    # ------------------------------------------------------------------
+    # Escrita (chamada na rota, sem I/O de banco)
+    # ------------------------------------------------------------------
+
+    def add_session(self, session_id: str, user_id: int, title: str):
+        """Enfileira a criação de uma sessão
+
+        Args:
+            session_id: ID da sessão (gerado pelo chamador)
+            user_id: ID do usuário
+            title: Título (normalmente a primeira mensagem)
+        """
+        now = datetime.now().isoformat()
+        self._add({
+            "kind": "session",
+            "session_id": session_id,
+            "user_id": user_id,
+            "title": title,
+            "created_at": now,
+        })
+
+    def add_message(
+        self,
+        session_id: str,
+        user_id: int,
+        role: str,
+        content: str,
+        image_url: Optional[str] = None,
+        map_url: Optional[str] = None,
+        interrupted: bool = False
+    ) -> str:
+        """Enfileira uma mensagem
+
+        Returns:
+            message_uid da mensagem
+        """
+        message_uid = uuid.uuid4().hex
+        self._add({
+            "kind": "message",
+            "session_id": session_id,
+            "user_id": user_id,
+            "role": role,
+            "content": content,
+            "image_url": image_url,
+            "map_url": map_url,
+            "is_interrupted": bool(interrupted),
+            "message_uid": message_uid,
+            "created_at": datetime.now().isoformat(),
+        })
+        return message_uid
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Recupera spools anteriores e inicia a task de flush"""
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        if not self._recovered:
+            self._recover_spool()
+            self._recovered = True
+        self._task = asyncio.create_task(self._flush_loop(), name="chat-message-sink")
+
+    async def close(self):
+        """Grava o que estiver na fila e para a task"""
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            # Espera o cancelamento: um lote em gravação volta para a fila
+            await asyncio.gather(task, return_exceptions=True)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Final chat flush failed, {len(self._pending)} records kept in spool: {e}")
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        if self._owner_lock is not None:
+            # Spools que sobraram ficam para o próximo processo que iniciar
+            try:
+                os.remove(self._owner_lock.name)
+            except OSError:
+                pass
+            self._owner_lock.close()
+            self._owner_lock = None
+
+    async def flush(self) -> int:
+        """Grava todos os registros da fila
+
+        Returns:
+            Número de registros gravados
+        """
+        async with self._get_flush_lock():
+            if not self._pending:
+                return 0
+
+            batch, self._pending = self._pending, []
+            self._rotate_spool()
+            # Spools com os registros deste lote (todos os rotacionados até aqui)
+            batch_spools = list(self._rotated)
+            loop = asyncio.get_running_loop()
+            try:
+                written = await loop.run_in_executor(None, self._write_batch, batch)
+            except BaseException as e:
+                # Falha ou cancelamento (close()): o lote volta antes do que chegou
+                # durante a escrita; regravar é idempotente (INSERT IGNORE)
+                self._pending = batch + self._pending
+                if isinstance(e, Exception):
+                    self.stats["failures"] += 1
+                raise
+
+            for path in batch_spools:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._rotated = [path for path in self._rotated if path not in batch_spools]
+            self.stats["written"] += written
+            self.stats["flushes"] += 1
+            return written
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, "pending": len(self._pending)}
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+
+    def _add(self, record: Dict):
+        self._ensure_started()
+        self._pending.append(record)
+        self.stats["queued"] += 1
+        try:
+            self._spool_file().write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._spool.flush()
+        except OSError as e:
+            logger.error(f"Chat spool write failed (record kept in memory only): {e}")
+        if len(self._pending) >= self.MAX_BATCH:
+            self._wakeup.set()
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self.start()
+
+    def _get_flush_lock(self) -> asyncio.Lock:
+        # Criado no event loop do servidor (o módulo é importado antes dele)
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        return self._flush_lock
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Chat message flush failed ({len(self._pending)} pending): {e}")
+                await asyncio.sleep(self.RETRY_SECONDS)
+
+    @property
+    def _live_path(self) -> str:
+        return f"{self.spool_path}.{self._owner}"
+
+    def _spool_file(self):
+        if self._spool is None:
+            self._lock_owner()
+            self._spool = open(self._live_path, "a", encoding="utf-8")
+        return self._spool
+
+    def _lock_owner(self):
+        """Cria o .lock deste processo e segura um flock exclusivo até o close()"""
+        if self._owner_lock is not None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.spool_path)), exist_ok=True)
+        self._owner_lock = open(f"{self._live_path}.lock", "w")
+        if fcntl is not None:
+            fcntl.flock(self._owner_lock, fcntl.LOCK_EX)
+
+    def _rotate_spool(self):
+        """Separa o spool dos registros do lote (os novos vão para outro arquivo)"""
+        if self._spool is None:
+            return
+        self._spool.close()
+        self._spool = None
+        rotated = self._rotated_path()
+        try:
+            os.replace(self._live_path, rotated)
+            self._rotated.append(rotated)
+        except OSError as e:
+            logger.error(f"Chat spool rotation failed: {e}")
+
+    def _rotated_path(self) -> str:
+        return f"{self._live_path}.{uuid.uuid4().hex[:12]}"
+
+    def _spool_owner(self, path: str) -> Optional[str]:
+        """Dono de um arquivo de spool (None = formato antigo, sem dono)"""
+        name = path[len(self.spool_path):].lstrip(".").split(".")[0]
+        return name if "-" in name else None
+
+    def _recover_spool(self):
+        """Coloca na fila registros de spools de processos encerrados"""
+        self._lock_owner()
+        # Dois workers iniciando juntos não assumem o mesmo spool
+        with open(f"{self.spool_path}.recover.lock", "w") as recover_lock:
+            if fcntl is not None:
+                fcntl.flock(recover_lock, fcntl.LOCK_EX)
+            self._claim_orphan_spools()
+
+    def _claim_orphan_spools(self):
+        candidates = glob.glob(self.spool_path + ".*")
+        if os.path.exists(self.spool_path):
+            candidates.append(self.spool_path)
+
+        owners: Dict[str, bool] = {}
+        dead_locks = []
+        paths = []
+        for path in candidates:
+            if path.endswith(".lock"):
+                continue
+            owner = self._spool_owner(path)
+            if owner == self._owner:
+                continue
+            if owner is not None and owner not in owners:
+                owners[owner] = self._owner_is_dead(owner, dead_locks)
+            if owner is None or owners[owner]:
+                paths.append(path)
+        paths.sort(key=os.path.getmtime)
+
+        recovered = []
+        for path in paths:
+            # Renomeado antes de ler: o arquivo passa a ser deste processo
+            claimed = self._rotated_path()
+            try:
+                os.replace(path, claimed)
+                with open(claimed, encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            recovered.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            # Última linha cortada por uma queda
+                            logger.warning(f"Skipping corrupt line in {path}")
+            except OSError as e:
+                logger.error(f"Could not read chat spool {path}: {e}")
+                continue
+            self._rotated.append(claimed)
+
+        for lock_file in dead_locks:
+            try:
+                os.remove(lock_file.name)
+            except OSError:
+                pass
+            lock_file.close()
+
+        if recovered:
+            logger.info(f"Recovered {len(recovered)} chat records from spool")
+            self._pending = recovered + self._pending
+            self.stats["recovered"] += len(recovered)
+
+    def _owner_is_dead(self, owner: str, dead_locks: List) -> bool:
+        """True se o processo dono não segura mais o lock (o lock fica em dead_locks)"""
+        lock_path = f"{self.spool_path}.{owner}.lock"
+        try:
+            lock_file = open(lock_path, "a")
+        except OSError:
+            return True
+        # Sem flock (Windows) vale um processo por spool: os outros donos já saíram
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        dead_locks.append(lock_file)
+        return True
+
+    def _write_batch(self, batch: List[Dict]) -> int:
+        """Grava sessões, mensagens e updated_at numa transação
+
+        Se o banco rejeitar o lote (FK, dado grande demais), grava registro a
+        registro e descarta, com log, os que forem rejeitados.
+
+        Returns:
+            Número de registros gravados
+        """
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        dropped = 0
+        try:
+            cursor = conn.cursor()
+            try:
+                self._insert_records(cursor, batch)
+                conn.commit()
+            except (IntegrityError, DataError) as e:
+                conn.rollback()
+                logger.warning(f"Chat batch of {len(batch)} records rejected ({e}), writing one by one")
+                for record in batch:
+                    try:
+                        self._insert_records(cursor, [record])
+                        conn.commit()
+                    except (IntegrityError, DataError) as e:
+                        conn.rollback()
+                        dropped += 1
+                        self.stats["dropped"] += 1
+                        logger.error(
+                            f"Dropping chat {record['kind']} {record.get('message_uid') or ''} "
+                            f"of session {record['session_id']}: {e}"
+                        )
+            cursor.close()
+            return len(batch) - dropped
+
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _insert_records(self, cursor, batch: List[Dict]):
+        """INSERTs do lote (sem commit); chave repetida = registro já gravado"""
+        sessions = [r for r in batch if r["kind"] == "session"]
+        if sessions:
+            cursor.execute(
+                "INSERT INTO chat_sessions (session_id, user_id, title, created_at, updated_at) VALUES "
+                + ", ".join(["(%s, %s, %s, %s, %s)"] * len(sessions))
+                + " ON DUPLICATE KEY UPDATE session_id = session_id",
+                [v for r in sessions for v in (
+                    r["session_id"], r["user_id"], r["title"],
+                    datetime.fromisoformat(r["created_at"]), datetime.fromisoformat(r["created_at"])
+                )]
+            )
+            self._log_warnings(cursor, "chat_sessions")
+
+        messages = [r for r in batch if r["kind"] == "message"]
+        row = "(" + ", ".join(["%s"] * len(MESSAGE_COLUMNS)) + ")"
+        for start in range(0, len(messages), self.MAX_BATCH):
+            chunk = messages[start:start + self.MAX_BATCH]
+            cursor.execute(
+                f"INSERT INTO chat_messages ({', '.join(MESSAGE_COLUMNS)}) VALUES "
+                + ", ".join([row] * len(chunk))
+                + " ON DUPLICATE KEY UPDATE message_uid = message_uid",
+                [
+                    datetime.fromisoformat(r[c]) if c == "created_at" else r[c]
+                    for r in chunk for c in MESSAGE_COLUMNS
+                ]
+            )
+            self._log_warnings(cursor, "chat_messages")
+
+        # updated_at: um UPDATE para todas as sessões do lote
+        last_activity: Dict[str, str] = {}
+        for r in messages:
+            last_activity[r["session_id"]] = max(last_activity.get(r["session_id"], ""), r["created_at"])
+        if last_activity:
+            session_ids = list(last_activity)
+            cursor.execute(
+                "UPDATE chat_sessions SET updated_at = CASE session_id "
+                + " ".join(["WHEN %s THEN %s"] * len(session_ids))
+                + " END WHERE session_id IN (" + ", ".join(["%s"] * len(session_ids)) + ")",
+                [v for sid in session_ids for v in (sid, datetime.fromisoformat(last_activity[sid]))]
+                + session_ids
+            )
+        logger.debug(f"Wrote {len(sessions)} sessions and {len(messages)} chat messages")
+
+    @staticmethod
+    def _log_warnings(cursor, table: str):
+        """Loga avisos do INSERT (ex: texto truncado fora do modo estrito)"""
+        if not getattr(cursor, "warning_count", 0):
+            return
+        cursor.execute("SHOW WARNINGS")
+        for level, code, message in cursor.fetchall():
+            logger.warning(f"Chat insert into {table}: {level} {code}: {message}")
+
+
+_message_sink: Optional[MessageSink] = None
+
+
+def get_message_sink(get_db_connection_func: Callable) -> MessageSink:
+    """Retorna o sink singleton do processo"""
+    global _message_sink
+    if _message_sink is None:
+        _message_sink = MessageSink(get_db_connection_func)
+    return _message_sink
@@ -0,0 +1,255 @@
+"""
+Query Cache - Cache de resultados do execute_sql_query
+
+O agente repete as mesmas agregações (COUNT(*) de reports, tipos de lixo
+mais comuns, hotspots ativos) para usuários e sessões diferentes, e cada
+chamada ia ao MySQL. O cache guarda as linhas por SQL canônico:
+
+- Chave: SQL sem diferenças de espaços, caixa e comentários fora de
+  literais (ver canonicalize)
+- Invalidação por versão: data_versions tem contadores por tabela
+  (migrações 007 e 009), incrementados pelo commit das conexões do
+  backend que escreveram na tabela (core/database.py) - da API, da fila e
+  do re-análise. Cada tabela tem 16 slots para escritores concorrentes não
+  disputarem a mesma linha; a versão da tabela é a soma dos slots. Cada
+  entrada guarda a versão das tabelas que a query cita; mudou, a entrada
+  é descartada. Escritas fora do backend só valem depois do TTL
+- Versões relidas no máximo a cada VERSION_CHECK_SECONDS (uma agregação
+  sobre poucas dezenas de linhas)
+- TTL (SQL_CACHE_TTL_SECONDS) para tabelas sem contador e para queries que
+  dependem do relógio (NOW(), CURDATE())
+- Misses simultâneos da mesma query esperam uma única execução
+- LRU com SQL_CACHE_MAX_ENTRIES entradas; resultados grandes não entram
+
+Sem a tabela data_versions o cache fica desligado (toda query vai ao banco).
+Cada processo mantém o próprio cache.
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Literais e identificadores entre crases mantêm o texto original
+_LITERAL_RE = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)")
+_COMMENT_RE = re.compile(r"/\*.*?\*/|(?:--|#)[^\n]*", re.DOTALL)
+_SPACE_RE = re.compile(r"\s+")
+_PUNCT_SPACE_RE = re.compile(r"\s*([,()=])\s*")
+
+# Resultado muda a cada execução (ou a query tem efeito colateral)
+_VOLATILE_RE = re.compile(
+    r"\b(rand|uuid|uuid_short|sysdate|connection_id|last_insert_id|found_rows|sleep|benchmark)\("
+    r"|\bfor update\b|\block in share mode\b|\bfor share\b"
+)
+
+
+def canonicalize(query: str) -> str:
+    """SQL canônico para a chave do cache
+
+    Fora de literais: remove comentários, junta espaços, passa para
+    minúsculas e tira espaços em volta de , ( ) =. Literais ficam intactos.
+    """
+    parts = _LITERAL_RE.split(query.strip().rstrip(";").strip())
+    canonical = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            canonical.append(part)
+            continue
+        part = _COMMENT_RE.sub(" ", part)
+        part = _SPACE_RE.sub(" ", part).lower()
+        canonical.append(_PUNCT_SPACE_RE.sub(r"\1", part))
+    return "".join(canonical).strip()
+
+
+def _code_only(canonical: str) -> str:
+    """SQL canônico sem o conteúdo dos literais (para buscar tabelas e funções)"""
+    return "".join(p for i, p in enumerate(_LITERAL_RE.split(canonical)) if i % 2 == 0 or p.startswith("`"))
+
+
+class _Entry:
+    def __init__(self, result: Dict, versions: Dict[str, int], created_at: float):
+        self.result = result
+        self.versions = versions
+        self.created_at = created_at
+
+
+class QueryCache:
+    """Cache LRU de resultados de queries read-only, invalidado por data_versions"""
+
+    ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true"
+    TTL_SECONDS = float(os.getenv("SQL_CACHE_TTL_SECONDS", "60"))
+    MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "256"))
+    MAX_RESULT_BYTES = 256 * 1024
+    VERSION_CHECK_SECONDS = float(os.getenv("SQL_CACHE_VERSION_CHECK_SECONDS", "1"))
+
+    def __init__(self, get_db_connection_func: Callable):
+        """
+        Args:
+            get_db_connection_func: Função que retorna conexão do banco
+        """
+        self.get_db_connection = get_db_connection_func
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._versions: Optional[Dict[str, int]] = None
+        self._versions_checked_at = 0.0
+        self._versions_lock: Optional[asyncio.Lock] = None
+        self._versions_error_logged = False
+
+        self.stats = {
+            "hits": 0, "misses": 0, "expired": 0, "invalidated": 0,
+            "coalesced": 0, "bypassed": 0, "evictions": 0, "too_large": 0,
+        }
+
+    async def get_or_run(
+        self,
+        query: str,
+        run: Callable[[], Awaitable[Optional[Dict]]]
+    ) -> Tuple[Optional[Dict], Optional[float]]:
+        """Resultado da query, do cache ou executando run()
+
+        Args:
+            query: Query já validada (com o LIMIT final)
+            run: Executa a query no banco (None = falha de conexão)
+
+        Returns:
+            (resultado, idade em segundos se veio do cache, senão None)
+        """
+        canonical = canonicalize(query)
+        code = _code_only(canonical)
+        if not self.ENABLED or _VOLATILE_RE.search(code):
+            self.stats["bypassed"] += 1
+            return await run(), None
+
+        versions = await self._current_versions()
+        if versions is None:
+            self.stats["bypassed"] += 1
+            return await run(), None
+        depends = {
+            table: version for table, version in versions.items()
+            if re.search(rf"\b{re.escape(table)}\b", code)
+        }
+
+        now = time.monotonic()
+        entry = self._entries.get(canonical)
+        if entry is not None:
+            if now - entry.created_at > self.TTL_SECONDS:
+                self.stats["expired"] += 1
+                del self._entries[canonical]
+            elif entry.versions != depends:
+                self.stats["invalidated"] += 1
+                del self._entries[canonical]
+            else:
+                self.stats["hits"] += 1
+                self._entries.move_to_end(canonical)
+                return entry.result, now - entry.created_at
+
+        inflight = self._inflight.get(canonical)
+        if inflight is not None:
+            # Mesma query já rodando: usa o resultado dela
+            result = await asyncio.shield(inflight)
+            if result is not None:
+                self.stats["coalesced"] += 1
+                return result, None
+
+        self.stats["misses"] += 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[canonical] = future
+        result = None
+        try:
+            result = await run()
+        finally:
+            # None faz quem estava esperando executar a própria query
+            future.set_result(result)
+            self._inflight.pop(canonical, None)
+
+        if result is not None:
+            self._store(canonical, result, depends)
+        return result, None
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        # Coalescidas também não foram ao banco
+        served = self.stats["hits"] + self.stats["coalesced"]
+        lookups = served + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "hit_rate": round(served / lookups, 3) if lookups else 0.0,
+            "enabled": self.ENABLED and self._versions is not None,
+            "versions": dict(self._versions or {}),
+        }
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+
+    def _store(self, canonical: str, result: Dict, versions: Dict[str, int]):
+        # Versões lidas antes da execução: escrita durante a query invalida a entrada
+        if len(json.dumps(result, default=str)) > self.MAX_RESULT_BYTES:
+            self.stats["too_large"] += 1
+            return
+        self._entries[canonical] = _Entry(result, versions, time.monotonic())
+        self._entries.move_to_end(canonical)
+        while len(self._entries) > self.MAX_ENTRIES:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def _current_versions(self) -> Optional[Dict[str, int]]:
+        if time.monotonic() - self._versions_checked_at < self.VERSION_CHECK_SECONDS:
+            return self._versions
+
+        if self._versions_lock is None:
+            self._versions_lock = asyncio.Lock()
+        async with self._versions_lock:
+            # Outra task pode ter relido enquanto esta esperava
+            if time.monotonic() - self._versions_checked_at < self.VERSION_CHECK_SECONDS:
+                return self._versions
+            loop = asyncio.get_running_loop()
+            try:
+                versions = await loop.run_in_executor(None, self._load_versions)
+                self._versions_error_logged = False
+            except Exception as e:
+                if not self._versions_error_logged:
+                    logger.warning(f"SQL cache disabled, could not read data_versions: {e}")
+                    self._versions_error_logged = True
+                versions = None
+            if versions is None and self._entries:
+                # Sem versões não há como saber o que mudou
+                self._entries.clear()
+            self._versions = versions
+            self._versions_checked_at = time.monotonic()
+            return versions
+
+    def _load_versions(self) -> Dict[str, int]:
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT table_name, SUM(version) FROM data_versions GROUP BY table_name")
+            rows = cursor.fetchall()
+            cursor.close()
+            return {table.lower(): int(version) for table, version in rows}
+        finally:
+            conn.close()
+
+
+_query_cache: Optional[QueryCache] = None
+
+
+def get_query_cache(get_db_connection_func: Callable) -> QueryCache:
+    """Retorna o cache singleton do processo"""
+    global _query_cache
+    if _query_cache is None:
+        _query_cache = QueryCache(get_db_connection_func)
+    return _query_cache
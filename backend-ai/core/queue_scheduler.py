@@ -0,0 +1,317 @@
+"""
+Queue Scheduler - Agendamento por prioridade da image_processing_queue
+
+Substitui o FIFO puro (ORDER BY queued_at) por uma prioridade calculada:
+- urgência informada pelo usuário
+- localização dentro de um hotspot ativo
+- histórico do usuário (proporção de relatórios que eram lixo de fato)
+- envelhecimento (aging): a prioridade cresce com o tempo de espera,
+  então nenhum item fica parado para sempre
+
+Justiça por usuário: cada item adicional do mesmo usuário no lote (ou já em
+processamento) recebe uma penalidade, então um único usuário com muitos
+envios não monopoliza os workers.
+
+Candidatos: a urgência é o maior termo fixo da prioridade, então cada nível
+de urgência contribui com os seus itens mais antigos (maior aging) e mais
+recentes, lidos pelo índice (status, urgency, queued_at). Um item crítico no
+meio de um backlog grande de itens normais sempre entra na disputa.
+
+Itens presos em 'processing' (worker que caiu, erro não tratado) voltam para
+a fila em reap_stale, chamado periodicamente pelo app.
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from core.geo import haversine_km
+
+logger = logging.getLogger(__name__)
+
+# Pontos por nível de urgência (coluna image_processing_queue.urgency)
+URGENCY_POINTS = {
+    "low": 0.0,
+    "normal": 10.0,
+    "high": 25.0,
+    "critical": 40.0,
+}
+
+
+class QueueScheduler:
+    """Seleciona e reserva itens da fila de análise por prioridade"""
+
+    # Itens pendentes avaliados por chamada, divididos entre os níveis de urgência
+    # (em cada nível, metade mais antigos e metade mais novos)
+    CANDIDATE_WINDOW = int(os.getenv("QUEUE_CANDIDATE_WINDOW", "200"))
+
+    # Tempo em 'processing' após o qual o item é considerado abandonado
+    PROCESSING_TIMEOUT_MINUTES = float(os.getenv("QUEUE_PROCESSING_TIMEOUT_MINUTES", "30"))
+
+    # Aging: pontos ganhos por hora de espera (proteção contra starvation)
+    AGING_POINTS_PER_HOUR = float(os.getenv("QUEUE_AGING_POINTS_PER_HOUR", "5"))
+
+    HOTSPOT_POINTS = 30.0
+
+    # Histórico do usuário: +/- até 15 pontos, a partir de 3 análises
+    REPORTER_HISTORY_POINTS = 15.0
+    REPORTER_HISTORY_MIN_REPORTS = 3
+
+    # Penalidade por item do mesmo usuário já escolhido/em processamento
+    USER_REPEAT_PENALTY = float(os.getenv("QUEUE_USER_REPEAT_PENALTY", "20"))
+
+    def __init__(self, get_db_connection_func):
+        """
+        Args:
+            get_db_connection_func: Função que retorna conexão do banco
+        """
+        self.get_db_connection = get_db_connection_func
+
+    def next_batch(self, limit: int = 10) -> List[Dict]:
+        """Escolhe os próximos itens da fila e os marca como 'processing'
+
+        Args:
+            limit: Número máximo de itens
+
+        Returns:
+            Lista de itens reservados (queue_id, report_id, image_url, user_id, priority)
+        """
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        try:
+            cursor = conn.cursor(dictionary=True)
+
+            candidates = self._fetch_candidates(cursor)
+            if not candidates:
+                cursor.close()
+                conn.close()
+                return []
+
+            hotspots = self._fetch_active_hotspots(cursor)
+            user_ids = sorted({c["user_id"] for c in candidates if c["user_id"] is not None})
+            history = self._fetch_reporter_history(cursor, user_ids)
+            in_flight = self._fetch_in_flight_by_user(cursor, user_ids)
+
+            now = datetime.now()
+            for item in candidates:
+                item["priority"] = self.compute_priority(item, now, hotspots, history)
+
+            selected = self._select_fair(candidates, limit, in_flight)
+
+            # Reservar itens (a condição status='pending' evita despacho duplicado)
+            claimed = []
+            for item in selected:
+                cursor.execute(
+                    """
+                    UPDATE image_processing_queue
+                    SET status = 'processing', processed_at = %s
+                    WHERE queue_id = %s AND status = 'pending'
+                    """,
+                    (now, item["queue_id"])
+                )
+                if cursor.rowcount:
+                    claimed.append({
+                        "queue_id": item["queue_id"],
+                        "report_id": item["report_id"],
+                        "image_url": item["image_url"],
+                        "user_id": item["user_id"],
+                        "priority": round(item["priority"], 2),
+                    })
+
+            conn.commit()
+            cursor.close()
+            conn.close()
+
+            logger.info(f"Scheduled {len(claimed)} queue items out of {len(candidates)} candidates")
+            return claimed
+
+        except Exception as e:
+            logger.error(f"Error scheduling queue items: {e}")
+            if conn:
+                conn.rollback()
+                conn.close()
+            raise
+
+    def compute_priority(
+        self,
+        item: Dict,
+        now: datetime,
+        hotspots: List[Dict],
+        history: Dict[int, Dict]
+    ) -> float:
+        """Calcula a prioridade de um item (maior = analisado antes)"""
+        priority = URGENCY_POINTS.get((item.get("urgency") or "normal").lower(), URGENCY_POINTS["normal"])
+
+        # Aging
+        if item.get("queued_at"):
+            waited_hours = max(0.0, (now - item["queued_at"]).total_seconds() / 3600)
+            priority += waited_hours * self.AGING_POINTS_PER_HOUR
+
+        # Dentro de um hotspot ativo
+        if item.get("latitude") is not None and item.get("longitude") is not None:
+            for hotspot in hotspots:
+                distance_km = haversine_km(
+                    item["latitude"], item["longitude"],
+                    hotspot["center_latitude"], hotspot["center_longitude"]
+                )
+                if distance_km * 1000 <= (hotspot["radius_meters"] or 500):
+                    priority += self.HOTSPOT_POINTS
+                    break
+
+        # Histórico do usuário: taxa de acerto acima/abaixo de 50%
+        stats = history.get(item.get("user_id"))
+        if stats and stats["analyzed"] >= self.REPORTER_HISTORY_MIN_REPORTS:
+            useful_rate = float(stats["useful"] or 0) / stats["analyzed"]
+            priority += (useful_rate - 0.5) * 2 * self.REPORTER_HISTORY_POINTS
+
+        return priority
+
+    def _select_fair(self, candidates: List[Dict], limit: int, in_flight: Dict[int, int]) -> List[Dict]:
+        """Seleção gulosa por prioridade com penalidade por usuário repetido"""
+        remaining = list(candidates)
+        picked_per_user = dict(in_flight)
+        selected = []
+
+        while remaining and len(selected) < limit:
+            best = max(
+                remaining,
+                key=lambda c: c["priority"] - self.USER_REPEAT_PENALTY * picked_per_user.get(c["user_id"], 0)
+            )
+            remaining.remove(best)
+            selected.append(best)
+            picked_per_user[best["user_id"]] = picked_per_user.get(best["user_id"], 0) + 1
+
+        return selected
+
+    def reap_stale(self, max_retries: int) -> int:
+        """Devolve à fila itens em 'processing' há mais de PROCESSING_TIMEOUT_MINUTES
+
+        Conta como uma tentativa (item vira 'failed' ao atingir max_retries) e
+        volta o relatório de 'analyzing' para 'submitted'.
+
+        Args:
+            max_retries: Tentativas antes de marcar o item como 'failed'
+
+        Returns:
+            Número de itens devolvidos ou encerrados
+        """
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        try:
+            cursor = conn.cursor()
+            cutoff = datetime.now() - timedelta(minutes=self.PROCESSING_TIMEOUT_MINUTES)
+
+            cursor.execute(
+                """
+                UPDATE reports r
+                JOIN image_processing_queue q ON q.report_id = r.report_id
+                SET r.status = 'submitted'
+                WHERE q.status = 'processing' AND q.processed_at < %s
+                  AND r.status = 'analyzing'
+                """,
+                (cutoff,)
+            )
+            cursor.execute(
+                """
+                UPDATE image_processing_queue
+                SET retry_count = retry_count + 1,
+                    status = IF(retry_count >= %s, 'failed', 'pending'),
+                    error_message = 'Processing timed out'
+                WHERE status = 'processing' AND processed_at < %s
+                """,
+                (max_retries, cutoff)
+            )
+            reaped = cursor.rowcount
+            conn.commit()
+            cursor.close()
+            conn.close()
+
+            if reaped:
+                logger.warning(f"Requeued {reaped} queue items stuck in processing since before {cutoff}")
+            return reaped
+
+        except Exception as e:
+            logger.error(f"Error reaping stale queue items: {e}")
+            if conn:
+                conn.rollback()
+                conn.close()
+            raise
+
+    def _fetch_candidates(self, cursor) -> List[Dict]:
+        """Itens pendentes: os mais antigos e os mais recentes de cada nível de urgência"""
+        half_window = max(1, self.CANDIDATE_WINDOW // (2 * len(URGENCY_POINTS)))
+        select = """
+            SELECT q.queue_id, q.report_id, q.image_url, q.queued_at, q.urgency,
+                   r.user_id, r.latitude, r.longitude
+            FROM image_processing_queue q
+            JOIN reports r ON q.report_id = r.report_id
+            WHERE q.status = 'pending' AND q.urgency = %s
+        """
+        parts, params = [], []
+        for urgency in URGENCY_POINTS:
+            parts.append(f"({select} ORDER BY q.queued_at ASC LIMIT %s)")
+            parts.append(f"({select} ORDER BY q.queued_at DESC LIMIT %s)")
+            params.extend([urgency, half_window, urgency, half_window])
+
+        cursor.execute("\nUNION\n".join(parts), tuple(params))
+        return cursor.fetchall()
+
+    def _fetch_active_hotspots(self, cursor) -> List[Dict]:
+        cursor.execute(
+            """
+            SELECT center_latitude, center_longitude, radius_meters
+            FROM hotspots
+            WHERE status = 'active'
+            """
+        )
+        return cursor.fetchall()
+
+    def _fetch_reporter_history(self, cursor, user_ids: List[int]) -> Dict[int, Dict]:
+        if not user_ids:
+            return {}
+
+        placeholders = ", ".join(["%s"] * len(user_ids))
+        cursor.execute(
+            f"""
+            SELECT r.user_id,
+                   COUNT(*) as analyzed,
+                   SUM(CASE WHEN wt.name = 'Not Garbage' THEN 0 ELSE 1 END) as useful
+            FROM reports r
+            JOIN analysis_results ar ON r.report_id = ar.report_id
+            LEFT JOIN waste_types wt ON ar.waste_type_id = wt.waste_type_id
+            WHERE r.user_id IN ({placeholders})
+            GROUP BY r.user_id
+            """,
+            tuple(user_ids)
+        )
+        return {row["user_id"]: row for row in cursor.fetchall()}
+
+    def _fetch_in_flight_by_user(self, cursor, user_ids: List[int]) -> Dict[int, int]:
+        if not user_ids:
+            return {}
+
+        placeholders = ", ".join(["%s"] * len(user_ids))
+        cursor.execute(
+            f"""
+            SELECT r.user_id, COUNT(*) as in_flight
+            FROM image_processing_queue q
+            JOIN reports r ON q.report_id = r.report_id
+            WHERE q.status = 'processing'
+              AND q.processed_at >= NOW() - INTERVAL 1 HOUR
+              AND r.user_id IN ({placeholders})
+            GROUP BY r.user_id
+            """,
+            tuple(user_ids)
+        )
+        return {row["user_id"]: row["in_flight"] for row in cursor.fetchall()}
+
+
+def normalize_urgency(urgency: Optional[str]) -> str:
+    """Normaliza a urgência informada pelo usuário (default: normal)"""
+    urgency = (urgency or "normal").strip().lower()
+    return urgency if urgency in URGENCY_POINTS else "normal"
@@ -0,0 +1,723 @@
+"""
+Reanalysis - Campanhas de reanálise em massa de relatórios
+
+Quando o prompt ou o modelo de análise muda, os analysis_results antigos
+ficam inconsistentes com os novos. Uma campanha seleciona relatórios por
+filtro e os analisa de novo pelo mesmo caminho do pipeline (análise em lote
+do vision tool), gravando cada resultado como uma nova versão em
+analysis_result_versions. Com promote=True a nova versão também substitui a
+análise atual em analysis_results (a anterior fica salva na versão).
+
+- Retomável: o progresso é salvo por report_id (checkpoint) na mesma
+  transação das versões; uma campanha interrompida continua de onde parou
+- Falhas de análise não bloqueiam o checkpoint: ao fim da passada principal,
+  relatórios sem versão nesta campanha são tentados de novo (RETRY_PASSES)
+- Rate limit: token bucket em imagens por minuto
+- Não disputa capacidade com o tráfego ao vivo: espera enquanto houver
+  itens recentes na fila de análise ou o circuit breaker estiver aberto
+- Lease por heartbeat: só um processo executa cada campanha; se o processo
+  morrer, outro pode retomar depois de LEASE_SECONDS
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Filtros aceitos na seleção de relatórios
+CAMPAIGN_FILTERS = {
+    "waste_type",       # nome do tipo de lixo atual
+    "processed_by",     # modelo/versão que gerou a análise atual
+    "analyzed_from",    # data (YYYY-MM-DD) mínima da análise atual
+    "analyzed_to",      # data (YYYY-MM-DD) máxima da análise atual
+    "max_confidence",   # confiança máxima (0-100)
+    "location_id",
+    "user_id",
+    "report_ids",       # lista explícita de relatórios
+}
+
+
+class _TokenBucket:
+    """Rate limiter assíncrono (tokens = imagens)"""
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self, amount: float = 1.0):
+        amount = min(amount, self.capacity)
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class ReanalysisRunner:
+    """Cria, executa e acompanha campanhas de reanálise"""
+
+    # Relatórios analisados por iteração (um lote do vision tool)
+    PAGE_SIZE = int(os.getenv("REANALYSIS_BATCH_SIZE", "4"))
+
+    # Itens ao vivo (pending/processing, enfileirados nos últimos minutos)
+    # tolerados antes de a campanha ceder a vez
+    LIVE_BACKLOG_THRESHOLD = int(os.getenv("REANALYSIS_LIVE_BACKLOG_THRESHOLD", "0"))
+    LIVE_WINDOW_MINUTES = int(os.getenv("REANALYSIS_LIVE_WINDOW_MINUTES", "10"))
+    YIELD_SECONDS = float(os.getenv("REANALYSIS_YIELD_SECONDS", "15"))
+
+    LEASE_SECONDS = 300
+
+    # Passadas extras sobre os relatórios que falharam, depois da principal
+    RETRY_PASSES = int(os.getenv("REANALYSIS_RETRY_PASSES", "2"))
+
+    def __init__(self, get_db_connection_func, analyze_batch_func: Callable, breaker=None):
+        """
+        Args:
+            get_db_connection_func: Função que retorna conexão do banco
+            analyze_batch_func: Coroutine que recebe relatórios (report_id,
+                image_url, latitude, longitude, description) e retorna
+                {report_id: (analysis_result, image_data)}
+            breaker: CircuitBreaker do backend de visão (opcional)
+        """
+        self.get_db_connection = get_db_connection_func
+        self.analyze_batch = analyze_batch_func
+        self.breaker = breaker
+
+    # ------------------------------------------------------------------
+    # Gestão das campanhas
+    # ------------------------------------------------------------------
+
+    def create_campaign(
+        self,
+        name: str,
+        analysis_version: str,
+        filters: Optional[Dict[str, Any]] = None,
+        rate_per_minute: float = 30.0,
+        promote: bool = False,
+        created_by: Optional[int] = None
+    ) -> Dict:
+        """Cria uma campanha (status pending) e conta os relatórios selecionados
+
+        Args:
+            name: Nome da campanha
+            analysis_version: Identificador da nova versão de análise (prompt/modelo)
+            filters: Filtros de seleção (ver CAMPAIGN_FILTERS)
+            rate_per_minute: Imagens analisadas por minuto, no máximo
+            promote: Substituir a análise atual pelos novos resultados
+            created_by: user_id de quem criou
+
+        Returns:
+            Campanha criada
+
+        Raises:
+            ValueError: Filtros ou parâmetros inválidos
+        """
+        filters = filters or {}
+        where, params = self._build_filters(filters)
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        if not analysis_version or len(analysis_version) > 50:
+            raise ValueError("analysis_version must have 1-50 characters")
+
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                f"SELECT COUNT(DISTINCT r.report_id) as total {self._selection_sql(where)}",
+                params
+            )
+            total = cursor.fetchone()["total"]
+
+            cursor.execute(
+                """
+                INSERT INTO reanalysis_campaigns
+                (name, analysis_version, filters, promote, rate_per_minute, total_reports, created_by)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """,
+                (name, analysis_version, json.dumps(filters), promote, rate_per_minute, total, created_by)
+            )
+            campaign_id = cursor.lastrowid
+            conn.commit()
+            cursor.close()
+            conn.close()
+
+            logger.info(f"Created reanalysis campaign {campaign_id} ({analysis_version}): {total} reports")
+            return self.get_campaign(campaign_id)
+
+        except Exception as e:
+            logger.error(f"Error creating reanalysis campaign: {e}")
+            conn.rollback()
+            conn.close()
+            raise
+
+    def get_campaign(self, campaign_id: int) -> Optional[Dict]:
+        """Retorna a campanha com progresso e ETA"""
+        conn = self.get_db_connection()
+        if not conn:
+            return None
+
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM reanalysis_campaigns WHERE campaign_id = %s", (campaign_id,))
+            campaign = cursor.fetchone()
+            cursor.close()
+            conn.close()
+            return self._with_progress(campaign) if campaign else None
+
+        except Exception as e:
+            logger.error(f"Error loading reanalysis campaign {campaign_id}: {e}")
+            conn.close()
+            return None
+
+    def list_campaigns(self, limit: int = 20) -> List[Dict]:
+        """Campanhas mais recentes, com progresso"""
+        conn = self.get_db_connection()
+        if not conn:
+            return []
+
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                "SELECT * FROM reanalysis_campaigns ORDER BY campaign_id DESC LIMIT %s",
+                (limit,)
+            )
+            campaigns = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return [self._with_progress(c) for c in campaigns]
+
+        except Exception as e:
+            logger.error(f"Error listing reanalysis campaigns: {e}")
+            conn.close()
+            return []
+
+    def pause_campaign(self, campaign_id: int) -> bool:
+        """Pede a pausa; o runner para ao fim do lote atual"""
+        return self._set_status(campaign_id, "paused", ("pending", "running"))
+
+    def cancel_campaign(self, campaign_id: int) -> bool:
+        """Cancela definitivamente (não pode ser retomada)"""
+        return self._set_status(campaign_id, "cancelled", ("pending", "running", "paused", "failed"))
+
+    # ------------------------------------------------------------------
+    # Execução
+    # ------------------------------------------------------------------
+
+    async def run(self, campaign_id: int) -> Dict:
+        """Executa (ou retoma) uma campanha até terminar, pausar ou falhar
+
+        Args:
+            campaign_id: ID da campanha
+
+        Returns:
+            Estado final da campanha (ou erro se não pôde ser reservada)
+        """
+        loop = asyncio.get_event_loop()
+
+        if not await loop.run_in_executor(None, self._claim, campaign_id):
+            logger.warning(f"Reanalysis campaign {campaign_id} not claimed (finished or running elsewhere)")
+            return {"success": False, "message": "Campaign is finished or already running"}
+
+        campaign = await loop.run_in_executor(None, self.get_campaign, campaign_id)
+        where, params = self._build_filters(json.loads(campaign["filters"] or "{}"))
+        bucket = _TokenBucket(float(campaign["rate_per_minute"]) / 60.0, self.PAGE_SIZE)
+        last_report_id = campaign["last_report_id"]
+        # Passada de repetição: cursor próprio, sobre relatórios até o checkpoint
+        retrying = False
+        retry_cursor = 0
+        retry_passes = 0
+
+        logger.info(f"Running reanalysis campaign {campaign_id} from report {last_report_id}")
+
+        try:
+            while True:
+                iteration_started = time.monotonic()
+
+                status = await loop.run_in_executor(None, self._heartbeat, campaign_id)
+                if status != "running":
+                    logger.info(f"Reanalysis campaign {campaign_id} stopped: {status}")
+                    break
+
+                await self._wait_for_capacity(campaign_id)
+
+                if retrying:
+                    page = await loop.run_in_executor(
+                        None, self._next_failed_page, campaign_id, where, params, retry_cursor, last_report_id
+                    )
+                else:
+                    page = await loop.run_in_executor(
+                        None, self._next_page, where, params, last_report_id
+                    )
+                if not page:
+                    # Fim de uma passada: repete as falhas (se a última passada teve alguma)
+                    if retry_passes < self.RETRY_PASSES and not (retrying and retry_cursor == 0):
+                        retrying, retry_cursor = True, 0
+                        retry_passes += 1
+                        continue
+                    await loop.run_in_executor(None, self._finish, campaign_id, "completed", None)
+                    logger.info(f"Reanalysis campaign {campaign_id} completed")
+                    break
+                if retrying and retry_cursor == 0:
+                    logger.info(f"Campaign {campaign_id} retrying failed reports (pass {retry_passes})")
+
+                await bucket.acquire(len(page))
+                outcomes = await self.analyze_batch(page)
+
+                handled = []
+                for report in page:
+                    analysis, _ = outcomes.get(report["report_id"]) or (None, None)
+                    # Falha por indisponibilidade do backend: não avança o checkpoint,
+                    # o relatório é tentado de novo quando o backend voltar
+                    if analysis is None and self.breaker is not None and self.breaker.is_open():
+                        break
+                    handled.append((report["report_id"], analysis))
+
+                if handled:
+                    if retrying:
+                        retry_cursor = handled[-1][0]
+                    else:
+                        last_report_id = handled[-1][0]
+                    await loop.run_in_executor(
+                        None, self._save_page, campaign, handled,
+                        time.monotonic() - iteration_started, retrying
+                    )
+
+        except asyncio.CancelledError:
+            # Interrompido (Ctrl+C / shutdown): fica pausada para ser retomada
+            await loop.run_in_executor(None, self._finish, campaign_id, "paused", None)
+            raise
+        except Exception as e:
+            logger.error(f"Reanalysis campaign {campaign_id} failed: {e}")
+            await loop.run_in_executor(None, self._finish, campaign_id, "failed", str(e))
+
+        return await loop.run_in_executor(None, self.get_campaign, campaign_id)
+
+    async def _wait_for_capacity(self, campaign_id: int):
+        """Cede a vez ao tráfego ao vivo e espera o backend de visão se recuperar"""
+        loop = asyncio.get_event_loop()
+
+        while True:
+            if self.breaker is not None and self.breaker.is_open():
+                wait = max(1.0, self.breaker.retry_after())
+                logger.info(f"Campaign {campaign_id} waiting {wait:.0f}s: vision backend circuit open")
+            else:
+                live = await loop.run_in_executor(None, self._live_backlog)
+                if live <= self.LIVE_BACKLOG_THRESHOLD:
+                    return
+                wait = self.YIELD_SECONDS
+                logger.info(f"Campaign {campaign_id} yielding {wait:.0f}s to {live} live queue items")
+
+            await asyncio.sleep(wait)
+            # Mantém o lease enquanto espera
+            await loop.run_in_executor(None, self._heartbeat, campaign_id)
+
+    # ------------------------------------------------------------------
+    # Banco
+    # ------------------------------------------------------------------
+
+    def _build_filters(self, filters: Dict[str, Any]) -> Tuple[List[str], List]:
+        """Valida os filtros e gera as condições SQL"""
+        unknown = set(filters) - CAMPAIGN_FILTERS
+        if unknown:
+            raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+        where = ["r.image_url IS NOT NULL"]
+        params = []
+
+        if filters.get("waste_type"):
+            where.append("ar.waste_type_id = (SELECT waste_type_id FROM waste_types WHERE name = %s)")
+            params.append(filters["waste_type"])
+        if filters.get("processed_by"):
+            where.append("ar.processed_by = %s")
+            params.append(filters["processed_by"])
+        if filters.get("analyzed_from"):
+            where.append("ar.analyzed_date >= %s")
+            params.append(self._parse_date(filters["analyzed_from"]))
+        if filters.get("analyzed_to"):
+            where.append("ar.analyzed_date < %s + INTERVAL 1 DAY")
+            params.append(self._parse_date(filters["analyzed_to"]))
+        if filters.get("max_confidence") is not None:
+            where.append("ar.confidence_score <= %s")
+            params.append(float(filters["max_confidence"]))
+        if filters.get("location_id") is not None:
+            where.append("r.location_id = %s")
+            params.append(int(filters["location_id"]))
+        if filters.get("user_id") is not None:
+            where.append("r.user_id = %s")
+            params.append(int(filters["user_id"]))
+        if filters.get("report_ids"):
+            report_ids = [int(report_id) for report_id in filters["report_ids"]]
+            where.append(f"r.report_id IN ({', '.join(['%s'] * len(report_ids))})")
+            params.extend(report_ids)
+
+        return where, params
+
+    @staticmethod
+    def _parse_date(value: str) -> date:
+        try:
+            return datetime.strptime(str(value), "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError(f"Invalid date (expected YYYY-MM-DD): {value}")
+
+    @staticmethod
+    def _selection_sql(where: List[str]) -> str:
+        return f"""
+            FROM reports r
+            JOIN analysis_results ar ON r.report_id = ar.report_id
+            WHERE {' AND '.join(where)}
+        """
+
+    def _next_page(self, where: List[str], params: List, last_report_id: int) -> List[Dict]:
+        """Próximos relatórios depois do checkpoint (ordem de report_id)"""
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            f"""
+            SELECT DISTINCT r.report_id, r.image_url, r.latitude, r.longitude, r.description
+            {self._selection_sql(where + ['r.report_id > %s'])}
+            ORDER BY r.report_id
+            LIMIT %s
+            """,
+            tuple(params) + (last_report_id, self.PAGE_SIZE)
+        )
+        page = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return page
+
+    def _next_failed_page(self, campaign_id: int, where: List[str], params: List,
+                          after_report_id: int, last_report_id: int) -> List[Dict]:
+        """Relatórios já passados pelo checkpoint que ainda não têm versão nesta campanha"""
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            f"""
+            SELECT DISTINCT r.report_id, r.image_url, r.latitude, r.longitude, r.description
+            {self._selection_sql(where + [
+                'r.report_id > %s', 'r.report_id <= %s',
+                'NOT EXISTS (SELECT 1 FROM analysis_result_versions v'
+                ' WHERE v.campaign_id = %s AND v.report_id = r.report_id)'
+            ])}
+            ORDER BY r.report_id
+            LIMIT %s
+            """,
+            tuple(params) + (after_report_id, last_report_id, campaign_id, self.PAGE_SIZE)
+        )
+        page = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return page
+
+    def _save_page(self, campaign: Dict, handled: List[Tuple[int, Optional[Dict]]], elapsed: float,
+                   retry: bool = False):
+        """Grava as versões do lote e avança o checkpoint na mesma transação
+
+        Numa passada de repetição o checkpoint não muda: sucessos saem de
+        failed_reports e entram em succeeded_reports.
+        """
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        try:
+            cursor = conn.cursor(dictionary=True)
+            succeeded = 0
+
+            for report_id, analysis in handled:
+                if analysis is None:
+                    continue
+                self._save_version(cursor, campaign, report_id, analysis)
+                succeeded += 1
+
+            if retry:
+                cursor.execute(
+                    """
+                    UPDATE reanalysis_campaigns
+                    SET succeeded_reports = succeeded_reports + %s,
+                        failed_reports = GREATEST(failed_reports - %s, 0),
+                        active_seconds = active_seconds + %s,
+                        heartbeat_at = NOW()
+                    WHERE campaign_id = %s
+                    """,
+                    (succeeded, succeeded, round(elapsed, 1), campaign["campaign_id"])
+                )
+                conn.commit()
+                cursor.close()
+                conn.close()
+                return
+
+            cursor.execute(
+                """
+                UPDATE reanalysis_campaigns
+                SET processed_reports = processed_reports + %s,
+                    succeeded_reports = succeeded_reports + %s,
+                    failed_reports = failed_reports + %s,
+                    last_report_id = %s,
+                    active_seconds = active_seconds + %s,
+                    heartbeat_at = NOW()
+                WHERE campaign_id = %s
+                """,
+                (
+                    len(handled), succeeded, len(handled) - succeeded,
+                    handled[-1][0], round(elapsed, 1), campaign["campaign_id"]
+                )
+            )
+            conn.commit()
+            cursor.close()
+            conn.close()
+
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+
+    def _save_version(self, cursor, campaign: Dict, report_id: int, analysis: Dict):
+        """Grava uma versão de análise (e promove para analysis_results se pedido)"""
+        not_garbage = analysis["waste_type"] == "Not Garbage"
+        waste_type_id = self._get_waste_type_id(cursor, analysis["waste_type"])
+
+        # Mesmos valores que process_report grava para cada caso
+        values = (
+            waste_type_id,
+            analysis.get("waste_detection_confidence", 90.0),
+            0.0 if not_garbage else self._extract_volume(analysis.get("estimated_volume")),
+            1 if not_garbage else analysis["severity_score"],
+            "low" if not_garbage else analysis["priority_level"],
+            "This image does not contain waste material." if not_garbage else analysis.get("analysis_notes", ""),
+            analysis.get("full_description", "No detailed description available."),
+            campaign["analysis_version"][:50],
+        )
+
+        previous = None
+        if campaign["promote"]:
+            cursor.execute(
+                """
+                SELECT analysis_id, analyzed_date, waste_type_id, confidence_score,
+                       estimated_volume, severity_score, priority_level,
+                       analysis_notes, full_description, processed_by
+                FROM analysis_results
+                WHERE report_id = %s
+                ORDER BY analyzed_date DESC
+                LIMIT 1
+                """,
+                (report_id,)
+            )
+            previous = cursor.fetchone()
+
+            if previous:
+                cursor.execute(
+                    """
+                    UPDATE analysis_results
+                    SET waste_type_id = %s, confidence_score = %s, estimated_volume = %s,
+                        severity_score = %s, priority_level = %s, analysis_notes = %s,
+                        full_description = %s, processed_by = %s, analyzed_date = %s
+                    WHERE analysis_id = %s
+                    """,
+                    values + (datetime.now(), previous["analysis_id"])
+                )
+
+        cursor.execute(
+            """
+            INSERT INTO analysis_result_versions (
+                campaign_id, report_id, analysis_version, waste_type_id,
+                confidence_score, estimated_volume, severity_score, priority_level,
+                analysis_notes, full_description, processed_by,
+                previous_analysis, promoted
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                waste_type_id = VALUES(waste_type_id),
+                confidence_score = VALUES(confidence_score),
+                estimated_volume = VALUES(estimated_volume),
+                severity_score = VALUES(severity_score),
+                priority_level = VALUES(priority_level),
+                analysis_notes = VALUES(analysis_notes),
+                full_description = VALUES(full_description),
+                processed_by = VALUES(processed_by),
+                previous_analysis = COALESCE(previous_analysis, VALUES(previous_analysis)),
+                promoted = VALUES(promoted),
+                created_at = NOW()
+            """,
+            (campaign["campaign_id"], report_id, campaign["analysis_version"]) + values + (
+                json.dumps(previous, default=str) if previous else None,
+                bool(previous)
+            )
+        )
+
+    @staticmethod
+    def _get_waste_type_id(cursor, name: str) -> int:
+        cursor.execute("SELECT waste_type_id FROM waste_types WHERE name = %s", (name,))
+        row = cursor.fetchone()
+        if row:
+            return row["waste_type_id"]
+
+        cursor.execute(
+            """
+            INSERT INTO waste_types (name, description, hazard_level, recyclable)
+            VALUES (%s, %s, %s, %s)
+            """,
+            (name, f"Auto-generated waste type for {name}", "medium", False)
+        )
+        return cursor.lastrowid
+
+    @staticmethod
+    def _extract_volume(volume) -> float:
+        """Mesmo critério de extract_volume_number (primeiro número da string)"""
+        import re
+
+        numbers = re.findall(r"\d+\.?\d*", str(volume or ""))
+        return float(numbers[0]) if numbers else 0.0
+
+    def _claim(self, campaign_id: int) -> bool:
+        """Reserva a campanha para este processo (pending/paused ou lease expirado)"""
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE reanalysis_campaigns
+            SET status = 'running', heartbeat_at = NOW(), error_message = NULL,
+                started_at = COALESCE(started_at, NOW())
+            WHERE campaign_id = %s
+              AND (status IN ('pending', 'paused', 'failed')
+                   OR (status = 'running'
+                       AND (heartbeat_at IS NULL OR heartbeat_at < NOW() - INTERVAL %s SECOND)))
+            """,
+            (campaign_id, self.LEASE_SECONDS)
+        )
+        claimed = cursor.rowcount == 1
+        conn.commit()
+        cursor.close()
+        conn.close()
+        return claimed
+
+    def _heartbeat(self, campaign_id: int) -> Optional[str]:
+        """Renova o lease e retorna o status atual (pausa/cancelamento pelo admin)"""
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE reanalysis_campaigns SET heartbeat_at = NOW() WHERE campaign_id = %s AND status = 'running'",
+            (campaign_id,)
+        )
+        cursor.execute("SELECT status FROM reanalysis_campaigns WHERE campaign_id = %s", (campaign_id,))
+        row = cursor.fetchone()
+        conn.commit()
+        cursor.close()
+        conn.close()
+        return row[0] if row else None
+
+    def _live_backlog(self) -> int:
+        """Itens recentes da fila ao vivo aguardando ou em análise"""
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT COUNT(*)
+            FROM image_processing_queue
+            WHERE status IN ('pending', 'processing')
+              AND queued_at >= NOW() - INTERVAL %s MINUTE
+            """,
+            (self.LIVE_WINDOW_MINUTES,)
+        )
+        count = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+        return count
+
+    def _finish(self, campaign_id: int, status: str, error_message: Optional[str]):
+        conn = self.get_db_connection()
+        if not conn:
+            logger.error(f"Could not mark campaign {campaign_id} as {status}: no database connection")
+            return
+
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE reanalysis_campaigns
+            SET status = %s, error_message = %s, heartbeat_at = NULL,
+                completed_at = IF(%s = 'completed', NOW(), completed_at)
+            WHERE campaign_id = %s AND status = 'running'
+            """,
+            (status, error_message, status, campaign_id)
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    def _set_status(self, campaign_id: int, status: str, allowed_from: Tuple[str, ...]) -> bool:
+        conn = self.get_db_connection()
+        if not conn:
+            return False
+
+        try:
+            cursor = conn.cursor()
+            placeholders = ", ".join(["%s"] * len(allowed_from))
+            cursor.execute(
+                f"""
+                UPDATE reanalysis_campaigns
+                SET status = %s
+                WHERE campaign_id = %s AND status IN ({placeholders})
+                """,
+                (status, campaign_id) + allowed_from
+            )
+            changed = cursor.rowcount == 1
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return changed
+
+        except Exception as e:
+            logger.error(f"Error setting campaign {campaign_id} to {status}: {e}")
+            conn.close()
+            return False
+
+    @staticmethod
+    def _with_progress(campaign: Dict) -> Dict:
+        """Adiciona progresso, taxa observada e ETA"""
+        total = campaign["total_reports"] or 0
+        processed = campaign["processed_reports"] or 0
+        active_seconds = float(campaign["active_seconds"] or 0)
+        rate = processed / active_seconds if active_seconds > 0 else None
+        remaining = max(0, total - processed)
+
+        result = dict(campaign)
+        result["filters"] = json.loads(campaign["filters"]) if campaign.get("filters") else {}
+        result["rate_per_minute"] = float(campaign["rate_per_minute"])
+        result["active_seconds"] = active_seconds
+        result["promote"] = bool(campaign["promote"])
+        result["progress_percent"] = round(100.0 * processed / total, 1) if total else 100.0
+        result["observed_per_minute"] = round(rate * 60, 2) if rate else None
+        result["eta_seconds"] = (
+            0 if campaign["status"] == "completed"
+            else round(remaining / rate) if rate else None
+        )
+        for key in ("created_at", "started_at", "completed_at", "heartbeat_at"):
+            if isinstance(result.get(key), datetime):
+                result[key] = result[key].isoformat()
+        return result
@@ -1,12 +1,15 @@
 """
 Session Manager para persistência de chat no MySQL
 
-Gerencia sessões de chat e mensagens no banco de dados.
+Gerencia sessões de chat e mensagens no banco de dados. Com um MessageSink
+(core/message_sink.py), criar sessão e salvar mensagem só enfileiram; a
+gravação acontece em lote fora do loop do WebSocket.
 """
 
 import uuid
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,23 +18,42 @@ logger = logging.getLogger(__name__)
 class SessionManager:
     """Gerencia sessões de chat com persistência MySQL"""
 
-    def __init__(self, get_db_connection_func):
+    # Donos de sessão em cache (o dono nunca muda; só sessões existentes entram)
+    OWNER_CACHE_SIZE = 10000
+
+    def __init__(self, get_db_connection_func, sink=None, get_read_connection_func=None, note_write_func=None):
         """
         Args:
             get_db_connection_func: Função que retorna conexão do banco
+            sink: MessageSink para gravação write-behind (opcional)
+            get_read_connection_func: Conexão de leitura (réplica) por user_id, para a
+                listagem de sessões (opcional; padrão: get_db_connection_func)
+            note_write_func: Registra escrita do usuário (read-your-writes na réplica)
         """
         self.get_db_connection = get_db_connection_func
+        self.sink = sink
+        self.get_read_connection = get_read_connection_func or (lambda user_id=None: get_db_connection_func())
+        self.note_write = note_write_func or (lambda user_id: None)
+        self._owners: "OrderedDict[str, int]" = OrderedDict()
 
-    async def create_session(self, user_id: int) -> str:
+    async def create_session(self, user_id: int, title: Optional[str] = None) -> str:
         """Cria nova sessão no banco
 
         Args:
             user_id: ID do usuário
+            title: Título (ex: primeira mensagem); padrão "Nova Conversa"
 
         Returns:
             session_id: ID da sessão criada (UUID)
         """
         session_id = f"chat_{int(datetime.now().timestamp())}.{uuid.uuid4().hex[:8]}"
+        title = self._make_title(title) if title else "Nova Conversa"
+        self.note_write(user_id)
+        self._remember_owner(session_id, user_id)
+
+        if self.sink is not None:
+            self.sink.add_session(session_id, user_id, title)
+            return session_id
 
         conn = self.get_db_connection()
         if not conn:
@@ -50,7 +72,7 @@ class SessionManager:
             cursor.execute(query, (
                 session_id,
                 user_id,
-                "Nova Conversa",  # Título padrão
+                title,
                 now,
                 now
             ))
@@ -76,7 +98,8 @@ class SessionManager:
         role: str,
         content: str,
         image_url: Optional[str] = None,
-        map_url: Optional[str] = None
+        map_url: Optional[str] = None,
+        interrupted: bool = False
     ):
         """Salva mensagem no banco
 
@@ -87,7 +110,13 @@ class SessionManager:
             content: Conteúdo da mensagem
             image_url: URL da imagem (opcional)
             map_url: URL do mapa (opcional)
+            interrupted: Resposta parcial de uma geração cancelada
         """
+        self.note_write(user_id)
+        if self.sink is not None:
+            self.sink.add_message(session_id, user_id, role, content, image_url, map_url, interrupted)
+            return
+
         conn = self.get_db_connection()
         if not conn:
             raise Exception("Database connection failed")
@@ -98,8 +127,8 @@ class SessionManager:
             # Salvar mensagem
             query = """
                 INSERT INTO chat_messages
-                (session_id, user_id, role, content, image_url, map_url, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                (session_id, user_id, role, content, image_url, map_url, is_interrupted, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             """
 
             cursor.execute(query, (
@@ -109,6 +138,7 @@ class SessionManager:
                 content,
                 image_url,
                 map_url,
+                interrupted,
                 datetime.now()
             ))
 
@@ -132,7 +162,7 @@ class SessionManager:
                 result = cursor.fetchone()
 
                 if result and result[0] == 1:  # Primeira mensagem
-                    title = content[:100] if len(content) <= 100 else content[:97] + "..."
+                    title = self._make_title(content)
                     title_query = """
                         UPDATE chat_sessions
                         SET title = %s
@@ -153,20 +183,73 @@ class SessionManager:
                 conn.close()
             raise
 
+    async def is_session_owner(self, session_id: str, user_id: int) -> bool:
+        """Verifica se a sessão existe e pertence ao usuário
+
+        Usado antes de reaproveitar o cliente do agente, montar o contexto ou
+        ler/apagar o histórico de um conversation_id vindo do cliente.
+
+        Args:
+            session_id: ID da sessão
+            user_id: ID do usuário autenticado
+
+        Returns:
+            False para sessão inexistente ou de outro usuário
+        """
+        owner = self._owners.get(session_id)
+        if owner is None:
+            if self.sink is not None:
+                await self.sink.flush()  # Sessão ainda na fila
+
+            conn = self.get_db_connection()
+            if not conn:
+                raise Exception("Database connection failed")
+
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT user_id FROM chat_sessions WHERE session_id = %s", (session_id,))
+                row = cursor.fetchone()
+                cursor.close()
+                conn.close()
+            except Exception as e:
+                logger.error(f"Error checking session owner: {e}")
+                if conn:
+                    conn.close()
+                raise
+
+            if row is None:
+                return False
+            owner = row[0]
+            self._remember_owner(session_id, owner)
+        else:
+            self._owners.move_to_end(session_id)
+
+        return owner == user_id
+
     async def get_session_history(
         self,
         session_id: str,
-        limit: int = 50
+        limit: int = 50,
+        after_message_id: Optional[int] = None,
+        before_message_id: Optional[int] = None
     ) -> List[Dict]:
-        """Recupera histórico da sessão
+        """Recupera uma janela do histórico da sessão (ordem cronológica)
+
+        Sem after/before retorna as últimas `limit` mensagens. As consultas
+        usam o índice (session_id, message_id).
 
         Args:
             session_id: ID da sessão
             limit: Número máximo de mensagens
+            after_message_id: Só mensagens posteriores (sincronização incremental)
+            before_message_id: Só mensagens anteriores (carregar mais antigas)
 
         Returns:
             Lista de mensagens
         """
+        if self.sink is not None:
+            await self.sink.flush()  # Inclui mensagens ainda na fila
+
         conn = self.get_db_connection()
         if not conn:
             raise Exception("Database connection failed")
@@ -174,22 +257,36 @@ class SessionManager:
         try:
             cursor = conn.cursor(dictionary=True)
 
-            query = """
+            conditions = ["session_id = %s"]
+            params: List = [session_id]
+            if after_message_id is not None:
+                conditions.append("message_id > %s")
+                params.append(after_message_id)
+            if before_message_id is not None:
+                conditions.append("message_id < %s")
+                params.append(before_message_id)
+
+            # Com after: as próximas a partir do cursor; senão as mais recentes
+            order = "ASC" if after_message_id is not None else "DESC"
+            query = f"""
                 SELECT
                     message_id,
                     role,
                     content,
                     image_url,
                     map_url,
+                    is_interrupted,
                     created_at
                 FROM chat_messages
-                WHERE session_id = %s
-                ORDER BY created_at ASC
+                WHERE {' AND '.join(conditions)}
+                ORDER BY message_id {order}
                 LIMIT %s
             """
 
-            cursor.execute(query, (session_id, limit))
+            cursor.execute(query, (*params, limit))
             messages = cursor.fetchall()
+            if order == "DESC":
+                messages.reverse()
 
             cursor.close()
             conn.close()
@@ -202,6 +299,36 @@ class SessionManager:
                 conn.close()
             raise
 
+    async def get_history_version(self, session_id: str) -> Tuple[int, int]:
+        """Versão do histórico (para ETag): (nº de mensagens, último message_id)
+
+        Mensagens só são acrescentadas ou apagadas com a sessão, então o par
+        muda sempre que o histórico muda. Resolvida só pelo índice.
+        """
+        if self.sink is not None:
+            await self.sink.flush()
+
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*), COALESCE(MAX(message_id), 0) FROM chat_messages WHERE session_id = %s",
+                (session_id,)
+            )
+            count, last_message_id = cursor.fetchone()
+            cursor.close()
+            conn.close()
+            return int(count), int(last_message_id)
+
+        except Exception as e:
+            logger.error(f"Error getting history version: {e}")
+            if conn:
+                conn.close()
+            raise
+
     async def get_user_sessions(
         self,
         user_id: int,
@@ -218,7 +345,11 @@ class SessionManager:
         Returns:
             {sessions: [...], total: N}
         """
-        conn = self.get_db_connection()
+        if self.sink is not None:
+            await self.sink.flush()  # Inclui mensagens ainda na fila
+
+        # Réplica, a não ser que o usuário tenha escrito há pouco
+        conn = self.get_read_connection(user_id)
         if not conn:
             raise Exception("Database connection failed")
 
@@ -275,6 +406,9 @@ class SessionManager:
             session_id: ID da sessão
             user_id: ID do usuário (para segurança)
         """
+        if self.sink is not None:
+            await self.sink.flush()  # Inclui mensagens ainda na fila
+
         conn = self.get_db_connection()
         if not conn:
             raise Exception("Database connection failed")
@@ -289,6 +423,9 @@ class SessionManager:
             """
             cursor.execute(delete_messages, (session_id,))
 
+            # Resumo/cache de contexto da sessão (core/conversation_context.py)
+            cursor.execute("DELETE FROM chat_session_context WHERE session_id = %s", (session_id,))
+
             # Deletar sessão
             delete_session = """
                 DELETE FROM chat_sessions
@@ -300,6 +437,7 @@ class SessionManager:
             cursor.close()
             conn.close()
 
+            self._owners.pop(session_id, None)
             logger.info(f"Deleted session {session_id}")
 
         except Exception as e:
@@ -308,3 +446,13 @@ class SessionManager:
                 conn.rollback()
                 conn.close()
             raise
+
+    def _remember_owner(self, session_id: str, user_id: int):
+        self._owners[session_id] = user_id
+        self._owners.move_to_end(session_id)
+        while len(self._owners) > self.OWNER_CACHE_SIZE:
+            self._owners.popitem(last=False)
+
+    @staticmethod
+    def _make_title(content: str) -> str:
+        return content[:100] if len(content) <= 100 else content[:97] + "..."
@@ -0,0 +1,618 @@
+"""
+Text Index - Busca textual (BM25) em relatórios e análises
+
+Índice invertido em processo sobre os textos de cada relatório, no lugar de
+LIKE '%termo%' (que não usa índice e piora a cada relatório novo):
+
+- Campos: description, address_text (relatório) e analysis_notes,
+  full_description e nome do tipo de lixo (análise mais recente), cada um
+  com peso próprio (BM25F: frequência normalizada pelo tamanho do campo)
+- Tokens sem acento, em minúsculas e sem plural simples; o último termo da
+  consulta também casa por prefixo ("plást" encontra "plástico")
+- Filtros (tipo de lixo, status, severidade, data) em arrays NumPy
+- Sync incremental: relatórios novos (report_id) e análises novas
+  (analysis_id, que reindexam o relatório); reconstrução completa periódica
+  em background para status alterados e relatórios removidos
+- Os textos não ficam em memória: os resultados são completados no banco
+  pela chave primária e os trechos destacados são gerados na hora
+"""
+
+import os
+import re
+import html
+import math
+import time
+import bisect
+import logging
+import threading
+import unicodedata
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SYNC_INTERVAL_SECONDS = float(os.getenv("TEXT_INDEX_SYNC_SECONDS", "5"))
+REBUILD_INTERVAL_SECONDS = float(os.getenv("TEXT_INDEX_REBUILD_SECONDS", "600"))
+
+# Peso de cada campo no BM25F
+FIELD_WEIGHTS = {
+    "description": 1.0,
+    "address_text": 0.8,
+    "analysis_notes": 1.0,
+    "full_description": 0.6,
+    "waste_type": 1.5,
+}
+FIELDS = tuple(FIELD_WEIGHTS)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Expansões máximas do prefixo do último termo
+MAX_PREFIX_EXPANSIONS = 50
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a o as os de da do das dos e em no na nos nas um uma uns umas para por com sem que se ao aos "
+    "the an and or of in on at to for with from by is are was were be this that it its".split()
+)
+
+_NO_DATE = -1.0
+
+
+def normalize(text: str) -> str:
+    """Minúsculas e sem acentos (NFKD; caracteres fora do ASCII são descartados)"""
+    text = text.lower()
+    if text.isascii():
+        return text
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+
+def stem(token: str) -> str:
+    """Plural simples (pneus -> pneu, garrafas -> garrafa, bottles -> bottle)"""
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return [stem(t) for t in _TOKEN_RE.findall(normalize(text)) if t not in _STOPWORDS and len(t) > 1]
+
+
+class TextIndex:
+    """Índice invertido BM25F por relatório"""
+
+    _COLUMNS = (
+        ("report_id", np.int64),
+        ("waste_type", np.int32),
+        ("status", np.int16),
+        ("severity", np.int16),
+        ("report_time", np.float64),
+        ("live", np.bool_),
+    )
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._report_high_water_mark = 0
+        self._analysis_high_water_mark = 0
+        self._last_sync = 0.0
+        self._last_rebuild = 0.0
+        self._rebuilding = False
+        self._reset()
+
+    # ------------------------------------------------------------------
+    # Consulta
+    # ------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def search(self, query: str, limit: int = 10, offset: int = 0, fields: Optional[Sequence[str]] = None,
+               waste_type: Optional[str] = None, status: Optional[str] = None,
+               min_severity: Optional[int] = None, max_severity: Optional[int] = None,
+               date_from=None, date_to=None) -> Tuple[List[Tuple[int, float]], int, List[str]]:
+        """Relatórios ordenados por relevância
+
+        Args:
+            query: Texto da consulta
+            limit: Resultados por página
+            offset: Resultados a pular
+            fields: Restringir a estes campos (default: todos)
+            waste_type, status, min_severity, max_severity, date_from, date_to: Filtros
+
+        Returns:
+            ([(report_id, score)], total de resultados, termos do índice
+            usados na consulta, para os destaques)
+        """
+        terms = tokenize(query)
+        if not terms:
+            return [], 0, []
+        fields = [f for f in (fields or FIELDS) if f in FIELD_WEIGHTS]
+
+        with self._lock:
+            size = self._size
+            if not size:
+                return [], 0, terms
+
+            # Termos da consulta -> termos do índice (último também por prefixo)
+            expansions = [[term] for term in terms]
+            expansions[-1] = self._prefix_terms(terms[-1]) or [terms[-1]]
+
+            scores = np.zeros(size, dtype=np.float32)
+            live_count = max(1, len(self._positions))
+            for group in expansions:
+                group_tf = np.zeros(size, dtype=np.float32)
+                for term in group:
+                    term_tf = self._term_frequency(term, fields, size)
+                    if term_tf is not None:
+                        group_tf = np.maximum(group_tf, term_tf)
+
+                hits = group_tf > 0
+                df = int(np.count_nonzero(hits & self._columns["live"][:size]))
+                if not df:
+                    continue
+                idf = math.log(1 + (live_count - df + 0.5) / (df + 0.5))
+                scores += idf * group_tf * (BM25_K1 + 1) / (group_tf + BM25_K1)
+
+            columns = {name: values[:size] for name, values in self._columns.items()}
+            mask = columns["live"] & (scores > 0) & self._filter_mask(
+                columns, waste_type, status, min_severity, max_severity, date_from, date_to
+            )
+
+        positions = np.flatnonzero(mask)
+        total = len(positions)
+        wanted = offset + limit
+        if total > wanted:
+            top = np.argpartition(-scores[positions], wanted - 1)[:wanted]
+            positions = positions[top]
+        positions = positions[np.lexsort((positions, -scores[positions]))][offset:wanted]
+
+        hits = [(int(columns["report_id"][p]), float(scores[p])) for p in positions]
+        return hits, total, [term for group in expansions for term in group]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "reports": len(self._positions),
+                "terms": len(self._vocabulary),
+                "report_high_water_mark": self._report_high_water_mark,
+                "analysis_high_water_mark": self._analysis_high_water_mark,
+            }
+
+    # ------------------------------------------------------------------
+    # Atualização
+    # ------------------------------------------------------------------
+
+    def upsert(self, documents: List[Dict]):
+        """Indexa (ou reindexa) relatórios
+
+        Args:
+            documents: Dicts com report_id, os campos de texto (FIELDS),
+                status, severity_score e report_date
+        """
+        with self._lock:
+            for doc in documents:
+                old = self._positions.get(doc["report_id"])
+                if old is not None:
+                    # Postings antigas ficam órfãs até a próxima reconstrução
+                    self._columns["live"][old] = False
+                    self._subtract_lengths(old)
+
+                position = self._append_position()
+                self._positions[doc["report_id"]] = position
+
+                for field in FIELDS:
+                    tokens = tokenize(doc.get(field))
+                    self._field_lengths[field][position] = len(tokens)
+                    self._field_totals[field] += len(tokens)
+                    counts = {}
+                    for token in tokens:
+                        counts[token] = counts.get(token, 0) + 1
+                    postings = self._postings[field]
+                    for token, count in counts.items():
+                        entry = postings.get(token)
+                        if entry is None:
+                            entry = postings[token] = (array("q"), array("f"))
+                            self._add_vocabulary(token)
+                        entry[0].append(position)
+                        entry[1].append(count)
+
+                self._columns["report_id"][position] = doc["report_id"]
+                self._columns["waste_type"][position] = self._code(self._waste_types, doc.get("waste_type"))
+                self._columns["status"][position] = self._code(self._statuses, doc.get("status"))
+                self._columns["severity"][position] = doc.get("severity_score") or 0
+                self._columns["report_time"][position] = _timestamp(doc.get("report_date"))
+                self._columns["live"][position] = True
+
+    def remove(self, report_ids: Sequence[int]):
+        with self._lock:
+            for report_id in report_ids:
+                position = self._positions.pop(report_id, None)
+                if position is not None:
+                    self._columns["live"][position] = False
+                    self._subtract_lengths(position)
+
+    def sync(self, get_db_connection_func, batch_size: int = 2000, force: bool = False) -> int:
+        """Indexa relatórios e análises novos desde o último sync
+
+        Também dispara a reconstrução completa em background a cada
+        REBUILD_INTERVAL_SECONDS.
+
+        Returns:
+            Número de relatórios (re)indexados
+        """
+        now = time.monotonic()
+        if not force and now - self._last_sync < SYNC_INTERVAL_SECONDS:
+            return 0
+
+        if self._last_rebuild and now - self._last_rebuild >= REBUILD_INTERVAL_SECONDS:
+            self.rebuild_async(get_db_connection_func)
+
+        with self._sync_lock:
+            if not force and now - self._last_sync < SYNC_INTERVAL_SECONDS:
+                return 0
+            self._last_sync = now
+
+            conn = get_db_connection_func()
+            if not conn:
+                raise Exception("Database connection failed")
+
+            indexed = 0
+            try:
+                cursor = conn.cursor(dictionary=True)
+
+                # Relatórios novos
+                while True:
+                    documents = _fetch_documents(
+                        cursor, "r.report_id > %s ORDER BY r.report_id LIMIT %s",
+                        (self._report_high_water_mark, batch_size)
+                    )
+                    if not documents:
+                        break
+                    self.upsert(documents)
+                    indexed += len(documents)
+                    with self._lock:
+                        self._report_high_water_mark = documents[-1]["report_id"]
+                    if len(documents) < batch_size:
+                        break
+
+                # Análises novas de relatórios já indexados
+                while True:
+                    cursor.execute(
+                        """
+                        SELECT analysis_id, report_id
+                        FROM analysis_results
+                        WHERE analysis_id > %s
+                        ORDER BY analysis_id
+                        LIMIT %s
+                        """,
+                        (self._analysis_high_water_mark, batch_size)
+                    )
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    report_ids = sorted({row["report_id"] for row in rows})
+                    placeholders = ", ".join(["%s"] * len(report_ids))
+                    documents = _fetch_documents(cursor, f"r.report_id IN ({placeholders})", tuple(report_ids))
+                    self.upsert(documents)
+                    indexed += len(documents)
+                    with self._lock:
+                        self._analysis_high_water_mark = rows[-1]["analysis_id"]
+                    if len(rows) < batch_size:
+                        break
+
+                cursor.close()
+            finally:
+                conn.close()
+
+            if not self._last_rebuild:
+                # Primeiro sync carrega tudo: conta como reconstrução
+                self._last_rebuild = now
+                logger.info(f"Text index loaded: {self.stats()}")
+            return indexed
+
+    def rebuild(self, get_db_connection_func):
+        """Reconstrói do zero (compacta postings órfãs) e troca o estado de uma vez"""
+        fresh = TextIndex()
+        fresh.sync(get_db_connection_func, force=True)
+
+        with self._sync_lock, self._lock:
+            # Inserções durante a reconstrução são relidas no próximo sync
+            for name in ("_size", "_columns", "_positions", "_postings", "_vocabulary", "_field_lengths",
+                         "_field_totals", "_waste_types", "_statuses",
+                         "_report_high_water_mark", "_analysis_high_water_mark"):
+                setattr(self, name, getattr(fresh, name))
+            self._last_rebuild = time.monotonic()
+            self._last_sync = 0.0
+
+    def rebuild_async(self, get_db_connection_func):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+            # Evita disparar de novo enquanto esta reconstrução roda
+            self._last_rebuild = time.monotonic()
+
+        def run():
+            try:
+                self.rebuild(get_db_connection_func)
+            except Exception as e:
+                logger.error(f"Error rebuilding text index: {e}")
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, name="text-index-rebuild", daemon=True).start()
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+
+    def _reset(self):
+        self._size = 0
+        self._columns = {name: np.zeros(1024, dtype=dtype) for name, dtype in self._COLUMNS}
+        self._field_lengths = {field: np.zeros(1024, dtype=np.float32) for field in FIELDS}
+        self._field_totals = {field: 0 for field in FIELDS}
+        self._positions: Dict[int, int] = {}
+        self._postings: Dict[str, Dict[str, Tuple[array, array]]] = {field: {} for field in FIELDS}
+        self._vocabulary: List[str] = []
+        self._waste_types: Dict[str, int] = {}
+        self._statuses: Dict[str, int] = {}
+
+    def _append_position(self) -> int:
+        if self._size == len(self._columns["report_id"]):
+            for arrays in (self._columns, self._field_lengths):
+                for name, values in arrays.items():
+                    grown = np.zeros(len(values) * 2, dtype=values.dtype)
+                    grown[:self._size] = values[:self._size]
+                    arrays[name] = grown
+        self._size += 1
+        return self._size - 1
+
+    def _subtract_lengths(self, position: int):
+        for field in FIELDS:
+            self._field_totals[field] -= int(self._field_lengths[field][position])
+
+    def _add_vocabulary(self, token: str):
+        index = bisect.bisect_left(self._vocabulary, token)
+        if index == len(self._vocabulary) or self._vocabulary[index] != token:
+            self._vocabulary.insert(index, token)
+
+    def _prefix_terms(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        terms = []
+        for term in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def _term_frequency(self, term: str, fields: Sequence[str], size: int) -> Optional[np.ndarray]:
+        """Frequência BM25F do termo por posição (soma ponderada dos campos)"""
+        tf = None
+        live_docs = max(1, len(self._positions))
+        for field in fields:
+            entry = self._postings[field].get(term)
+            if entry is None:
+                continue
+            positions = np.frombuffer(entry[0], dtype=np.int64)
+            counts = np.frombuffer(entry[1], dtype=np.float32)
+            average = max(self._field_totals[field] / live_docs, 1e-6)
+            norm = 1 - BM25_B + BM25_B * self._field_lengths[field][positions] / average
+            if tf is None:
+                tf = np.zeros(size, dtype=np.float32)
+            np.add.at(tf, positions, FIELD_WEIGHTS[field] * counts / norm)
+        return tf
+
+    def _filter_mask(self, columns: Dict[str, np.ndarray], waste_type, status, min_severity,
+                     max_severity, date_from, date_to) -> np.ndarray:
+        mask = np.ones(len(columns["report_id"]), dtype=bool)
+        if waste_type:
+            code = self._waste_types.get(waste_type.strip().lower())
+            if code is None:
+                return np.zeros_like(mask)
+            mask &= columns["waste_type"] == code
+        if status:
+            code = self._statuses.get(status.strip().lower())
+            if code is None:
+                return np.zeros_like(mask)
+            mask &= columns["status"] == code
+        if min_severity is not None:
+            mask &= columns["severity"] >= min_severity
+        if max_severity is not None:
+            mask &= columns["severity"] <= max_severity
+        if date_from is not None:
+            mask &= columns["report_time"] >= _timestamp(date_from)
+        if date_to is not None:
+            # Data sem hora inclui o dia inteiro
+            end = _timestamp(date_to) + (86400 if len(str(date_to).strip()) == 10 else 0)
+            mask &= (columns["report_time"] != _NO_DATE) & (columns["report_time"] < end)
+        return mask
+
+    @staticmethod
+    def _code(codes: Dict[str, int], value: Optional[str]) -> int:
+        if not value:
+            return -1
+        return codes.setdefault(value.strip().lower(), len(codes))
+
+
+def _fetch_documents(cursor, condition: str, params: tuple) -> List[Dict]:
+    """Relatórios com a análise mais recente (campos de texto do índice)"""
+    cursor.execute(
+        f"""
+        SELECT r.report_id, r.description, r.address_text, r.status, r.report_date,
+               ar.analysis_notes, ar.full_description, ar.severity_score,
+               wt.name AS waste_type
+        FROM reports r
+        LEFT JOIN analysis_results ar ON ar.analysis_id = (
+            SELECT MAX(analysis_id) FROM analysis_results WHERE report_id = r.report_id
+        )
+        LEFT JOIN waste_types wt ON ar.waste_type_id = wt.waste_type_id
+        WHERE {condition}
+        """,
+        params
+    )
+    return cursor.fetchall()
+
+
+def _timestamp(value) -> float:
+    """datetime/date/ISO string -> epoch (segundos); ausente = _NO_DATE"""
+    if value is None:
+        return _NO_DATE
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip())
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime(value.year, value.month, value.day).timestamp()
+
+
+# ----------------------------------------------------------------------
+# Destaques
+# ----------------------------------------------------------------------
+
+def highlight(text: Optional[str], terms: Sequence[str], max_length: int = 200,
+              start_tag: str = "<mark>", end_tag: str = "</mark>") -> Optional[str]:
+    """Trecho do texto em volta do primeiro termo encontrado, com os termos marcados
+
+    O texto vem de relatos dos usuários: cada pedaço é escapado (html.escape)
+    antes de receber as tags, então o trecho pode ser exibido como HTML.
+
+    Args:
+        text: Texto original
+        terms: Termos normalizados do índice (tokenize)
+        max_length: Tamanho aproximado do trecho
+
+    Returns:
+        Trecho destacado, ou None se nenhum termo aparece no texto
+    """
+    if not text or not terms:
+        return None
+
+    wanted = set(terms)
+    matches = []
+    for match in re.finditer(r"\w+", text):
+        if stem(normalize(match.group())) in wanted:
+            matches.append((match.start(), match.end()))
+    if not matches:
+        return None
+
+    start = max(0, matches[0][0] - max_length // 3)
+    end = min(len(text), start + max_length)
+    if start > 0:
+        # Não cortar palavra no início
+        space = text.find(" ", start)
+        start = space + 1 if 0 <= space < matches[0][0] else start
+
+    pieces, cursor = [], start
+    for match_start, match_end in matches:
+        if match_start < start or match_end > end:
+            continue
+        pieces.append(html.escape(text[cursor:match_start]))
+        pieces.append(f"{start_tag}{html.escape(text[match_start:match_end])}{end_tag}")
+        cursor = match_end
+    pieces.append(html.escape(text[cursor:end]))
+
+    return ("…" if start > 0 else "") + "".join(pieces).strip() + ("…" if end < len(text) else "")
+
+
+def search_reports(get_db_connection_func, query: str, limit: int = 10, offset: int = 0,
+                   fields: Optional[Sequence[str]] = None, **filters) -> Dict:
+    """Busca textual completa: índice + dados do banco + destaques
+
+    Usada pelo endpoint /api/reports/search e pela tool MCP search_reports_text.
+
+    Args:
+        get_db_connection_func: Função que retorna conexão do banco
+        query: Texto da consulta
+        limit: Resultados por página
+        offset: Resultados a pular
+        fields: Restringir a estes campos
+        **filters: waste_type, status, min_severity, max_severity, date_from, date_to
+
+    Returns:
+        {"total": int, "results": [relatório + score + highlights]}
+    """
+    from core.database import get_worker_connection
+    from core.index_sync import get_index_syncer
+
+    # Índice sincronizado em background: a busca só lê a memória
+    get_index_syncer(get_worker_connection).wait_ready("text")
+    index = get_text_index()
+    hits, total, terms = index.search(query, limit=limit, offset=offset, fields=fields, **filters)
+    if not hits:
+        return {"total": total, "results": []}
+
+    conn = get_db_connection_func()
+    if not conn:
+        raise Exception("Database connection failed")
+
+    placeholders = ", ".join(["%s"] * len(hits))
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(
+        f"""
+        SELECT r.report_id, r.latitude, r.longitude, r.report_date, r.status,
+               r.description, r.address_text, ar.analysis_notes, ar.full_description,
+               ar.severity_score, ar.priority_level, wt.name AS waste_type
+        FROM reports r
+        LEFT JOIN analysis_results ar ON ar.analysis_id = (
+            SELECT MAX(analysis_id) FROM analysis_results WHERE report_id = r.report_id
+        )
+        LEFT JOIN waste_types wt ON ar.waste_type_id = wt.waste_type_id
+        WHERE r.report_id IN ({placeholders})
+        """,
+        tuple(report_id for report_id, _ in hits)
+    )
+    rows = {row["report_id"]: row for row in cursor.fetchall()}
+    cursor.close()
+    conn.close()
+
+    results = []
+    for report_id, score in hits:
+        row = rows.get(report_id)
+        if row is None:
+            continue
+        # O status pode ter mudado depois da indexação
+        if filters.get("status") and (row["status"] or "").lower() != filters["status"].strip().lower():
+            continue
+
+        highlights = {}
+        for field in fields or FIELDS:
+            snippet = highlight(row.get(field), terms)
+            if snippet:
+                highlights[field] = snippet
+
+        results.append({
+            "report_id": report_id,
+            "score": round(score, 4),
+            "latitude": float(row["latitude"]) if row["latitude"] is not None else None,
+            "longitude": float(row["longitude"]) if row["longitude"] is not None else None,
+            "report_date": row["report_date"].isoformat() if row["report_date"] else None,
+            "status": row["status"],
+            "description": row["description"],
+            "address_text": row["address_text"],
+            "waste_type": row["waste_type"],
+            "severity_score": row["severity_score"],
+            "priority_level": row["priority_level"],
+            "highlights": highlights,
+        })
+
+    return {"total": total, "results": results}
+
+
+_text_index = None
+_text_index_lock = threading.Lock()
+
+
+def get_text_index() -> TextIndex:
+    """Índice textual deste processo (carregado no primeiro sync)"""
+    global _text_index
+
+    if _text_index is None:
+        with _text_index_lock:
+            if _text_index is None:
+                _text_index = TextIndex()
+    return _text_index
@@ -0,0 +1,565 @@
+"""
+Vector Index - Índice ANN (IVF-flat) em processo para embeddings de imagem
+
+Evita o VEC_COSINE_DISTANCE com full scan em analysis_results a cada chamada
+do search_similar_waste_images (e a dependência de um banco com VECTOR).
+
+- Vetores L2-normalizados: similaridade de cosseno = produto escalar
+- Os vetores ficam no EmbeddingStore (core/embedding_store.py): int8
+  quantizado, memory-mapped, endereçado por analysis_id
+- IVF-flat: k-means esférico divide os vetores em nlist listas; a busca só
+  compara com as nprobe listas mais próximas da consulta. Abaixo de
+  TRAIN_MIN_VECTORS a busca é exata (força bruta)
+- Persistido no diretório do índice (store, centróides, atribuições);
+  reabrir o processo não exige reconstruir
+- Incremental: process_report adiciona cada análise nova; sync() busca no
+  banco as análises com analysis_id acima da marca d'água (outros processos,
+  backfill). O re-treino (quando o volume cresce 4x) roda em thread separada
+- Linhas antigas preenchidas depois (backfill) ficam abaixo da marca d'água:
+  request_rescan() pede ao processo escritor que volte a marca até elas
+
+Um único processo escreve no diretório (lock de arquivo). Os demais abrem o
+índice em modo leitura: busca exata sobre o mesmo store memory-mapped,
+compartilhando as páginas do arquivo sem copiar os vetores.
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.embeddings import EMBEDDING_DIM
+from core.embedding_store import EmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_DIR = os.getenv(
+    "VECTOR_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "vector_index")
+)
+
+# Intervalo mínimo entre sincronizações com o banco
+SYNC_INTERVAL_SECONDS = float(os.getenv("VECTOR_INDEX_SYNC_SECONDS", "5"))
+
+# Quantização dos vetores no store (int8 ou float16)
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "int8")
+
+# Pedido de reindexação (menor analysis_id) deixado por outro processo
+RESCAN_FILE = "rescan_from"
+
+
+class IVFFlatIndex:
+    """Índice IVF-flat sobre um EmbeddingStore (ids = analysis_id)"""
+
+    TRAIN_MIN_VECTORS = int(os.getenv("VECTOR_INDEX_TRAIN_MIN", "4096"))
+    TRAIN_SAMPLE_SIZE = 20000
+    KMEANS_ITERATIONS = 10
+    RETRAIN_GROWTH = 4
+
+    def __init__(self, path: str, dim: int = EMBEDDING_DIM, nprobe: Optional[int] = None,
+                 read_only: bool = False):
+        """
+        Args:
+            path: Diretório dos arquivos do índice (criado se não existir)
+            dim: Dimensão dos vetores
+            nprobe: Listas visitadas por busca (default: VECTOR_INDEX_NPROBE ou 16)
+            read_only: Só leitura (busca exata no store de outro processo)
+
+        Raises:
+            BlockingIOError: Outro processo já escreve neste índice
+        """
+        self.path = path
+        self.dim = dim
+        self.nprobe = nprobe or int(os.getenv("VECTOR_INDEX_NPROBE", "16"))
+        self.read_only = read_only
+
+        self._lock = threading.RLock()
+        self._training = False
+        self._last_sync = 0.0
+        self._centroids = None
+        self._lists = []
+
+        if read_only:
+            self.store = EmbeddingStore(self._file("embeddings.store"), read_only=True)
+            return
+
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(self._file("index.lock"), "a+")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        self.store = EmbeddingStore(self._file("embeddings.store"), dim=dim, dtype=VECTOR_STORE_DTYPE)
+        if self.store.dim != dim:
+            raise ValueError(f"Index at {path} has dim {self.store.dim}, expected {dim}")
+        self._load()
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    @property
+    def high_water_mark(self) -> int:
+        """Maior analysis_id já sincronizado do banco (ponto de partida do sync)"""
+        return self._meta["high_water_mark"] if not self.read_only else 0
+
+    def add(self, ids: Sequence[int], vectors) -> int:
+        """Adiciona (ou substitui) vetores
+
+        Args:
+            ids: analysis_id de cada vetor
+            vectors: Matriz (n, dim) ou lista de listas
+
+        Returns:
+            Número de vetores adicionados
+        """
+        if self.read_only:
+            return 0
+
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors must have the same length")
+        if not len(ids):
+            return 0
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+
+        with self._lock:
+            self.store.put(ids, vectors)
+            self._ensure_assign_capacity(self.store.capacity)
+
+            if self._centroids is not None:
+                assignments = np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+                changed = self._assign[ids] != assignments
+                self._assign[ids] = assignments
+                # Entradas antigas em outra lista são descartadas na busca
+                for analysis_id, cluster in zip(ids[changed], assignments[changed]):
+                    self._lists[cluster].append(int(analysis_id))
+
+            needs_training = self._needs_training()
+
+        if needs_training:
+            self.train_async()
+        return len(ids)
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """Remove vetores pelo analysis_id"""
+        if self.read_only:
+            return 0
+        with self._lock:
+            return self.store.delete(list(ids))
+
+    def search(self, query, k: int = 10, exclude_ids: Iterable[int] = ()) -> List[Tuple[int, float]]:
+        """Vizinhos mais próximos por similaridade de cosseno
+
+        Args:
+            query: Vetor de consulta (dim,)
+            k: Número de resultados
+            exclude_ids: analysis_id a ignorar (ex: a própria consulta)
+
+        Returns:
+            Lista de (analysis_id, similaridade) em ordem decrescente
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+        exclude = set(int(i) for i in exclude_ids)
+        wanted = k + len(exclude)
+
+        if self.read_only:
+            self.store.refresh()
+
+        with self._lock:
+            if self._centroids is None:
+                candidates = None
+            else:
+                probes = np.argsort(-(self._centroids @ query))[:self.nprobe]
+                candidates = np.concatenate(
+                    [np.frombuffer(self._lists[c], dtype=np.int64) for c in probes]
+                    + [np.empty(0, dtype=np.int64)]
+                )
+                # Só a entrada da lista atual de cada id (re-adições deixam cópias)
+                candidates = np.unique(candidates)
+                candidates = candidates[np.isin(self._assign[candidates], probes)]
+
+        if candidates is None:
+            ids, scores = self.store.search(query, wanted)
+        else:
+            ids, scores = self.store.dot(query, candidates)
+            if len(scores) > wanted:
+                top = np.argpartition(-scores, wanted - 1)[:wanted]
+                ids, scores = ids[top], scores[top]
+            order = np.argsort(-scores)
+            ids, scores = ids[order], scores[order]
+
+        results = []
+        for analysis_id, score in zip(ids, scores):
+            if int(analysis_id) in exclude:
+                continue
+            results.append((int(analysis_id), float(score)))
+            if len(results) == k:
+                break
+        return results
+
+    def sync(self, get_db_connection_func, batch_size: int = 1000, force: bool = False) -> int:
+        """Indexa as análises do banco acima da marca d'água
+
+        Args:
+            get_db_connection_func: Função que retorna conexão do banco
+            batch_size: Linhas por consulta
+            force: Ignorar o intervalo mínimo entre sincronizações
+
+        Returns:
+            Número de vetores adicionados
+
+        Raises:
+            Exception: Sem conexão ou falha no meio da carga (o que já foi
+                indexado fica, a marca d'água para no último lote)
+        """
+        if self.read_only:
+            return 0
+
+        now = time.monotonic()
+        if not force and now - self._last_sync < SYNC_INTERVAL_SECONDS:
+            return 0
+        self._last_sync = now
+        self._apply_rescan_request()
+
+        conn = get_db_connection_func()
+        if not conn:
+            raise Exception("Database connection failed")
+
+        added = 0
+        try:
+            cursor = conn.cursor()
+            while True:
+                cursor.execute(
+                    """
+                    SELECT analysis_id, image_embedding
+                    FROM analysis_results
+                    WHERE analysis_id > %s AND image_embedding IS NOT NULL
+                    ORDER BY analysis_id
+                    LIMIT %s
+                    """,
+                    (self.high_water_mark, batch_size)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                ids, vectors = [], []
+                for analysis_id, embedding in rows:
+                    vector = parse_embedding(embedding)
+                    if vector is not None and len(vector) == self.dim:
+                        ids.append(analysis_id)
+                        vectors.append(vector)
+
+                if ids:
+                    added += self.add(ids, vectors)
+                # Avança mesmo se o lote só tinha vetores inválidos
+                with self._lock:
+                    self._meta["high_water_mark"] = max(self.high_water_mark, rows[-1][0])
+                    self._save_meta()
+
+                if len(rows) < batch_size:
+                    break
+
+            cursor.close()
+
+        except Exception as e:
+            logger.error(f"Error syncing vector index after +{added} vectors: {e}")
+            raise
+        finally:
+            conn.close()
+
+        if added:
+            logger.info(f"Vector index synced: +{added} vectors ({len(self)} total)")
+        return added
+
+    def train(self, nlist: Optional[int] = None):
+        """(Re)treina os centróides e reconstrói as listas invertidas"""
+        if self.read_only:
+            return
+
+        present = self.store.present_ids()
+        if len(present) == 0:
+            return
+
+        nlist = nlist or int(np.clip(4 * np.sqrt(len(present)), 16, 4096))
+        nlist = min(nlist, len(present))
+
+        rng = np.random.default_rng(len(present))
+        sample_ids = np.sort(rng.choice(present, min(len(present), self.TRAIN_SAMPLE_SIZE), replace=False))
+        centroids = _spherical_kmeans(self.store.get(sample_ids), nlist, self.KMEANS_ITERATIONS, rng)
+
+        # Atribuição fora do lock; vetores adicionados durante o treino são
+        # atribuídos de novo abaixo
+        assignments = self._assign_ids(centroids, present)
+
+        with self._lock:
+            self._ensure_assign_capacity(self.store.capacity)
+            self._assign[:] = -1
+            self._assign[present] = assignments
+
+            latest = self.store.present_ids()
+            missing = latest[~np.isin(latest, present)]
+            if len(missing):
+                self._assign[missing] = self._assign_ids(centroids, missing)
+
+            self._centroids = centroids
+            np.save(self._file("centroids.npy"), centroids)
+            self._meta["trained_count"] = int(len(latest))
+            self._build_lists()
+            self._flush()
+
+        logger.info(f"Vector index trained: {nlist} lists over {len(present)} vectors")
+
+    def train_async(self):
+        """Treina em thread separada (no máximo um treino por vez)"""
+        with self._lock:
+            if self._training or self.read_only:
+                return
+            self._training = True
+
+        def run():
+            try:
+                self.train()
+            except Exception as e:
+                logger.error(f"Error training vector index: {e}")
+            finally:
+                self._training = False
+
+        threading.Thread(target=run, name="vector-index-train", daemon=True).start()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "vectors": len(self.store),
+                "capacity": self.store.capacity,
+                "store_dtype": self.store.dtype,
+                "lists": 0 if self._centroids is None else len(self._centroids),
+                "nprobe": self.nprobe,
+                "high_water_mark": self.high_water_mark,
+                "training": self._training,
+                "read_only": self.read_only,
+            }
+
+    def flush(self):
+        if self.read_only:
+            return
+        with self._lock:
+            self._flush()
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        meta_path = self._file("meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self._meta = json.load(f)
+        else:
+            self._meta = {"high_water_mark": 0, "trained_count": 0}
+
+        self._assign = None
+        self._ensure_assign_capacity(self.store.capacity)
+
+        centroids_path = self._file("centroids.npy")
+        if os.path.exists(centroids_path):
+            self._centroids = np.load(centroids_path)
+        self._build_lists()
+        self._save_meta()
+
+    def _ensure_assign_capacity(self, capacity: int):
+        """Atribuição de lista por analysis_id (int32 memory-mapped, -1 = nenhuma)"""
+        if self._assign is not None and len(self._assign) >= capacity:
+            return
+
+        path = self._file("assign.i32")
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        if self._assign is not None:
+            self._assign.flush()
+            self._assign = None
+
+        with open(path, "ab") as f:
+            if f.tell() < capacity * 4:
+                f.truncate(capacity * 4)
+        self._assign = np.memmap(path, dtype=np.int32, mode="r+", shape=(capacity,))
+        self._assign[old_size // 4:] = -1
+
+    def _build_lists(self):
+        if self._centroids is None:
+            self._lists = []
+            return
+
+        nlist = len(self._centroids)
+        present = self.store.present_ids()
+        assignments = np.asarray(self._assign[present])
+        valid = assignments >= 0
+        present, assignments = present[valid], assignments[valid]
+
+        order = np.argsort(assignments, kind="stable")
+        ids = present[order].astype(np.int64)
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+
+        self._lists = []
+        for c in range(nlist):
+            lst = array("q")
+            lst.frombytes(ids[bounds[c]:bounds[c + 1]].tobytes())
+            self._lists.append(lst)
+
+    def _needs_training(self) -> bool:
+        if self._training:
+            return False
+        live = len(self.store)
+        if self._centroids is None:
+            return live >= self.TRAIN_MIN_VECTORS
+        return live >= self.RETRAIN_GROWTH * max(1, self._meta["trained_count"])
+
+    def _assign_ids(self, centroids: np.ndarray, ids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+        assignments = np.empty(len(ids), dtype=np.int32)
+        for start in range(0, len(ids), chunk):
+            block = self.store.get(ids[start:start + chunk])
+            assignments[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+    def _apply_rescan_request(self):
+        """Recua a marca d'água se outro processo pediu (request_rescan)"""
+        marker = self._file(RESCAN_FILE)
+        claimed = marker + ".claimed"
+        try:
+            # Renomear antes de ler: um pedido novo cria outro arquivo
+            os.replace(marker, claimed)
+        except FileNotFoundError:
+            return
+
+        try:
+            with open(claimed) as f:
+                rescan_from = int(f.read().strip())
+            with self._lock:
+                if rescan_from <= self.high_water_mark:
+                    self._meta["high_water_mark"] = max(0, rescan_from - 1)
+                    self._save_meta()
+                    logger.info(f"Vector index rescanning from analysis_id {rescan_from}")
+        except ValueError as e:
+            logger.warning(f"Invalid vector index rescan request: {e}")
+        finally:
+            os.remove(claimed)
+
+    def _save_meta(self):
+        tmp_path = self._file("meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self._meta, f)
+        os.replace(tmp_path, self._file("meta.json"))
+
+    def _flush(self):
+        self.store.flush()
+        self._assign.flush()
+        self._save_meta()
+
+
+def _spherical_kmeans(sample: np.ndarray, k: int, iterations: int, rng) -> np.ndarray:
+    """k-means com similaridade de cosseno (centróides normalizados)"""
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=k)
+
+        # Listas vazias recebem um ponto aleatório da amostra
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+
+    return centroids.astype(np.float32)
+
+
+def parse_embedding(value) -> Optional[np.ndarray]:
+    """Converte a coluna VECTOR/JSON de analysis_results para float32"""
+    if value is None:
+        return None
+    try:
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode("utf-8")
+        if isinstance(value, str):
+            value = json.loads(value)
+        return np.asarray(value, dtype=np.float32)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Invalid embedding value: {e}")
+        return None
+
+
+def request_rescan(path: str, from_analysis_id: int):
+    """Pede ao processo escritor do índice em path que reindexe a partir de um id
+
+    Usado por quem grava embeddings em linhas antigas sem poder escrever no
+    índice (ex: backfill com o servidor rodando). Pedidos acumulam o menor id.
+    """
+    marker = os.path.join(path, RESCAN_FILE)
+    try:
+        with open(marker) as f:
+            from_analysis_id = min(from_analysis_id, int(f.read().strip()))
+    except (FileNotFoundError, ValueError):
+        pass
+
+    os.makedirs(path, exist_ok=True)
+    tmp_path = marker + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(int(from_analysis_id)))
+    os.replace(tmp_path, marker)
+
+
+def image_index_path() -> str:
+    return os.path.join(VECTOR_INDEX_DIR, "image_embeddings")
+
+
+_image_index = None
+_image_index_lock = threading.Lock()
+_image_index_unavailable = False
+
+
+def get_image_index() -> Optional[IVFFlatIndex]:
+    """Índice de embeddings de imagem deste processo (None se indisponível)
+
+    O primeiro processo a abrir o diretório é o escritor; os demais recebem
+    um índice somente leitura sobre o mesmo store.
+    """
+    global _image_index, _image_index_unavailable
+
+    if _image_index is not None or _image_index_unavailable:
+        return _image_index
+
+    with _image_index_lock:
+        if _image_index is None and not _image_index_unavailable:
+            path = image_index_path()
+            try:
+                try:
+                    _image_index = IVFFlatIndex(path)
+                except BlockingIOError:
+                    logger.info("Image vector index is owned by another process, opening read-only")
+                    _image_index = IVFFlatIndex(path, read_only=True)
+                logger.info(f"Image vector index opened: {_image_index.stats()}")
+            except Exception as e:
+                logger.error(f"Error opening image vector index, using SQL search: {e}")
+                _image_index_unavailable = True
+        return _image_index
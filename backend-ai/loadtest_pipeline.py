@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+Teste de carga do pipeline de relatórios
+
+Exercita submit_report -> fila -> process_report -> check_and_create_hotspots
+em volume, usando o backend de visão simulado (VISION_BACKEND=fake) no lugar
+do Claude Code CLI. Usado para dimensionar workers e pool do banco antes de
+cada expansão para uma nova cidade.
+
+Gera relatórios sintéticos agrupados geograficamente (clusters gaussianos em
+volta de um centro), submete pelo mesmo código do endpoint /api/reports e
+processa a fila com N workers, como o /api/process-queue faria.
+
+Mede:
+- throughput de submissão e de processamento
+- latência de fila (submissão -> reserva pelo scheduler) p50/p95/p99
+- latência ponta a ponta (submissão -> análise persistida) p50/p95/p99
+- round trips ao banco por relatório (execute/commit/rollback)
+
+ATENÇÃO: escreve no banco configurado em .env. Use um banco de teste.
+Os relatórios ficam marcados com device_info.loadtest_run; --cleanup remove.
+
+Exemplo:
+    python loadtest_pipeline.py --reports 2000 --workers 8 --batch-size 4 \\
+        --fake-latency-ms 1500 --fake-failure-rate 0.02 --cleanup
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import asyncio
+import argparse
+import threading
+from io import BytesIO
+from collections import Counter
+from typing import Dict
+
+# O backend simulado precisa estar selecionado antes de importar a app
+os.environ.setdefault('VISION_BACKEND', 'fake')
+
+import numpy as np
+from PIL import Image, ImageDraw
+from fastapi import BackgroundTasks
+from starlette.requests import Request
+
+import core.database as database
+import app as api
+from tools.vision_backends import FakeVisionBackend, set_vision_backend
+
+METERS_PER_DEGREE = 111320.0
+
+
+class CountingPool:
+    """Envolve o pool do banco contando round trips por tipo de operação"""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def connection(self, *args, **kwargs):
+        self.add('checkout')
+        return _CountingConnection(self._pool.connection(*args, **kwargs), self)
+
+    def add(self, kind: str):
+        with self._lock:
+            self.counts[kind] += 1
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self.counts)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+class _CountingConnection:
+    def __init__(self, conn, counter: CountingPool):
+        self._conn = conn
+        self._counter = counter
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(self._conn.cursor(*args, **kwargs), self._counter)
+
+    def commit(self):
+        self._counter.add('commit')
+        return self._conn.commit()
+
+    def rollback(self):
+        self._counter.add('rollback')
+        return self._conn.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _CountingCursor:
+    def __init__(self, cursor, counter: CountingPool):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter.add('execute')
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._counter.add('execute')
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def snapshot_all(counters: Dict[str, CountingPool]) -> Counter:
+    return sum((counter.snapshot() for counter in counters.values()), Counter())
+
+
+def round_trips(counts: Counter) -> int:
+    return counts['execute'] + counts['commit'] + counts['rollback']
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    arr = np.asarray(values)
+    return {
+        "p50": round(float(np.percentile(arr, 50)), 3),
+        "p95": round(float(np.percentile(arr, 95)), 3),
+        "p99": round(float(np.percentile(arr, 99)), 3),
+        "max": round(float(arr.max()), 3),
+    }
+
+
+def synthetic_image_base64(seed: int) -> str:
+    """JPEG pequeno com formas aleatórias (conteúdo irrelevante para o fake)"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (320, 240), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(320), rng.randrange(240)
+        draw.ellipse(
+            (x, y, x + rng.randrange(10, 80), y + rng.randrange(10, 80)),
+            fill=tuple(rng.randrange(256) for _ in range(3))
+        )
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=70)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def clustered_points(count, center, clusters, spread_km, cluster_sigma_m, noise_ratio, rng):
+    """Pontos em clusters gaussianos + uma fração de ruído uniforme"""
+    center_lat, center_lon = center
+    lon_scale = METERS_PER_DEGREE * np.cos(np.radians(center_lat))
+    spread_m = spread_km * 1000
+
+    cluster_centers = [
+        (center_lat + rng.uniform(-spread_m, spread_m) / METERS_PER_DEGREE,
+         center_lon + rng.uniform(-spread_m, spread_m) / lon_scale)
+        for _ in range(clusters)
+    ]
+
+    points = []
+    for _ in range(count):
+        if rng.random() < noise_ratio:
+            points.append((
+                center_lat + rng.uniform(-spread_m, spread_m) / METERS_PER_DEGREE,
+                center_lon + rng.uniform(-spread_m, spread_m) / lon_scale
+            ))
+        else:
+            lat, lon = rng.choice(cluster_centers)
+            points.append((
+                lat + rng.gauss(0, cluster_sigma_m) / METERS_PER_DEGREE,
+                lon + rng.gauss(0, cluster_sigma_m) / lon_scale
+            ))
+    return points
+
+
+def load_user_ids(limit: int):
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id FROM users ORDER BY user_id LIMIT %s", (limit,))
+    user_ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    conn.close()
+    return user_ids
+
+
+def fake_request() -> Request:
+    """Request mínimo exigido pelo decorator do rate limiter"""
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/api/reports",
+        "headers": [],
+        "query_string": b"",
+        "client": ("127.0.0.1", 0),
+        "server": ("loadtest", 0),
+    })
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.run_id = args.run_id or uuid.uuid4().hex[:12]
+        self.rng = random.Random(args.seed)
+
+        self.submitted_at = {}
+        self.claimed_at = {}
+        self.completed_at = {}
+        self.finished = set()
+        self.outcomes = Counter()
+        self.submit_errors = 0
+        self.submission_done = False
+
+    async def submit_all(self, user_ids):
+        args = self.args
+        points = clustered_points(
+            args.reports, (args.center_lat, args.center_lon), args.clusters,
+            args.spread_km, args.cluster_sigma_m, args.noise_ratio, self.rng
+        )
+        images = [synthetic_image_base64(args.seed + i) for i in range(args.distinct_images)]
+        urgencies = ['low', 'normal', 'normal', 'normal', 'high', 'critical']
+        interval = 1.0 / args.rate if args.rate > 0 else 0.0
+
+        queue = asyncio.Queue()
+        for index, point in enumerate(points):
+            queue.put_nowait((index, point))
+
+        start = time.monotonic()
+
+        async def submitter():
+            while True:
+                try:
+                    index, (lat, lon) = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+
+                if interval:
+                    delay = start + index * interval - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                user_id = user_ids[index % len(user_ids)]
+                report = api.ReportCreate(
+                    user_id=user_id,
+                    latitude=lat,
+                    longitude=lon,
+                    description=f"Load test report {index}",
+                    image_data=images[index % len(images)],
+                    device_info={"loadtest_run": self.run_id},
+                    urgency=self.rng.choice(urgencies)
+                )
+                try:
+                    # As background tasks do endpoint são descartadas: a fila é
+                    # processada pelos workers do teste
+                    response = await api.submit_report(
+                        report, BackgroundTasks(), fake_request(), user_id=user_id
+                    )
+                    self.submitted_at[response["report_id"]] = time.monotonic()
+                except Exception as e:
+                    self.submit_errors += 1
+                    print(f"❌ Submit failed: {e}", file=sys.stderr)
+
+        await asyncio.gather(*[submitter() for _ in range(args.submitters)])
+        self.submission_done = True
+        return time.monotonic() - start
+
+    async def worker(self):
+        loop = asyncio.get_event_loop()
+        idle_since = None
+
+        while True:
+            batch = await loop.run_in_executor(None, api.queue_scheduler.next_batch, self.args.batch_size)
+
+            if not batch:
+                if self.submission_done and len(self.finished) >= len(self.submitted_at):
+                    return
+                idle_since = idle_since or time.monotonic()
+                if self.submission_done and time.monotonic() - idle_since > self.args.idle_timeout:
+                    return
+                await asyncio.sleep(0.2)
+                continue
+            idle_since = None
+
+            claimed = time.monotonic()
+            report_ids = [item["report_id"] for item in batch]
+            for report_id in report_ids:
+                self.claimed_at.setdefault(report_id, claimed)
+
+            if len(report_ids) > 1:
+                results = await api.process_reports_batch(report_ids, BackgroundTasks())
+            else:
+                results = [await api.process_report(report_ids[0], BackgroundTasks())]
+
+            done = time.monotonic()
+            for report_id, result in zip(report_ids, results):
+                if result.get("parked"):
+                    self.outcomes["parked"] += 1
+                    self.claimed_at.pop(report_id, None)
+                    continue
+                self.outcomes["success" if result.get("success") else "failed"] += 1
+                self.finished.add(report_id)
+                if result.get("success") and report_id in self.submitted_at:
+                    self.completed_at[report_id] = done
+
+            if any(result.get("parked") for result in results):
+                await asyncio.sleep(min(5.0, api.vision_breaker.retry_after() or 1.0))
+
+    async def run(self):
+        args = self.args
+        user_ids = load_user_ids(args.users)
+        if not user_ids:
+            raise SystemExit("❌ Nenhum usuário no banco. Crie ao menos um usuário de teste.")
+
+        # Um contador por pool nomeado (api, worker, analytics)
+        counters = {name: CountingPool(pool) for name, pool in database.pools.items()}
+        database.pools.update(counters)
+
+        print(f"🚀 Run {self.run_id}: {args.reports} relatórios, {len(user_ids)} usuários, "
+              f"{args.workers} workers, lote {args.batch_size}")
+
+        start = time.monotonic()
+        workers = [asyncio.ensure_future(self.worker()) for _ in range(args.workers)]
+
+        submit_seconds = await self.submit_all(user_ids)
+        submit_counts = snapshot_all(counters)
+        print(f"📝 Submissão concluída em {submit_seconds:.1f}s")
+
+        await asyncio.gather(*workers)
+        total_seconds = time.monotonic() - start
+        total_counts = snapshot_all(counters)
+        process_counts = total_counts - submit_counts
+
+        database.pools.update({name: counter._pool for name, counter in counters.items()})
+        return self.report(submit_seconds, total_seconds, submit_counts, process_counts)
+
+    def report(self, submit_seconds, total_seconds, submit_counts, process_counts):
+        submitted = len(self.submitted_at)
+        completed = len(self.completed_at)
+        queue_latencies = [
+            self.claimed_at[r] - self.submitted_at[r]
+            for r in self.submitted_at if r in self.claimed_at
+        ]
+        e2e_latencies = [
+            self.completed_at[r] - self.submitted_at[r] for r in self.completed_at
+        ]
+
+        backend = api_backend_stats()
+        return {
+            "run_id": self.run_id,
+            "reports_submitted": submitted,
+            "submit_errors": self.submit_errors,
+            "reports_completed": completed,
+            "outcomes": dict(self.outcomes),
+            "submit_seconds": round(submit_seconds, 2),
+            "total_seconds": round(total_seconds, 2),
+            "submit_throughput_per_s": round(submitted / submit_seconds, 2) if submit_seconds else None,
+            "process_throughput_per_s": round(completed / total_seconds, 2) if total_seconds else None,
+            "queue_latency_seconds": percentiles(queue_latencies),
+            "end_to_end_latency_seconds": percentiles(e2e_latencies),
+            "db_round_trips": {
+                "submit_per_report": round(round_trips(submit_counts) / submitted, 2) if submitted else None,
+                # Inclui as consultas do scheduler (next_batch) e o polling dos workers ociosos
+                "process_per_report": round(round_trips(process_counts) / completed, 2) if completed else None,
+                "submit": dict(submit_counts),
+                "process": dict(process_counts),
+            },
+            "db_pools": database.get_pool_stats(),
+            "vision_backend": backend,
+            "vision_breaker": api.vision_breaker.stats(),
+        }
+
+
+def api_backend_stats():
+    from tools.vision_backends import get_vision_backend
+    backend = get_vision_backend()
+    return backend.stats() if hasattr(backend, 'stats') else {"name": backend.name}
+
+
+def cleanup(run_id: str):
+    """Remove os relatórios do run e os hotspots que só continham eles"""
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        "SELECT report_id FROM reports WHERE JSON_UNQUOTE(JSON_EXTRACT(device_info, '$.loadtest_run')) = %s",
+        (run_id,)
+    )
+    report_ids = [row[0] for row in cursor.fetchall()]
+    if not report_ids:
+        print(f"Nenhum relatório do run {run_id}")
+        cursor.close()
+        conn.close()
+        return
+
+    placeholders = ", ".join(["%s"] * len(report_ids))
+    cursor.execute(
+        f"SELECT DISTINCT hotspot_id FROM hotspot_reports WHERE report_id IN ({placeholders})",
+        tuple(report_ids)
+    )
+    hotspot_ids = [row[0] for row in cursor.fetchall()]
+
+    for table in ("hotspot_reports", "analysis_results", "image_processing_queue"):
+        cursor.execute(f"DELETE FROM {table} WHERE report_id IN ({placeholders})", tuple(report_ids))
+    cursor.execute(
+        f"DELETE FROM system_logs WHERE related_table = 'reports' AND related_id IN ({placeholders})",
+        tuple(report_ids)
+    )
+    cursor.execute(f"DELETE FROM reports WHERE report_id IN ({placeholders})", tuple(report_ids))
+
+    if hotspot_ids:
+        hotspot_placeholders = ", ".join(["%s"] * len(hotspot_ids))
+        cursor.execute(
+            f"""
+            DELETE FROM hotspots
+            WHERE hotspot_id IN ({hotspot_placeholders})
+              AND hotspot_id NOT IN (SELECT hotspot_id FROM hotspot_reports)
+            """,
+            tuple(hotspot_ids)
+        )
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"🗑️  Removidos {len(report_ids)} relatórios do run {run_id}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Teste de carga do pipeline de relatórios")
+    parser.add_argument('--reports', type=int, default=1000, help="Relatórios a submeter")
+    parser.add_argument('--users', type=int, default=50, help="Máximo de usuários existentes a usar")
+    parser.add_argument('--rate', type=float, default=0, help="Submissões por segundo (0 = sem limite)")
+    parser.add_argument('--submitters', type=int, default=4, help="Submissões concorrentes")
+    parser.add_argument('--workers', type=int, default=4, help="Workers processando a fila")
+    parser.add_argument('--batch-size', type=int, default=4, help="Itens reservados por worker")
+    parser.add_argument('--idle-timeout', type=float, default=30, help="Segundos sem itens na fila para encerrar")
+
+    parser.add_argument('--center-lat', type=float, default=-23.5505)
+    parser.add_argument('--center-lon', type=float, default=-46.6333)
+    parser.add_argument('--spread-km', type=float, default=10, help="Meia largura da área gerada")
+    parser.add_argument('--clusters', type=int, default=25, help="Número de clusters de lixo")
+    parser.add_argument('--cluster-sigma-m', type=float, default=150, help="Desvio de cada cluster em metros")
+    parser.add_argument('--noise-ratio', type=float, default=0.2, help="Fração de pontos fora de clusters")
+    parser.add_argument('--distinct-images', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=42)
+
+    parser.add_argument('--fake-latency-ms', type=float, default=2000)
+    parser.add_argument('--fake-latency-sigma', type=float, default=0.35)
+    parser.add_argument('--fake-failure-rate', type=float, default=0.0)
+    parser.add_argument('--fake-timeout-rate', type=float, default=0.0)
+    parser.add_argument('--fake-malformed-rate', type=float, default=0.1)
+
+    parser.add_argument('--run-id', help="Identificador do run (default: aleatório)")
+    parser.add_argument('--cleanup', action='store_true', help="Remover os dados do run ao final")
+    parser.add_argument('--cleanup-only', action='store_true', help="Apenas remover os dados de --run-id")
+    parser.add_argument('--json', action='store_true', help="Imprimir o resultado em JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.cleanup_only:
+        if not args.run_id:
+            raise SystemExit("--cleanup-only requer --run-id")
+        cleanup(args.run_id)
+        return
+
+    set_vision_backend(FakeVisionBackend(
+        latency_mean_ms=args.fake_latency_ms,
+        latency_sigma=args.fake_latency_sigma,
+        failure_rate=args.fake_failure_rate,
+        timeout_rate=args.fake_timeout_rate,
+        malformed_rate=args.fake_malformed_rate,
+        seed=args.seed
+    ))
+    # Sem rate limit por IP: todas as submissões vêm do mesmo processo
+    api.limiter.enabled = False
+
+    loadtest = LoadTest(args)
+    try:
+        result = asyncio.run(loadtest.run())
+    finally:
+        if args.cleanup:
+            cleanup(loadtest.run_id)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print("\n📊 Resultado")
+    print(f"  Submetidos: {result['reports_submitted']} (erros: {result['submit_errors']})")
+    print(f"  Processados: {result['reports_completed']} {result['outcomes']}")
+    print(f"  Throughput: submissão {result['submit_throughput_per_s']}/s, "
+          f"processamento {result['process_throughput_per_s']}/s")
+    print(f"  Latência de fila (s): {result['queue_latency_seconds']}")
+    print(f"  Latência ponta a ponta (s): {result['end_to_end_latency_seconds']}")
+    trips = result['db_round_trips']
+    print(f"  Round trips/relatório: submissão {trips['submit_per_report']}, "
+          f"processamento {trips['process_per_report']}")
+    print(f"  Backend de visão: {result['vision_backend']}")
+    print(f"  Circuit breaker: {result['vision_breaker']['state']}")
+
+
+if __name__ == '__main__':
+    main()
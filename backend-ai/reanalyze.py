@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Campanhas de reanálise em massa (CLI)
+
+Mesmo runner usado pelos endpoints /api/admin/reanalysis (core/reanalysis.py).
+Ctrl+C pausa a campanha; "run" de novo retoma a partir do checkpoint.
+
+Exemplos:
+    python reanalyze.py create --name "prompt v2" --version claude-prompt-v2 \\
+        --filter processed_by="Nova AI" --filter analyzed_to=2026-09-30 --rate 20
+    python reanalyze.py run 3
+    python reanalyze.py status 3
+    python reanalyze.py list
+    python reanalyze.py pause 3
+    python reanalyze.py cancel 3
+"""
+
+import sys
+import json
+import asyncio
+import argparse
+
+from app import reanalysis_runner
+
+
+def parse_filters(values):
+    """--filter chave=valor (report_ids aceita lista separada por vírgula)"""
+    filters = {}
+    for value in values or []:
+        if '=' not in value:
+            raise SystemExit(f"Filtro inválido (use chave=valor): {value}")
+        key, raw = value.split('=', 1)
+        key = key.strip()
+        filters[key] = [int(v) for v in raw.split(',') if v.strip()] if key == 'report_ids' else raw
+    return filters
+
+
+def print_campaign(campaign):
+    eta = campaign['eta_seconds']
+    eta_text = f"{eta // 3600}h{eta % 3600 // 60:02d}m" if eta is not None else "-"
+    print(
+        f"#{campaign['campaign_id']} {campaign['name']} [{campaign['status']}] "
+        f"{campaign['analysis_version']}: {campaign['processed_reports']}/{campaign['total_reports']} "
+        f"({campaign['progress_percent']}%), ok {campaign['succeeded_reports']}, "
+        f"falhas {campaign['failed_reports']}, {campaign['observed_per_minute'] or '-'}/min, ETA {eta_text}"
+    )
+    if campaign.get('error_message'):
+        print(f"  erro: {campaign['error_message']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Campanhas de reanálise em massa")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    create = sub.add_parser('create', help="Criar campanha")
+    create.add_argument('--name', required=True)
+    create.add_argument('--version', required=True, help="Identificador da nova análise (prompt/modelo)")
+    create.add_argument('--filter', action='append', help="Filtro chave=valor (repetível)")
+    create.add_argument('--rate', type=float, default=30, help="Imagens por minuto")
+    create.add_argument('--promote', action='store_true', help="Substituir a análise atual")
+    create.add_argument('--run', action='store_true', help="Executar logo após criar")
+
+    for name, help_text in (('run', "Executar/retomar"), ('status', "Progresso e ETA"),
+                            ('pause', "Pausar"), ('cancel', "Cancelar")):
+        command = sub.add_parser(name, help=help_text)
+        command.add_argument('campaign_id', type=int)
+
+    list_parser = sub.add_parser('list', help="Listar campanhas")
+    list_parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help="Saída em JSON")
+
+    args = parser.parse_args()
+
+    def output(campaign):
+        if args.json:
+            print(json.dumps(campaign, indent=2, default=str))
+        else:
+            print_campaign(campaign)
+
+    if args.command == 'create':
+        try:
+            campaign = reanalysis_runner.create_campaign(
+                name=args.name,
+                analysis_version=args.version,
+                filters=parse_filters(args.filter),
+                rate_per_minute=args.rate,
+                promote=args.promote
+            )
+        except ValueError as e:
+            raise SystemExit(f"❌ {e}")
+        output(campaign)
+        if not args.run:
+            return
+        args.campaign_id = campaign['campaign_id']
+        args.command = 'run'
+
+    if args.command == 'run':
+        try:
+            result = asyncio.run(reanalysis_runner.run(args.campaign_id))
+        except KeyboardInterrupt:
+            print("\n⏸️  Campanha pausada; use 'run' para retomar")
+            result = reanalysis_runner.get_campaign(args.campaign_id)
+        if result and 'campaign_id' in result:
+            output(result)
+        else:
+            print(f"❌ {result['message'] if result else 'Campanha não encontrada'}")
+            sys.exit(1)
+
+    elif args.command == 'status':
+        campaign = reanalysis_runner.get_campaign(args.campaign_id)
+        if not campaign:
+            raise SystemExit("❌ Campanha não encontrada")
+        output(campaign)
+
+    elif args.command == 'list':
+        for campaign in reanalysis_runner.list_campaigns(args.limit):
+            output(campaign)
+
+    elif args.command in ('pause', 'cancel'):
+        action = reanalysis_runner.pause_campaign if args.command == 'pause' else reanalysis_runner.cancel_campaign
+        if not action(args.campaign_id):
+            raise SystemExit(f"❌ Não foi possível executar '{args.command}' nesta campanha")
+        output(reanalysis_runner.get_campaign(args.campaign_id))
+
+
+if __name__ == '__main__':
+    main()
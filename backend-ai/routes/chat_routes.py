@@ -5,29 +5,45 @@ Inspirado em: /Users/2a/Desktop/duraeco/backend-chat/server.py
 """
 
 import time
+import asyncio
 import logging
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, Depends, Header, HTTPException
-from typing import Optional
+from contextlib import aclosing
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, Depends, Header, HTTPException, Request, Response
+from typing import Dict, Optional
 
 from claude_agent_sdk import (
     ClaudeAgentOptions,
-    ClaudeSDKClient,
     AssistantMessage,
     TextBlock,
     ThinkingBlock,
     ToolUseBlock,
     ToolResultBlock,
     ResultMessage,
+    StreamEvent,
+    UserMessage,
 )
 
 # Importar funções de utilidade (evitando importação circular)
-from core.database import get_db_connection
-from core.auth import verify_token
+from core.database import (
+    get_db_connection, get_read_connection, get_analytics_connection, get_pool_stats, note_write
+)
+from core.auth import verify_token, ADMIN_USER_IDS
 from core.session_manager import SessionManager
+from core.message_sink import get_message_sink
+from core.conversation_context import ConversationContext
+from core.query_cache import get_query_cache
+from core.claude_handler import ClaudeHandler
+from core.frame_scheduler import FrameScheduler, negotiate_encoding
 from tools import duraeco_mcp_server
 
 logger = logging.getLogger(__name__)
 
+# Tempo para a geração terminar depois do interrupt antes de ser abortada
+CANCEL_GRACE_SECONDS = 10
+
+# Máximo de mensagens por janela em /sessions/{id}/messages
+MAX_HISTORY_WINDOW = 200
+
 
 async def get_user_from_token(authorization: Optional[str] = Header(None)) -> int:
     """Extract user ID from JWT token in Authorization header"""
@@ -44,10 +60,112 @@ async def get_user_from_token(authorization: Optional[str] = Header(None)) -> in
     return user_id
 
 
+async def get_admin_from_token(user_id: int = Depends(get_user_from_token)) -> int:
+    """Require an authenticated user listed in ADMIN_USER_IDS"""
+    if user_id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user_id
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match contém a ETag (comparação fraca: ignora o prefixo W/)"""
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def build_agent_options() -> ClaudeAgentOptions:
+    """Opções do agente do chat (iguais para todas as conversas)"""
+    return ClaudeAgentOptions(
+        model="claude-sonnet-4-5",  # Ou claude-opus-4-5 para melhor qualidade
+        max_turns=10,
+        permission_mode="bypassPermissions",  # Execução automática
+        include_partial_messages=True,  # StreamEvent com deltas de texto (menor TTFT)
+        system_prompt="""
+You are DuraEco AI Assistant, specializing in waste management and environmental data analysis.
+
+You have access to these powerful tools:
+
+1. **RAG Tools (Retrieval Augmented Generation)**:
+   - search_similar_waste_images: Find visually similar waste reports using embeddings
+   - search_reports_by_location: Search reports near a location (radius or nearest, filters by waste type, severity and date)
+   - search_reports_text: Full-text search over report descriptions, addresses and analysis text
+   - hybrid_search_reports: Combine text, image similarity to a report and proximity in ONE call
+
+2. **Data Tools**:
+   - execute_sql_query: Query the database for statistics and analysis
+
+Database Schema:
+- reports: waste reports with location and images
+- analysis_results: AI analysis with embeddings (VECTOR 1024-d)
+- hotspots: areas with high waste concentration
+- waste_types: categories of waste
+
+IMPORTANT GUIDELINES:
+1. Use RAG tools (search_similar_*) when users ask about similar cases
+2. Use execute_sql_query for statistics, counts, and aggregations
+3. Always provide actionable insights, not just data dumps
+4. Cite specific report IDs when referencing cases
+5. Be proactive in suggesting relevant analyses
+
+Example queries:
+- "Find similar plastic waste" → use search_similar_waste_images
+- "Show reports near me" → use search_reports_by_location
+- "Reports mentioning burning tyres" → use search_reports_text
+- "Plastic dumps like report 123 within 2 km in the last month" → use hybrid_search_reports
+  (query="plastic dump", like_report_id=123, latitude/longitude, radius_km=2, last_days=30)
+- "How many reports last week?" → use execute_sql_query
+""",
+        mcp_servers={"duraeco": duraeco_mcp_server},
+        allowed_tools=[
+            "mcp__duraeco__search_similar_waste_images",
+            "mcp__duraeco__search_reports_by_location",
+            "mcp__duraeco__search_reports_text",
+            "mcp__duraeco__hybrid_search_reports",
+            "mcp__duraeco__execute_sql_query",
+        ]
+    )
+
+
 router = APIRouter(prefix="/api/chat", tags=["chat-v2"])
 
 # Inicializar managers
-session_manager = SessionManager(get_db_connection)
+message_sink = get_message_sink(get_db_connection)
+session_manager = SessionManager(
+    get_db_connection, sink=message_sink,
+    get_read_connection_func=get_read_connection, note_write_func=note_write
+)
+conversation_context = ConversationContext(session_manager, get_db_connection)
+claude_handler = ClaudeHandler(build_agent_options, context_builder=conversation_context.build)
+
+# Tasks em background das rotas (o loop só guarda referência fraca)
+_background_tasks: set = set()
+
+
+def _run_in_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+@router.on_event("startup")
+async def start_message_sink():
+    # Regrava mensagens que ficaram no spool numa parada anterior
+    message_sink.start()
+
+
+@router.on_event("shutdown")
+async def close_agent_clients():
+    await claude_handler.shutdown()
+    await message_sink.close()
 
 
 @router.websocket("/ws")
@@ -64,13 +182,20 @@ async def websocket_chat(
         "conversation_id": "string|null"
     }
 
+    Cancelar a geração em andamento: {"type": "cancel"}. Uma nova pergunta
+    ou a desconexão também cancelam; a resposta parcial é salva como
+    interrompida.
+
+    Encoding: JSON por padrão; MessagePack (frames binários) se o cliente
+    oferecer o subprotocolo "duraeco.msgpack.v1"
+
     Response formats:
     - {"type": "user_message_saved", "conversation_id": "..."}
-    - {"type": "text_chunk", "content": "..."}
+    - {"type": "text_chunk", "content": "..."}  (deltas de texto conforme chegam)
     - {"type": "thinking", "content": "..."}
     - {"type": "tool_start", "tool": "...", "tool_use_id": "...", "input": {...}}
-    - {"type": "tool_result", "tool_use_id": "...", "content": "..."}
-    - {"type": "result", "content": "...", "cost": 0.01, "duration_ms": 1234, "num_turns": 3}
+    - {"type": "tool_result", "tool_use_id": "...", "content": "...", "truncated": true, "content_length": 12345}
+    - {"type": "result", "content": "...", "cost": 0.01, "duration_ms": 1234, "ttft_ms": 350, "num_turns": 3, "interrupted": false}
     - {"type": "error", "error": "..."}
     """
 
@@ -81,26 +206,248 @@ async def websocket_chat(
         await websocket.close(code=4001, reason="Unauthorized")
         return
 
-    await websocket.accept()
-    logger.info(f"WebSocket connected for user {user_id}")
+    subprotocol, encoding = negotiate_encoding(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    logger.info(f"WebSocket connected for user {user_id} ({encoding})")
+
+    # Frames de saída: coalescing de texto, truncagem e backpressure
+    frames = FrameScheduler(websocket, encoding).start()
+
+    # Geração em andamento: roda em task para o loop continuar lendo o socket
+    # (cancelamento pelo usuário, nova pergunta ou desconexão)
+    generation: Optional[asyncio.Task] = None
+    generation_state: Dict = {}
+
+    async def cancel_generation(reason: str):
+        if generation is None or generation.done():
+            return
+        generation_state["cancel_reason"] = reason
+        generation_state["interrupt_sent"] = await claude_handler.cancel(generation_state["conversation_id"], reason)
+        try:
+            # A geração termina com o ResultMessage da interrupção
+            await asyncio.wait_for(asyncio.shield(generation), CANCEL_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            generation.cancel()
+            await asyncio.gather(generation, return_exceptions=True)
+        except Exception:
+            pass
+
+    async def generate(conversation_id: str, message: str, state: Dict):
+        full_content = ""
+        thinking_content = ""
+        tool_names = {}
+        tool_inputs = {}
+        # Chamadas do turno para o cache de contexto da conversa
+        tool_calls = []
+        start_time = time.time()
+        first_token_time = None
+        num_turns = 0
+        # Deltas já enviados do bloco em andamento (o bloco completo não é reenviado)
+        streamed_text = False
+        streamed_thinking = False
+
+        async def emit(frame: Dict):
+            # Depois da desconexão a geração segue até o fim só para salvar a resposta
+            if state.get("disconnected"):
+                return
+            try:
+                await frames.send(frame)
+            except WebSocketDisconnect:
+                state["disconnected"] = True
+
+        async def on_tool_result(block: ToolResultBlock):
+            await emit({
+                "type": "tool_result",
+                "tool_use_id": block.tool_use_id,
+                "tool": tool_names.get(block.tool_use_id, "unknown"),
+                "content": block.content,
+                "is_error": block.is_error
+            })
+            if not block.is_error and block.tool_use_id in tool_names:
+                content = block.content
+                if isinstance(content, list):
+                    content = "\n".join(b.get("text", "") for b in content if isinstance(b, dict))
+                tool_calls.append({
+                    "tool": tool_names[block.tool_use_id],
+                    "input": tool_inputs.get(block.tool_use_id, {}),
+                    "result": content or ""
+                })
+
+        async def save_interrupted():
+            if full_content:
+                await session_manager.save_message(
+                    conversation_id, user_id, "assistant", full_content, interrupted=True
+                )
+
+        # Stream resposta usando Claude Agent SDK
+        try:
+            # Cliente da conversa mantido pelo pool (reutilizado entre mensagens);
+            # aclosing libera o lock da conversa mesmo se a task for cancelada
+            async with aclosing(claude_handler.send_message(conversation_id, message)) as stream:
+                async for msg in stream:
+                    # Cancelado antes do cliente começar a geração: interrompe agora
+                    if state.get("cancel_reason") and not state.get("interrupt_sent"):
+                        state["interrupt_sent"] = await claude_handler.cancel(conversation_id, state["cancel_reason"])
+
+                    if isinstance(msg, StreamEvent):
+                        # Deltas parciais: repassados na hora; o texto completo
+                        # para salvar vem do AssistantMessage
+                        event = msg.event
+                        if event.get("type") != "content_block_delta" or msg.parent_tool_use_id:
+                            continue
+                        delta = event.get("delta", {})
+                        if delta.get("type") == "text_delta" and delta.get("text"):
+                            if first_token_time is None:
+                                first_token_time = time.time()
+                            streamed_text = True
+                            await emit({
+                                "type": "text_chunk",
+                                "content": delta["text"]
+                            })
+                        elif delta.get("type") == "thinking_delta" and delta.get("thinking"):
+                            streamed_thinking = True
+                            await emit({
+                                "type": "thinking",
+                                "content": delta["thinking"]
+                            })
+                        continue
+
+                    num_turns += 1
+
+                    if isinstance(msg, AssistantMessage):
+                        for block in msg.content:
+                            if isinstance(block, TextBlock):
+                                full_content += block.text
+                                if not streamed_text:
+                                    if first_token_time is None:
+                                        first_token_time = time.time()
+                                    await emit({
+                                        "type": "text_chunk",
+                                        "content": block.text
+                                    })
+
+                            elif isinstance(block, ThinkingBlock):
+                                thinking_content += block.thinking
+                                if not streamed_thinking:
+                                    await emit({
+                                        "type": "thinking",
+                                        "content": block.thinking
+                                    })
+
+                            elif isinstance(block, ToolUseBlock):
+                                tool_names[block.id] = block.name
+                                tool_inputs[block.id] = block.input
+                                await emit({
+                                    "type": "tool_start",
+                                    "tool": block.name,
+                                    "tool_use_id": block.id,
+                                    "input": block.input
+                                })
+
+                            elif isinstance(block, ToolResultBlock):
+                                await on_tool_result(block)
+                        streamed_text = False
+                        streamed_thinking = False
+
+                    elif isinstance(msg, UserMessage) and isinstance(msg.content, list):
+                        # Resultados das ferramentas chegam como mensagem do "usuário"
+                        for block in msg.content:
+                            if isinstance(block, ToolResultBlock):
+                                await on_tool_result(block)
+
+                    elif isinstance(msg, ResultMessage):
+                        duration_ms = int((time.time() - start_time) * 1000)
+                        ttft_ms = int((first_token_time - start_time) * 1000) if first_token_time else None
+                        interrupted = bool(state.get("cancel_reason"))
+
+                        # Salvar resposta do assistente no banco (parcial se interrompida)
+                        if interrupted:
+                            await save_interrupted()
+                        else:
+                            await session_manager.save_message(
+                                conversation_id,
+                                user_id,
+                                "assistant",
+                                full_content
+                            )
+                            # Cache de ferramentas e resumo da conversa (em background)
+                            _run_in_background(conversation_context.record_turn(conversation_id, tool_calls))
+
+                        # Enviar resultado final
+                        await emit({
+                            "type": "result",
+                            "content": full_content,
+                            "thinking": thinking_content,
+                            "cost": msg.total_cost_usd,
+                            "duration_ms": duration_ms,
+                            "ttft_ms": ttft_ms,
+                            "num_turns": num_turns,
+                            "interrupted": interrupted,
+                            "is_error": False
+                        })
+
+                        logger.info(
+                            f"Chat {'interrupted (' + state['cancel_reason'] + ')' if interrupted else 'completed'} "
+                            f"for user {user_id}: "
+                            f"{num_turns} turns, {duration_ms}ms (TTFT {ttft_ms}ms), ${msg.total_cost_usd or 0:.4f}"
+                        )
+
+        except asyncio.CancelledError:
+            # Interrupção não terminou no prazo: salva o que já foi gerado
+            await save_interrupted()
+            raise
+
+        except Exception as e:
+            if state.get("cancel_reason"):
+                logger.info(f"Generation ended after cancel ({state['cancel_reason']}): {e}")
+                await save_interrupted()
+                await emit({
+                    "type": "result",
+                    "content": full_content,
+                    "interrupted": True,
+                    "is_error": False
+                })
+                return
+            logger.error(f"Error processing message: {e}")
+            await emit({
+                "type": "error",
+                "error": str(e)
+            })
 
     try:
         while True:
             # Receber mensagem
             data = await websocket.receive_json()
+
+            if data.get("type") == "cancel":
+                await cancel_generation("user")
+                continue
+
             message = data.get("message", "")
             conversation_id = data.get("conversation_id")
 
             if not message.strip():
-                await websocket.send_json({
+                await frames.send({
                     "type": "error",
                     "error": "Empty message"
                 })
                 continue
 
+            # Só sessões do próprio usuário: o id vem do cliente e dá acesso ao
+            # cliente do agente e ao contexto da conversa
+            if conversation_id and not await session_manager.is_session_owner(conversation_id, user_id):
+                await frames.send({
+                    "type": "error",
+                    "error": "Conversation not found"
+                })
+                continue
+
+            # Nova pergunta durante uma geração: a anterior é cancelada
+            await cancel_generation("superseded")
+
             # Criar ou reutilizar sessão
             if not conversation_id:
-                conversation_id = await session_manager.create_session(user_id)
+                conversation_id = await session_manager.create_session(user_id, title=message)
 
             # Salvar mensagem do usuário
             await session_manager.save_message(
@@ -111,153 +458,36 @@ async def websocket_chat(
             )
 
             # Confirmar save
-            await websocket.send_json({
+            await frames.send({
                 "type": "user_message_saved",
                 "conversation_id": conversation_id
             })
 
             # Processar com Claude Agent SDK
-            full_content = ""
-            thinking_content = ""
-            tool_names = {}
-            start_time = time.time()
-            num_turns = 0
-
-            # Configurar opções do Agent
-            options = ClaudeAgentOptions(
-                model="claude-sonnet-4-5",  # Ou claude-opus-4-5 para melhor qualidade
-                max_turns=10,
-                permission_mode="bypassPermissions",  # Execução automática
-                system_prompt="""
-You are DuraEco AI Assistant, specializing in waste management and environmental data analysis.
-
-You have access to these powerful tools:
-
-1. **RAG Tools (Retrieval Augmented Generation)**:
-   - search_similar_waste_images: Find visually similar waste reports using embeddings
-   - search_reports_by_location: Search reports near a location using geographic embeddings
-
-2. **Data Tools**:
-   - execute_sql_query: Query the database for statistics and analysis
-
-Database Schema:
-- reports: waste reports with location and images
-- analysis_results: AI analysis with embeddings (VECTOR 1024-d)
-- hotspots: areas with high waste concentration
-- waste_types: categories of waste
-
-IMPORTANT GUIDELINES:
-1. Use RAG tools (search_similar_*) when users ask about similar cases
-2. Use execute_sql_query for statistics, counts, and aggregations
-3. Always provide actionable insights, not just data dumps
-4. Cite specific report IDs when referencing cases
-5. Be proactive in suggesting relevant analyses
-
-Example queries:
-- "Find similar plastic waste" → use search_similar_waste_images
-- "Show reports near me" → use search_reports_by_location
-- "How many reports last week?" → use execute_sql_query
-""",
-                mcp_servers={"duraeco": duraeco_mcp_server},
-                allowed_tools=[
-                    "mcp__duraeco__search_similar_waste_images",
-                    "mcp__duraeco__search_reports_by_location",
-                    "mcp__duraeco__execute_sql_query",
-                ]
-            )
-
-            # Stream resposta usando Claude Agent SDK
-            try:
-                async with ClaudeSDKClient(options=options) as client:
-                    await client.query(message)
-
-                    async for msg in client.receive_response():
-                        num_turns += 1
-
-                        if isinstance(msg, AssistantMessage):
-                            for block in msg.content:
-                                if isinstance(block, TextBlock):
-                                    full_content += block.text
-                                    await websocket.send_json({
-                                        "type": "text_chunk",
-                                        "content": block.text
-                                    })
-
-                                elif isinstance(block, ThinkingBlock):
-                                    thinking_content += block.thinking
-                                    await websocket.send_json({
-                                        "type": "thinking",
-                                        "content": block.thinking
-                                    })
-
-                                elif isinstance(block, ToolUseBlock):
-                                    tool_names[block.id] = block.name
-                                    await websocket.send_json({
-                                        "type": "tool_start",
-                                        "tool": block.name,
-                                        "tool_use_id": block.id,
-                                        "input": block.input
-                                    })
-
-                                elif isinstance(block, ToolResultBlock):
-                                    await websocket.send_json({
-                                        "type": "tool_result",
-                                        "tool_use_id": block.tool_use_id,
-                                        "tool": tool_names.get(block.tool_use_id, "unknown"),
-                                        "content": block.content,
-                                        "is_error": block.is_error
-                                    })
-
-                        elif isinstance(msg, ResultMessage):
-                            duration_ms = int((time.time() - start_time) * 1000)
-
-                            # Salvar resposta do assistente no banco
-                            await session_manager.save_message(
-                                conversation_id,
-                                user_id,
-                                "assistant",
-                                full_content
-                            )
-
-                            # Enviar resultado final
-                            await websocket.send_json({
-                                "type": "result",
-                                "content": full_content,
-                                "thinking": thinking_content,
-                                "cost": msg.total_cost_usd,
-                                "duration_ms": duration_ms,
-                                "num_turns": num_turns,
-                                "is_error": False
-                            })
-
-                            logger.info(
-                                f"Chat completed for user {user_id}: "
-                                f"{num_turns} turns, {duration_ms}ms, ${msg.total_cost_usd:.4f}"
-                            )
-                            break
-
-            except Exception as e:
-                logger.error(f"Error processing message: {e}")
-                await websocket.send_json({
-                    "type": "error",
-                    "error": str(e)
-                })
+            generation_state = {"conversation_id": conversation_id}
+            generation = asyncio.create_task(generate(conversation_id, message, generation_state))
 
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected for user {user_id}")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
         try:
-            await websocket.send_json({
+            await frames.send({
                 "type": "error",
                 "error": str(e)
             })
+            await frames.close()
         except:
             pass
         try:
             await websocket.close()
         except:
             pass
+    finally:
+        # Ninguém vai ler a resposta: interrompe a geração em andamento
+        await cancel_generation("disconnect")
+        await frames.close()
+        logger.debug(f"WebSocket frames for user {user_id}: {frames.stats}")
 
 
 # Endpoints auxiliares para gerenciar sessões
@@ -281,17 +511,67 @@ async def list_sessions(
 @router.get("/sessions/{session_id}/messages")
 async def get_session_messages(
     session_id: str,
-    limit: int = 50
+    request: Request,
+    response: Response,
+    limit: int = 50,
+    after_message_id: Optional[int] = None,
+    before_message_id: Optional[int] = None,
+    user_id: int = Depends(get_user_from_token)
 ):
-    """Retorna mensagens de uma sessão"""
+    """Retorna uma janela de mensagens de uma sessão do usuário
+
+    - Sem cursor: as `limit` mensagens mais recentes
+    - ?after_message_id=N: mensagens novas depois de N (sincronização incremental)
+    - ?before_message_id=N: mensagens anteriores a N (carregar mais antigas)
+
+    has_more indica se há mais mensagens na direção pedida. Com ETag: um
+    If-None-Match igual responde 304 sem ler as mensagens.
+    """
+    if not await session_manager.is_session_owner(session_id, user_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    limit = max(1, min(limit, MAX_HISTORY_WINDOW))
     try:
-        messages = await session_manager.get_session_history(session_id, limit)
-        return {"success": True, "messages": messages}
+        count, last_message_id = await session_manager.get_history_version(session_id)
+        etag = f'W/"{count}-{last_message_id}-{after_message_id}-{before_message_id}-{limit}"'
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        # Uma a mais para saber se a janela tem continuação
+        messages = await session_manager.get_session_history(
+            session_id, limit + 1, after_message_id=after_message_id, before_message_id=before_message_id
+        )
+        has_more = len(messages) > limit
+        if has_more:
+            # A sobra fica no lado oposto ao cursor
+            messages = messages[:limit] if after_message_id is not None else messages[1:]
+
+        response.headers.update(headers)
+        return {
+            "success": True,
+            "messages": messages,
+            "has_more": has_more,
+            "total": count,
+            "last_message_id": last_message_id
+        }
     except Exception as e:
         logger.error(f"Error getting session messages: {e}")
         return {"error": str(e)}
 
 
+@router.get("/pool")
+async def chat_pool_stats(admin_id: int = Depends(get_admin_from_token)):
+    """Estatísticas do pool de clientes Agent SDK, da fila de mensagens e do cache SQL (admin)"""
+    return {
+        "success": True,
+        **claude_handler.get_pool_stats(),
+        "message_sink": message_sink.get_stats(),
+        "sql_cache": get_query_cache(get_analytics_connection).get_stats(),
+        "db_pools": get_pool_stats()
+    }
+
+
 @router.delete("/sessions/{session_id}")
 async def delete_session(
     session_id: str,
@@ -299,8 +579,12 @@ async def delete_session(
 ):
     """Deleta uma sessão de chat"""
 
+    if not await session_manager.is_session_owner(session_id, user_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+
     try:
         await session_manager.delete_session(session_id, user_id)
+        await claude_handler.close_session(session_id)
         return {"success": True, "message": "Session deleted"}
     except Exception as e:
         logger.error(f"Error deleting session: {e}")
@@ -0,0 +1,87 @@
+"""
+Testes do validador de SQL do execute_sql_query
+
+O módulo é carregado pelo caminho: o pacote tools importa o SDK do agente
+e o conector do MySQL, que o validador não usa.
+"""
+
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    "sql_validator", Path(__file__).resolve().parent.parent / "tools" / "sql_validator.py"
+)
+sql_validator = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(sql_validator)
+
+validate_query = sql_validator.validate_query
+SQLValidationError = sql_validator.SQLValidationError
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM users",
+    "SELECT * FROM (users)",
+    "SELECT * FROM ((users))",
+    "SELECT * FROM reports UNION TABLE users",
+    "SELECT * FROM reports WHERE user_id IN (TABLE users)",
+    "SELECT * FROM reports WHERE EXISTS (TABLE users)",
+    "SELECT * FROM reports r JOIN (users u) ON u.user_id = r.user_id",
+    "SELECT * FROM (reports r JOIN users u ON u.user_id = r.user_id)",
+    "SELECT * FROM (SELECT * FROM users) x",
+    "SELECT * FROM reports, `users`",
+])
+def test_sensitive_tables_blocked(query):
+    with pytest.raises(SQLValidationError, match="users"):
+        validate_query(query)
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM information_schema.processlist",
+    "SELECT * FROM mysql.user",
+    "SELECT * FROM reports UNION TABLE performance_schema.threads",
+])
+def test_blocked_schemas(query):
+    with pytest.raises(SQLValidationError, match="schema"):
+        validate_query(query)
+
+
+def test_parenthesized_table_references_are_recorded():
+    result = validate_query(
+        "SELECT * FROM (reports) r JOIN (hotspots h) ON 1 WHERE EXISTS (TABLE waste_types)"
+    )
+    assert result["tables"] == ["hotspots", "reports", "waste_types"]
+
+
+def test_derived_table_reads_inner_tables():
+    result = validate_query("SELECT COUNT(*) FROM (SELECT report_id FROM reports) x")
+    assert result["tables"] == ["reports"]
+    assert result["limit"] == "added"
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT created_at FROM reports",
+    "SELECT * FROM reports WHERE status = 'updated'",
+    "SELECT EXTRACT(YEAR FROM report_date) FROM reports",
+])
+def test_keywords_outside_keyword_position_allowed(query):
+    assert validate_query(query)["tables"] == ["reports"]
+
+
+@pytest.mark.parametrize("query", [
+    "TABLE users",
+    "DELETE FROM reports",
+    "SELECT * FROM reports; DROP TABLE reports",
+    "SELECT SLEEP(10)",
+    "SELECT @@version",
+])
+def test_rejected_statements(query):
+    with pytest.raises(SQLValidationError):
+        validate_query(query)
+
+
+def test_limit_clamped_before_trailing_comment():
+    result = validate_query("SELECT * FROM reports LIMIT 5000 -- all")
+    assert result["query"] == "SELECT * FROM reports LIMIT 100"
+    assert result["limit"] == "clamped"
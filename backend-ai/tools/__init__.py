@@ -7,6 +7,8 @@ Usa Claude Code CLI local (subprocess) - SEM API KEY necessaria!
 from claude_agent_sdk import create_sdk_mcp_server
 
 from .rag_tools import search_similar_waste_images, search_reports_by_location
+from .text_search_tools import search_reports_text
+from .hybrid_tools import hybrid_search_reports
 from .sql_tools import execute_sql_query
 
 
@@ -19,6 +21,12 @@ duraeco_mcp_server = create_sdk_mcp_server(
         search_similar_waste_images,
         search_reports_by_location,
 
+        # Busca textual (BM25)
+        search_reports_text,
+
+        # Busca híbrida (texto + imagem + proximidade, RRF)
+        hybrid_search_reports,
+
         # SQL tools (migrado do app.py)
         execute_sql_query,
 
@@ -32,5 +40,7 @@ __all__ = [
     "duraeco_mcp_server",
     "search_similar_waste_images",
     "search_reports_by_location",
+    "search_reports_text",
+    "hybrid_search_reports",
     "execute_sql_query",
 ]
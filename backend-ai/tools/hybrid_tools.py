@@ -0,0 +1,349 @@
+"""
+Hybrid Tools - Busca híbrida (texto + imagem + proximidade) em uma chamada
+
+Perguntas como "lixões de plástico parecidos com o relatório 123 a até 2 km
+no último mês" exigiam várias chamadas sequenciais de tools. A busca
+híbrida executa cada perna no seu próprio índice, em paralelo:
+
+- texto: BM25 (core/text_index.py)
+- imagem: similaridade de embedding com o relatório de referência
+  (core/vector_index.py)
+- proximidade: distância ao ponto de busca (core/geo_index.py)
+
+e funde as listas com Reciprocal Rank Fusion: score = Σ peso / (60 + rank).
+Filtros (raio, tipo de lixo, severidade, datas) valem para todas as pernas.
+"""
+
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+# Importar do SDK (SEM API KEY - usa Claude Code CLI local)
+from claude_agent_sdk import tool
+
+logger = logging.getLogger(__name__)
+
+# Constante do RRF (Cormack et al.): reduz o peso das primeiras posições
+RRF_K = 60
+
+# Candidatos por perna antes da fusão
+LEG_CANDIDATES = 100
+
+LEG_WEIGHTS = {"text": 1.0, "image": 1.0, "geo": 1.0}
+
+# O que o valor de cada perna significa na resposta
+LEG_VALUE_NAMES = {"text": "bm25", "image": "similarity", "geo": "distance_km"}
+
+
+@tool(
+    "hybrid_search_reports",
+    "Find waste reports in one call by combining text relevance, image similarity to a reference report "
+    "and proximity to a point (reciprocal-rank fusion). Give any combination of query, like_report_id and "
+    "latitude/longitude, plus optional filters",
+    {
+        "type": "object",
+        "properties": {
+            "query": {"type": "string", "description": "Text to match in descriptions and analyses"},
+            "like_report_id": {"type": "integer", "description": "Rank by visual similarity to this report's image"},
+            "latitude": {"type": "number"},
+            "longitude": {"type": "number"},
+            "radius_km": {"type": "number", "description": "Only reports within this distance of latitude/longitude"},
+            "waste_type": {"type": "string", "description": "Waste type name, e.g. Plastic"},
+            "min_severity": {"type": "integer"},
+            "max_severity": {"type": "integer"},
+            "date_from": {"type": "string", "description": "Report date lower bound (YYYY-MM-DD)"},
+            "date_to": {"type": "string", "description": "Report date upper bound, inclusive (YYYY-MM-DD)"},
+            "last_days": {"type": "integer", "description": "Shortcut for date_from = today - last_days"},
+            "limit": {"type": "integer", "description": "Maximum number of results (default 10)"}
+        }
+    }
+)
+async def hybrid_search_reports(args: Dict[str, Any]) -> Dict:
+    """
+    Busca híbrida com fusão por rank (RRF)
+
+    Args:
+        query: Texto (perna BM25)
+        like_report_id: Relatório de referência (perna de similaridade de imagem)
+        latitude, longitude: Ponto de busca (perna de proximidade)
+        radius_km: Raio máximo (filtro para todas as pernas)
+        waste_type, min_severity, max_severity, date_from, date_to, last_days: Filtros
+        limit: Número máximo de resultados (default: 10)
+
+    Returns:
+        {
+            "content": [{"type": "text", "text": "JSON com resultados"}]
+        }
+    """
+    # Pool de analytics: ferramentas do chat não disputam conexões com a API
+    import sys
+    import os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from core.database import get_analytics_connection as get_db_connection
+
+    try:
+        request = _parse_request(args)
+        if not (request["query"] or request["like_report_id"] or request["point"]):
+            raise ValueError("Provide at least one of query, like_report_id or latitude/longitude")
+
+        result = await hybrid_search(get_db_connection, request)
+
+        logger.info(
+            f"Hybrid search legs={list(result['legs'])}: {len(result['reports'])} results"
+        )
+
+        return {
+            "content": [{
+                "type": "text",
+                "text": json.dumps(result, indent=2, ensure_ascii=False)
+            }]
+        }
+
+    except Exception as e:
+        logger.error(f"Error in hybrid_search_reports: {e}")
+        return {
+            "content": [{
+                "type": "text",
+                "text": f"Error: {str(e)}"
+            }],
+            "is_error": True
+        }
+
+
+def _parse_request(args: Dict[str, Any]) -> Dict[str, Any]:
+    latitude, longitude = args.get("latitude"), args.get("longitude")
+    point = None
+    if latitude is not None and longitude is not None:
+        point = (float(latitude), float(longitude))
+        if not (-90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+            raise ValueError("latitude must be within [-90, 90] and longitude within [-180, 180]")
+
+    filters = {
+        key: args[key]
+        for key in ("waste_type", "min_severity", "max_severity", "date_from", "date_to")
+        if args.get(key) not in (None, "")
+    }
+    if args.get("last_days"):
+        filters["date_from"] = (datetime.now() - timedelta(days=int(args["last_days"]))).strftime("%Y-%m-%d")
+    for key in ("date_from", "date_to"):
+        if key in filters:
+            datetime.fromisoformat(str(filters[key]).strip())
+
+    radius = args.get("radius_km")
+    return {
+        "query": (args.get("query") or "").strip(),
+        "like_report_id": args.get("like_report_id"),
+        "point": point,
+        "radius_km": float(radius) if radius and point else None,
+        "filters": filters,
+        "limit": max(1, min(int(args.get("limit") or 10), 50)),
+    }
+
+
+async def hybrid_search(get_db_connection, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Executa as pernas em paralelo, funde por RRF e completa os dados no banco"""
+    from core.database import get_worker_connection
+    from core.geo_index import get_geo_index
+    from core.index_sync import get_index_syncer
+
+    # Índices sincronizados em background: as pernas só leem a memória
+    syncer = get_index_syncer(get_worker_connection)
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, syncer.wait_ready, "geo")
+    geo_index = get_geo_index()
+
+    legs = {}
+    if request["query"]:
+        legs["text"] = loop.run_in_executor(None, _text_leg, syncer, geo_index, request)
+    if request["like_report_id"]:
+        legs["image"] = loop.run_in_executor(None, _image_leg, syncer, get_db_connection, geo_index, request)
+    if request["point"]:
+        legs["geo"] = loop.run_in_executor(None, _geo_leg, geo_index, request)
+
+    ranked, skipped = {}, {}
+    for name, outcome in zip(legs, await asyncio.gather(*legs.values(), return_exceptions=True)):
+        if isinstance(outcome, Exception):
+            logger.warning(f"Hybrid search {name} leg failed: {outcome}")
+            skipped[name] = str(outcome)
+        elif outcome is None:
+            skipped[name] = "index unavailable"
+        else:
+            ranked[name] = outcome
+
+    fused = fuse(ranked, exclude=[request["like_report_id"]] if request["like_report_id"] else [])
+    top = fused[:request["limit"]]
+    details = await loop.run_in_executor(None, _load_reports, get_db_connection, [r for r, _ in top])
+
+    reports = []
+    for report_id, score in top:
+        row = details.get(report_id)
+        if row is None:
+            continue
+        row["rrf_score"] = round(score, 5)
+        row["legs"] = {
+            name: {"rank": rank + 1, LEG_VALUE_NAMES[name]: round(value, 4)}
+            for name, hits in ranked.items()
+            for rank, (hit_id, value) in enumerate(hits) if hit_id == report_id
+        }
+        reports.append(row)
+
+    return {
+        "query": request["query"] or None,
+        "like_report_id": request["like_report_id"],
+        "search_location": (
+            {"latitude": request["point"][0], "longitude": request["point"][1]} if request["point"] else None
+        ),
+        "radius_km": request["radius_km"],
+        "filters": request["filters"],
+        "legs": {name: len(hits) for name, hits in ranked.items()},
+        "legs_skipped": skipped,
+        "found": len(reports),
+        "reports": reports,
+    }
+
+
+def fuse(ranked: Dict[str, List[Tuple[int, float]]], exclude=()) -> List[Tuple[int, float]]:
+    """Reciprocal Rank Fusion das listas ordenadas de cada perna
+
+    Args:
+        ranked: {perna: [(report_id, score da perna)] em ordem de relevância}
+        exclude: report_ids a remover (ex: o relatório de referência)
+
+    Returns:
+        [(report_id, score RRF)] em ordem decrescente
+    """
+    excluded = set(exclude)
+    scores: Dict[int, float] = {}
+    for name, hits in ranked.items():
+        weight = LEG_WEIGHTS.get(name, 1.0)
+        for rank, (report_id, _) in enumerate(hits):
+            if report_id not in excluded:
+                scores[report_id] = scores.get(report_id, 0.0) + weight / (RRF_K + rank + 1)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def _within(geo_index, report_ids: List[int], request: Dict[str, Any]) -> Dict[int, Optional[float]]:
+    """Aplica os filtros comuns (e o raio) a resultados de outra perna"""
+    point = request["point"]
+    matches = geo_index.lookup(
+        report_ids,
+        latitude=point[0] if point else None,
+        longitude=point[1] if point else None,
+        **request["filters"]
+    )
+    if request["radius_km"] is not None:
+        matches = {r: d for r, d in matches.items() if d is not None and d <= request["radius_km"]}
+    return matches
+
+
+def _text_leg(syncer, geo_index, request: Dict[str, Any]) -> List[Tuple[int, float]]:
+    from core.text_index import get_text_index
+
+    syncer.wait_ready("text")
+    index = get_text_index()
+    hits, _, _ = index.search(request["query"], limit=LEG_CANDIDATES, **request["filters"])
+
+    if request["radius_km"] is None:
+        return hits
+    allowed = _within(geo_index, [r for r, _ in hits], request)
+    return [(r, score) for r, score in hits if r in allowed]
+
+
+def _image_leg(syncer, get_db_connection, geo_index, request: Dict[str, Any]) -> Optional[List[Tuple[int, float]]]:
+    from core.vector_index import get_image_index, parse_embedding
+
+    # Até o primeiro sync a perna fica de fora (None = índice indisponível)
+    index = get_image_index() if syncer.is_ready("image") else None
+    if index is None:
+        return None
+
+    conn = get_db_connection()
+    if not conn:
+        raise Exception("Database connection failed")
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            """
+            SELECT analysis_id, image_embedding
+            FROM analysis_results
+            WHERE report_id = %s AND image_embedding IS NOT NULL
+            ORDER BY analyzed_date DESC
+            """,
+            (request["like_report_id"],)
+        )
+        own_analyses = cursor.fetchall()
+        query = parse_embedding(own_analyses[0]["image_embedding"]) if own_analyses else None
+        if query is None or len(query) != index.dim:
+            cursor.close()
+            return []
+
+        # Folga para análises repetidas e para os filtros
+        hits = index.search(query, k=LEG_CANDIDATES * 3, exclude_ids=[a["analysis_id"] for a in own_analyses])
+        if not hits:
+            cursor.close()
+            return []
+
+        placeholders = ", ".join(["%s"] * len(hits))
+        cursor.execute(
+            f"SELECT analysis_id, report_id FROM analysis_results WHERE analysis_id IN ({placeholders})",
+            tuple(analysis_id for analysis_id, _ in hits)
+        )
+        report_by_analysis = {row["analysis_id"]: row["report_id"] for row in cursor.fetchall()}
+        cursor.close()
+    finally:
+        conn.close()
+
+    # Uma entrada por relatório (a análise mais similar; hits já ordenados)
+    ranked, seen = [], set()
+    for analysis_id, similarity in hits:
+        report_id = report_by_analysis.get(analysis_id)
+        if report_id is not None and report_id not in seen:
+            seen.add(report_id)
+            ranked.append((report_id, similarity))
+
+    allowed = _within(geo_index, [r for r, _ in ranked], request)
+    return [(r, similarity) for r, similarity in ranked if r in allowed][:LEG_CANDIDATES]
+
+
+def _geo_leg(geo_index, request: Dict[str, Any]) -> List[Tuple[int, float]]:
+    latitude, longitude = request["point"]
+    if request["radius_km"] is not None:
+        return geo_index.radius(latitude, longitude, request["radius_km"], limit=LEG_CANDIDATES, **request["filters"])
+    return geo_index.nearest(latitude, longitude, LEG_CANDIDATES, **request["filters"])
+
+
+def _load_reports(get_db_connection, report_ids: List[int]) -> Dict[int, Dict]:
+    if not report_ids:
+        return {}
+
+    conn = get_db_connection()
+    if not conn:
+        raise Exception("Database connection failed")
+
+    placeholders = ", ".join(["%s"] * len(report_ids))
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(
+        f"""
+        SELECT r.report_id, r.latitude, r.longitude, r.report_date, r.status, r.description,
+               r.address_text, wt.name AS waste_type, ar.severity_score, ar.priority_level
+        FROM reports r
+        LEFT JOIN analysis_results ar ON ar.analysis_id = (
+            SELECT MAX(analysis_id) FROM analysis_results WHERE report_id = r.report_id
+        )
+        LEFT JOIN waste_types wt ON ar.waste_type_id = wt.waste_type_id
+        WHERE r.report_id IN ({placeholders})
+        """,
+        tuple(report_ids)
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    for row in rows:
+        row["latitude"] = float(row["latitude"]) if row["latitude"] is not None else None
+        row["longitude"] = float(row["longitude"]) if row["longitude"] is not None else None
+        row["report_date"] = row["report_date"].isoformat() if row["report_date"] else None
+    return {row["report_id"]: row for row in rows}
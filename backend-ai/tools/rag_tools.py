@@ -1,12 +1,16 @@
 """
 RAG Tools - Retrieval Augmented Generation usando embeddings vetoriais
 
-Ferramentas para busca semântica usando VEC_COSINE_DISTANCE no MySQL/TiDB.
+Ferramentas para busca semântica: índice ANN em processo para embeddings de
+imagem, com VEC_COSINE_DISTANCE no MySQL/TiDB como fallback, e índice
+espacial em grade para busca por localização.
 """
 
 import json
+import asyncio
 import logging
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 
 # Importar do SDK (SEM API KEY - usa Claude Code CLI local)
 from claude_agent_sdk import tool
@@ -25,10 +29,14 @@ logger = logging.getLogger(__name__)
 )
 async def search_similar_waste_images(args: Dict[str, Any]) -> Dict:
     """
-    Busca relatórios com imagens similares usando VEC_COSINE_DISTANCE
+    Busca relatórios com imagens similares usando embeddings
 
     Esta ferramenta usa embeddings vetoriais (VECTOR 1024-d) para encontrar
-    imagens de resíduos visualmente similares.
+    imagens de resíduos visualmente similares. Os embeddings são gerados
+    localmente em process_report (core/embeddings.py: cor, bordas, textura).
+
+    A busca usa o índice ANN em processo (core/vector_index.py); se ele não
+    estiver disponível, usa VEC_COSINE_DISTANCE no banco.
 
     Args:
         query_report_id: ID do relatório de referência
@@ -40,66 +48,37 @@ async def search_similar_waste_images(args: Dict[str, Any]) -> Dict:
             "content": [{"type": "text", "text": "JSON com resultados"}]
         }
     """
-    # Importar função de conexão do módulo pai
+    # Pool de analytics: ferramentas do chat não disputam conexões com a API
     import sys
     import os
     sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from app import get_db_connection
+    from core.database import get_analytics_connection as get_db_connection, get_worker_connection
+    from core.index_sync import get_index_syncer
+    from core.vector_index import get_image_index
 
     report_id = args["query_report_id"]
     limit = args.get("limit", 5)
     min_similarity = args.get("min_similarity", 0.1)
 
     try:
-        conn = get_db_connection()
-        if not conn:
-            return {
-                "content": [{
-                    "type": "text",
-                    "text": "Error: Database connection failed"
-                }],
-                "is_error": True
-            }
-
-        cursor = conn.cursor(dictionary=True)
-
-        # Query usando embeddings vetoriais
-        query = """
-            SELECT
-                r.report_id,
-                r.latitude,
-                r.longitude,
-                r.description,
-                r.status,
-                r.created_at,
-                ar.waste_type,
-                ar.severity_score,
-                ar.priority_level,
-                ar.description as analysis_description,
-                VEC_COSINE_DISTANCE(
-                    ar.image_embedding,
-                    (SELECT image_embedding
-                     FROM analysis_results
-                     WHERE report_id = %s)
-                ) as similarity
-            FROM reports r
-            JOIN analysis_results ar ON r.report_id = ar.report_id
-            WHERE r.report_id != %s
-              AND ar.image_embedding IS NOT NULL
-            ORDER BY similarity ASC
-            LIMIT %s
-        """
-
-        cursor.execute(query, (report_id, report_id, limit))
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
-
-        # Filtrar por similaridade mínima
-        filtered = [
-            r for r in results
-            if r['similarity'] is not None and r['similarity'] < min_similarity
-        ]
+        filtered = None
+        search_method = "ann_index"
+
+        # Índice sincronizado em background; até o primeiro sync, SQL
+        index = get_image_index() if get_index_syncer(get_worker_connection).is_ready("image") else None
+        if index is not None:
+            try:
+                loop = asyncio.get_event_loop()
+                filtered = await loop.run_in_executor(
+                    None, _search_similar_with_index,
+                    index, get_db_connection, report_id, limit, min_similarity
+                )
+            except Exception as e:
+                logger.warning(f"Vector index search failed, falling back to SQL: {e}")
+
+        if filtered is None:
+            search_method = "sql"
+            filtered = _search_similar_with_sql(get_db_connection, report_id, limit, min_similarity)
 
         # Formatar resultado
         response_data = {
@@ -107,6 +86,7 @@ async def search_similar_waste_images(args: Dict[str, Any]) -> Dict:
             "found": len(filtered),
             "limit": limit,
             "min_similarity": min_similarity,
+            "search_method": search_method,
             "similar_reports": [
                 {
                     "report_id": r["report_id"],
@@ -127,7 +107,7 @@ async def search_similar_waste_images(args: Dict[str, Any]) -> Dict:
             ]
         }
 
-        logger.info(f"Found {len(filtered)} similar images for report {report_id}")
+        logger.info(f"Found {len(filtered)} similar images for report {report_id} ({search_method})")
 
         return {
             "content": [{
@@ -147,109 +127,220 @@ async def search_similar_waste_images(args: Dict[str, Any]) -> Dict:
         }
 
 
+SIMILAR_REPORT_COLUMNS = """
+    r.report_id,
+    r.latitude,
+    r.longitude,
+    r.description,
+    r.status,
+    r.report_date as created_at,
+    wt.name as waste_type,
+    ar.severity_score,
+    ar.priority_level,
+    ar.analysis_notes as analysis_description
+"""
+
+
+def _search_similar_with_index(index, get_db_connection, report_id: int, limit: int,
+                               min_similarity: float) -> Optional[List[Dict]]:
+    """Busca no índice ANN e completa os dados no banco (None = usar SQL)"""
+    from core.vector_index import parse_embedding
+
+    if len(index) == 0:
+        return None
+
+    conn = get_db_connection()
+    if not conn:
+        raise Exception("Database connection failed")
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+
+        # Embedding da análise mais recente do relatório de referência
+        cursor.execute(
+            """
+            SELECT analysis_id, image_embedding
+            FROM analysis_results
+            WHERE report_id = %s
+            ORDER BY analyzed_date DESC
+            """,
+            (report_id,)
+        )
+        own_analyses = cursor.fetchall()
+        query = next(
+            (parse_embedding(a["image_embedding"]) for a in own_analyses if a["image_embedding"] is not None),
+            None
+        )
+        if query is None or len(query) != index.dim:
+            cursor.close()
+            conn.close()
+            return []
+
+        # Folga para análises repetidas do mesmo relatório e abaixo do mínimo
+        hits = index.search(query, k=limit * 2 + 5, exclude_ids=[a["analysis_id"] for a in own_analyses])
+        similarity_by_analysis = {
+            analysis_id: similarity for analysis_id, similarity in hits
+            if similarity >= min_similarity
+        }
+        if not similarity_by_analysis:
+            cursor.close()
+            conn.close()
+            return []
+
+        placeholders = ", ".join(["%s"] * len(similarity_by_analysis))
+        cursor.execute(
+            f"""
+            SELECT ar.analysis_id, {SIMILAR_REPORT_COLUMNS}
+            FROM analysis_results ar
+            JOIN reports r ON r.report_id = ar.report_id
+            LEFT JOIN waste_types wt ON ar.waste_type_id = wt.waste_type_id
+            WHERE ar.analysis_id IN ({placeholders}) AND r.report_id != %s
+            """,
+            tuple(similarity_by_analysis) + (report_id,)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+
+        # Um resultado por relatório (a análise mais similar)
+        best = {}
+        for row in rows:
+            row["similarity"] = similarity_by_analysis[row["analysis_id"]]
+            current = best.get(row["report_id"])
+            if current is None or row["similarity"] > current["similarity"]:
+                best[row["report_id"]] = row
+
+        return sorted(best.values(), key=lambda r: r["similarity"], reverse=True)[:limit]
+
+    except Exception:
+        conn.close()
+        raise
+
+
+def _search_similar_with_sql(get_db_connection, report_id: int, limit: int, min_similarity: float) -> List[Dict]:
+    """Busca com VEC_COSINE_DISTANCE no banco (full scan)"""
+    conn = get_db_connection()
+    if not conn:
+        raise Exception("Database connection failed")
+
+    cursor = conn.cursor(dictionary=True)
+
+    # Query usando embeddings vetoriais
+    query = f"""
+        SELECT
+            {SIMILAR_REPORT_COLUMNS},
+            VEC_COSINE_DISTANCE(
+                ar.image_embedding,
+                (SELECT image_embedding
+                 FROM analysis_results
+                 WHERE report_id = %s AND image_embedding IS NOT NULL
+                 ORDER BY analyzed_date DESC
+                 LIMIT 1)
+            ) as distance
+        FROM reports r
+        JOIN analysis_results ar ON r.report_id = ar.report_id
+        LEFT JOIN waste_types wt ON ar.waste_type_id = wt.waste_type_id
+        WHERE r.report_id != %s
+          AND ar.image_embedding IS NOT NULL
+        ORDER BY distance ASC
+        LIMIT %s
+    """
+
+    cursor.execute(query, (report_id, report_id, limit))
+    results = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    # Similaridade de cosseno = 1 - distância; filtrar pela mínima
+    for r in results:
+        r['similarity'] = 1.0 - float(r['distance']) if r['distance'] is not None else None
+    return [
+        r for r in results
+        if r['similarity'] is not None and r['similarity'] >= min_similarity
+    ]
+
+
 @tool(
     "search_reports_by_location",
-    "Search for reports near a geographic location using location embeddings",
+    "Search for analysed waste reports near a geographic location (radius or k-nearest), "
+    "optionally filtered by waste type, severity and report date range",
     {
-        "latitude": float,
-        "longitude": float,
-        "radius_km": float,
-        "limit": int
+        "type": "object",
+        "properties": {
+            "latitude": {"type": "number"},
+            "longitude": {"type": "number"},
+            "radius_km": {"type": "number", "description": "Search radius in km (default 5; maximum distance when nearest=true)"},
+            "limit": {"type": "integer", "description": "Maximum number of results (default 10)"},
+            "nearest": {"type": "boolean", "description": "Return the `limit` closest reports instead of all within the radius"},
+            "waste_type": {"type": "string", "description": "Waste type name, e.g. Plastic"},
+            "min_severity": {"type": "integer"},
+            "max_severity": {"type": "integer"},
+            "date_from": {"type": "string", "description": "Report date lower bound (YYYY-MM-DD)"},
+            "date_to": {"type": "string", "description": "Report date upper bound, inclusive (YYYY-MM-DD)"}
+        },
+        "required": ["latitude", "longitude"]
     }
 )
 async def search_reports_by_location(args: Dict[str, Any]) -> Dict:
     """
-    Busca relatórios próximos usando location_embedding
+    Busca relatórios próximos usando o índice espacial em processo
 
-    Combina busca vetorial (similaridade semântica de localização)
-    com cálculo de distância real (fórmula Haversine).
+    O índice em grade (core/geo_index.py) seleciona só as células que cobrem
+    o raio, aplica os filtros e calcula a distância exata (Haversine); os
+    detalhes dos relatórios encontrados vêm do banco pela chave primária.
 
     Args:
         latitude: Latitude do ponto de busca
         longitude: Longitude do ponto de busca
         radius_km: Raio de busca em quilômetros (default: 5.0)
         limit: Número máximo de resultados (default: 10)
+        nearest: k vizinhos mais próximos (radius_km vira distância máxima
+            e só é aplicado se informado)
+        waste_type, min_severity, max_severity, date_from, date_to: Filtros
 
     Returns:
         {
             "content": [{"type": "text", "text": "JSON com resultados"}]
         }
     """
-    # Importar funções do módulo pai
+    # Pool de analytics: ferramentas do chat não disputam conexões com a API
     import sys
     import os
     sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from app import get_db_connection, invoke_titan_embed_text
-
-    lat = args["latitude"]
-    lon = args["longitude"]
-    radius = args.get("radius_km", 5.0)
-    limit = args.get("limit", 10)
+    from core.database import get_analytics_connection as get_db_connection, get_worker_connection
+    from core.geo_index import get_geo_index
+    from core.index_sync import get_index_syncer
+
+    lat = float(args["latitude"])
+    lon = float(args["longitude"])
+    nearest = bool(args.get("nearest", False))
+    radius = args.get("radius_km")
+    limit = max(1, min(int(args.get("limit") or 10), 100))
+    filters = {
+        key: args[key]
+        for key in ("waste_type", "min_severity", "max_severity", "date_from", "date_to")
+        if args.get(key) not in (None, "")
+    }
 
     try:
-        # 1. Gerar embedding para localização de busca
-        location_text = f"Geographic location at latitude {lat} longitude {lon}"
-        query_embedding = invoke_titan_embed_text(location_text)
-
-        if not query_embedding:
-            return {
-                "content": [{
-                    "type": "text",
-                    "text": "Error: Failed to generate location embedding"
-                }],
-                "is_error": True
-            }
-
-        # 2. Buscar usando VEC_COSINE_DISTANCE + distância real
-        conn = get_db_connection()
-        if not conn:
-            return {
-                "content": [{
-                    "type": "text",
-                    "text": "Error: Database connection failed"
-                }],
-                "is_error": True
-            }
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("latitude must be within [-90, 90] and longitude within [-180, 180]")
+        for key in ("date_from", "date_to"):
+            if key in filters:
+                datetime.fromisoformat(str(filters[key]).strip())
 
-        cursor = conn.cursor(dictionary=True)
+        # Índice sincronizado em background: a busca só lê a memória
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, get_index_syncer(get_worker_connection).wait_ready, "geo")
+        index = get_geo_index()
 
-        query = """
-            SELECT
-                r.report_id,
-                r.latitude,
-                r.longitude,
-                r.description,
-                r.status,
-                r.created_at,
-                ar.waste_type,
-                ar.severity_score,
-                ar.priority_level,
-                VEC_COSINE_DISTANCE(
-                    ar.location_embedding,
-                    %s
-                ) as location_similarity,
-                (6371 * acos(
-                    cos(radians(%s)) * cos(radians(r.latitude)) *
-                    cos(radians(r.longitude) - radians(%s)) +
-                    sin(radians(%s)) * sin(radians(r.latitude))
-                )) as distance_km
-            FROM reports r
-            JOIN analysis_results ar ON r.report_id = ar.report_id
-            WHERE ar.location_embedding IS NOT NULL
-            HAVING distance_km < %s
-            ORDER BY location_similarity ASC
-            LIMIT %s
-        """
-
-        cursor.execute(query, (
-            json.dumps(query_embedding),
-            lat, lon, lat,
-            radius,
-            limit
-        ))
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        if nearest:
+            hits = index.nearest(lat, lon, limit, max_radius_km=radius, **filters)
+        else:
+            radius = 5.0 if radius is None else float(radius)
+            hits = index.radius(lat, lon, radius, limit=limit, **filters)
+
+        results = await loop.run_in_executor(None, _load_nearby_reports, get_db_connection, hits)
 
         # Formatar resultado
         response_data = {
@@ -258,13 +349,14 @@ async def search_reports_by_location(args: Dict[str, Any]) -> Dict:
                 "longitude": lon
             },
             "radius_km": radius,
+            "nearest": nearest,
+            "filters": filters,
             "found": len(results),
             "limit": limit,
             "nearby_reports": [
                 {
                     "report_id": r["report_id"],
-                    "distance_km": round(float(r["distance_km"]), 2),
-                    "location_similarity": round(float(r["location_similarity"]), 4),
+                    "distance_km": round(r["distance_km"], 3),
                     "waste_type": r["waste_type"],
                     "severity_score": r["severity_score"],
                     "priority_level": r["priority_level"],
@@ -280,7 +372,7 @@ async def search_reports_by_location(args: Dict[str, Any]) -> Dict:
             ]
         }
 
-        logger.info(f"Found {len(results)} reports near ({lat}, {lon}) within {radius}km")
+        logger.info(f"Found {len(results)} reports near ({lat}, {lon}) (radius {radius}, nearest={nearest})")
 
         return {
             "content": [{
@@ -298,3 +390,50 @@ async def search_reports_by_location(args: Dict[str, Any]) -> Dict:
             }],
             "is_error": True
         }
+
+
+def _load_nearby_reports(get_db_connection, hits: List[Tuple[int, float]]) -> List[Dict]:
+    """Detalhes dos relatórios encontrados no índice, na ordem de distância"""
+    if not hits:
+        return []
+
+    conn = get_db_connection()
+    if not conn:
+        raise Exception("Database connection failed")
+
+    distance_by_report = dict(hits)
+    placeholders = ", ".join(["%s"] * len(distance_by_report))
+
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(
+        f"""
+        SELECT {NEARBY_REPORT_COLUMNS}
+        FROM reports r
+        JOIN analysis_results ar ON ar.analysis_id = (
+            SELECT MAX(analysis_id) FROM analysis_results WHERE report_id = r.report_id
+        )
+        LEFT JOIN waste_types wt ON ar.waste_type_id = wt.waste_type_id
+        WHERE r.report_id IN ({placeholders})
+        """,
+        tuple(distance_by_report)
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    for row in rows:
+        row["distance_km"] = distance_by_report[row["report_id"]]
+    return sorted(rows, key=lambda r: r["distance_km"])
+
+
+NEARBY_REPORT_COLUMNS = """
+    r.report_id,
+    r.latitude,
+    r.longitude,
+    r.description,
+    r.status,
+    r.report_date as created_at,
+    wt.name as waste_type,
+    ar.severity_score,
+    ar.priority_level
+"""
@@ -4,18 +4,56 @@ SQL Tools - Ferramentas de query SQL seguras
 Migrado de app.py - mantém toda lógica de segurança.
 """
 
+import os
+import re
 import json
+import asyncio
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
 from claude_agent_sdk import tool
+from mysql.connector import FieldType
+
+from core.cancellation import CancellationToken, GenerationCancelled, current_token, track_query
+from core.query_cache import get_query_cache
+from tools.sql_validator import MAX_ROWS, SQLValidationError, validate_query
 
 logger = logging.getLogger(__name__)
 
 
+class QueryTooExpensive(Exception):
+    """EXPLAIN estimou mais linhas examinadas que MAX_ESTIMATED_ROWS"""
+
+    def __init__(self, estimated_rows: int, plan: List[Dict]):
+        super().__init__(f"estimated {estimated_rows} rows examined")
+        self.estimated_rows = estimated_rows
+        self.plan = plan
+
+# Orçamento do resultado enviado ao modelo (~4 caracteres por token)
+RESULT_MAX_BYTES = int(os.getenv("SQL_RESULT_MAX_BYTES", "16000"))
+MAX_CELL_CHARS = int(os.getenv("SQL_RESULT_MAX_CELL_CHARS", "500"))
+FETCH_BATCH_ROWS = 50
+
+# Guarda de custo: queries do agente dividem o pool com o envio de relatórios
+MAX_EXECUTION_MS = int(os.getenv("SQL_MAX_EXECUTION_MS", "5000"))
+MAX_ESTIMATED_ROWS = int(os.getenv("SQL_MAX_ESTIMATED_ROWS", "500000"))
+
+# ER_QUERY_TIMEOUT: MAX_EXECUTION_TIME estourado
+_ER_QUERY_TIMEOUT = 3024
+
+# Colunas omitidas quando vêm de SELECT * (só entram se citadas no SELECT)
+_LARGE_FIELD_TYPES = {FieldType.JSON, getattr(FieldType, "VECTOR", 242)}
+_LARGE_COLUMN_RE = re.compile(r"embedding|vector", re.IGNORECASE)
+_SELECT_LIST_RE = re.compile(r"^\s*select\s+(.*?)\s+from\s", re.IGNORECASE | re.DOTALL)
+
+
 @tool(
     "execute_sql_query",
-    "Execute read-only SQL query on DuraEco database. Returns up to 100 rows.",
+    "Execute read-only SQL query on DuraEco database. Returns up to 100 rows as "
+    "{columns, rows (arrays in column order)}. Large results are truncated (see 'truncated'); "
+    "embedding/JSON/binary columns are omitted unless named in the SELECT list. "
+    "Prefer aggregates and explicit columns over SELECT *. Queries estimated to scan too many rows "
+    "are refused and slow queries are aborted (error with a hint): filter on indexed columns.",
     {
         "query": str
     }
@@ -24,11 +62,11 @@ async def execute_sql_query(args: Dict[str, Any]) -> Dict:
     """
     Executa query SQL READ-ONLY no banco DuraEco
 
-    SEGURANÇA:
-    - Apenas SELECT queries permitidas
-    - Bloqueia INSERT, UPDATE, DELETE, DROP, ALTER, CREATE, TRUNCATE
-    - Auto-adiciona LIMIT 100 se não presente
-    - Não permite queries em tabelas sensíveis (users, api_keys)
+    SEGURANÇA (tools/sql_validator.py):
+    - Apenas um comando SELECT (ou WITH ... SELECT)
+    - Bloqueia escrita, DDL, locks, INTO OUTFILE e funções perigosas
+    - Adiciona LIMIT 100 se ausente, reduz LIMIT maior que 100
+    - Não permite queries em tabelas sensíveis (users, api_keys, ...)
 
     Args:
         query: Query SQL (apenas SELECT)
@@ -38,72 +76,39 @@ async def execute_sql_query(args: Dict[str, Any]) -> Dict:
             "content": [{"type": "text", "text": "JSON com resultados"}]
         }
     """
-    # Importar função de conexão do módulo pai
+    # Pool de analytics: ferramentas do chat não disputam conexões com a API
     import sys
     import os
     sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from app import get_db_connection
-
-    query = args["query"]
-    query_upper = query.upper().strip()
+    from core.database import get_analytics_connection as get_db_connection
 
-    # VALIDAÇÃO 1: Apenas SELECT
-    if not query_upper.startswith("SELECT"):
-        logger.warning(f"Blocked non-SELECT query: {query[:100]}")
+    # VALIDAÇÃO estrutural (tokenizada): comando, tabelas, funções e LIMIT
+    try:
+        validated = validate_query(args["query"], max_execution_ms=MAX_EXECUTION_MS)
+    except SQLValidationError as e:
+        logger.warning(f"Blocked query ({e}): {args['query'][:100]}")
         return {
             "content": [{
                 "type": "text",
-                "text": "Error: Only SELECT queries are allowed for security reasons."
+                "text": f"Error: {e}"
             }],
             "is_error": True
         }
 
-    # VALIDAÇÃO 2: Bloquear palavras perigosas
-    dangerous_keywords = [
-        "INSERT", "UPDATE", "DELETE", "DROP",
-        "ALTER", "CREATE", "TRUNCATE", "GRANT",
-        "REVOKE", "EXEC", "EXECUTE"
-    ]
-
-    for keyword in dangerous_keywords:
-        if keyword in query_upper:
-            logger.warning(f"Blocked query with dangerous keyword {keyword}: {query[:100]}")
-            return {
-                "content": [{
-                    "type": "text",
-                    "text": f"Error: Dangerous operation '{keyword}' is not allowed."
-                }],
-                "is_error": True
-            }
-
-    # VALIDAÇÃO 3: Bloquear tabelas sensíveis
-    sensitive_tables = [
-        "users", "user_verifications", "api_keys",
-        "refresh_tokens"  # Novo - tokens de refresh
-    ]
-
-    query_lower = query.lower()
-    for table in sensitive_tables:
-        # Verificar se tabela aparece no FROM ou JOIN
-        if f" {table} " in f" {query_lower} " or f" {table}," in query_lower:
-            logger.warning(f"Blocked query accessing sensitive table {table}: {query[:100]}")
-            return {
-                "content": [{
-                    "type": "text",
-                    "text": f"Error: Access to table '{table}' is not allowed for privacy reasons."
-                }],
-                "is_error": True
-            }
+    query = validated["query"]
+    if validated["limit"]:
+        logger.info(f"LIMIT {validated['limit']} ({MAX_ROWS} rows)")
 
-    # VALIDAÇÃO 4: Auto-adicionar LIMIT se não tiver
-    if "LIMIT" not in query_upper:
-        query = query.rstrip(";") + " LIMIT 100"
-        logger.info("Auto-added LIMIT 100 to query")
-
-    # EXECUTAR QUERY
+    # EXECUTAR QUERY (cache por SQL canônico; no miss roda fora do event loop,
+    # abortável pelo cancelamento do chat)
     try:
-        conn = get_db_connection()
-        if not conn:
+        loop = asyncio.get_running_loop()
+        token = current_token()
+        result, cache_age = await get_query_cache(get_db_connection).get_or_run(
+            query,
+            lambda: loop.run_in_executor(None, _run_query, get_db_connection, query, token)
+        )
+        if result is None:
             return {
                 "content": [{
                     "type": "text",
@@ -112,33 +117,55 @@ async def execute_sql_query(args: Dict[str, Any]) -> Dict:
                 "is_error": True
             }
 
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(query)
-        results = cursor.fetchall()
+        row_count = len(result["rows"])
 
-        # Contar linhas afetadas
-        row_count = len(results)
+        if cache_age is None:
+            logger.info(f"SQL query executed successfully, returned {row_count} rows")
+        else:
+            logger.info(f"SQL query served from cache ({cache_age:.0f}s old), {row_count} rows")
 
-        cursor.close()
-        conn.close()
-
-        logger.info(f"SQL query executed successfully, returned {row_count} rows")
+        # Formatar resposta (tabular e sem indentação: menos tokens)
+        response_data = {"query": query, "row_count": row_count, **result}
+        if cache_age is not None:
+            response_data["cached"] = True
+            response_data["cache_age_seconds"] = round(cache_age)
 
-        # Formatar resposta
-        response_data = {
-            "rows": row_count,
-            "data": results,
-            "query": query
+        return {
+            "content": [{
+                "type": "text",
+                "text": json.dumps(response_data, separators=(",", ":"), ensure_ascii=False, default=str)
+            }]
         }
 
+    except GenerationCancelled:
+        logger.info(f"SQL query cancelled: {query[:100]}")
         return {
             "content": [{
                 "type": "text",
-                "text": json.dumps(response_data, indent=2, ensure_ascii=False, default=str)
-            }]
+                "text": "Query cancelled: the user interrupted the conversation."
+            }],
+            "is_error": True
         }
 
+    except QueryTooExpensive as e:
+        logger.warning(f"Blocked expensive query ({e}): {query[:100]}")
+        return _error_result({
+            "error": "query_too_expensive",
+            "estimated_rows_examined": e.estimated_rows,
+            "budget": MAX_ESTIMATED_ROWS,
+            "plan": e.plan,
+            "hint": "Too expensive: add a filter on an indexed column (report_id, report_date, status, "
+                    "user_id), join on keys, or aggregate in smaller date ranges."
+        })
+
     except Exception as e:
+        if getattr(e, "errno", None) == _ER_QUERY_TIMEOUT:
+            logger.warning(f"SQL query timed out after {MAX_EXECUTION_MS} ms: {query[:100]}")
+            return _error_result({
+                "error": "query_timeout",
+                "timeout_ms": MAX_EXECUTION_MS,
+                "hint": "Query took too long: add a filter on an indexed column or narrow the date range."
+            })
         logger.error(f"SQL query error: {e}")
         return {
             "content": [{
@@ -147,3 +174,151 @@ async def execute_sql_query(args: Dict[str, Any]) -> Dict:
             }],
             "is_error": True
         }
+
+
+def _run_query(get_db_connection, query: str, token: Optional[CancellationToken]) -> Optional[Dict]:
+    """Executa a query registrando a conexão no token (para KILL QUERY)
+
+    Lê em lotes (fetchmany) e para de acumular ao atingir RESULT_MAX_BYTES;
+    o restante é só contado (o cursor não bufferizado precisa ser drenado).
+
+    Returns:
+        {"columns", "rows", ...} com "truncated" e "omitted_columns" quando
+        aplicável, ou None se a conexão falhou
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    try:
+        cursor = conn.cursor()
+        with track_query(conn, get_db_connection, token):
+            if MAX_ESTIMATED_ROWS > 0:
+                estimated, plan = _estimate_rows(cursor, query)
+                if estimated is not None and estimated > MAX_ESTIMATED_ROWS:
+                    cursor.close()
+                    raise QueryTooExpensive(estimated, plan)
+            cursor.execute(query)
+            keep, omitted = _select_columns(cursor.description or [], query)
+            columns = [cursor.description[i][0] for i in keep]
+
+            rows: List[List] = []
+            size = len(json.dumps(columns, ensure_ascii=False))
+            clipped_cells = 0
+            total = 0
+            full = False
+            while True:
+                batch = cursor.fetchmany(FETCH_BATCH_ROWS)
+                if not batch:
+                    break
+                total += len(batch)
+                if full:
+                    continue
+                for raw in batch:
+                    row, clipped = _compact_row(raw, keep)
+                    row_size = len(json.dumps(row, separators=(",", ":"), ensure_ascii=False, default=str)) + 1
+                    if rows and size + row_size > RESULT_MAX_BYTES:
+                        full = True
+                        break
+                    rows.append(row)
+                    size += row_size
+                    clipped_cells += clipped
+        cursor.close()
+    finally:
+        conn.close()
+
+    result: Dict[str, Any] = {"columns": columns, "rows": rows}
+    if len(rows) < total:
+        result["truncated"] = {
+            "reason": f"result exceeded {RESULT_MAX_BYTES} bytes",
+            "rows_returned": len(rows),
+            "rows_total": total,
+        }
+        logger.info(f"SQL result truncated to {len(rows)} of {total} rows")
+    if clipped_cells:
+        result["clipped_cells"] = clipped_cells
+    if omitted:
+        result["omitted_columns"] = omitted
+    return result
+
+
+def _estimate_rows(cursor, query: str) -> Tuple[Optional[int], List[Dict]]:
+    """Linhas examinadas estimadas pelo EXPLAIN (sem executar a query)
+
+    Em cada SELECT do plano, junção nested-loop: cada tabela é lida uma vez
+    por linha que sai das anteriores (rows × filtered%). Os SELECTs somam.
+
+    Returns:
+        (estimativa ou None se o plano não tem estimativas, plano resumido)
+    """
+    cursor.execute(f"EXPLAIN {query}")
+    names = [d[0].lower() for d in cursor.description or []]
+    steps = [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    plan = []
+    examined: Dict[Any, float] = {}
+    fanout: Dict[Any, float] = {}
+    for step in steps:
+        rows = step.get("rows", step.get("estrows"))
+        if rows is None:
+            continue
+        rows = float(rows)
+        select_id = step.get("id")
+        filtered = float(step.get("filtered") or 100) / 100
+        examined[select_id] = examined.get(select_id, 0.0) + fanout.get(select_id, 1.0) * rows
+        fanout[select_id] = fanout.get(select_id, 1.0) * max(rows * filtered, 1.0)
+        plan.append({
+            "table": step.get("table"),
+            "type": step.get("type"),
+            "key": step.get("key"),
+            "rows": int(rows),
+        })
+
+    if not examined:
+        return None, plan
+    return int(sum(examined.values())), plan
+
+
+def _error_result(error: Dict) -> Dict:
+    return {
+        "content": [{
+            "type": "text",
+            "text": json.dumps(error, separators=(",", ":"), ensure_ascii=False, default=str)
+        }],
+        "is_error": True
+    }
+
+
+def _select_columns(description: List[Tuple], query: str) -> Tuple[List[int], List[str]]:
+    """Índices das colunas mantidas e nomes das omitidas
+
+    Embedding, JSON e binárias só entram se o nome aparece na lista do SELECT.
+    """
+    match = _SELECT_LIST_RE.match(query)
+    select_list = match.group(1).lower() if match else ""
+
+    keep, omitted = [], []
+    for i, column in enumerate(description):
+        name, type_code = column[0], column[1]
+        large = type_code in _LARGE_FIELD_TYPES or _LARGE_COLUMN_RE.search(name)
+        if large and not re.search(rf"\b{re.escape(name.lower())}\b", select_list):
+            omitted.append(name)
+        else:
+            keep.append(i)
+    return keep, omitted
+
+
+def _compact_row(raw: Tuple, keep: List[int]) -> Tuple[List, int]:
+    """Valores das colunas mantidas, com textos longos e binários cortados"""
+    row = []
+    clipped = 0
+    for i in keep:
+        value = raw[i]
+        if isinstance(value, (bytes, bytearray)):
+            value = f"<{len(value)} bytes>"
+            clipped += 1
+        elif isinstance(value, str) and len(value) > MAX_CELL_CHARS:
+            value = value[:MAX_CELL_CHARS] + f"…[+{len(value) - MAX_CELL_CHARS} chars]"
+            clipped += 1
+        row.append(value)
+    return row, clipped
@@ -0,0 +1,327 @@
+"""
+SQL Validator - Validação estrutural das queries do execute_sql_query
+
+A validação antiga procurava palavras no texto em maiúsculas, então
+`SELECT created_at ...` ou `WHERE status = 'updated'` eram recusadas
+("CREATE", "UPDATE") e o agente gastava turnos reescrevendo a query. Aqui a
+query é tokenizada (strings, identificadores entre crases, comentários,
+números, palavras, operadores) e as regras olham só para os tokens certos:
+
+- Um único comando, começando por SELECT ou WITH (ou parênteses)
+- Palavras de escrita/DDL/lock (INSERT, INTO, FOR UPDATE...) só contam como
+  palavra-chave: dentro de strings, entre crases, qualificadas (r.update)
+  ou como função (REPLACE(), INSERT()) não
+- Tabelas lidas após FROM/JOIN (fora de funções como EXTRACT(x FROM y)),
+  inclusive entre parênteses (FROM (users)), e no comando TABLE do MySQL
+  (UNION TABLE users, IN (TABLE users)), checadas contra SENSITIVE_TABLES
+  e BLOCKED_SCHEMAS
+- Funções com efeito colateral ou bloqueantes (SLEEP, LOAD_FILE...) negadas
+- LIMIT do nível externo reescrito: adicionado se ausente, limitado a
+  MAX_ROWS se maior (antes de comentários finais, que o anulariam)
+- Comentários executáveis (/*! ... */), atribuição (:=) e variáveis de
+  sistema (@@) recusados
+- Hint MAX_EXECUTION_TIME no SELECT externo, se pedido (o MySQL aborta a
+  query ao passar do tempo)
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+MAX_ROWS = 100
+
+SENSITIVE_TABLES = {
+    "users", "user_verifications", "api_keys",
+    "refresh_tokens", "admin_users",
+}
+
+BLOCKED_SCHEMAS = {"mysql", "performance_schema", "sys", "information_schema"}
+
+# Palavras-chave que não podem aparecer num SELECT read-only
+FORBIDDEN_KEYWORDS = {
+    "INSERT", "UPDATE", "DELETE", "REPLACE", "DROP", "ALTER", "CREATE",
+    "TRUNCATE", "RENAME", "GRANT", "REVOKE", "CALL", "EXEC", "EXECUTE",
+    "PREPARE", "DEALLOCATE", "HANDLER", "LOAD", "INTO", "OUTFILE",
+    "DUMPFILE", "LOCK", "UNLOCK", "KILL", "SHUTDOWN", "FLUSH",
+}
+
+FORBIDDEN_FUNCTIONS = {
+    "sleep", "benchmark", "load_file", "get_lock", "release_lock",
+    "release_all_locks", "is_free_lock", "is_used_lock", "master_pos_wait",
+    "source_pos_wait", "sys_exec", "sys_eval",
+}
+
+# Palavras seguidas de "(" que não são chamadas de função
+_NON_FUNCTION_WORDS = {
+    "SELECT", "FROM", "JOIN", "WHERE", "ON", "USING", "IN", "EXISTS", "AS",
+    "AND", "OR", "NOT", "XOR", "IS", "LIKE", "BETWEEN", "CASE", "WHEN",
+    "THEN", "ELSE", "END", "ANY", "ALL", "SOME", "OVER", "WITH", "RECURSIVE",
+    "UNION", "INTERSECT", "EXCEPT", "LATERAL", "HAVING", "BY", "VALUES",
+    "DISTINCT", "INTERVAL", "RETURNING", "WINDOW", "PARTITION", "ROW", "ROWS",
+    "LIMIT", "OFFSET", "DIV", "MOD", "REGEXP", "RLIKE", "MEMBER", "OF",
+}
+
+# Fim de uma referência de tabela após o nome/alias
+_TABLE_REF_END = {
+    "WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "UNION", "INTERSECT",
+    "EXCEPT", "WINDOW", "ON", "USING", "JOIN", "INNER", "LEFT", "RIGHT",
+    "CROSS", "NATURAL", "STRAIGHT_JOIN", "FULL", "OUTER", "USE", "IGNORE",
+    "FORCE", "PARTITION", "FOR", "LOCK", "INTO",
+}
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>/\*.*?\*/|--(?:[ \t][^\n]*)?(?=\n|$)|\#[^\n]*)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<ident>`(?:[^`]|``)*`)
+  | (?P<number>0[xX][0-9a-fA-F]+|\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)
+  | (?P<var>@@?(?:[\w.$]+|`(?:[^`]|``)*`|'(?:[^'\\]|\\.)*'))
+  | (?P<word>[^\W\d][\w$]*)
+  | (?P<op>:=|<=>|->>|->|<=|>=|<>|!=|\|\||&&|<<|>>|[-+*/%=<>!~^&|,.;()?:{}])
+""", re.VERBOSE | re.DOTALL)
+
+
+class SQLValidationError(ValueError):
+    """Query recusada pelo validador (mensagem vai para o agente)"""
+
+
+class Token:
+    __slots__ = ("kind", "value", "start", "end")
+
+    def __init__(self, kind: str, value: str, start: int, end: int):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+
+    @property
+    def upper(self) -> str:
+        return self.value.upper() if self.kind == "word" else ""
+
+    def __repr__(self):
+        return f"Token({self.kind}, {self.value!r})"
+
+
+def tokenize(query: str) -> List[Token]:
+    """Tokens da query, incluindo espaços e comentários
+
+    Raises:
+        SQLValidationError: String, identificador ou comentário sem fechamento,
+            ou caractere inesperado
+    """
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        match = _TOKEN_RE.match(query, pos)
+        if not match:
+            fragment = query[pos:pos + 20]
+            if fragment[0] in "'\"`" or fragment.startswith("/*"):
+                raise SQLValidationError(f"Unterminated string, identifier or comment near: {fragment}")
+            raise SQLValidationError(f"Unexpected character near: {fragment}")
+        tokens.append(Token(match.lastgroup, match.group(), pos, match.end()))
+        pos = match.end()
+    return tokens
+
+
+def validate_query(query: str, max_rows: int = MAX_ROWS, max_execution_ms: Optional[int] = None) -> Dict[str, Any]:
+    """Valida uma query read-only e reescreve o LIMIT
+
+    Args:
+        query: SQL enviado pelo agente
+        max_rows: Máximo de linhas (LIMIT adicionado ou reduzido)
+        max_execution_ms: Tempo máximo (hint MAX_EXECUTION_TIME); None = sem hint
+
+    Returns:
+        {
+            "query": SQL a executar,
+            "tables": tabelas lidas (minúsculas, sem schema),
+            "functions": funções chamadas (minúsculas),
+            "limit": "added" | "clamped" | None,
+            "max_execution_ms": tempo do hint, ou None se não foi aplicado
+        }
+
+    Raises:
+        SQLValidationError: Query recusada (mensagem explica o motivo)
+    """
+    all_tokens = tokenize(query)
+    for token in all_tokens:
+        if token.kind == "comment" and token.value.startswith("/*!"):
+            raise SQLValidationError("Executable comments (/*! ... */) are not allowed.")
+
+    tokens = [t for t in all_tokens if t.kind not in ("ws", "comment")]
+    while tokens and tokens[-1].value == ";":
+        tokens.pop()
+    if not tokens:
+        raise SQLValidationError("Empty query.")
+    if any(t.value == ";" for t in tokens if t.kind == "op"):
+        raise SQLValidationError("Only one statement per query is allowed.")
+
+    first = next((t for t in tokens if t.value != "("), None)
+    if first is None or first.upper not in ("SELECT", "WITH"):
+        raise SQLValidationError("Only SELECT queries are allowed for security reasons.")
+
+    tables: List[str] = []
+    functions: List[str] = []
+    # Tipo de cada parêntese aberto: "function" ou "group" (subquery/expressão)
+    parens: List[str] = []
+    limit_at: Optional[int] = None
+    select_at: Optional[int] = None
+
+    for i, token in enumerate(tokens):
+        prev = tokens[i - 1] if i > 0 else None
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+
+        if token.kind == "op":
+            if token.value == "(":
+                is_call = (
+                    prev is not None and prev.kind in ("word", "ident")
+                    and prev.upper not in _NON_FUNCTION_WORDS
+                    and not (nxt is not None and nxt.upper in ("SELECT", "WITH"))
+                )
+                parens.append("function" if is_call else "group")
+            elif token.value == ")":
+                if not parens:
+                    raise SQLValidationError("Unbalanced parentheses.")
+                parens.pop()
+            elif token.value == ":=":
+                raise SQLValidationError("Variable assignment is not allowed.")
+            continue
+
+        if token.kind == "var":
+            if token.value.startswith("@@"):
+                raise SQLValidationError("System variables are not allowed.")
+            continue
+
+        if token.kind != "word":
+            continue
+
+        qualified = (prev is not None and prev.value == ".") or (nxt is not None and nxt.value == ".")
+        if nxt is not None and nxt.value == "(" and not qualified and token.upper not in _NON_FUNCTION_WORDS:
+            name = token.value.lower()
+            if name in FORBIDDEN_FUNCTIONS:
+                raise SQLValidationError(f"Function '{name.upper()}' is not allowed.")
+            functions.append(name)
+            continue
+        if qualified:
+            continue
+
+        word = token.upper
+        if word in FORBIDDEN_KEYWORDS:
+            raise SQLValidationError(f"Dangerous operation '{word}' is not allowed.")
+        if word == "FOR" and nxt is not None and nxt.upper == "SHARE":
+            raise SQLValidationError("Locking reads (FOR SHARE) are not allowed.")
+
+        in_function = bool(parens) and parens[-1] == "function"
+        if word in ("FROM", "JOIN", "STRAIGHT_JOIN") and not in_function:
+            tables.extend(_table_refs(tokens, i + 1, allow_list=(word == "FROM")))
+        elif word == "TABLE":
+            # TABLE t equivale a SELECT * FROM t (em UNION, IN (...), EXISTS (...))
+            tables.extend(_table_refs(tokens, i + 1, allow_list=False))
+        elif word == "LIMIT" and not parens:
+            limit_at = i
+        elif word == "SELECT" and not parens and select_at is None:
+            select_at = i
+
+    if parens:
+        raise SQLValidationError("Unbalanced parentheses.")
+
+    for schema, table in tables:
+        if schema in BLOCKED_SCHEMAS:
+            raise SQLValidationError(f"Access to schema '{schema}' is not allowed.")
+        if table in SENSITIVE_TABLES:
+            raise SQLValidationError(f"Access to table '{table}' is not allowed for privacy reasons.")
+
+    # Texto até o último token útil: descarta ";" e comentários finais
+    text = query[:tokens[-1].end]
+    limit = None
+    if limit_at is None:
+        text = f"{text} LIMIT {max_rows}"
+        limit = "added"
+    else:
+        count = _limit_count_token(tokens, limit_at)
+        if int(count.value) > max_rows:
+            text = text[:count.start] + str(max_rows) + text[count.end:]
+            limit = "clamped"
+
+    # Hint logo após o SELECT externo (depois do LIMIT, que vem mais adiante no texto).
+    # (SELECT ...) UNION (SELECT ...) não tem SELECT externo: fica sem hint
+    timeout = None
+    if max_execution_ms and select_at is not None:
+        at = tokens[select_at].end
+        text = f"{text[:at]} /*+ MAX_EXECUTION_TIME({int(max_execution_ms)}) */{text[at:]}"
+        timeout = int(max_execution_ms)
+
+    return {
+        "query": text,
+        "tables": sorted({table for _, table in tables}),
+        "functions": sorted(set(functions)),
+        "limit": limit,
+        "max_execution_ms": timeout,
+    }
+
+
+def _name(token: Token) -> Optional[str]:
+    if token.kind == "ident":
+        return token.value[1:-1].replace("``", "`").lower()
+    if token.kind == "word":
+        return token.value.lower()
+    return None
+
+
+def _table_refs(tokens: List[Token], i: int, allow_list: bool) -> List[Tuple[Optional[str], str]]:
+    """(schema, tabela) referenciadas a partir de tokens[i] (após FROM/JOIN/TABLE)
+
+    Tabelas derivadas (subqueries) são puladas aqui; as tabelas delas são
+    encontradas quando o laço principal chega no FROM interno. Parênteses
+    que não abrem subquery (FROM (users), JOIN (a JOIN b)) são lidos como
+    referências de tabela.
+    """
+    refs = []
+    while i < len(tokens):
+        token = tokens[i]
+        if token.value == "(":
+            nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+            if nxt is None or nxt.upper not in ("SELECT", "WITH"):
+                # Referências entre parênteses; JOINs internos o laço principal acha
+                refs.extend(_table_refs(tokens, i + 1, allow_list=True))
+            # Pula até o ")" correspondente
+            depth = 0
+            while i < len(tokens):
+                if tokens[i].value == "(":
+                    depth += 1
+                elif tokens[i].value == ")":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                i += 1
+            i += 1
+        else:
+            name = _name(token)
+            if name is None or token.upper in _TABLE_REF_END or token.upper in ("SELECT", "LATERAL", "DUAL"):
+                break
+            if i + 2 < len(tokens) and tokens[i + 1].value == "." and _name(tokens[i + 2]):
+                refs.append((name, _name(tokens[i + 2])))
+                i += 3
+            else:
+                refs.append((None, name))
+                i += 1
+
+        # Alias opcional
+        if i < len(tokens) and tokens[i].upper == "AS":
+            i += 2
+        elif i < len(tokens) and tokens[i].kind in ("word", "ident") and tokens[i].upper not in _TABLE_REF_END:
+            i += 1
+
+        if allow_list and i < len(tokens) and tokens[i].value == ",":
+            i += 1
+            continue
+        break
+    return refs
+
+
+def _limit_count_token(tokens: List[Token], i: int) -> Token:
+    """Token com o número de linhas de LIMIT n | LIMIT m, n | LIMIT n OFFSET m"""
+    values = tokens[i + 1:i + 4]
+    count = values[2] if len(values) >= 3 and values[1].value == "," else (values[0] if values else None)
+    if count is None or count.kind != "number" or not count.value.isdigit():
+        raise SQLValidationError("LIMIT must be a whole number.")
+    return count
@@ -0,0 +1,110 @@
+"""
+Text Search Tools - Busca textual em relatórios e análises
+
+Ferramenta MCP sobre o índice BM25 em processo (core/text_index.py), o mesmo
+usado pelo endpoint /api/reports/search.
+"""
+
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any
+
+# Importar do SDK (SEM API KEY - usa Claude Code CLI local)
+from claude_agent_sdk import tool
+
+logger = logging.getLogger(__name__)
+
+
+@tool(
+    "search_reports_text",
+    "Full-text search over report descriptions, addresses and AI analysis text, ranked by relevance "
+    "with highlighted snippets; optional filters on waste type, status, severity and report date",
+    {
+        "type": "object",
+        "properties": {
+            "query": {"type": "string", "description": "Words to search for (accents and case are ignored)"},
+            "limit": {"type": "integer", "description": "Maximum number of results (default 10)"},
+            "waste_type": {"type": "string", "description": "Waste type name, e.g. Plastic"},
+            "status": {"type": "string", "description": "submitted, analyzing, analyzed, resolved or rejected"},
+            "min_severity": {"type": "integer"},
+            "max_severity": {"type": "integer"},
+            "date_from": {"type": "string", "description": "Report date lower bound (YYYY-MM-DD)"},
+            "date_to": {"type": "string", "description": "Report date upper bound, inclusive (YYYY-MM-DD)"}
+        },
+        "required": ["query"]
+    }
+)
+async def search_reports_text(args: Dict[str, Any]) -> Dict:
+    """
+    Busca relatórios por texto (descrição, endereço, notas e descrição da análise)
+
+    Args:
+        query: Texto da consulta
+        limit: Número máximo de resultados (default: 10)
+        waste_type, status, min_severity, max_severity, date_from, date_to: Filtros
+
+    Returns:
+        {
+            "content": [{"type": "text", "text": "JSON com resultados"}]
+        }
+    """
+    # Pool de analytics: ferramentas do chat não disputam conexões com a API
+    import sys
+    import os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from core.database import get_analytics_connection as get_db_connection
+    from core.text_index import search_reports
+
+    query = args["query"]
+    limit = max(1, min(int(args.get("limit") or 10), 50))
+    filters = {
+        key: args[key]
+        for key in ("waste_type", "status", "min_severity", "max_severity", "date_from", "date_to")
+        if args.get(key) not in (None, "")
+    }
+
+    try:
+        for key in ("date_from", "date_to"):
+            if key in filters:
+                datetime.fromisoformat(str(filters[key]).strip())
+
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(
+            None, lambda: search_reports(get_db_connection, query, limit=limit, **filters)
+        )
+
+        # Destaques em markdown para o chat
+        for report in result["results"]:
+            report["highlights"] = {
+                field: snippet.replace("<mark>", "**").replace("</mark>", "**")
+                for field, snippet in report["highlights"].items()
+            }
+
+        response_data = {
+            "query": query,
+            "filters": filters,
+            "total_matches": result["total"],
+            "found": len(result["results"]),
+            "reports": result["results"]
+        }
+
+        logger.info(f"Text search '{query}': {result['total']} matches")
+
+        return {
+            "content": [{
+                "type": "text",
+                "text": json.dumps(response_data, indent=2, ensure_ascii=False)
+            }]
+        }
+
+    except Exception as e:
+        logger.error(f"Error in search_reports_text: {e}")
+        return {
+            "content": [{
+                "type": "text",
+                "text": f"Error: {str(e)}"
+            }],
+            "is_error": True
+        }
@@ -0,0 +1,234 @@
+"""
+Vision Backends - Backends plugáveis para análise de imagens
+
+- ClaudeCLIBackend: Claude Code CLI local via subprocess (produção)
+- FakeVisionBackend: substituto local determinístico para testes de carga,
+  com distribuição de latência, taxa de falhas/timeouts e respostas JSON
+  enlatadas (incluindo respostas malformadas para exercitar _extract_json)
+
+Seleção via variável de ambiente VISION_BACKEND (claude_cli | fake).
+"""
+
+import os
+import json
+import random
+import hashlib
+import logging
+import threading
+import subprocess
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class VisionBackendError(Exception):
+    """Falha do backend de visão (erro de execução)"""
+
+
+class VisionBackendTimeout(VisionBackendError):
+    """O backend não respondeu dentro do timeout"""
+
+
+class VisionBackendUnavailable(VisionBackendError):
+    """O backend não está instalado/disponível"""
+
+
+class ClaudeCLIBackend:
+    """Backend real: chama o Claude Code CLI com as imagens"""
+
+    name = "claude_cli"
+
+    def complete(self, prompt: str, image_paths: List[str], timeout: float) -> str:
+        """Executa o prompt com as imagens e retorna a resposta em texto
+
+        Raises:
+            VisionBackendTimeout, VisionBackendUnavailable, VisionBackendError
+        """
+        try:
+            result = subprocess.run(
+                ['claude', '-p', prompt, *image_paths],
+                capture_output=True,
+                text=True,
+                timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            raise VisionBackendTimeout(f"Claude CLI timeout after {timeout:.0f}s")
+        except FileNotFoundError:
+            raise VisionBackendUnavailable("Claude CLI not installed")
+
+        if result.returncode != 0:
+            raise VisionBackendError(f"Claude CLI failed: {result.stderr}")
+
+        return result.stdout.strip()
+
+
+class FakeVisionBackend:
+    """Backend simulado determinístico (sem CLI, sem rede)"""
+
+    name = "fake"
+
+    WASTE_TYPES = [
+        "Plastic", "Paper", "Glass", "Metal", "Organic",
+        "Electronic", "Mixed", "Construction", "Not Garbage"
+    ]
+    PRIORITIES = ["Low", "Medium", "High", "Critical"]
+    VOLUMES = ["Small", "Medium", "Large", "Very Large"]
+
+    def __init__(
+        self,
+        latency_mean_ms: float = 2000.0,
+        latency_sigma: float = 0.35,
+        failure_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        malformed_rate: float = 0.1,
+        seed: Optional[int] = 42
+    ):
+        """
+        Args:
+            latency_mean_ms: Latência mediana (distribuição log-normal)
+            latency_sigma: Desvio da log-normal (0 = latência fixa)
+            failure_rate: Probabilidade de erro do backend
+            timeout_rate: Probabilidade de a chamada estourar o timeout
+            malformed_rate: Probabilidade de resposta fora do formato JSON puro
+            seed: Semente do gerador (None = não determinístico)
+        """
+        self.latency_mean_ms = latency_mean_ms
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.timeout_rate = timeout_rate
+        self.malformed_rate = malformed_rate
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.images = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.malformed = 0
+
+    @classmethod
+    def from_env(cls) -> "FakeVisionBackend":
+        """Cria o backend a partir das variáveis VISION_FAKE_*"""
+        seed = os.getenv('VISION_FAKE_SEED', '42')
+        return cls(
+            latency_mean_ms=float(os.getenv('VISION_FAKE_LATENCY_MS', '2000')),
+            latency_sigma=float(os.getenv('VISION_FAKE_LATENCY_SIGMA', '0.35')),
+            failure_rate=float(os.getenv('VISION_FAKE_FAILURE_RATE', '0')),
+            timeout_rate=float(os.getenv('VISION_FAKE_TIMEOUT_RATE', '0')),
+            malformed_rate=float(os.getenv('VISION_FAKE_MALFORMED_RATE', '0.1')),
+            seed=int(seed) if seed else None
+        )
+
+    def complete(self, prompt: str, image_paths: List[str], timeout: float) -> str:
+        with self._lock:
+            self.calls += 1
+            self.images += len(image_paths)
+            roll = self._rng.random()
+            latency = self._sample_latency(len(image_paths))
+            malformed_roll = self._rng.random()
+            variant = self._rng.randrange(4)
+
+        if roll < self.timeout_rate or latency > timeout:
+            time.sleep(timeout)
+            with self._lock:
+                self.timeouts += 1
+            raise VisionBackendTimeout(f"Fake backend timeout after {timeout:.0f}s")
+
+        time.sleep(latency)
+
+        if roll < self.timeout_rate + self.failure_rate:
+            with self._lock:
+                self.failures += 1
+            raise VisionBackendError("Fake backend failure")
+
+        if len(image_paths) > 1:
+            payload = {"results": [
+                {"index": index, **self._canned_analysis(path)}
+                for index, path in enumerate(image_paths)
+            ]}
+        else:
+            payload = self._canned_analysis(image_paths[0] if image_paths else "")
+
+        text = json.dumps(payload)
+        if malformed_roll < self.malformed_rate:
+            with self._lock:
+                self.malformed += 1
+            return self._malform(text, variant)
+        return text
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "images": self.images,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "malformed": self.malformed,
+            }
+
+    def _sample_latency(self, image_count: int) -> float:
+        """Latência em segundos; lotes custam menos por imagem"""
+        base = self.latency_mean_ms / 1000.0 * (1 + 0.3 * (image_count - 1))
+        if self.latency_sigma <= 0:
+            return base
+        return base * self._rng.lognormvariate(0.0, self.latency_sigma)
+
+    def _canned_analysis(self, image_path: str) -> Dict:
+        """Análise determinística derivada do caminho da imagem"""
+        digest = hashlib.sha256(image_path.encode('utf-8')).digest()
+        waste_type = self.WASTE_TYPES[digest[0] % len(self.WASTE_TYPES)]
+        is_waste = waste_type != "Not Garbage"
+        severity = 1 + digest[1] % 10 if is_waste else 1
+
+        return {
+            "is_waste": is_waste,
+            "waste_type": waste_type,
+            "waste_subtypes": [f"{waste_type.lower()} item"] if is_waste else [],
+            "severity_score": severity,
+            "priority_level": self.PRIORITIES[min(3, (severity - 1) // 3)] if is_waste else "Low",
+            "description": f"Synthetic analysis: {waste_type}",
+            "environmental_impact": "Synthetic impact assessment",
+            "recommended_action": "Synthetic cleanup recommendation",
+            "volume_estimate": self.VOLUMES[digest[2] % len(self.VOLUMES)],
+            "confidence": round(0.5 + (digest[3] % 50) / 100, 2),
+        }
+
+    @staticmethod
+    def _malform(text: str, variant: int) -> str:
+        """Respostas fora do formato pedido, como o modelo às vezes produz"""
+        if variant == 0:
+            return f"Here is the analysis:\n```json\n{text}\n```"
+        if variant == 1:
+            return f"Sure! {text} Let me know if you need anything else."
+        if variant == 2:
+            return text[:len(text) // 2]  # JSON truncado
+        return "I could not analyze this image."
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_vision_backend():
+    """Retorna o backend configurado em VISION_BACKEND (default: claude_cli)"""
+    global _backend
+
+    with _backend_lock:
+        if _backend is None:
+            backend_name = os.getenv('VISION_BACKEND', 'claude_cli').lower()
+            if backend_name == 'fake':
+                _backend = FakeVisionBackend.from_env()
+            else:
+                _backend = ClaudeCLIBackend()
+            logger.info(f"Vision backend: {_backend.name}")
+        return _backend
+
+
+def set_vision_backend(backend):
+    """Substitui o backend em uso (ex: harness de carga)"""
+    global _backend
+
+    with _backend_lock:
+        _backend = backend
+        logger.info(f"Vision backend set to: {backend.name}")
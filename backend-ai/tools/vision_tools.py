@@ -3,19 +3,70 @@ Vision Tools - Análise de imagens usando Claude Code CLI
 
 Usa Claude Code CLI local via subprocess para análise de imagens.
 SEM necessidade de API key - usa autenticação do Claude Code CLI.
+
+O backend é plugável (tools/vision_backends.py): VISION_BACKEND=fake usa um
+substituto local determinístico para testes de carga.
 """
 
 import json
 import logging
 import base64
-import subprocess
 import tempfile
 import os
-from typing import Dict, Any, Optional
+import sys
+import time
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.circuit_breaker import CircuitBreaker, AdaptiveTimeout
+from tools.vision_backends import (
+    get_vision_backend,
+    VisionBackendError,
+    VisionBackendTimeout,
+    VisionBackendUnavailable,
+)
+
 logger = logging.getLogger(__name__)
 
+# Circuit breaker do backend de visão: abre após falhas/timeouts consecutivos
+# e rejeita chamadas imediatamente até o tempo de recuperação (probes em half-open)
+vision_breaker = CircuitBreaker(
+    "vision",
+    failure_threshold=int(os.getenv('VISION_BREAKER_FAILURES', '5')),
+    recovery_timeout=float(os.getenv('VISION_BREAKER_RECOVERY_SECONDS', '60'))
+)
+
+# Timeout adaptativo: p95 das latências recentes com folga, limitado a 120s
+vision_timeout = AdaptiveTimeout(
+    default=120.0,
+    minimum=float(os.getenv('VISION_TIMEOUT_MIN_SECONDS', '30')),
+    maximum=120.0
+)
+
+# Formato JSON esperado para cada análise
+ANALYSIS_JSON_FORMAT = """{
+    "is_waste": true or false,
+    "waste_type": "Plastic/Paper/Glass/Metal/Organic/Electronic/Textile/Mixed/Hazardous/Construction/Other/Not Garbage",
+    "waste_subtypes": ["specific items found"],
+    "severity_score": 1-10,
+    "priority_level": "Low/Medium/High/Critical",
+    "description": "What you see in the image",
+    "environmental_impact": "Environmental impact assessment",
+    "recommended_action": "Suggested cleanup method",
+    "volume_estimate": "Small/Medium/Large/Very Large",
+    "confidence": 0.0-1.0
+}"""
+
+# Tamanho máximo de um lote no modo batch (imagens por chamada ao CLI)
+VISION_BATCH_SIZE = int(os.getenv('VISION_BATCH_SIZE', '4'))
+
+# Marcador de "recusado pelo circuit breaker" (análise não tentada; não conta como retry)
+VISION_CIRCUIT_OPEN = "circuit_open"
+
+# Campos obrigatórios em cada análise retornada pelo modelo
+REQUIRED_ANALYSIS_FIELDS = ("is_waste", "waste_type", "severity_score", "priority_level", "description")
+
 
 def analyze_waste_image_direct(
     image_base64: str = "",
@@ -40,28 +91,19 @@ def analyze_waste_image_direct(
         Dict com análise estruturada
     """
     temp_image_path = None
+    breaker_reserved = False
 
     try:
-        # Determinar caminho da imagem
-        if image_path and os.path.exists(image_path):
-            actual_image_path = image_path
-        elif image_base64:
-            # Salvar imagem base64 em arquivo temporário
-            # Remover prefixo data:image/... se existir
-            if image_base64.startswith('data:'):
-                image_base64 = image_base64.split(',', 1)[1]
-
-            image_data = base64.b64decode(image_base64)
-
-            # Criar arquivo temporário
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
-                f.write(image_data)
-                temp_image_path = f.name
-                actual_image_path = temp_image_path
-        else:
+        actual_image_path, temp_image_path = _resolve_image(image_base64, image_path)
+        if not actual_image_path:
             logger.error("No image provided (neither base64 nor path)")
             return _error_result("No image provided")
 
+        if not vision_breaker.allow_request():
+            logger.warning("Vision backend circuit open, skipping analysis")
+            return _circuit_open_result()
+        breaker_reserved = True
+
         logger.info(f"Analyzing image with Claude Code CLI: {actual_image_path}")
 
         # Prompt para análise
@@ -72,36 +114,22 @@ Context:
 - User description: "{description}"
 
 Analyze the image and respond with ONLY this JSON format (no other text):
-{{
-    "is_waste": true or false,
-    "waste_type": "Plastic/Paper/Glass/Metal/Organic/Electronic/Textile/Mixed/Hazardous/Construction/Other/Not Garbage",
-    "waste_subtypes": ["specific items found"],
-    "severity_score": 1-10,
-    "priority_level": "Low/Medium/High/Critical",
-    "description": "What you see in the image",
-    "environmental_impact": "Environmental impact assessment",
-    "recommended_action": "Suggested cleanup method",
-    "volume_estimate": "Small/Medium/Large/Very Large",
-    "confidence": 0.0-1.0
-}}
+{ANALYSIS_JSON_FORMAT}
 
 If the image does NOT contain waste/garbage, set is_waste to false and waste_type to "Not Garbage".
 Respond with ONLY valid JSON, nothing else."""
 
-        # Chamar Claude Code CLI
-        result = subprocess.run(
-            ['claude', '-p', prompt, actual_image_path],
-            capture_output=True,
-            text=True,
-            timeout=120  # 2 minutos timeout
+        # Chamar Claude Code CLI (ou o backend configurado)
+        started = time.monotonic()
+        response_text = get_vision_backend().complete(
+            prompt, [actual_image_path], timeout=vision_timeout.current()
         )
 
-        if result.returncode != 0:
-            logger.error(f"Claude CLI error: {result.stderr}")
-            return _error_result(f"Claude CLI failed: {result.stderr}")
+        # Backend respondeu: conta como sucesso mesmo que o JSON seja inválido
+        vision_breaker.record_success()
+        vision_timeout.observe(time.monotonic() - started)
 
         # Parsear resposta JSON
-        response_text = result.stdout.strip()
         logger.info(f"Claude CLI response: {response_text[:500]}...")
 
         # Tentar extrair JSON da resposta
@@ -116,22 +144,217 @@ Respond with ONLY valid JSON, nothing else."""
             logger.error(f"Failed to parse JSON from response: {response_text}")
             return _error_result("Failed to parse analysis response")
 
-    except subprocess.TimeoutExpired:
+    except VisionBackendTimeout:
         logger.error("Claude CLI timeout")
+        vision_breaker.record_failure()
         return _error_result("Analysis timeout")
-    except FileNotFoundError:
+    except VisionBackendUnavailable:
         logger.error("Claude CLI not found - is it installed?")
+        vision_breaker.record_failure()
         return _error_result("Claude CLI not installed")
+    except VisionBackendError as e:
+        logger.error(f"Claude CLI error: {e}")
+        vision_breaker.record_failure()
+        return _error_result(str(e))
     except Exception as e:
         logger.error(f"Error analyzing image: {e}")
+        if breaker_reserved:
+            vision_breaker.record_failure()
         return _error_result(str(e))
     finally:
-        # Limpar arquivo temporário
-        if temp_image_path and os.path.exists(temp_image_path):
+        _cleanup_temp_file(temp_image_path)
+
+
+def analyze_waste_images_batch(items: List[Dict[str, Any]]) -> List[Dict]:
+    """
+    Analisa um pequeno grupo de imagens em uma única chamada ao Claude Code CLI
+
+    Usado quando a fila acumula (ex: após uma queda ou um mutirão de limpeza):
+    o custo fixo de cada invocação do CLI é dividido entre várias imagens.
+    O modelo responde com um JSON por imagem (identificado por "index"); cada
+    resultado é validado separadamente e os itens inválidos ou ausentes são
+    reprocessados individualmente com analyze_waste_image_direct.
+
+    Args:
+        items: Lista de dicts com image_path ou image_base64, latitude,
+               longitude e description (mesmos campos de analyze_waste_image_direct)
+
+    Returns:
+        Lista de análises na mesma ordem de items
+    """
+    results: List[Optional[Dict]] = [None] * len(items)
+
+    for start in range(0, len(items), VISION_BATCH_SIZE):
+        chunk = items[start:start + VISION_BATCH_SIZE]
+        chunk_results = _analyze_chunk(chunk) if len(chunk) > 1 else [None]
+
+        for offset, analysis in enumerate(chunk_results):
+            if analysis is None:
+                # Fallback: análise individual para o item que falhou no lote
+                item = chunk[offset]
+                analysis = analyze_waste_image_direct(
+                    image_base64=item.get("image_base64", ""),
+                    image_path=item.get("image_path", ""),
+                    latitude=item.get("latitude", 0.0),
+                    longitude=item.get("longitude", 0.0),
+                    description=item.get("description", "")
+                )
+            results[start + offset] = analysis
+
+    return results
+
+
+def _analyze_chunk(chunk: List[Dict[str, Any]]) -> List[Optional[Dict]]:
+    """Analisa um lote em uma chamada; retorna None nas posições que falharam"""
+    results: List[Optional[Dict]] = [None] * len(chunk)
+    temp_paths = []
+
+    try:
+        image_paths = []
+        for item in chunk:
+            path, temp_path = _resolve_image(item.get("image_base64", ""), item.get("image_path", ""))
+            if temp_path:
+                temp_paths.append(temp_path)
+            image_paths.append(path)
+
+        # Itens sem imagem ficam fora do lote (o fallback individual reporta o erro)
+        batch_indexes = [i for i, path in enumerate(image_paths) if path]
+        if len(batch_indexes) < 2:
+            return results
+
+        if not vision_breaker.allow_request():
+            logger.warning("Vision backend circuit open, skipping batch analysis")
+            return results
+
+        image_lines = "\n".join(
+            f"- Image {i}: {image_paths[i]} | Location: Latitude {chunk[i].get('latitude', 0.0)}, "
+            f"Longitude {chunk[i].get('longitude', 0.0)} | User description: \"{chunk[i].get('description', '')}\""
+            for i in batch_indexes
+        )
+
+        prompt = f"""Analyze each of these {len(batch_indexes)} waste/garbage images independently.
+
+Images:
+{image_lines}
+
+Respond with ONLY this JSON format (no other text), with exactly one entry per image:
+{{"results": [{{"index": <image number>, ...analysis...}}]}}
+
+Each analysis must follow this format:
+{ANALYSIS_JSON_FORMAT}
+
+If an image does NOT contain waste/garbage, set is_waste to false and waste_type to "Not Garbage".
+Respond with ONLY valid JSON, nothing else."""
+
+        logger.info(f"Analyzing batch of {len(batch_indexes)} images with Claude Code CLI")
+
+        try:
+            response_text = get_vision_backend().complete(
+                prompt,
+                [image_paths[i] for i in batch_indexes],
+                # Mais tempo para lotes maiores
+                timeout=vision_timeout.current(scale=1 + 0.5 * (len(batch_indexes) - 1))
+            )
+        except Exception:
+            # Qualquer erro libera o probe reservado em half-open
+            vision_breaker.record_failure()
+            raise
+
+        vision_breaker.record_success()
+
+        parsed = _extract_json(response_text)
+        entries = parsed.get("results") if isinstance(parsed, dict) else parsed
+
+        if not isinstance(entries, list):
+            logger.error(f"Failed to parse batch JSON from response: {response_text[:500]}")
+            return results
+
+        analyzed_at = datetime.now().isoformat()
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
             try:
-                os.unlink(temp_image_path)
-            except Exception as e:
-                logger.warning(f"Failed to delete temp file: {e}")
+                index = int(entry.pop("index", None))
+            except (TypeError, ValueError):
+                continue
+            if index not in batch_indexes or results[index] is not None:
+                continue
+            if not _validate_analysis(entry):
+                logger.warning(f"Invalid analysis for batch image {index}, falling back to single analysis")
+                continue
+            entry['analyzed_at'] = analyzed_at
+            entry['analysis_method'] = 'Claude Code CLI (batch)'
+            results[index] = entry
+
+        valid = sum(1 for r in results if r is not None)
+        logger.info(f"Batch analysis complete: {valid}/{len(batch_indexes)} valid results")
+        return results
+
+    except VisionBackendTimeout:
+        logger.error("Claude CLI batch timeout")
+        return results
+    except VisionBackendUnavailable:
+        logger.error("Claude CLI not found - is it installed?")
+        return results
+    except VisionBackendError as e:
+        logger.error(f"Claude CLI batch error: {e}")
+        return results
+    except Exception as e:
+        logger.error(f"Error analyzing image batch: {e}")
+        return results
+    finally:
+        for temp_path in temp_paths:
+            _cleanup_temp_file(temp_path)
+
+
+def _validate_analysis(analysis: Dict) -> bool:
+    """Valida e normaliza uma análise individual retornada pelo modelo"""
+    if not all(field in analysis for field in REQUIRED_ANALYSIS_FIELDS):
+        return False
+
+    if not isinstance(analysis["is_waste"], bool) or not isinstance(analysis["waste_type"], str):
+        return False
+
+    try:
+        analysis["severity_score"] = max(1, min(10, int(analysis["severity_score"])))
+        analysis["confidence"] = max(0.0, min(1.0, float(analysis.get("confidence", 0.8))))
+    except (TypeError, ValueError):
+        return False
+
+    return True
+
+
+def _resolve_image(image_base64: str, image_path: str):
+    """
+    Retorna (caminho da imagem, caminho temporário a remover ou None)
+
+    Se a imagem vier em base64, grava em arquivo temporário.
+    """
+    if image_path and os.path.exists(image_path):
+        return image_path, None
+
+    if image_base64:
+        # Remover prefixo data:image/... se existir
+        if image_base64.startswith('data:'):
+            image_base64 = image_base64.split(',', 1)[1]
+
+        image_data = base64.b64decode(image_base64)
+
+        # Criar arquivo temporário
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+            f.write(image_data)
+            return f.name, f.name
+
+    return None, None
+
+
+def _cleanup_temp_file(temp_image_path: Optional[str]):
+    """Remove arquivo temporário criado para a análise"""
+    if temp_image_path and os.path.exists(temp_image_path):
+        try:
+            os.unlink(temp_image_path)
+        except Exception as e:
+            logger.warning(f"Failed to delete temp file: {e}")
 
 
 def _extract_json(text: str) -> Optional[Dict]:
@@ -162,6 +385,15 @@ def _extract_json(text: str) -> Optional[Dict]:
     return None
 
 
+def _circuit_open_result() -> Dict:
+    """Resultado de erro quando o circuito do backend de visão está aberto"""
+    result = _error_result(
+        f"Vision backend unavailable (circuit open, retry in {vision_breaker.retry_after():.0f}s)"
+    )
+    result[VISION_CIRCUIT_OPEN] = True
+    return result
+
+
 def _error_result(message: str) -> Dict:
     """Retorna resultado de erro padronizado"""
     return {
@@ -186,9 +418,11 @@ if __name__ == "__main__":
     import sys
 
     if len(sys.argv) < 2:
-        print("Usage: python vision_tools.py <image_path>")
+        print("Usage: python vision_tools.py <image_path> [<image_path> ...]")
         sys.exit(1)
 
-    image_path = sys.argv[1]
-    result = analyze_waste_image_direct(image_path=image_path)
+    if len(sys.argv) > 2:
+        result = analyze_waste_images_batch([{"image_path": path} for path in sys.argv[1:]])
+    else:
+        result = analyze_waste_image_direct(image_path=sys.argv[1])
     print(json.dumps(result, indent=2, ensure_ascii=False))
@@ -0,0 +1,8 @@
+-- Priority scheduling for image_processing_queue
+-- Urgency informed by the reporter (used by core/queue_scheduler.py)
+
+ALTER TABLE image_processing_queue
+    ADD COLUMN urgency ENUM('low', 'normal', 'high', 'critical') NOT NULL DEFAULT 'normal' AFTER image_url;
+
+-- Candidate scan (pending items ordered by queued_at)
+CREATE INDEX idx_queue_status_queued ON image_processing_queue (status, queued_at);
@@ -0,0 +1,53 @@
+-- Bulk re-analysis campaigns (used by core/reanalysis.py)
+-- A campaign re-runs the vision analysis over a filtered set of reports.
+-- Progress is checkpointed by report_id so an interrupted campaign resumes
+-- where it stopped.
+
+CREATE TABLE reanalysis_campaigns (
+    campaign_id INT AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    analysis_version VARCHAR(50) NOT NULL,
+    filters JSON NULL,
+    status ENUM('pending', 'running', 'paused', 'completed', 'cancelled', 'failed') NOT NULL DEFAULT 'pending',
+    promote BOOLEAN NOT NULL DEFAULT FALSE,
+    rate_per_minute DECIMAL(8,2) NOT NULL DEFAULT 30,
+    total_reports INT NOT NULL DEFAULT 0,
+    processed_reports INT NOT NULL DEFAULT 0,
+    succeeded_reports INT NOT NULL DEFAULT 0,
+    failed_reports INT NOT NULL DEFAULT 0,
+    last_report_id INT NOT NULL DEFAULT 0,
+    active_seconds DECIMAL(12,1) NOT NULL DEFAULT 0,
+    heartbeat_at DATETIME NULL,
+    error_message TEXT NULL,
+    created_by INT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    started_at DATETIME NULL,
+    completed_at DATETIME NULL,
+    INDEX idx_campaigns_status (status)
+);
+
+-- One row per (campaign, report). analysis_results keeps the current
+-- analysis; promoted versions replaced it and keep the replaced values in
+-- previous_analysis.
+CREATE TABLE analysis_result_versions (
+    version_id INT AUTO_INCREMENT PRIMARY KEY,
+    campaign_id INT NOT NULL,
+    report_id INT NOT NULL,
+    analysis_version VARCHAR(50) NOT NULL,
+    waste_type_id INT NULL,
+    confidence_score DECIMAL(5,2) NULL,
+    estimated_volume DECIMAL(10,2) NULL,
+    severity_score INT NULL,
+    priority_level ENUM('low', 'medium', 'high', 'critical') NULL,
+    analysis_notes TEXT NULL,
+    full_description TEXT NULL,
+    processed_by VARCHAR(50) NULL,
+    previous_analysis JSON NULL,
+    promoted BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_versions_campaign_report (campaign_id, report_id),
+    INDEX idx_versions_report (report_id),
+    FOREIGN KEY (campaign_id) REFERENCES reanalysis_campaigns (campaign_id),
+    FOREIGN KEY (report_id) REFERENCES reports (report_id),
+    FOREIGN KEY (waste_type_id) REFERENCES waste_types (waste_type_id)
+);
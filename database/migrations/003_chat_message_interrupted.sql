@@ -0,0 +1,5 @@
+-- Partial chat answers from cancelled generations
+-- Set by routes/chat_routes.py when the user cancels, disconnects or sends a new question mid-answer
+
+ALTER TABLE chat_messages
+    ADD COLUMN is_interrupted TINYINT(1) NOT NULL DEFAULT 0 AFTER map_url;
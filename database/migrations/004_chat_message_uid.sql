@@ -0,0 +1,7 @@
+-- Write-behind chat persistence (core/message_sink.py)
+-- Messages get an id before reaching the database; replaying the spool after a crash
+-- upserts on it (ON DUPLICATE KEY UPDATE), so a batch written twice does not duplicate messages
+
+ALTER TABLE chat_messages
+    ADD COLUMN message_uid CHAR(32) NULL AFTER is_interrupted,
+    ADD UNIQUE INDEX uq_chat_messages_uid (message_uid);
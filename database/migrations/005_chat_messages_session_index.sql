@@ -0,0 +1,4 @@
+-- Chat history windows (GET /api/chat/sessions/{id}/messages)
+-- Latest/after/before windows and the ETag version (COUNT, MAX(message_id)) are resolved from this index
+
+CREATE INDEX idx_chat_messages_session_message ON chat_messages (session_id, message_id);
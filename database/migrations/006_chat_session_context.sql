@@ -0,0 +1,10 @@
+-- Persisted conversation context (core/conversation_context.py)
+-- Rolling summary of older turns and a compact cache of recent tool results, one row per chat session
+
+CREATE TABLE IF NOT EXISTS chat_session_context (
+    session_id VARCHAR(100) NOT NULL PRIMARY KEY,
+    summary TEXT NULL,
+    summarized_until_message_id INT NOT NULL DEFAULT 0,
+    tool_results JSON NULL,
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
@@ -0,0 +1,19 @@
+-- Data versions for the execute_sql_query result cache (core/query_cache.py)
+-- One counter per table, bumped by the backend after each commit that wrote
+-- to the table (core/database.py), so writes from the API, the queue worker
+-- and the re-analysis runner invalidate cached chat query results. No
+-- triggers: the deployment targets TiDB. Writes from outside the backend
+-- only show up once the cache TTL expires.
+
+CREATE TABLE data_versions (
+    table_name VARCHAR(64) PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+INSERT INTO data_versions (table_name) VALUES
+    ('reports'),
+    ('analysis_results'),
+    ('hotspots'),
+    ('hotspot_reports'),
+    ('report_waste_types');
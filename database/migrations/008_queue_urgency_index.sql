@@ -0,0 +1,3 @@
+-- Candidate scan per urgency level (core/queue_scheduler.py): oldest and
+-- newest pending items of each level come straight from this index
+CREATE INDEX idx_queue_status_urgency_queued ON image_processing_queue (status, urgency, queued_at);
@@ -0,0 +1,28 @@
+-- Sharded data_versions counters (core/query_cache.py, core/database.py)
+-- A single row per table made every writer to that table wait on the same
+-- row lock. Each table now has 16 slots; the backend bumps a random slot
+-- and readers sum the slots per table.
+-- The table is rebuilt instead of altered: TiDB cannot change a clustered
+-- primary key. Slot 0 keeps the current version, so the sums do not go back.
+
+RENAME TABLE data_versions TO data_versions_old;
+
+CREATE TABLE data_versions (
+    table_name VARCHAR(64) NOT NULL,
+    slot TINYINT UNSIGNED NOT NULL,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (table_name, slot)
+);
+
+INSERT INTO data_versions (table_name, slot, version)
+SELECT o.table_name, s.slot, IF(s.slot = 0, o.version, 0)
+FROM data_versions_old o
+JOIN (
+    SELECT 0 AS slot UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+    UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+    UNION ALL SELECT 8 UNION ALL SELECT 9 UNION ALL SELECT 10 UNION ALL SELECT 11
+    UNION ALL SELECT 12 UNION ALL SELECT 13 UNION ALL SELECT 14 UNION ALL SELECT 15
+) s;
+
+DROP TABLE data_versions_old;
@@ -31,6 +31,24 @@ export interface ChatMessage {
   timestamp: Date;
   imageUrl?: string;
   mapUrl?: string;
+  messageId?: number;
+  interrupted?: boolean;
+}
+
+interface HistoryResponse {
+  success?: boolean;
+  status?: string;
+  messages?: any[];
+  has_more?: boolean;
+  last_message_id?: number;
+  data?: { session_id: string; title: string; messages: any[] };
+}
+
+// Histórico já baixado de uma sessão (a próxima abertura só busca o delta)
+interface CachedHistory {
+  messages: ChatMessage[];
+  lastMessageId: number;
+  hasOlder: boolean;
 }
 
 export interface ToolEvent {
@@ -51,7 +69,9 @@ export interface WebSocketMessage {
   is_error?: boolean;
   cost?: number;
   duration_ms?: number;
+  ttft_ms?: number | null;
   num_turns?: number;
+  interrupted?: boolean;
   error?: string;
 }
 
@@ -81,6 +101,8 @@ export class WebSocketChatService {
   readonly sessions = signal<ChatSession[]>([]);
   readonly isLoadingSessions = signal(false);
   readonly showHistory = signal(false);
+  readonly hasOlderMessages = signal(false);
+  private readonly historyCache = new Map<string, CachedHistory>();
 
   /**
    * Conectar ao WebSocket do backend
@@ -255,7 +277,9 @@ export class WebSocketChatService {
         console.log('[WebSocketChat] Conversation complete:', {
           cost: data.cost,
           duration_ms: data.duration_ms,
-          num_turns: data.num_turns
+          ttft_ms: data.ttft_ms,
+          num_turns: data.num_turns,
+          interrupted: data.interrupted
         });
 
         // Limpar thinking content
@@ -314,11 +338,22 @@ export class WebSocketChatService {
     this.ws.send(JSON.stringify(payload));
   }
 
+  /**
+   * Cancelar a resposta em andamento (o servidor salva a parte já gerada)
+   */
+  cancelGeneration(): void {
+    if (!this.ws || this.ws.readyState !== WebSocket.OPEN || !this.isTyping()) {
+      return;
+    }
+    this.ws.send(JSON.stringify({ type: 'cancel' }));
+  }
+
   /**
    * Limpar chat (manter conversação no servidor)
    */
   clearChat(): void {
     this.messages.set([]);
+    this.hasOlderMessages.set(false);
     this.conversationId.set(null);
     this.activeTools.set(new Map());
     this.thinkingContent.set('');
@@ -420,24 +455,32 @@ export class WebSocketChatService {
   loadSession(sessionId: string): void {
     this.isLoadingSessions.set(true);
 
-    this.http.get<{ success?: boolean; status?: string; messages?: any[]; data?: { session_id: string; title: string; messages: any[] } }>(
-      `${environment.apiUrl}/api/chat/sessions/${sessionId}/messages`
+    // Sessão já aberta antes: só as mensagens novas (ETag evita até isso se nada mudou)
+    const cached = this.historyCache.get(sessionId);
+    const params: Record<string, string> = cached ? { after_message_id: String(cached.lastMessageId) } : {};
+
+    this.http.get<HistoryResponse>(
+      `${environment.apiUrl}/api/chat/sessions/${sessionId}/messages`,
+      { params }
     ).subscribe({
       next: (response) => {
         if (response.success || response.status === 'success') {
           // Suporta ambos os formatos: response.messages ou response.data.messages
-          const rawMessages = response.messages || response.data?.messages || [];
+          const fetched = (response.messages || response.data?.messages || []).map(m => this.toChatMessage(m));
+
+          if (cached && response.has_more) {
+            // Muitas mensagens novas: recarrega a janela mais recente
+            this.historyCache.delete(sessionId);
+            this.loadSession(sessionId);
+            return;
+          }
 
-          // Converter mensagens do backend para o formato do frontend
-          const messages: ChatMessage[] = rawMessages.map(m => ({
-            role: m.role as 'user' | 'assistant',
-            content: m.content,
-            timestamp: new Date(m.created_at),
-            imageUrl: m.image_url,
-            mapUrl: m.map_url
-          }));
+          const messages = cached ? [...cached.messages, ...fetched] : fetched;
+          const hasOlder = cached ? cached.hasOlder : !!response.has_more;
+          this.cacheHistory(sessionId, messages, hasOlder);
 
           this.messages.set(messages);
+          this.hasOlderMessages.set(hasOlder);
           this.conversationId.set(sessionId);
           this.showHistory.set(false);
         }
@@ -451,6 +494,61 @@ export class WebSocketChatService {
     });
   }
 
+  /**
+   * Carregar mensagens anteriores às exibidas
+   */
+  loadOlderMessages(): void {
+    const sessionId = this.conversationId();
+    const first = this.messages().find(m => m.messageId !== undefined);
+    if (!sessionId || !first || !this.hasOlderMessages()) {
+      return;
+    }
+
+    this.http.get<HistoryResponse>(
+      `${environment.apiUrl}/api/chat/sessions/${sessionId}/messages`,
+      { params: { before_message_id: String(first.messageId) } }
+    ).subscribe({
+      next: (response) => {
+        const older = (response.messages || []).map(m => this.toChatMessage(m));
+        const hasOlder = !!response.has_more;
+        this.messages.update(m => [...older, ...m]);
+        this.hasOlderMessages.set(hasOlder);
+
+        const cached = this.historyCache.get(sessionId);
+        if (cached) {
+          this.cacheHistory(sessionId, [...older, ...cached.messages], hasOlder);
+        }
+      },
+      error: (err) => {
+        console.error('[WebSocketChat] Error loading older messages:', err);
+        this.error.set('Erro ao carregar mensagens anteriores');
+      }
+    });
+  }
+
+  private toChatMessage(m: any): ChatMessage {
+    // Converter mensagem do backend para o formato do frontend
+    return {
+      role: m.role as 'user' | 'assistant',
+      content: m.content,
+      timestamp: new Date(m.created_at),
+      imageUrl: m.image_url,
+      mapUrl: m.map_url,
+      messageId: m.message_id,
+      interrupted: !!m.is_interrupted
+    };
+  }
+
+  private cacheHistory(sessionId: string, messages: ChatMessage[], hasOlder: boolean): void {
+    const ids = messages.map(m => m.messageId ?? 0);
+    this.historyCache.set(sessionId, {
+      messages,
+      lastMessageId: ids.length ? Math.max(...ids) : 0,
+      hasOlder
+    });
+  }
+
+
   /**
    * Apagar uma sessão
    */
@@ -461,6 +559,7 @@ export class WebSocketChatService {
       next: (response) => {
         if (response.success || response.status === 'success') {
           // Remover da lista local
+          this.historyCache.delete(sessionId);
           this.sessions.update(sessions =>
             sessions.filter(s => s.session_id !== sessionId)
           );
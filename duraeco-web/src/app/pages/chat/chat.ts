@@ -178,6 +178,18 @@ import { environment } from '../../../environments/environment';
             </div>
           }
 
+          @if (chatService.hasOlderMessages()) {
+            <div class="flex justify-center">
+              <button
+                type="button"
+                (click)="chatService.loadOlderMessages()"
+                class="text-sm text-emerald-700 hover:text-emerald-800 underline"
+              >
+                Carregar mensagens anteriores
+              </button>
+            </div>
+          }
+
           @for (message of chatService.messages(); track $index) {
             <div [class]="message.role === 'user' ? 'flex justify-end' : 'flex justify-start'">
               <div [class]="message.role === 'user'
@@ -217,6 +229,13 @@ import { environment } from '../../../environments/environment';
                     <div class="w-2 h-2 bg-emerald-600 rounded-full animate-bounce" style="animation-delay: 300ms"></div>
                   </div>
                   <span class="text-gray-500 text-sm">Processando...</span>
+                  <button
+                    type="button"
+                    (click)="chatService.cancelGeneration()"
+                    class="ml-2 text-sm text-gray-500 hover:text-red-600 underline"
+                  >
+                    Parar
+                  </button>
                 </div>
               </div>
             </div>